@@ -97,6 +97,13 @@ class BasicChatApp(AppGeneric):
 		del BasicChatApp.RUNNING_SESSION_QUEUES[self]
 
 
+	def handle_server_shutdown(self, message):
+		# Shown like any other chat message. Users still picking a
+		#  username haven't got a message queue yet.
+		if self.incoming_messages is not None:
+			self.incoming_messages.put([b"*** " + message.encode("utf-8") + b" ***"])
+
+
 	def handle_CHANNEL_DATA(self, msg):
 		# Add incoming data to the input data queue to pass to running
 		#  thread
@@ -0,0 +1,355 @@
+
+import os
+import shlex
+import signal
+import subprocess
+import threading
+
+from apps.generic import AppGeneric
+from config import Config
+from event_loop import EventLoop
+
+
+class CommandRegistry:
+	"""
+	Lookup of the commands a client may run with an 'exec' request.
+	Commands are either built-in Python handlers, or (if enabled in the
+	config) a fixed argv that is started as a subprocess. Nothing that
+	isn't in here can ever be run.
+	"""
+
+	def __init__(self):
+		# name -> handler(app, args) that returns an exit status
+		self.builtins = {}
+
+
+	def register(self, name):
+		# Decorator to add a built-in command
+		def decorator(handler):
+			self.builtins[name] = handler
+			return handler
+		return decorator
+
+
+	def lookup(self, command):
+		"""
+		Splits up a command line and finds what should handle it.
+		Returns (kind, target, args), or None if the command can't be
+		run. kind is either "builtin" or "subprocess".
+		"""
+		try:
+			words = shlex.split(command)
+		except ValueError:
+			# Unbalanced quotes etc.
+			return None
+		if not words:
+			return None
+
+		name, args = words[0], words[1:]
+
+		if name in self.builtins:
+			return "builtin", self.builtins[name], args
+
+		if Config.EXEC_ALLOW_SUBPROCESSES:
+			argv = Config.EXEC_SUBPROCESS_COMMANDS.get(name)
+			if argv is not None:
+				return "subprocess", list(argv), args
+
+		return None
+
+
+	def names(self):
+		names = set(self.builtins)
+		if Config.EXEC_ALLOW_SUBPROCESSES:
+			names.update(Config.EXEC_SUBPROCESS_COMMANDS)
+		return sorted(names)
+
+
+
+COMMANDS = CommandRegistry()
+
+
+#####################
+# Built-in commands #
+#####################
+@COMMANDS.register("echo")
+def command_echo(app, args):
+	app.send_CHANNEL_DATA(" ".join(args).encode("utf-8") + b"\n")
+	return 0
+
+@COMMANDS.register("true")
+def command_true(app, args):
+	return 0
+
+@COMMANDS.register("false")
+def command_false(app, args):
+	return 1
+
+@COMMANDS.register("help")
+def command_help(app, args):
+	app.send_CHANNEL_DATA("\n".join(COMMANDS.names()).encode("utf-8") + b"\n")
+	return 0
+
+
+
+# Runs a single command from an 'exec' request. Built-in commands run
+#  straight away on the thread that received the request. Subprocesses
+#  have their pipes watched by the shared event loop, so no extra
+#  threads are started per command.
+class ExecApp(AppGeneric):
+
+	# Biggest read from a subprocess pipe in one go
+	READ_SIZE = 32768
+
+	# Output queued for the client before the pipes stop being read.
+	#  The process then blocks writing until the client catches up.
+	MAX_QUEUED = 4 * READ_SIZE
+
+	# How often to check if a subprocess has exited once it has closed
+	#  both of its output pipes
+	REAP_INTERVAL = 0.01
+
+
+	def __init__(self, session, command):
+		self.session = session
+		self.command = command
+		self.loop = EventLoop.shared()
+
+		# Only one of the loop thread and the channel thread may finish
+		#  the command off
+		self.finish_lock = threading.Lock()
+		self.finished = False
+
+		# Subprocess state
+		self.process = None
+		self.open_pipes = []
+		self.pipe_readers = {}
+		self.reading_paused = False
+		self.stdin_buffer = b""
+		self.stdin_eof = False
+
+
+	def start(self):
+		lookup = COMMANDS.lookup(self.command)
+		if lookup is None:
+			# Checked before the app was started, but the config may
+			#  have changed in between
+			self.send_CHANNEL_EXTENDED_DATA(b"Command not found\n")
+			self.finish(127)
+			return
+
+		kind, target, args = lookup
+		if kind == "builtin":
+			self.run_builtin(target, args)
+		else:
+			self.run_subprocess(target + args)
+
+
+	def stop(self):
+		# The channel is going away, so nothing more may be sent
+		with self.finish_lock:
+			self.finished = True
+
+		if self.process is not None:
+			self.loop.call_soon(self._cleanup_process)
+
+
+	def handle_outbound_drained(self):
+		# Called on whichever thread sent the last of the output
+		if self.reading_paused:
+			self.loop.call_soon(self._resume_reading)
+
+
+	def handle_CHANNEL_DATA(self, msg):
+		# Builtins don't read stdin
+		if self.process is None:
+			return
+		self.loop.call_soon(self._queue_stdin, msg.data)
+
+
+	def handle_CHANNEL_EOF(self):
+		# The client has finished sending stdin. Unlike an interactive
+		#  app, this doesn't end the command; that happens when the
+		#  command exits. Once there's a process, the flag is set on the
+		#  loop, so any data queued before it is still written first.
+		if self.process is None:
+			self.stdin_eof = True
+		else:
+			self.loop.call_soon(self._end_stdin)
+
+
+	def finish(self, exit_status=None, exit_signal=None):
+		with self.finish_lock:
+			if self.finished:
+				return
+			self.finished = True
+
+		# SSH-CONNECT 6.10. The exit status is sent before the channel
+		#  is closed
+		if exit_signal is not None:
+			self.session.send_exit_signal(exit_signal)
+		else:
+			self.session.send_exit_status(exit_status)
+		self.session.send_CHANNEL_EOF()
+		self.send_CHANNEL_CLOSE()
+
+
+	############
+	# Builtins #
+	############
+	def run_builtin(self, handler, args):
+		try:
+			exit_status = handler(self, args)
+		except Exception as e:
+			print(f" [!] Built-in command '{self.command}' raised {e!r}")
+			self.send_CHANNEL_EXTENDED_DATA(f"{e}\n".encode("utf-8"))
+			exit_status = 1
+
+		self.finish(exit_status or 0)
+
+
+	################
+	# Subprocesses #
+	################
+	def run_subprocess(self, argv):
+		try:
+			self.process = subprocess.Popen(
+				argv,
+				stdin=subprocess.PIPE,
+				stdout=subprocess.PIPE,
+				stderr=subprocess.PIPE,
+				bufsize=0,
+				start_new_session=True)
+		except OSError as e:
+			print(f" [!] Could not start {argv}: {e!r}")
+			self.send_CHANNEL_EXTENDED_DATA(f"{e.strerror}\n".encode("utf-8"))
+			self.finish(127)
+			return
+
+		# Never block the loop thread on any of the pipes
+		for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+			os.set_blocking(pipe.fileno(), False)
+
+		self.open_pipes = [self.process.stdout, self.process.stderr]
+		self.pipe_readers = {
+			self.process.stdout: lambda: self._read_pipe(self.process.stdout, self.send_CHANNEL_DATA),
+			self.process.stderr: lambda: self._read_pipe(self.process.stderr, self.send_CHANNEL_EXTENDED_DATA)}
+		for pipe, reader in self.pipe_readers.items():
+			self.loop.add_reader(pipe, reader)
+
+		# The client may have already sent EOF for stdin
+		self.loop.call_soon(self._flush_stdin)
+
+
+	# All methods below are only run on the loop thread
+	def _read_pipe(self, pipe, sender):
+		try:
+			data = os.read(pipe.fileno(), self.READ_SIZE)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b""
+
+		if data:
+			if not self.finished:
+				sender(data)
+				if self.session.outbound_backlog()[0] > self.MAX_QUEUED:
+					self._pause_reading()
+			return
+
+		# End of this pipe. Once both stdout and stderr are done, wait
+		#  for the process to exit.
+		self._close_pipe(pipe)
+		if not self.open_pipes:
+			self._reap()
+
+
+	def _pause_reading(self):
+		# The client isn't keeping up, so leave the output in the pipes
+		#  instead of queueing it all in memory
+		self.reading_paused = True
+		for pipe in self.open_pipes:
+			self.loop.remove_reader(pipe)
+
+		# The queue may have drained before reading_paused was set
+		if self.session.outbound_backlog()[0] == 0:
+			self._resume_reading()
+
+
+	def _resume_reading(self):
+		if not self.reading_paused:
+			return
+		self.reading_paused = False
+		for pipe in self.open_pipes:
+			self.loop.add_reader(pipe, self.pipe_readers[pipe])
+
+
+	def _close_pipe(self, pipe):
+		self.loop.remove_reader(pipe)
+		if pipe in self.open_pipes:
+			self.open_pipes.remove(pipe)
+		pipe.close()
+
+
+	def _reap(self):
+		returncode = self.process.poll()
+		if returncode is None:
+			self.loop.call_later(self.REAP_INTERVAL, self._reap)
+			return
+
+		# Negative return codes are the signal that killed the process
+		if returncode < 0:
+			try:
+				signal_name = signal.Signals(-returncode).name[3:] # "SIGKILL" -> "KILL"
+			except ValueError:
+				signal_name = str(-returncode)
+			self.finish(exit_signal=signal_name)
+		else:
+			self.finish(returncode)
+
+
+	def _queue_stdin(self, data):
+		self.stdin_buffer += data
+		self._flush_stdin()
+
+
+	def _end_stdin(self):
+		self.stdin_eof = True
+		self._flush_stdin()
+
+
+	def _flush_stdin(self):
+		stdin = self.process.stdin
+		if stdin.closed:
+			self.stdin_buffer = b""
+			return
+
+		try:
+			while self.stdin_buffer:
+				written = os.write(stdin.fileno(), self.stdin_buffer)
+				self.stdin_buffer = self.stdin_buffer[written:]
+		except BlockingIOError:
+			# Try again once the process has read some of its input
+			self.loop.add_writer(stdin, self._flush_stdin)
+			return
+		except OSError:
+			# The process isn't reading stdin anymore
+			self.stdin_buffer = b""
+			self.stdin_eof = True
+
+		self.loop.remove_writer(stdin)
+		if self.stdin_eof:
+			stdin.close()
+
+
+	def _cleanup_process(self):
+		# Channel closed before the command finished
+		for pipe in list(self.open_pipes):
+			self._close_pipe(pipe)
+		if not self.process.stdin.closed:
+			self.loop.remove_writer(self.process.stdin)
+			self.process.stdin.close()
+
+		if self.process.poll() is None:
+			self.process.kill()
+			self._reap()
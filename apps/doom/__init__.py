@@ -1 +1 @@
-from apps.doom.doom_app import DoomGame
\ No newline at end of file
+from apps.doom.doom_app import DoomGame
@@ -0,0 +1,128 @@
+
+import numpy as np
+
+
+# Blocks are squares of this many map units
+BLOCK_SIZE = 128
+
+# Ends each block's list of linedefs in the lump
+END_OF_LIST = -1
+
+
+
+class BlockLists:
+	"""
+	A list of ids for each block of a grid, kept as one flat array of
+	every list one after another, and where each block's list starts and
+	ends in it as arrays shaped like the grid, (rows, columns).
+	"""
+
+	def __init__(self, ids, starts, ends):
+		self.ids = ids
+		self.starts = starts
+		self.ends = ends
+
+	def freeze(self):
+		for array in (self.ids, self.starts, self.ends):
+			array.flags.writeable = False
+		return self
+
+	def in_blocks(self, rows, columns):
+		# Every id in the blocks of the given slices of rows and columns,
+		#  once each. A box a player or thing fits in usually touches
+		#  only one block, or a few, so those skip the work of gathering
+		#  and merging many lists.
+		starts = self.starts[rows, columns].ravel()
+		ends = self.ends[rows, columns].ravel()
+		if len(starts) == 1:
+			return self.ids[starts[0]:ends[0]]
+		if len(starts) <= 4:
+			ids = set()
+			for start, end in zip(starts.tolist(), ends.tolist()):
+				ids.update(self.ids[start:end].tolist())
+			return np.array(sorted(ids), dtype=self.ids.dtype)
+		counts = ends - starts
+		index = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+		return np.unique(self.ids[index])
+
+
+
+class Blockmap:
+	"""
+	The map cut into a grid of 128x128 blocks, with the linedefs that
+	touch each block. Finding what's near a point only looks at the
+	linedefs of the blocks around it, so it takes the same time however
+	big the map is. That time is more than checking every linedef of a
+	small map, so Map only uses it on bigger ones. Things can be put in
+	the same grid with link().
+	"""
+
+	def __init__(self, lump):
+		# lump is the BLOCKMAP lump as an array of int16: the grid's
+		#  origin and size, then the offset of each block's list in the
+		#  lump. Each list starts with a 0 that isn't a linedef, and
+		#  ends with END_OF_LIST.
+		self.lump = lump
+		if len(lump) < 4:
+			self.origin_x = self.origin_y = self.columns = self.rows = 0
+		else:
+			self.origin_x, self.origin_y = int(lump[0]), int(lump[1])
+			self.columns, self.rows = int(lump[2]) & 0xffff, int(lump[3]) & 0xffff
+
+		# Offsets and linedef ids are unsigned, so big maps can use all
+		#  16 bits
+		count = min(self.columns * self.rows, max(len(lump) - 4, 0))
+		offsets = lump[4:4 + count].astype(np.int64) & 0xffff
+		offsets = np.concatenate((offsets, np.zeros(self.columns * self.rows - count, dtype=np.int64)))
+		ends = np.flatnonzero(lump == END_OF_LIST)
+		ends = np.append(ends, len(lump))[np.searchsorted(ends, offsets)]
+		starts = np.minimum(offsets + 1, ends)
+
+		ids = lump.astype(np.int64) & 0xffff
+		shape = (self.rows, self.columns)
+		self.lines = BlockLists(ids, starts.reshape(shape), ends.reshape(shape)).freeze()
+
+
+	def blocks(self, x1, y1, x2, y2):
+		# The slices of rows and columns of blocks that the box from
+		#  (x1, y1) to (x2, y2) touches, cut to the grid
+		column1 = max(int(x1 - self.origin_x) // BLOCK_SIZE, 0)
+		column2 = min(int(x2 - self.origin_x) // BLOCK_SIZE + 1, self.columns)
+		row1 = max(int(y1 - self.origin_y) // BLOCK_SIZE, 0)
+		row2 = min(int(y2 - self.origin_y) // BLOCK_SIZE + 1, self.rows)
+		return slice(row1, max(row2, row1)), slice(column1, max(column2, column1))
+
+
+	def lines_in_box(self, x1, y1, x2, y2):
+		# The linedefs that might touch the box, which are all the ones in
+		#  the blocks it touches
+		return self.lines.in_blocks(*self.blocks(x1, y1, x2, y2))
+
+
+	def link(self, x, y):
+		# Puts points in the grid, returning BlockLists of the indexes of
+		#  the ones in each block. Points outside it go in the nearest
+		#  block on its edge.
+		column = np.clip((np.asarray(x) - self.origin_x) // BLOCK_SIZE, 0, max(self.columns - 1, 0))
+		row = np.clip((np.asarray(y) - self.origin_y) // BLOCK_SIZE, 0, max(self.rows - 1, 0))
+		block = row * self.columns + column
+		ids = np.argsort(block, kind="stable")
+		edges = np.searchsorted(block[ids], np.arange(self.rows * self.columns + 1))
+		shape = (self.rows, self.columns)
+		return BlockLists(ids, edges[:-1].reshape(shape), edges[1:].reshape(shape)).freeze()
+
+
+
+def pack_blockmap(origin_x, origin_y, columns, rows, lists):
+	"""
+	Builds a BLOCKMAP lump from the list of linedef ids of each block,
+	going along each row in turn from the bottom left.
+	"""
+	data = [origin_x, origin_y, columns, rows]
+	offset = len(data) + len(lists)
+	for block in lists:
+		data.append(offset)
+		offset += len(block) + 2
+	for block in lists:
+		data += [0] + list(block) + [END_OF_LIST]
+	return (np.array(data, dtype=np.int64) & 0xffff).astype("<u2").view("<i2")
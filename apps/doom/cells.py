@@ -0,0 +1,105 @@
+
+import numpy as np
+
+
+class HalfBlockCells:
+	"""
+	Two pixels per character, one above the other, drawn with ▀. The
+	upper pixel is the foreground colour and the lower one the
+	background, so every pixel keeps its own colour.
+	"""
+	name = "half"
+
+	# Pixels per character
+	HEIGHT = 2
+	WIDTH = 1
+
+	GLYPHS = ["▀"]
+
+	def reduce(self, pixels, changed):
+		# Turns a (rows*HEIGHT, columns*WIDTH) array of pixels into the
+		#  foreground colour, background colour and index into GLYPHS of
+		#  each character. Only characters set in the (rows, columns)
+		#  changed array have to be filled in. A glyph index of None means
+		#  always GLYPHS[0].
+		return pixels[0::2], pixels[1::2], None
+
+
+
+class TwoColourCells:
+	"""
+	Characters that cover more pixels by drawing a pattern of them. Only
+	two colours can be shown per character: the background is the most
+	common colour of its pixels, and every other pixel is drawn in the
+	foreground colour, which is the most common of the rest.
+	"""
+	name = None
+
+	HEIGHT = None
+	WIDTH = None
+
+	# The bit of the glyph index each pixel of a character sets, row by
+	#  row, and the glyph for every index
+	BITS = []
+	GLYPHS = []
+
+	def reduce(self, pixels, changed):
+		rows, cols = changed.shape
+		cells = pixels.reshape(rows, self.HEIGHT, cols, self.WIDTH).transpose(0, 2, 1, 3)[changed]
+		cells = cells.reshape(cells.shape[0], -1)
+
+		# How many pixels in the character are the same colour as each one
+		same = cells[:, :, None] == cells[:, None, :]
+		bg = np.take_along_axis(cells, same.sum(axis=2).argmax(axis=1)[:, None], axis=1)[:, 0]
+
+		# Of the pixels that aren't the background, the most common colour.
+		#  Characters that are all background get fg = bg.
+		on = cells != bg[:, None]
+		counts = (same & on[:, None, :]).sum(axis=2)
+		counts[~on] = -1
+		fg = np.take_along_axis(cells, counts.argmax(axis=1)[:, None], axis=1)[:, 0]
+
+		# Only the changed characters are filled in
+		full = [np.zeros(changed.shape, dtype=pixels.dtype) for _ in range(3)]
+		full[0][changed] = fg
+		full[1][changed] = bg
+		full[2][changed] = on.astype(np.int32) @ np.array(self.BITS, dtype=np.int32)
+		return tuple(full)
+
+
+
+class QuadrantCells(TwoColourCells):
+	"""
+	2x2 pixels per character, drawn with the quadrant block elements.
+	"""
+	name = "quadrant"
+
+	HEIGHT = 2
+	WIDTH = 2
+
+	BITS = [1, 2, 4, 8]
+	GLYPHS = list(" ▘▝▀▖▌▞▛▗▚▐▜▄▙▟█")
+
+
+
+class BrailleCells(TwoColourCells):
+	"""
+	2x4 pixels per character, drawn with Braille patterns. Dots are
+	small, so this suits thin lines on a plain background, like the
+	automap, more than filled areas.
+	"""
+	name = "braille"
+
+	HEIGHT = 4
+	WIDTH = 2
+
+	# Dots 1-8 of a Braille cell are bits 0-7 of its code point
+	BITS = [0x01, 0x08, 0x02, 0x10, 0x04, 0x20, 0x40, 0x80]
+	GLYPHS = [chr(0x2800 + i) for i in range(256)]
+
+
+
+CELLS = {
+	cells.name: cells
+	for cells in (HalfBlockCells, QuadrantCells, BrailleCells)
+}
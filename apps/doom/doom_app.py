@@ -1,13 +1,16 @@
 
 import numpy as np
-import queue
 import threading
-import time
 
 from apps.generic import AppGeneric
+from config import Config
 
-from apps.doom.screen import Screen
+from apps.doom.cells import CELLS
+from apps.doom.palette import select_palette
+from apps.doom.screen import Screen, ansi_move_cursor, ansi_reset_colour
 from apps.doom.doom_engine import DoomEngine
+from apps.doom.keys import KeyDecoder
+from apps.doom.pacer import FramePacer
 # from apps.doom.wad import WAD
 # from apps.doom.player import Player
 
@@ -18,8 +21,17 @@ class Game:
 	"""
 	Simple example of a game
 	"""
-	def __init__(self, screen):
+	def __init__(self, screen, automap_screen=None):
+		# The textured view is drawn to screen, and the automap to
+		#  automap_screen, which can draw its pixels another way
 		self.screen = screen
+		self.automap_screen = automap_screen if automap_screen is not None else screen
+
+		# The screen the last frame was drawn to, which is the one to
+		#  refresh. Switching to the other redraws all of it, as the
+		#  client has been showing the other one's frames. The client
+		#  starts off showing screen, which cleared it when it was made.
+		self.drawn_screen = screen
 
 		# Where the top left corner of the flag is
 		self.flag_offset_x = 1
@@ -28,28 +40,43 @@ class Game:
 		self.automap_showing = False
 		# self.draw_trans_flag()
 
-		# Start doom engine
-		self.doom_engine = DoomEngine(screen)
+		# Set whenever something happens that changes what's on screen,
+		#  so frames are only rendered when they would look different
+		self.changed = threading.Event()
+		self.changed.set()
+
+		# Start doom engine. Moves are applied by the world, which sets
+		#  changed once they have been.
+		self.doom_engine = DoomEngine(screen, self.changed.set, self.automap_screen)
 
 	def turn_left(self):
-		self.doom_engine.player.turn_left()
+		self.doom_engine.queue_input("turn_left")
 	def turn_right(self):
-		self.doom_engine.player.turn_right()
+		self.doom_engine.queue_input("turn_right")
 	def move_forward(self):
-		self.doom_engine.player.move_forward()
+		self.doom_engine.queue_input("move_forward")
 	def move_backward(self):
-		self.doom_engine.player.move_backward()
+		self.doom_engine.queue_input("move_backward")
 	def toggle_automap(self):
 		self.automap_showing = not self.automap_showing
+		self.changed.set()
 	def draw_demon(self):
 		self.screen.draw_image(20, 20, "apps/doom/Cacodemon_sprite.png")
 
 	def draw_screen(self):
+		screen = self.automap_screen if self.automap_showing else self.screen
+		if screen is not self.drawn_screen:
+			screen.reset()
+			self.drawn_screen = screen
 		if self.automap_showing:
 			self.doom_engine.draw_automap()
 		else:
 			self.doom_engine.draw_projection()
 
+	def close(self):
+		# Leaves the world, so the other players stop seeing this one
+		self.doom_engine.close()
+
 
 
 class DoomGame(AppGeneric):
@@ -57,11 +84,24 @@ class DoomGame(AppGeneric):
 	def __init__(self, session):
 		self.session = session
 
-		# Window size
+		# Window size. The automap gets a screen of its own if it draws
+		#  its pixels another way, which sends nothing until the automap
+		#  is first shown.
 		self.screen = Screen(
 			height=session.config.window_height,
 			width=session.config.window_width,
-			sender=self.send_CHANNEL_DATA)
+			sender=self.send_CHANNEL_DATA,
+			palette=select_palette(session.config.environ),
+			cells=CELLS[Config.DOOM_CELLS]())
+		self.automap_screen = self.screen
+		if Config.DOOM_AUTOMAP_CELLS != Config.DOOM_CELLS:
+			self.automap_screen = Screen(
+				height=session.config.window_height,
+				width=session.config.window_width,
+				sender=self.send_CHANNEL_DATA,
+				palette=self.screen.palette,
+				cells=CELLS[Config.DOOM_AUTOMAP_CELLS](),
+				clear=False)
 
 		# Key binds
 		self.eof_char = None
@@ -71,8 +111,17 @@ class DoomGame(AppGeneric):
 
 		# Data used by this app
 		self.running = threading.Event()
-		self.user_input = queue.Queue()
-		self.game = Game(self.screen)
+		self.keys = KeyDecoder()
+		self.game = Game(self.screen, self.automap_screen)
+
+		# Sets the frame rate to what the client's connection can take
+		self.pacer = FramePacer(session.outbound_backlog)
+
+		# Written over the top of the view once the server is shutting
+		#  down. notice_shown is cleared whenever a frame may have drawn
+		#  over it.
+		self.shutdown_notice = None
+		self.notice_shown = False
 
 		# Threads used by this app
 		self.threads = []
@@ -100,11 +149,10 @@ class DoomGame(AppGeneric):
 
 
 	def start(self):
-		# Set up threads
+		# Set up threads. Keys are handled as they arrive, on the
+		#  session's thread.
 		self.threads = [
-			threading.Thread(target=self.user_input_handler),
-			threading.Thread(target=self.screen_refresh_loop),
-			threading.Thread(target=self.event_loop)
+			threading.Thread(target=self.screen_refresh_loop)
 		]
 		for t in self.threads:
 			t.daemon = True
@@ -120,79 +168,88 @@ class DoomGame(AppGeneric):
 		self.running.clear()
 		for t in self.threads:
 			t.join()
+		self.game.close()
+
+
+	def handle_server_shutdown(self, message):
+		# Written by the refresh loop, so it never lands in the middle of
+		#  a frame
+		width = self.screen.width // self.screen.cells.WIDTH
+		self.shutdown_notice = f"*** {message} ***"[:width]
+		self.notice_shown = False
 
 
 	def handle_CHANNEL_DATA(self, msg):
-		# Break up incoming data into individual bytes and add to the
-		#  user input queue to be handled
-		for b in msg.data:
-			self.user_input.put(bytes([b]))
+		# Handles the keys in each packet as it comes in. Moves go to the
+		#  world, which only makes each one once a tick, so the repeats of
+		#  a held key don't pile up.
+		for key in self.keys.decode(msg.data):
+			self.handle_key(key)
 
 
-	def user_input_handler(self):
+	def handle_key(self, key):
 		"""
 		Handles user input key presses etc
 		"""
-		while self.running.isSet():
-			# Get next key press if available
-			try:
-				key = self.user_input.get(timeout=0.1)
-			except queue.Empty:
-				continue
-
-			# Handle special characters set by the terminal config
-			if self.eof_char is not None and key == self.eof_char:
-				self.handle_key_eof()
-
-			# Handle normal keys
-			elif key == b"w": self.handle_key_w()
-			elif key == b"a": self.handle_key_a()
-			elif key == b"s": self.handle_key_s()
-			elif key == b"d": self.handle_key_d()
-			elif key == b"e": self.handle_key_e()
-			elif key == b"\t": self.handle_key_tab()
-
-			# Unbound keys
-			else:
-				self.handle_key_unbound(key)
-
-		# After exiting, clear screen and close
-		self.screen.close()
-		self.send_CHANNEL_CLOSE()
+		if not self.running.is_set():
+			return
+
+		# Handle special characters set by the terminal config
+		if self.eof_char is not None and key == self.eof_char:
+			self.handle_key_eof()
+
+		# Handle normal keys
+		elif key in (b"w", "up"): self.handle_key_w()
+		elif key in (b"a", "left"): self.handle_key_a()
+		elif key in (b"s", "down"): self.handle_key_s()
+		elif key in (b"d", "right"): self.handle_key_d()
+		elif key == b"e": self.handle_key_e()
+		elif key == b"\t": self.handle_key_tab()
+
+		# Unbound keys
+		else:
+			self.handle_key_unbound(key)
 
 
 	def screen_refresh_loop(self):
 		"""
-		Updates the clients screen at the desired refresh rate
+		Renders and sends frames as fast as the client's connection
+		allows, up to the pacer's max fps
 		"""
-		desired_fps = 30
-		desired_delay_between_frame = 1/desired_fps
-		last_refresh = 0
-
 		while self.running.isSet():
-			t = time.time()
+			self.pacer.wait()
 
-			# If it's already been too long since the last frame
-			if t - last_refresh > desired_delay_between_frame:
-				# print(f"Behind by {(t - last_refresh)/desired_delay_between_frame - 1} frames")
-				self.screen.refresh()
+			# Client is behind. Skip this frame; the next one sent will
+			#  show whatever the latest state is by then.
+			if not self.pacer.ready():
+				continue
 
-			# Else, we need to wait the remaining time and display after
-			else:
-				time.sleep(desired_delay_between_frame - (t - last_refresh))
-				self.screen.refresh()
+			self.send_frame()
 
-			last_refresh = t
+		# After exiting, clear screen and close
+		if self.automap_screen is not self.screen:
+			self.automap_screen.close()
+		self.screen.close()
+		self.send_CHANNEL_CLOSE()
 
 
-	def event_loop(self):
-		"""
-		Does nothing for now
-		"""
-		while self.running.isSet():
-			# Redraw the map every 2/30
+	def send_frame(self):
+		# Only render when something has changed
+		if self.game.changed.is_set():
+			self.game.changed.clear()
 			self.game.draw_screen()
-			time.sleep(2/30)
+
+		sent = self.game.drawn_screen.refresh()
+		if sent:
+			self.notice_shown = False
+
+		notice = self.shutdown_notice
+		if notice is not None and not self.notice_shown:
+			data = ansi_reset_colour() + ansi_move_cursor(0, 0) + notice
+			self.send_CHANNEL_DATA(data)
+			self.notice_shown = True
+			sent += len(data)
+		self.pacer.sent(sent)
 
 
 	################
@@ -1,29 +1,53 @@
 
 from apps.doom.player import Player
-from apps.doom.wad import WAD
 from apps.doom.renderer import Renderer
+from apps.doom.world import WORLDS
+from config import Config
 
 
 class DoomEngine:
 
-	def __init__(self, screen):
-		# Create players
-		self.player = Player(1)
-		
-		# Load WAD
-		self.wad = WAD("apps/doom/doom.wad")
-		self.wad.load()
-
-		# Load map
-		self.map = self.wad.load_map("E1M1", players=[self.player])
+	def __init__(self, screen, on_change=None, automap_screen=None):
+		# Join the world of the map, which every session playing it shares.
+		#  Only the first session on a map has to wait for it to load.
+		#  on_change is called whenever the world changes. The automap is
+		#  drawn to automap_screen if given, otherwise to screen.
+		self.on_change = on_change
+		self.world, self.player = WORLDS.join(Config.DOOM_WAD, "E1M1", on_change)
+		self.map = self.world.map
 		print(f"Loaded map: {self.map}")
 
-		# Create a renderer
-		self.renderer = Renderer(screen, self.player, self.map)
+		# The world's player moves on the world's thread, so this
+		#  session's view is rendered from a copy of it, taken at the
+		#  start of each frame
+		self.camera = Player(self.player.id)
+		self.world.view(self.player, self.camera)
+
+		# Create a renderer, and another for the automap if it has its
+		#  own screen
+		self.renderer = Renderer(screen, self.camera, self.map)
+		self.automap_renderer = self.renderer
+		if automap_screen is not None and automap_screen is not screen:
+			self.automap_renderer = Renderer(automap_screen, self.camera, self.map)
+
+
+	def queue_input(self, action):
+		# Applied on the world's next tick
+		self.world.queue_input(self.player, action)
 
 
+	def update_view(self):
+		others = self.world.view(self.player, self.camera)
+		self.renderer.others = self.automap_renderer.others = others
+
 	def draw_automap(self):
-		self.renderer.render_automap()
+		self.update_view()
+		self.automap_renderer.render_automap()
 
 	def draw_projection(self):
+		self.update_view()
 		self.renderer.render_perspective()
+
+
+	def close(self):
+		WORLDS.leave(self.world, self.player, self.on_change)
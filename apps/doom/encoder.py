@@ -0,0 +1,285 @@
+
+import hashlib
+import threading
+
+import numpy as np
+
+from apps.doom.cells import HalfBlockCells
+from apps.doom.palette import TrueColourPalette
+
+
+class FrameEncoder:
+	"""
+	Turns the characters of a Screen that changed into the ANSI escape
+	sequences that draw them, without looping over the characters in
+	Python.
+
+	Every character is drawn as a fixed list of "pieces": a cursor move,
+	a colour change, and the glyph itself. Each piece is a
+	slice of one pool of bytes, looked up from tables built up front,
+	e.g. "\\x1b[38;2;" + str(r) + ";" for every r. Pieces that aren't
+	needed (the cursor is already there, or the colours are already set)
+	get a length of 0. The output is then one numpy gather from the pool.
+	"""
+
+	# Biggest row or column number that can be moved to
+	MAX_POSITION = 1024
+
+
+	def __init__(self, cells=None, palette=None):
+		self.cells = cells if cells is not None else HalfBlockCells()
+		self.palette = palette if palette is not None else TrueColourPalette()
+		self._pool = bytearray()
+
+		# Cursor position, ESC [ row ; col H
+		self.MOVE_ROW = self.table(b"\x1b[", b";", self.MAX_POSITION)
+		self.MOVE_COL = self.table(b"", b"H", self.MAX_POSITION)
+
+		# Colours of the glyph (foreground) and the rest of the
+		#  character (background)
+		if self.palette.indexed:
+			# ESC [ fg ; bg m, with the palette's parameters for each index
+			count = max(self.palette.COLOURS) + 1
+			self.FG_INDEX = self.strings_table([
+				b"\x1b[" + self.palette.fg_parameters(i).encode("ascii") + b";" for i in range(count)])
+			self.BG_INDEX = self.strings_table([
+				self.palette.bg_parameters(i).encode("ascii") + b"m" for i in range(count)])
+		else:
+			# ESC [ 38;2;r;g;b;48;2;r;g;b m
+			self.FG_R = self.table(b"\x1b[38;2;", b";", 256)
+			self.G = self.table(b"", b";", 256)
+			self.FG_B = self.table(b"", b";48;2;", 256)
+			self.BG_R = self.table(b"", b";", 256)
+			self.BG_B = self.table(b"", b"m", 256)
+
+		self.GLYPH = self.strings_table([glyph.encode("utf-8") for glyph in self.cells.GLYPHS])
+
+		self.pool = np.frombuffer(bytes(self._pool), dtype=np.uint8)
+		del self._pool
+
+
+	@property
+	def cache_key(self):
+		# Encoders with the same cache_key give the same output for the
+		#  same input
+		return (self.__class__.__name__, self.cells.name, self.palette.name)
+
+
+	def table(self, prefix, suffix, count):
+		# prefix + str(n) + suffix for every n in range(count)
+		return self.strings_table([prefix + str(n).encode("ascii") + suffix for n in range(count)])
+
+
+	def strings_table(self, pieces):
+		# Adds each piece to the pool. Returns arrays of their offsets and
+		#  lengths, so pieces can be looked up by index.
+		offsets = np.empty(len(pieces), dtype=np.int32)
+		lengths = np.empty(len(pieces), dtype=np.int32)
+		for i, piece in enumerate(pieces):
+			offsets[i] = len(self._pool)
+			lengths[i] = len(piece)
+			self._pool.extend(piece)
+		return offsets, lengths
+
+
+	def encode(self, changed, fg, bg, row_numbers=None, first_col=0, glyphs=None):
+		"""
+		changed is a (rows, columns) bool array of the characters that
+		need redrawing. fg and bg are the foreground and background
+		colours of every character, already quantised by the palette,
+		and glyphs the index of each one's glyph in cells.GLYPHS (None
+		for all the first). Returns the bytes to send.
+
+		The arrays can be a part of the screen: row_numbers gives the
+		screen row of each of their rows, and first_col the screen column
+		of their first column.
+		"""
+		cells = np.flatnonzero(changed)
+		if cells.size == 0:
+			return b""
+
+		rows, cols = np.divmod(cells, changed.shape[1])
+		if row_numbers is not None:
+			rows = row_numbers[rows]
+		cols += first_col
+		fg = fg.ravel()[cells]
+		bg = bg.ravel()[cells]
+		glyphs = glyphs.ravel()[cells] if glyphs is not None else 0
+
+		# The cursor only needs moving when this character doesn't come
+		#  straight after the previous one, and the colours only need
+		#  setting when they differ from the previous character's
+		move = np.ones(cells.size, dtype=bool)
+		move[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1] + 1)
+		recolour = np.ones(cells.size, dtype=bool)
+		recolour[1:] = (fg[1:] != fg[:-1]) | (bg[1:] != bg[:-1])
+
+		pieces = [
+			(self.MOVE_ROW, rows + 1, move),
+			(self.MOVE_COL, cols + 1, move)]
+		pieces += self.colour_pieces(fg, bg, recolour)
+		pieces.append((self.GLYPH, glyphs, None))
+
+		# One row of pieces per character, in the order they're sent
+		offsets = np.empty((cells.size, len(pieces)), dtype=np.int32)
+		lengths = np.empty((cells.size, len(pieces)), dtype=np.int32)
+		for i, ((table_offsets, table_lengths), index, needed) in enumerate(pieces):
+			offsets[:, i] = table_offsets[index]
+			lengths[:, i] = table_lengths[index]
+			if needed is not None:
+				lengths[~needed, i] = 0
+
+		return self.gather(offsets.ravel(), lengths.ravel())
+
+
+	def colour_pieces(self, fg, bg, recolour):
+		# Pieces that set the colours, as (table, index, needed)
+		if self.palette.indexed:
+			return [
+				(self.FG_INDEX, fg, recolour),
+				(self.BG_INDEX, bg, recolour)]
+
+		return [
+			(self.FG_R, (fg >> 16) & 0xff, recolour),
+			(self.G, (fg >> 8) & 0xff, recolour),
+			(self.FG_B, fg & 0xff, recolour),
+			(self.BG_R, (bg >> 16) & 0xff, recolour),
+			(self.G, (bg >> 8) & 0xff, recolour),
+			(self.BG_B, bg & 0xff, recolour)]
+
+
+	def gather(self, offsets, lengths):
+		# Concatenates pool[offset:offset+length] for every piece. Each
+		#  output byte's index into the pool is its piece's offset plus
+		#  how far into that piece it is.
+		ends = np.cumsum(lengths, dtype=np.int32)
+		indices = np.repeat(offsets - (ends - lengths), lengths)
+		indices += np.arange(ends[-1], dtype=np.int32)
+		return self.pool[indices].tobytes()
+
+
+
+class SharedEncodeCache:
+	"""
+	Lets Screens that show exactly the same thing at the same size share
+	one encoded frame, e.g. spectators of the same view.
+
+	Screens subscribe with their geometry. When a Screen encodes a frame
+	while others with the same geometry are subscribed, the frame is
+	stored under a hash of what changed, and every other subscriber holds
+	a reference to it. A subscriber that then produces the same frame
+	claims it instead of encoding it again. Entries are evicted once
+	every subscriber has claimed them, or has moved MAX_HELD frames past
+	them without doing so.
+	"""
+
+	MAX_HELD = 4
+
+
+	def __init__(self):
+		self.lock = threading.Lock()
+
+		# geometry -> set of subscribers, and the reverse
+		self.subscribers = {}
+		self.geometries = {}
+
+		# key -> [encoded frame, reference count]
+		self.entries = {}
+
+		# subscriber -> keys it holds a reference to, oldest first
+		self.held = {}
+
+		self.hits = 0
+		self.misses = 0
+
+
+	def subscribe(self, subscriber, geometry):
+		with self.lock:
+			self.subscribers.setdefault(geometry, set()).add(subscriber)
+			self.geometries[subscriber] = geometry
+			self.held[subscriber] = {}
+
+
+	def unsubscribe(self, subscriber):
+		with self.lock:
+			geometry = self.geometries.pop(subscriber, None)
+			if geometry is None:
+				return
+			self.subscribers[geometry].discard(subscriber)
+			if not self.subscribers[geometry]:
+				del self.subscribers[geometry]
+			for key in self.held.pop(subscriber):
+				self._release(key)
+
+
+	def encode(self, subscriber, encoder, changed, fg, bg, row_numbers=None, first_col=0, glyphs=None):
+		# Takes the same arguments as FrameEncoder.encode
+		with self.lock:
+			geometry = self.geometries.get(subscriber)
+			others = self.subscribers.get(geometry, set()) - {subscriber}
+		if not others:
+			# Nobody to share with, so don't bother hashing
+			return encoder.encode(changed, fg, bg, row_numbers, first_col, glyphs)
+
+		key = (geometry, self.digest(changed, fg, bg, row_numbers, first_col, glyphs))
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				self.hits += 1
+				held = self.held[subscriber]
+				if key in held:
+					del held[key]
+					self._release(key)
+				return entry[0]
+			self.misses += 1
+
+		data = encoder.encode(changed, fg, bg, row_numbers, first_col, glyphs)
+
+		with self.lock:
+			# Another subscriber may have stored the same frame meanwhile
+			if key not in self.entries:
+				self.entries[key] = [data, 0]
+				for other in others:
+					if other in self.held:
+						self._hold(other, key)
+				if self.entries[key][1] == 0:
+					del self.entries[key]
+		return data
+
+
+	def digest(self, changed, fg, bg, row_numbers=None, first_col=0, glyphs=None):
+		h = hashlib.blake2b(digest_size=16)
+		h.update(repr((changed.shape, first_col)).encode("ascii"))
+		if row_numbers is not None:
+			h.update(np.asarray(row_numbers, dtype=np.int64).tobytes())
+		h.update(np.packbits(changed).tobytes())
+		h.update(fg[changed].tobytes())
+		h.update(bg[changed].tobytes())
+		if glyphs is not None:
+			h.update(glyphs[changed].tobytes())
+		return h.digest()
+
+
+	# Both of these are called with the lock held
+	def _hold(self, subscriber, key):
+		held = self.held[subscriber]
+		held[key] = None
+		self.entries[key][1] += 1
+
+		# Let go of the oldest frame if this subscriber is falling behind
+		if len(held) > self.MAX_HELD:
+			oldest = next(iter(held))
+			del held[oldest]
+			self._release(oldest)
+
+
+	def _release(self, key):
+		entry = self.entries[key]
+		entry[1] -= 1
+		if entry[1] == 0:
+			del self.entries[key]
+
+
+
+# Shared by every Screen
+SHARED_ENCODE_CACHE = SharedEncodeCache()
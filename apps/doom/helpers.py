@@ -1,21 +1,3 @@
-import struct
-
-
-# Helper methods to read numbers etc
-def read_int16(data, offset):
-	b = data[offset:offset+2]
-	return struct.unpack("h", b)[0]
-def read_uint16(data, offset):
-	b = data[offset:offset+2]
-	return struct.unpack("H", b)[0]
-def read_int32(data, offset):
-	b = data[offset:offset+4]
-	return struct.unpack("i", b)[0]
-def read_uint32(data, offset):
-	b = data[offset:offset+4]
-	return struct.unpack("I", b)[0]
-
-
 def normalise_angle(a):
 	"""
 	Adjusts an angle to be within the range [-180, 180]
@@ -43,5 +25,9 @@ class Vector:
 	def __mul__(self, other):
 		return Vector(self.x * other, self.y * other)
 
+	def __getitem__(self, index):
+		# For Vectors of arrays, the Vector of the indexed elements
+		return Vector(self.x[index], self.y[index])
+
 	def __repr__(self):
 		return f"<Vector ({self.x}, {self.y})>"
@@ -0,0 +1,47 @@
+
+import re
+
+
+# Keys that terminals send as escape sequences, by the bytes after ESC.
+#  Arrows are ESC [ A to D, or ESC O A to D in application cursor mode.
+ESCAPE_SEQUENCES = {
+	b"[A": "up", b"[B": "down", b"[C": "right", b"[D": "left",
+	b"OA": "up", b"OB": "down", b"OC": "right", b"OD": "left",
+}
+
+# One key: an escape sequence (ESC [, any parameters, then a final
+#  byte, or ESC O and a final byte), or any other single byte
+KEY = re.compile(rb"\x1b(?:\[[0-?]*[ -/]*[@-~]|O[@-~])|[\x00-\xff]")
+
+# The start of an escape sequence that the rest of hasn't arrived yet
+PARTIAL_ESCAPE = re.compile(rb"\x1b(?:\[[0-?]*[ -/]*|O)?\Z")
+
+
+
+class KeyDecoder:
+	"""
+	Turns what a terminal sends into key presses, a packet at a time.
+	Most keys are one byte, but arrows and the like are escape sequences
+	of a few, which a packet can end part way through, so the start of
+	one is kept until the rest arrives. An ESC on its own at the end of
+	a packet is taken to be the start of one too, so the Esc key is only
+	seen once something else is sent after it.
+	"""
+
+	def __init__(self):
+		self.partial = b""
+
+
+	def decode(self, data):
+		# The keys in data, in order. Each is its byte, like b"w", or the
+		#  name of an escape sequence, like "up". Escape sequences that
+		#  aren't known are given as their bytes.
+		data = self.partial + bytes(data)
+		partial = PARTIAL_ESCAPE.search(data)
+		if partial is not None:
+			data, self.partial = data[:partial.start()], data[partial.start():]
+		else:
+			self.partial = b""
+
+		keys = KEY.findall(data)
+		return [ESCAPE_SEQUENCES.get(key[1:], key) if len(key) > 1 else key for key in keys]
@@ -1,101 +1,330 @@
 
-import random
-import time
+import numpy as np
+
+from apps.doom.blockmap import Blockmap
+from apps.doom.reject import Reject, sector_bits
+
+
+# Set on a node's child id when the child is a subsector, not a node
+SUBSECTOR_FLAG = 0x8000
+
+# Sidedef id of the missing side of a one sided linedef
+NO_SIDEDEF = 0xffff
+
+# Thing types of Player 1, Player 2, etc
+PLAYER_THING_TYPES = [1, 2, 3, 4]
+
+# Linedef flags for the upper texture of a wall to start from its
+#  bottom rather than its top, and the lower or middle texture to start
+#  from the top of the sector rather than of the wall
+UPPER_UNPEGGED = 0x8
+LOWER_UNPEGGED = 0x10
+
+# Maps with no more linedefs than this check all of them for collisions,
+#  as that's quicker than finding the ones in the blocks around a point
+FULL_SCAN_LINEDEFS = 64
+
+
+
+class Table:
+	"""
+	The records of one lump, kept as one contiguous array per field
+	(e.g. vertexes.x, vertexes.y) rather than an object per record, so
+	they can be worked on all at once. Integer fields are widened to
+	int64 so that arithmetic on them can't overflow.
+
+	This copies every field out of the WAD's mapping, as the records'
+	fields are interleaved. The copy is made once, when the
+	MapGeometry is built, and shared from then on. It is not a view of
+	the WAD.
+	"""
+	def __init__(self, records=None):
+		self.fields = []
+		self.size = 0
+		if records is not None:
+			self.size = len(records)
+			for name in records.dtype.names:
+				column = records[name]
+				if column.dtype.kind in "iu":
+					column = column.astype(np.int64)
+				else:
+					column = np.ascontiguousarray(column)
+				self.add_column(name, column)
+
+	def __len__(self):
+		return self.size
+
+	def add_column(self, name, column):
+		self.fields.append(name)
+		setattr(self, name, column)
+
+	def freeze(self):
+		# Makes every column read only, so it can be shared
+		for name in self.fields:
+			getattr(self, name).flags.writeable = False
+		return self
+
+	def copy(self):
+		# A copy with its own writable columns
+		table = Table()
+		table.size = self.size
+		for name in self.fields:
+			table.add_column(name, getattr(self, name).copy())
+		return table
+
+
+
+class MapGeometry:
+	"""
+	Everything about a map that doesn't change while it's played: the
+	vertexes, walls, BSP tree and so on. Its arrays are read only, so
+	one MapGeometry can be shared by every world playing the map.
+	Anything that can change is copied into each world's Map.
+	"""
+
+	def __init__(self, name, lumps, textures=None, sprites=None):
+		# lumps maps each name in wad.MAP_LUMPS to its array of records,
+		#  textures is the WAD's TextureAtlas, if it has textures, and
+		#  sprites its WadSprites, if it has sprites
+		self.name = name
+		self.textures = textures
+		self.sprites = sprites
+
+		# Players are placed at their start things rather than those being
+		#  stored as things
+		things = lumps["things"]
+		is_player = np.isin(things["type"], PLAYER_THING_TYPES)
+		self.player_starts = Table(things[is_player]).freeze()
+		self.things = Table(things[~is_player]).freeze()
+
+		self.sectors = self.load_sectors(lumps["sectors"]).freeze()
+		self.sidedefs = self.load_sidedefs(lumps["sidedefs"]).freeze()
+		self.vertexes = Table(lumps["vertexes"]).freeze()
+		self.linedefs = self.load_linedefs(lumps["linedefs"]).freeze()
+		self.segs = self.load_segs(lumps["segs"]).freeze()
+		self.subsectors = Table(lumps["subsectors"]).freeze()
+		self.nodes = Table(lumps["nodes"]).freeze()
+
+		# Where linedefs and things are, for finding ones near a point
+		self.blockmap = Blockmap(lumps["blockmap"])
+		self.thing_blocks = self.blockmap.link(self.things.x, self.things.y)
+		self.all_lines = np.arange(len(self.linedefs))
+		self.all_lines.flags.writeable = False
+
+		# Which sectors can see each other, and which sectors are in each
+		#  subsector and under each node, so parts of the map that can't
+		#  be seen can be skipped
+		self.reject = Reject(lumps["reject"], len(self.sectors))
+		self.subsector_sectors = self.segs.right_sector[self.subsectors.first_seg_id]
+		self.subsector_sectors.flags.writeable = False
+		self.node_sectors = self.load_node_sectors()
+		self.thing_sectors = self.sectors_at(self.things.x, self.things.y)
+		self.thing_sectors.flags.writeable = False
+
+
+	def load_sectors(self, records):
+		# The id in the TextureAtlas of each flat name, or -1
+		sectors = Table(records)
+		for part in ("floor", "ceiling"):
+			names = getattr(sectors, part + "_texture")
+			if self.textures is not None:
+				ids = self.textures.flat_ids(names)
+			else:
+				ids = np.full(len(sectors), -1, dtype=np.int64)
+			sectors.add_column(part + "_texture_id", ids)
+		return sectors
+
+	def load_sidedefs(self, records):
+		# The id in the TextureAtlas of each texture name, or -1
+		sidedefs = Table(records)
+		for part in ("upper", "lower", "middle"):
+			names = getattr(sidedefs, part + "_texture")
+			if self.textures is not None:
+				ids = self.textures.texture_ids(names)
+			else:
+				ids = np.full(len(sidedefs), -1, dtype=np.int64)
+			sidedefs.add_column(part + "_texture_id", ids)
+		return sidedefs
+
+	def load_linedefs(self, records):
+		# Where every linedef starts and which way it goes, like Doom's
+		#  line_t, and the sectors on each side, or -1 where there's
+		#  nothing
+		linedefs = Table(records)
+		start_x = self.vertexes.x[linedefs.start_vertex]
+		start_y = self.vertexes.y[linedefs.start_vertex]
+		linedefs.add_column("start_x", start_x)
+		linedefs.add_column("start_y", start_y)
+		linedefs.add_column("dx", self.vertexes.x[linedefs.end_vertex] - start_x)
+		linedefs.add_column("dy", self.vertexes.y[linedefs.end_vertex] - start_y)
+		linedefs.add_column("right_sector", self.sidedef_sectors(linedefs.right_sidedef))
+		linedefs.add_column("left_sector", self.sidedef_sectors(linedefs.left_sidedef))
+		return linedefs
+
+	def load_segs(self, records):
+		segs = Table(records)
+
+		# The sectors on each side of every seg, or -1 where there's
+		#  nothing. A seg's right side is its linedef's right side,
+		#  unless the seg runs the opposite way to the linedef.
+		linedef = segs.linedef_id
+		reverse = segs.direction != 0
+		right_sidedef = np.where(reverse, self.linedefs.left_sidedef[linedef], self.linedefs.right_sidedef[linedef])
+		left_sidedef = np.where(reverse, self.linedefs.right_sidedef[linedef], self.linedefs.left_sidedef[linedef])
+		segs.add_column("right_sidedef", right_sidedef)
+		segs.add_column("right_sector", self.sidedef_sectors(right_sidedef))
+		segs.add_column("left_sector", self.sidedef_sectors(left_sidedef))
+		return segs
+
+	def sidedef_sectors(self, sidedefs):
+		# The sector of each sidedef id, or -1 for NO_SIDEDEF
+		missing = sidedefs == NO_SIDEDEF
+		sectors = self.sidedefs.sector_id[np.where(missing, 0, sidedefs)]
+		sectors[missing] = -1
+		return sectors
+
+
+	def load_node_sectors(self):
+		# The sectors of the subsectors under each node, as rows of packed
+		#  bits like Reject's. A node's children always come before it, so
+		#  going through the nodes in order does every child before its
+		#  parent. Nodes with children that don't, which could make the
+		#  tree loop, are refused with a ValueError.
+		count = len(self.sectors)
+		bits = np.zeros((len(self.nodes), len(sector_bits([], count))), dtype=np.uint8)
+		for node in range(len(self.nodes)):
+			for child in (int(self.nodes.r_child[node]), int(self.nodes.l_child[node])):
+				if child & SUBSECTOR_FLAG:
+					subsector = child & ~SUBSECTOR_FLAG
+					if subsector >= len(self.subsector_sectors):
+						raise ValueError(f"BSP node {node} has child subsector {subsector}, but there are only {len(self.subsector_sectors)}")
+					bits[node] |= sector_bits([self.subsector_sectors[subsector]], count)
+				elif child >= node:
+					raise ValueError(f"BSP node {node} has child node {child}, which doesn't come before it")
+				else:
+					bits[node] |= bits[child]
+		bits.flags.writeable = False
+		return bits
+
+
+	def subsectors_at(self, x, y):
+		# The subsector each of an array of points is in, going down the
+		#  BSP tree for all of them at once. Each step goes to a lower
+		#  node, so it takes at most one step per node.
+		x = np.asarray(x)
+		y = np.asarray(y)
+		nodes = self.nodes
+		node = np.full(x.shape, self.root_node, dtype=np.int64)
+		going = (node & SUBSECTOR_FLAG) == 0
+		for _ in range(len(nodes)):
+			if not going.any():
+				break
+			n = node[going]
+			dx = x[going] - nodes.x_partition[n]
+			dy = y[going] - nodes.y_partition[n]
+			left = dx * nodes.dy_partition[n] - dy * nodes.dx_partition[n] <= 0
+			node[going] = np.where(left, nodes.l_child[n], nodes.r_child[n])
+			going = (node & SUBSECTOR_FLAG) == 0
+		return node & ~SUBSECTOR_FLAG
 
-from apps.doom.helpers import *
 
+	def sectors_at(self, x, y):
+		# The sector each of an array of points is in
+		return self.subsector_sectors[self.subsectors_at(x, y)]
 
 
-class Map:
+	@property
+	def root_node(self):
+		# The BSP tree starts at the last node
+		return len(self.nodes) - 1
 
-	def __init__(self, wad, name, players):
-		self.name = name
+
+
+class Map:
+	"""
+	The map a world is played on. The static geometry is shared with
+	every other world on the same map, and the parts that can change,
+	like sector heights, belong to the world, so every session playing
+	in it sees the same ones.
+	"""
+
+	def __init__(self, geometry, players):
+		self.geometry = geometry
+		self.name = geometry.name
 		self.players = players
 
-		# Objects present in the map
-		self.things = []
-		self.linedefs = []
-		self.sidedefs = []
-		self.vertexes = []
-		self.segs = []
-		self.subsectors = []
-		self.nodes = []
-		self.sectors = []
-		self.reject = None
-		self.blockmap = None
-
-		# Screen drawing details
-		self.x_offset = 0
-		self.y_offset = 0
-		self.scale_factor = 1
-
-		# Load all objects from the given WAD
-		self.load_from_wad(wad)
-
-
-	#################################################
-	# Load methods for loading WAD objects into Map #
-	#################################################
-	def load_from_wad(self, wad):
-		self.load_things_from_wad(wad)
-		self.load_sectors_from_wad(wad)
-		self.load_sidedefs_from_wad(wad)
-		self.load_vertexes_from_wad(wad)
-		self.load_linedefs_from_wad(wad)
-		self.load_segs_from_wad(wad)
-		self.load_subsectors_from_wad(wad)
-		self.load_nodes_from_wad(wad)
-
-	def load_things_from_wad(self, wad):
-		for wad_thing in wad.things:
-			thing = Map_Thing(wad_thing)
-
-			# If a player, instead of storing as a thing, update the
-			#  player
-			if thing.is_player():
-				# Find the right player to update
-				for p in self.players:
-					if p.id == thing.type:
-						p.update_from_thing(thing)
-			else:
-				self.things.append(thing)
-
-	def load_sectors_from_wad(self, wad):
-		for wad_sector in wad.sectors:
-			sector = Map_Sector(wad_sector)
-			self.sectors.append(sector)
-
-	def load_sidedefs_from_wad(self, wad):
-		for wad_sidedef in wad.sidedefs:
-			sidedef = Map_Sidedef(wad_sidedef, self.sectors)
-			self.sidedefs.append(sidedef)
-
-	def load_vertexes_from_wad(self, wad):
-		for wad_vertex in wad.vertexes:
-			vertex = Map_Vertex(wad_vertex)
-			self.vertexes.append(vertex)
-
-	def load_linedefs_from_wad(self, wad):
-		for wad_linedef in wad.linedefs:
-			linedef = Map_Linedef(wad_linedef, self.sectors, self.sidedefs, self.vertexes)
-			self.linedefs.append(linedef)
-
-	def load_segs_from_wad(self, wad):
-		for wad_seg in wad.segs:
-			seg = Map_Seg(wad_seg, self.vertexes, self.linedefs)
-			self.segs.append(seg)
-
-	def load_subsectors_from_wad(self, wad):
-		for wad_subsector in wad.subsectors:
-			subsector = Map_Subsector(wad_subsector, self.segs)
-			self.subsectors.append(subsector)
-
-	def load_nodes_from_wad(self, wad):
-		for wad_node in wad.nodes:
-			node = Map_Node(wad_node)
-			self.nodes.append(node)
-		for node in self.nodes:
-			node.link_nodes(self.nodes, self.subsectors)
+		# Shared, read only
+		self.things = geometry.things
+		self.linedefs = geometry.linedefs
+		self.sidedefs = geometry.sidedefs
+		self.vertexes = geometry.vertexes
+		self.segs = geometry.segs
+		self.subsectors = geometry.subsectors
+		self.nodes = geometry.nodes
+		self.reject = geometry.reject
+		self.subsector_sectors = geometry.subsector_sectors
+		self.node_sectors = geometry.node_sectors
+		self.thing_sectors = geometry.thing_sectors
+		self.blockmap = geometry.blockmap
+		self.thing_blocks = geometry.thing_blocks
+		self.all_lines = geometry.all_lines
+		self.textures = geometry.textures
+		self.sprites = geometry.sprites
+
+		# The world's own
+		self.sectors = geometry.sectors.copy()
+
+		# Players move around this map
+		for p in self.players:
+			p.map = self
+		self.place_players()
+
+
+	def place_players(self):
+		# Moves each player to its start thing
+		starts = self.geometry.player_starts
+		for i in range(len(starts)):
+			for p in self.players:
+				if p.id == starts.type[i]:
+					p.update_from_thing(int(starts.x[i]), int(starts.y[i]), int(starts.angle[i]))
+
+
+	def lines_near(self, x, y, radius):
+		# The linedefs that might be within radius of (x, y), from the
+		#  blocks around it, or every linedef of a small map
+		if len(self.all_lines) <= FULL_SCAN_LINEDEFS:
+			return self.all_lines
+		return self.blockmap.lines_in_box(x - radius, y - radius, x + radius, y + radius)
+
+
+	def sector_at(self, x, y):
+		return int(self.geometry.sectors_at(x, y))
+
+
+	def can_see(self, sector, sectors):
+		# If anything in sector might be able to see each of sectors, for
+		#  line of sight checks to rule out most pairs quickly
+		return self.reject.can_see(sector, sectors)
+
+
+	def things_visible_from(self, sector):
+		# The things in sectors that might be seen from sector
+		return np.flatnonzero(self.reject.can_see(sector, self.thing_sectors))
+
+
+	def things_near(self, x, y, radius):
+		# The things within radius of (x, y), looking only at the things
+		#  in the blocks around it
+		things = self.thing_blocks.in_blocks(
+			*self.blockmap.blocks(x - radius, y - radius, x + radius, y + radius))
+		dx = self.things.x[things] - x
+		dy = self.things.y[things] - y
+		return things[dx * dx + dy * dy <= radius * radius]
+
+
+	@property
+	def root_node(self):
+		return self.geometry.root_node
 
 
 	def __repr__(self):
@@ -110,143 +339,5 @@ class Map:
 			+ f"{len(self.subsectors)} ssectors, "
 			+ f"{len(self.nodes)} nodes, "
 			+ f"{len(self.sectors)} sectors, "
-			+ f"0 reject, "
-			+ f"0 blockmap>")
-
-
-
-class Map_Thing:
-	def __init__(self, wad_thing):
-		self.x = wad_thing.x
-		self.y = wad_thing.y
-		self.angle = wad_thing.angle
-		self.type = wad_thing.type
-		self.flags = wad_thing.flags
-
-	def is_player(self):
-		# Things with a type of Player 1, Player 2, etc
-		return self.type in [1,2,3,4]
-
-class Map_Sector:
-	def __init__(self, wad_sector):
-		self.floor_height = wad_sector.floor_height
-		self.ceiling_height = wad_sector.ceiling_height
-		self.floor_texture = wad_sector.floor_texture
-		self.ceiling_texture = wad_sector.ceiling_texture
-		self.light_level = wad_sector.light_level
-		self.type = wad_sector.type
-		self.tag = wad_sector.tag
-
-class Map_Sidedef:
-	def __init__(self, wad_sidedef, sectors):
-		self.x_offset = wad_sidedef.x_offset
-		self.y_offset = wad_sidedef.y_offset
-		self.upper_texture = wad_sidedef.upper_texture
-		self.lower_texture = wad_sidedef.lower_texture
-		self.middle_texture = wad_sidedef.middle_texture
-		self.sector = sectors[wad_sidedef.sector_id]
-
-class Map_Vertex:
-	def __init__(self, wad_vertex):
-		self.x = wad_vertex.x
-		self.y = wad_vertex.y
-
-class Map_Linedef:
-	def __init__(self, wad_linedef, sectors, sidedefs, vertexes):
-		self.start_vertex = vertexes[wad_linedef.start_vertex]
-		self.end_vertex = vertexes[wad_linedef.end_vertex]
-		self.flags = wad_linedef.flags
-		self.line_type = wad_linedef.line_type
-
-		for sector in sectors:
-			if sector.tag == wad_linedef.sector_tag:
-				self.sector = sector
-				break
-
-		if wad_linedef.right_sidedef != 0xffff:
-			self.right_sidedef = sidedefs[wad_linedef.right_sidedef]
-		else:
-			self.right_sidedef = None
-		
-		if wad_linedef.left_sidedef != 0xffff:
-			self.left_sidedef = sidedefs[wad_linedef.left_sidedef]
-		else:
-			self.left_sidedef = None
-
-class Map_Seg:
-	def __init__(self, wad_seg, vertexes, linedefs):
-		self.start_vertex = vertexes[wad_seg.start_vertex]
-		self.end_vertex = vertexes[wad_seg.end_vertex]
-		self.angle = wad_seg.angle # TODO: Slope angle
-		self.linedef = linedefs[wad_seg.linedef_id]
-		self.direction = wad_seg.direction
-		self.offset = wad_seg.offset # TODO: Convert
-
-		self.right_sidedef = self.linedef.right_sidedef
-		self.left_sidedef = self.linedef.left_sidedef
-		
-		if self.right_sidedef:
-			self.right_sector = self.right_sidedef.sector
-		else:
-			self.right_sector = None
-		
-		if self.left_sidedef:
-			self.left_sector = self.left_sidedef.sector
-		else:
-			self.left_sector = None
-
-class Map_Subsector:
-	def __init__(self, wad_subsector, segs):
-		start_seg = wad_subsector.first_seg_id
-		end_seg = start_seg + wad_subsector.seg_count
-		self.segs = segs[start_seg:end_seg]
-
-	def is_subsector(self):
-		# Useful when traversing binary space partitioning tree
-		return True
-
-	def __repr__(self):
-		return f"<Subsector: {len(self.segs)} segs>"
-
-class Map_Node:
-	def __init__(self, wad_node):
-		self.x_partition = wad_node.x_partition
-		self.y_partition = wad_node.y_partition
-		self.dx_partition = wad_node.dx_partition
-		self.dy_partition = wad_node.dy_partition
-		self.rbox_t = wad_node.rbox_t
-		self.rbox_b = wad_node.rbox_b
-		self.rbox_l = wad_node.rbox_l
-		self.rbox_r = wad_node.rbox_r
-		self.lbox_t = wad_node.lbox_t
-		self.lbox_b = wad_node.lbox_b
-		self.lbox_l = wad_node.lbox_l
-		self.lbox_r = wad_node.lbox_r
-		self.r_child = wad_node.r_child # id, make reference
-		self.l_child = wad_node.l_child # id, make reference
-
-	def link_nodes(self, nodes, subsectors):
-		# If right child is a leaf node
-		if self.r_child & 0x8000:
-			self.r_child = subsectors[self.r_child & (~0x8000)]
-		else:
-			self.r_child = nodes[self.r_child]
-
-		# If left child is a leaf node
-		if self.l_child & 0x8000:
-			self.l_child = subsectors[self.l_child & (~0x8000)]
-		else:
-			self.l_child = nodes[self.l_child]
-
-	def is_subsector(self):
-		# Useful when traversing binary space partitioning tree
-		return False
-
-	def __repr__(self):
-		if isinstance(self.r_child, Map_Node) and isinstance(self.l_child, Map_Node):
-			return f"<Node: r_child=<Node ??>, l_child=<Node ??>>"
-		elif isinstance(self.r_child, Map_Node):
-			return f"<Node: r_child=<Node ??>, l_child={self.l_child}>"
-		elif isinstance(self.l_child, Map_Node):
-			return f"<Node: r_child={self.r_child}, l_child=<Node ??>>"
-		return f"<Node: r_child={self.r_child}, l_child={self.l_child}>"
+			+ f"{self.reject.sector_count}x{self.reject.sector_count} reject, "
+			+ f"{self.blockmap.columns}x{self.blockmap.rows} blockmap>")
@@ -0,0 +1,102 @@
+
+import collections
+import os
+import threading
+
+from apps.doom.map import Map
+from apps.doom.wad import WAD
+from config import Config
+
+
+class MapCache:
+	"""
+	Keeps loaded WADs and the geometry of their maps, so every session
+	playing a map shares one copy of it instead of loading its own.
+	WADs are memory mapped, so the geometry's raw lumps are views of the
+	same pages for everyone, and the geometry is read only, so it can be
+	shared between threads without locking.
+
+	At most max_maps maps are kept, evicting the least recently used one.
+	Sessions still playing an evicted map keep it alive until they end;
+	they just don't share it with sessions started after. A WAD is
+	dropped once none of its maps are cached.
+	"""
+
+	def __init__(self, max_maps=None):
+		# None keeps every map that is loaded
+		self.max_maps = max_maps
+
+		self.lock = threading.Lock()
+
+		# Real path of the file -> WAD
+		self.wads = {}
+
+		# (real path, map name) -> MapGeometry, least recently used first
+		self.maps = collections.OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+
+
+	def get_wad(self, path):
+		# Has to be called holding the lock
+		wad = self.wads.get(path)
+		if wad is None:
+			wad = WAD(path)
+			wad.load()
+			self.wads[path] = wad
+		return wad
+
+
+	def get_map(self, filename, map_name):
+		# The shared MapGeometry of the map, or None if it isn't in the WAD.
+		#  Loading is done holding the lock, so sessions starting at the
+		#  same time on a map that isn't loaded yet only load it once.
+		with self.lock:
+			path = os.path.realpath(filename)
+			key = (path, map_name)
+			geometry = self.maps.get(key)
+			if geometry is not None:
+				self.maps.move_to_end(key)
+				self.hits += 1
+				return geometry
+
+			self.misses += 1
+			geometry = self.get_wad(path).load_map_geometry(map_name)
+			if geometry is None:
+				self.drop_unused_wads()
+				return None
+
+			self.maps[key] = geometry
+			if self.max_maps is not None:
+				while len(self.maps) > self.max_maps:
+					self.maps.popitem(last=False)
+				self.drop_unused_wads()
+			return geometry
+
+
+	def load_map(self, filename, map_name, players):
+		# A new session's Map, sharing the geometry of the map
+		geometry = self.get_map(filename, map_name)
+		if geometry is None:
+			return None
+		return Map(geometry, players)
+
+
+	def drop_unused_wads(self):
+		# Has to be called holding the lock
+		used = {path for path, _ in self.maps}
+		for path in list(self.wads):
+			if path not in used:
+				del self.wads[path]
+
+
+	def clear(self):
+		with self.lock:
+			self.maps.clear()
+			self.wads.clear()
+
+
+
+# Shared by every session in the process
+MAP_CACHE = MapCache(Config.DOOM_MAP_CACHE_SIZE)
@@ -0,0 +1,71 @@
+
+import time
+
+
+class FramePacer:
+	"""
+	Decides when the next frame should be sent, so a client on a slow or
+	laggy connection isn't sent frames faster than it can take them.
+	Otherwise they pile up in the channel's queue and the kernel's
+	buffers, and key presses take seconds to show.
+
+	Before each frame, the channel's backlog is checked. If the client
+	still hasn't taken the last frame, or couldn't take another one,
+	the frame is skipped and the frame rate is cut. Skipped frames
+	aren't lost: drawing carries on into the Screen's pending changes,
+	so the next frame sent shows the latest state. While the client keeps
+	up, the frame rate creeps back up to max_fps.
+	"""
+
+	# Multiplied on the frame rate when the client falls behind, and
+	#  added to it for every frame that goes through cleanly
+	DECREASE_FACTOR = 0.7
+	INCREASE_STEP = 0.5
+
+	# Size assumed for a frame before any have been sent
+	INITIAL_FRAME_BYTES = 16384
+
+
+	def __init__(self, backlog, min_fps=2, max_fps=30):
+		# Returns (queued bytes, window bytes left, unsent socket bytes)
+		self.backlog = backlog
+
+		self.min_fps = min_fps
+		self.max_fps = max_fps
+		self.fps = max_fps
+
+		# Rolling size of the frames being sent, to compare the backlog
+		#  against
+		self.frame_bytes = self.INITIAL_FRAME_BYTES
+
+		self.next_frame = time.monotonic()
+		self.frames_sent = 0
+		self.frames_skipped = 0
+
+
+	def wait(self):
+		# Sleeps until it's time for the next frame. A frame that's late
+		#  doesn't make the ones after it come sooner.
+		now = time.monotonic()
+		if self.next_frame > now:
+			time.sleep(self.next_frame - now)
+			now = self.next_frame
+		self.next_frame = now + 1 / self.fps
+
+
+	def ready(self):
+		# If the client can take another frame right now
+		queued, window, unsent = self.backlog()
+		if queued > 0 or unsent > self.frame_bytes or window < self.frame_bytes:
+			self.fps = max(self.min_fps, self.fps * self.DECREASE_FACTOR)
+			self.frames_skipped += 1
+			return False
+		return True
+
+
+	def sent(self, size):
+		# Called after each frame that was sent, with how big it was
+		if size > 0:
+			self.frame_bytes = (self.frame_bytes * 3 + size) // 4
+		self.frames_sent += 1
+		self.fps = min(self.max_fps, self.fps + self.INCREASE_STEP)
@@ -0,0 +1,164 @@
+
+import threading
+
+import numpy as np
+
+from config import Config
+
+
+class TrueColourPalette:
+	"""
+	24-bit colour, sent as 38;2;r;g;b. Colours are used as they are.
+	"""
+	name = "truecolor"
+	indexed = False
+
+	def quantise(self, colours):
+		return colours
+
+
+
+class IndexedPalette:
+	"""
+	A palette of a fixed set of colours that terminals pick by index.
+	0xRRGGBB colours are mapped to their nearest palette entry through a
+	3D lookup table, indexed by the top LUT_BITS bits of each channel.
+	"""
+	name = None
+	indexed = True
+
+	LUT_BITS = 5
+
+	# Filled in by each palette: index -> (r, g, b) of every index that
+	#  colours can be mapped to
+	COLOURS = {}
+
+	_lut = None
+	_lut_lock = threading.Lock()
+
+
+	@classmethod
+	def lut(cls):
+		# Built on first use, as it takes a moment, and then shared
+		with cls._lut_lock:
+			if cls.__dict__.get("_lut") is None:
+				cls._lut = cls._build_lut()
+		return cls._lut
+
+
+	@classmethod
+	def _build_lut(cls):
+		indices = np.array(list(cls.COLOURS.keys()))
+		rgb = np.array(list(cls.COLOURS.values()), dtype=np.int32)
+
+		# The centre of each LUT cell, per channel
+		step = 1 << (8 - cls.LUT_BITS)
+		levels = np.arange(0, 256, step) + step // 2
+		r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+		centres = np.stack((r.ravel(), g.ravel(), b.ravel()), axis=1)
+
+		# Nearest palette entry by squared distance, a chunk at a time to
+		#  keep the distance arrays small
+		lut = np.empty(len(centres), dtype=np.int32)
+		for start in range(0, len(centres), 4096):
+			chunk = centres[start:start+4096]
+			distances = ((chunk[:, None, :] - rgb[None, :, :]) ** 2).sum(axis=2)
+			lut[start:start+4096] = indices[distances.argmin(axis=1)]
+		return lut
+
+
+	def quantise(self, colours):
+		shift = 8 - self.LUT_BITS
+		mask = (1 << self.LUT_BITS) - 1
+		index = (((colours >> (16 + shift)) & mask) << (2 * self.LUT_BITS)) \
+			| (((colours >> (8 + shift)) & mask) << self.LUT_BITS) \
+			| ((colours >> shift) & mask)
+		return self.lut()[index]
+
+
+	# The SGR parameters that set an index as the foreground/background
+	def fg_parameters(self, index):
+		raise NotImplementedError
+
+	def bg_parameters(self, index):
+		raise NotImplementedError
+
+
+
+# Channel values of xterm's 6x6x6 colour cube
+XTERM_CUBE_LEVELS = [0, 95, 135, 175, 215, 255]
+
+
+class Xterm256Palette(IndexedPalette):
+	"""
+	xterm's 256 colours, sent as 38;5;n. Only the 6x6x6 colour cube and
+	the grey ramp are used, as the first 16 colours vary by terminal.
+	"""
+	name = "256"
+
+	COLOURS = {
+		**{16 + 36*r + 6*g + b: (XTERM_CUBE_LEVELS[r], XTERM_CUBE_LEVELS[g], XTERM_CUBE_LEVELS[b])
+			for r in range(6) for g in range(6) for b in range(6)},
+		**{232 + i: (8 + 10*i,)*3 for i in range(24)}
+	}
+
+	def fg_parameters(self, index):
+		return f"38;5;{index}"
+
+	def bg_parameters(self, index):
+		return f"48;5;{index}"
+
+
+
+class Ansi16Palette(IndexedPalette):
+	"""
+	The 8 basic colours and their bright versions, sent as 30-37/90-97
+	for the foreground and 40-47/100-107 for the background. RGB values
+	are xterm's defaults.
+	"""
+	name = "16"
+
+	COLOURS = {
+		0: (0, 0, 0),        1: (205, 0, 0),      2: (0, 205, 0),      3: (205, 205, 0),
+		4: (0, 0, 238),      5: (205, 0, 205),    6: (0, 205, 205),    7: (229, 229, 229),
+		8: (127, 127, 127),  9: (255, 0, 0),      10: (0, 255, 0),     11: (255, 255, 0),
+		12: (92, 92, 255),   13: (255, 0, 255),   14: (0, 255, 255),   15: (255, 255, 255),
+	}
+
+	def fg_parameters(self, index):
+		return str(30 + index) if index < 8 else str(90 + index - 8)
+
+	def bg_parameters(self, index):
+		return str(40 + index) if index < 8 else str(100 + index - 8)
+
+
+
+PALETTES = {
+	palette.name: palette
+	for palette in (TrueColourPalette, Xterm256Palette, Ansi16Palette)
+}
+
+
+def select_palette(environ):
+	"""
+	Picks the best palette the client's terminal supports, going by the
+	TERM and COLORTERM environment variables it sent. Can be forced with
+	Config.DOOM_PALETTE.
+	"""
+	if Config.DOOM_PALETTE is not None:
+		return PALETTES[Config.DOOM_PALETTE]()
+
+	term = environ.get("TERM", "").lower()
+	colorterm = environ.get("COLORTERM", "").lower()
+
+	if colorterm in ("truecolor", "24bit") or term.endswith(("-direct", "-truecolor")):
+		return TrueColourPalette()
+	if "256color" in term:
+		return Xterm256Palette()
+	if term:
+		# linux console, vt100, screen, plain xterm...
+		return Ansi16Palette()
+
+	# Nothing was sent, e.g. 'ssh -T'. Almost every terminal handles 256
+	#  colours.
+	return Xterm256Palette()
@@ -7,6 +7,15 @@ MOVE_SPEED = 10
 TURN_SPEED = 1
 EYE_LEVEL = 41 # units
 
+# Players are circles this wide, this tall, and can step up this much
+#  (units)
+RADIUS = 16
+HEIGHT = 56
+MAX_STEP = 24
+
+# Linedef flag for walls that block players even if two sided
+BLOCKING = 0x1
+
 
 class Player:
 	def __init__(self, id_):
@@ -16,6 +25,10 @@ class Player:
 		self.angle = None
 		self.fov = 90 # degrees
 
+		# The Map being played, set by the Map. Without one there's
+		#  nothing to collide with.
+		self.map = None
+
 
 	@property
 	def x(self):
@@ -44,21 +57,111 @@ class Player:
 		self.angle = normalise_angle(self.angle - TURN_SPEED)
 		print(self.angle)
 
-	# TODO: Use numpy
 	def move_forward(self):
-		self.x += np.cos(np.deg2rad(self.angle)) * MOVE_SPEED
-		self.y += np.sin(np.deg2rad(self.angle)) * MOVE_SPEED
+		angle = math.radians(self.angle)
+		self.move(math.cos(angle) * MOVE_SPEED, math.sin(angle) * MOVE_SPEED)
 		print(self.x, self.y)
 	def move_backward(self):
-		self.x -= np.cos(np.deg2rad(self.angle)) * MOVE_SPEED
-		self.y -= np.sin(np.deg2rad(self.angle)) * MOVE_SPEED
+		angle = math.radians(self.angle)
+		self.move(-math.cos(angle) * MOVE_SPEED, -math.sin(angle) * MOVE_SPEED)
 		print(self.x, self.y)
 
 
-	def update_from_thing(self, thing):
-		self.x = thing.x
-		self.y = thing.y
-		self.angle = normalise_angle(thing.angle)
+	def move(self, dx, dy):
+		# Moves by (dx, dy). If a wall is in the way, slides along it
+		#  instead, and if that's blocked too, tries moving along just x
+		#  or just y, which gets the player out of corners.
+		if self.map is None:
+			self._x += dx
+			self._y += dy
+			return
+
+		wall = self.wall_hit(dx, dy)
+		if wall is None:
+			self._x += dx
+			self._y += dy
+			return
+
+		# The part of the move that's along the wall
+		wall_x = int(self.map.linedefs.dx[wall])
+		wall_y = int(self.map.linedefs.dy[wall])
+		along = (dx * wall_x + dy * wall_y) / max(wall_x * wall_x + wall_y * wall_y, 1)
+		for dx, dy in ((wall_x * along, wall_y * along), (dx, 0), (0, dy)):
+			if (dx or dy) and self.wall_hit(dx, dy) is None:
+				self._x += dx
+				self._y += dy
+				return
+
+
+	def wall_hit(self, dx, dy):
+		# The linedef the player would hit moving by (dx, dy), or None.
+		#  Only the linedefs in the blockmap blocks around where they'd
+		#  end up are looked at.
+		x = self._x + dx
+		y = self._y + dy
+		lines = self.map.lines_near(x, y, RADIUS)
+		if lines.size == 0:
+			return None
+
+		# The ones the player would be touching, if they can't go through
+		#  them. Moves that don't get nearer are fine, so players can't
+		#  get stuck in walls.
+		new_distance = self.distance_to_lines(lines, x, y)
+		near = new_distance < RADIUS
+		if not near.any():
+			return None
+		lines = lines[near]
+		new_distance = new_distance[near]
+		hit = self.blocking(lines) & (new_distance < self.distance_to_lines(lines, self._x, self._y))
+		if not hit.any():
+			return None
+		return int(lines[hit][np.argmin(new_distance[hit])])
+
+
+	def blocking(self, lines):
+		# Which of the linedefs the player can't go through: one sided
+		#  ones, ones flagged as blocking, and two sided ones where the
+		#  gap is too low to fit through or the floor on the other side
+		#  is too high to step up to
+		m = self.map
+		linedefs = m.linedefs
+		right = linedefs.right_sector[lines]
+		left = linedefs.left_sector[lines]
+		one_sided = left == -1
+		left = np.where(one_sided, right, left)
+
+		# Which side the player is on
+		on_right = (
+			(self._x - linedefs.start_x[lines]) * linedefs.dy[lines]
+			- (self._y - linedefs.start_y[lines]) * linedefs.dx[lines] > 0)
+		front = np.where(on_right, right, left)
+		back = np.where(on_right, left, right)
+
+		floor = m.sectors.floor_height
+		ceiling = m.sectors.ceiling_height
+		gap = np.minimum(ceiling[front], ceiling[back]) - np.maximum(floor[front], floor[back])
+		return (
+			one_sided | (linedefs.flags[lines] & BLOCKING != 0)
+			| (gap < HEIGHT) | (floor[back] - floor[front] > MAX_STEP))
+
+
+	def distance_to_lines(self, lines, x, y):
+		# How far (x, y) is from the nearest point of each linedef
+		linedefs = self.map.linedefs
+		x1 = linedefs.start_x[lines]
+		y1 = linedefs.start_y[lines]
+		wall_x = linedefs.dx[lines]
+		wall_y = linedefs.dy[lines]
+		length = np.maximum(wall_x * wall_x + wall_y * wall_y, 1)
+		along = np.clip(((x - x1) * wall_x + (y - y1) * wall_y) / length, 0, 1)
+		return np.hypot(x1 + along * wall_x - x, y1 + along * wall_y - y)
+
+
+	def update_from_thing(self, x, y, angle):
+		# Places the player where the map's player start thing is
+		self.x = x
+		self.y = y
+		self.angle = normalise_angle(angle)
 
 		# # Debug
 		# self.x = 1038
@@ -0,0 +1,50 @@
+
+import numpy as np
+
+
+
+class Reject:
+	"""
+	Which sectors can see each other, from the REJECT lump. The lump is
+	a bit for every pair of sectors, with the bit for (i, j) at i * n +
+	j set if nothing in sector j can be seen from sector i. It's kept
+	the other way round here, as which can be seen, with a row of bits
+	packed into bytes for each sector (as numpy.packbits makes them,
+	little end first, like the lump), so the rows of many sectors can be
+	checked against each other a byte at a time.
+	"""
+
+	def __init__(self, lump, sector_count):
+		# Missing bits, from lumps that are too short or empty, are
+		#  sectors that can be seen. A sector can always see itself.
+		n = sector_count
+		bits = np.unpackbits(np.asarray(lump, dtype=np.uint8), bitorder="little")[:n * n]
+		bits = np.concatenate((bits, np.zeros(n * n - bits.size, dtype=np.uint8)))
+		rejected = bits.reshape(n, n).astype(bool)
+		np.fill_diagonal(rejected, False)
+
+		self.sector_count = n
+		self.visible = np.packbits(~rejected, axis=1, bitorder="little")
+		self.visible.flags.writeable = False
+
+
+	def can_see(self, sector, sectors):
+		# If anything in each of an array of sectors can be seen from sector
+		sectors = np.asarray(sectors)
+		return (self.visible[sector, sectors >> 3] >> (sectors & 7)) & 1 != 0
+
+
+	def visible_from(self, sector):
+		# The packed row of the sectors that can be seen from sector
+		return self.visible[sector]
+
+
+
+def sector_bits(sectors, sector_count):
+	"""
+	Packs an array of sector ids into a row of bits, the same way as
+	the rows of Reject.visible.
+	"""
+	row = np.zeros(sector_count, dtype=bool)
+	row[sectors] = True
+	return np.packbits(row, bitorder="little")
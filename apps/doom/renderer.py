@@ -1,7 +1,120 @@
+import math
+
 import numpy as np
 from apps.doom.helpers import normalise_angle, Vector
-
-import time
+from apps.doom.map import LOWER_UNPEGGED, SUBSECTOR_FLAG, UPPER_UNPEGGED
+from apps.doom.player import HEIGHT, RADIUS
+from apps.doom.textures import LIGHT_LEVELS, shade_colours
+
+
+
+def running_max_before(groups, values, limit):
+	"""
+	For arrays sorted by groups, the largest of the values before each
+	one in the same group, or 0 for the first of a group. values must be
+	from 0 up to limit. It's one running max over the whole array, with
+	each group's values moved above those of the groups before it.
+	"""
+	offsets = groups * (limit + 1)
+	keys = offsets + values
+	before = np.concatenate(([-1], np.maximum.accumulate(keys)[:-1]))
+	return np.where(before >= offsets, before - offsets, 0)
+
+
+
+class Visplanes:
+	"""
+	The floors and ceilings seen this frame, as spans of rows of screen
+	columns, with the sector each is part of. Doom gathers these into a
+	visplane for each height, flat and light level, and draws them a row
+	at a time. Here the spans are kept as they're found, a batch of
+	walls at a time, and drawn all at once at the end of the frame.
+	"""
+
+	def __init__(self):
+		self.spans = []
+
+	def reset(self):
+		self.spans = []
+
+	def add(self, columns, y1, y2, sectors, floor):
+		# Takes arrays of the columns, rows from y1 up to y2, and sectors
+		#  of spans. floor is if they're floors, not ceilings.
+		keep = y2 > y1
+		if keep.any():
+			self.spans.append((
+				columns[keep], y1[keep], y2[keep], sectors[keep],
+				np.full(np.count_nonzero(keep), floor)))
+
+	def collect(self):
+		# Every span so far as arrays of columns, y1, y2, sectors and if
+		#  each is a floor, or None if there aren't any
+		if not self.spans:
+			return None
+		return [np.concatenate(field) for field in zip(*self.spans)]
+
+
+
+class SolidColumns:
+	"""
+	The columns of the screen that solid walls have been drawn in so far
+	this frame. Walls come nearest first, so anything further away in a
+	column that's already solid is hidden. This is Doom's list of solid
+	seg ranges, kept as one flag per column instead, so that every wall
+	of a batch can be clipped against it at once.
+	"""
+
+	def __init__(self, width):
+		self.width = width
+		self.solid = np.zeros(width, dtype=bool)
+
+	def reset(self):
+		self.solid[:] = False
+
+	def full(self):
+		return bool(self.solid.all())
+
+	def covered(self, x1, x2):
+		# If every column from x1 up to x2 is solid
+		return bool(self.solid[max(x1, 0):min(x2, self.width)].all())
+
+	def clip(self, x1, x2, solid=None):
+		# Takes arrays of the columns walls cover, from x1 up to x2, with
+		#  the nearest wall first, and which walls are solid (all of them
+		#  if not given). Returns the walls seen in each column that isn't
+		#  solid yet, which are the ones up to and including the first
+		#  solid one, as arrays of wall indexes and columns sorted by
+		#  column and then nearest first. Those columns are made solid.
+		x1 = np.clip(x1, 0, self.width)
+		widths = np.maximum(np.clip(x2, 0, self.width) - x1, 0)
+		walls = np.repeat(np.arange(x1.size), widths)
+		starts = np.cumsum(widths) - widths
+		columns = np.repeat(x1 - starts, widths) + np.arange(walls.size)
+
+		# Sorting by column keeps each column's walls nearest first
+		order = np.argsort(columns, kind="stable")
+		walls = walls[order]
+		columns = columns[order]
+
+		seen = ~self.solid[columns]
+		walls = walls[seen]
+		columns = columns[seen]
+		if walls.size == 0:
+			return walls, columns
+		if solid is None:
+			solid = np.ones(x1.size, dtype=bool)
+
+		# Nothing after the first solid wall in a column is seen. Count
+		#  the solid walls before each wall in its column.
+		is_solid = solid[walls]
+		solid_before = np.cumsum(is_solid) - is_solid
+		first = np.flatnonzero(np.diff(columns, prepend=-1))
+		solid_before -= np.repeat(solid_before[first], np.diff(first, append=walls.size))
+		seen = solid_before == 0
+		walls = walls[seen]
+		columns = columns[seen]
+		self.solid[columns[is_solid[seen]]] = True
+		return walls, columns
 
 
 
@@ -9,12 +122,53 @@ class Renderer:
 
 	wall_colours = {}
 
+	# Subsectors taken from the BSP tree at a time before drawing their
+	#  walls, and checking if the screen has filled up
+	SUBSECTORS_PER_BATCH = 8
+
+	# Skip the parts of the BSP tree the REJECT lump says can't be seen
+	#  from the player's sector. Maps that use REJECT for effects, like
+	#  monsters that can't see the player, can turn this off.
+	CULL_WITH_REJECT = True
+
+	# Past this distance walls are black
+	FOG_DISTANCE = 1500
+
+	# Colours of walls, floors and ceilings without a texture
+	UNTEXTURED_COLOUR = 0xa0a0a0
+	FLOOR_COLOUR = 0x705030
+	CEILING_COLOUR = 0x606060
+
+	# Colours of other players, by player number, like Doom's green,
+	#  indigo, brown and red, for WADs without the player's sprites
+	PLAYER_COLOURS = [0x00a000, 0x5050b0, 0x906030, 0xc00000]
+
+	# The sprite and frame other players are drawn with
+	PLAYER_SPRITE = "PLAYA"
+
+	# Nearest a wall is drawn, so ones the player is touching don't
+	#  become infinitely tall
+	MIN_DEPTH = 1
+
+	# Corners of a node's bounding box that are its left and right edges
+	#  as seen from the player, by where the player is: above, level with
+	#  or below it, then left of, level with or right of it. As (x, y)
+	#  field suffixes for the left corner then the right one. None is
+	#  inside the box.
+	BBOX_SILHOUETTES = [
+		[("r", "t", "l", "b"), ("r", "t", "l", "t"), ("r", "b", "l", "t")],
+		[("l", "t", "l", "b"), None,                 ("r", "b", "r", "t")],
+		[("l", "t", "r", "b"), ("l", "b", "r", "b"), ("l", "b", "r", "t")]]
+
 
 	def __init__(self, screen, player, map_):
 		self.screen = screen
 		self.player = player
 		self.map = map_
 
+		# Drawn to every frame, and reused
+		self.batch = self.screen.new_batch()
+
 		# Update the automap scaling etc.
 		self.update_automap_offset_and_scale()
 
@@ -24,19 +178,46 @@ class Renderer:
 		self.half_fov = self.player.fov / 2
 		self.screen_distance = self.half_screen_width / np.tan(np.deg2rad(self.half_fov))
 
-		# Precalculate each angle on screen to look up with screen coords
-		self.screen_x_to_angle = normalise_angle(
-			np.linspace(self.half_fov, -self.half_fov, self.screen.width + 1))
+		# Precalculate the angle of the ray through the middle of each
+		#  column, relative to the player, and its tan, which is how far
+		#  left the ray goes for each unit forward
+		self.column_tans = (self.half_screen_width - (np.arange(self.screen.width) + 0.5)) / self.screen_distance
+		self.screen_x_to_angle = np.rad2deg(np.arctan(self.column_tans))
+
+		# Unit vectors of where the player is looking, and to their left.
+		#  Set at the start of each frame.
+		self.forward = None
+		self.left = None
+
+		# And for each row, how far forward a plane one unit above or
+		#  below the player is seen there
+		self.row_distances = self.screen_distance / (self.half_screen_height - (np.arange(self.screen.height) + 0.5))
+
+		# Screen columns that a solid wall has been drawn in this frame
+		self.solid_columns = SolidColumns(self.screen.width)
+
+		# The rows of each column still open between the nearer ceilings
+		#  and floors drawn so far this frame, from ceiling_clip up to
+		#  floor_clip (Doom's ceilingclip and floorclip), and the floors
+		#  and ceilings seen
+		self.ceiling_clip = np.zeros(self.screen.width, dtype=np.int64)
+		self.floor_clip = np.full(self.screen.width, self.screen.height, dtype=np.int64)
+		self.visplanes = Visplanes()
+
+		# How far forward the wall that closed each column is, so things
+		#  behind it aren't drawn
+		self.wall_depth = np.full(self.screen.width, np.inf)
+
+		# Other players in the world, as (x, y, angle, id) rows. Set
+		#  before each frame.
+		self.others = np.zeros((0, 4))
 
 
 	def update_automap_offset_and_scale(self):
 		# Calculate what we need to shift the vertexes of the map by so
 		#  that it can be displayed on screen
-		self._automap_x_offset = 0
-		self._automap_y_offset = 0
-		for v in self.map.vertexes:
-			if v.x < self._automap_x_offset: self._automap_x_offset = v.x
-			if v.y < self._automap_y_offset: self._automap_y_offset = v.y
+		self._automap_x_offset = min(0, int(self.map.vertexes.x.min()))
+		self._automap_y_offset = min(0, int(self.map.vertexes.y.min()))
 
 		# Invert the offsets so we can add these numbers to screen coords
 		self._automap_x_offset *= -1
@@ -45,6 +226,16 @@ class Renderer:
 		# Set the map scale
 		self._automap_scale_factor = 15
 
+		# Screen coords of the end points of every wall, which don't move
+		#  so are only worked out once
+		vertexes = self.map.vertexes
+		linedefs = self.map.linedefs
+		self._automap_walls = (
+			self.remap_automap_x_to_screen(vertexes.x[linedefs.start_vertex]),
+			self.remap_automap_x_to_screen(vertexes.x[linedefs.end_vertex]),
+			self.remap_automap_y_to_screen(vertexes.y[linedefs.start_vertex]),
+			self.remap_automap_y_to_screen(vertexes.y[linedefs.end_vertex]))
+
 
 	def remap_automap_x_to_screen(self, x):
 		return (x + self._automap_x_offset) // self._automap_scale_factor
@@ -57,10 +248,16 @@ class Renderer:
 	def render_perspective(self):
 		# Start a batch render as we don't want to render frames during
 		#  drawing this screen
-		batch = self.screen.new_batch()
+		batch = self.batch
+
+		angle = math.radians(self.player.angle)
+		self.forward = Vector(math.cos(angle), math.sin(angle))
+		self.left = Vector(-self.forward.y, self.forward.x)
 
-		# Render nodes
+		# Render nodes, then the floors and ceilings between their walls
 		self._render_bsp_nodes(batch)
+		self.draw_planes(batch)
+		self.draw_players(batch)
 		batch.draw_box(0,320,0,200,colour=0x000000,fill=True,under=True)
 
 		# Draw the batch to the screen
@@ -69,16 +266,10 @@ class Renderer:
 	def render_automap(self):
 		# Start a batch render as we don't want to render frames during
 		#  drawing this screen
-		batch = self.screen.new_batch()
+		batch = self.batch
 
 		# Draw the walls
-		for line in self.map.linedefs:
-			batch.draw_line(
-				self.remap_automap_x_to_screen(line.start_vertex.x),
-				self.remap_automap_x_to_screen(line.end_vertex.x),
-				self.remap_automap_y_to_screen(line.start_vertex.y),
-				self.remap_automap_y_to_screen(line.end_vertex.y),
-				0x0000ff)
+		batch.draw_lines(*self._automap_walls, 0x0000ff)
 
 		# Render the player
 		batch.draw_box(
@@ -88,64 +279,160 @@ class Renderer:
 			self.remap_automap_y_to_screen(self.player.y),
 			0xff0000)
 
-		# Render all other things on the map
-		for t in self.map.things:
-			batch.draw_box(
-				self.remap_automap_x_to_screen(t.x),
-				self.remap_automap_x_to_screen(t.x),
-				self.remap_automap_y_to_screen(t.y),
-				self.remap_automap_y_to_screen(t.y),
-				0xff00ff)
+		# And the other players
+		others_x = self.remap_automap_x_to_screen(self.others[:, 0].astype(np.int64))
+		others_y = self.remap_automap_y_to_screen(self.others[:, 1].astype(np.int64))
+		batch.draw_lines(others_x, others_x, others_y, others_y, 0x00ff00)
+
+		# Render all other things on the map, as lines of one pixel
+		things_x = self.remap_automap_x_to_screen(self.map.things.x)
+		things_y = self.remap_automap_y_to_screen(self.map.things.y)
+		batch.draw_lines(things_x, things_x, things_y, things_y, 0xff00ff)
 
 		# Draw the batch to the screen
 		batch.draw()
 
 
-	def _render_bsp_nodes(self, screen, node=None):
-		# Start with root node if not specified
-		if node is None:
-			return self._render_bsp_nodes(screen, self.map.nodes[-1])
-
-		# If the node is a subsector, render it instead of recursing
-		if node.is_subsector():
-			self._render_subsector(screen, node)
-			return
+	def _render_bsp_nodes(self, screen):
+		# Walks the BSP tree for the subsectors in front to back order,
+		#  and draws their walls a batch of subsectors at a time. Once
+		#  solid walls fill every column, everything left is behind them.
+		self.solid_columns.reset()
+		self.ceiling_clip[:] = 0
+		self.floor_clip[:] = self.screen.height
+		self.wall_depth[:] = np.inf
+		self.visplanes.reset()
+		nodes = self.map.nodes
+		x = self.player.x
+		y = self.player.y
 
-		# Get the position of the player and find the next best node
+		node_visible, subsector_visible = self._potentially_visible()
+
+		stack = [self.map.root_node]
+		subsectors = []
+		while stack:
+			node = stack.pop()
+
+			# If the node is a subsector, add it instead of going down
+			if node & SUBSECTOR_FLAG:
+				subsector = node & ~SUBSECTOR_FLAG
+				if not subsector_visible[subsector]:
+					continue
+				subsectors.append(subsector)
+				if len(subsectors) == self.SUBSECTORS_PER_BATCH:
+					self._render_subsectors(screen, np.array(subsectors, dtype=np.int64))
+					subsectors = []
+					if self.solid_columns.full():
+						return
+				continue
+			if not node_visible[node]:
+				continue
+
+			# The side the player is on is closest, so is taken first. The
+			#  other side is only gone down if its bounding box can be seen.
+			if self._is_point_on_left_side(x, y, node):
+				near, far, far_box = nodes.l_child[node], nodes.r_child[node], "rbox"
+			else:
+				near, far, far_box = nodes.r_child[node], nodes.l_child[node], "lbox"
+			if self._is_bbox_visible(node, far_box):
+				stack.append(int(far))
+			stack.append(int(near))
+
+		if subsectors:
+			self._render_subsectors(screen, np.array(subsectors, dtype=np.int64))
+
+
+	def _potentially_visible(self):
+		# Lists of which nodes and subsectors have sectors under them that
+		#  can be seen from the player's sector
+		m = self.map
+		if not self.CULL_WITH_REJECT:
+			return [True] * len(m.nodes), [True] * len(m.subsectors)
+		sector = m.sector_at(self.player.x, self.player.y)
+		visible = m.reject.visible_from(sector)
+		node_visible = (m.node_sectors & visible).any(axis=1)
+		subsector_visible = m.reject.can_see(sector, m.subsector_sectors)
+		return node_visible.tolist(), subsector_visible.tolist()
+
+
+	def _is_bbox_visible(self, node, box):
+		# If any of a node's child's bounding box (box is "rbox" or
+		#  "lbox") is within the players FOV, and not behind solid walls
+		nodes = self.map.nodes
+		top = int(getattr(nodes, box + "_t")[node])
+		bottom = int(getattr(nodes, box + "_b")[node])
+		left = int(getattr(nodes, box + "_l")[node])
+		right = int(getattr(nodes, box + "_r")[node])
 		x = self.player.x
 		y = self.player.y
-		if self._is_point_on_left_side(x, y, node):
-			# Render the left side first as closest
-			self._render_bsp_nodes(screen, node.l_child)
-			self._render_bsp_nodes(screen, node.r_child)
-		else:
-			# Render the right side first as closest
-			self._render_bsp_nodes(screen, node.r_child)
-			self._render_bsp_nodes(screen, node.l_child)
+
+		row = 0 if y >= top else 1 if y > bottom else 2
+		column = 0 if x <= left else 1 if x < right else 2
+		silhouette = self.BBOX_SILHOUETTES[row][column]
+		if silhouette is None:
+			return True
+
+		# Angles relative to the player of the box's left and right edges
+		corners = {"t": top, "b": bottom, "l": left, "r": right}
+		x1, y1, x2, y2 = (corners[c] for c in silhouette)
+		v1_angle = math.degrees(math.atan2(y1 - y, x1 - x)) - self.player.angle
+		v2_angle = math.degrees(math.atan2(y2 - y, x2 - x)) - self.player.angle
+
+		# The box covers the angles from v2 anticlockwise to v1, which
+		#  might wrap around past 180. Check if those overlap the FOV. If
+		#  it's half the view or more, the player is as good as in it.
+		span = (v1_angle - v2_angle) % 360
+		if span >= 180:
+			return True
+		start = normalise_angle(v2_angle)
+		end = start + span
+		in_fov = []
+		if start <= self.half_fov and end >= -self.half_fov:
+			in_fov += [max(start, -self.half_fov), min(end, self.half_fov)]
+		if end >= 360 - self.half_fov:
+			in_fov += [-self.half_fov, min(end - 360, self.half_fov)]
+		if not in_fov:
+			return False
+
+		# The columns it would be drawn in, rounded outwards
+		x1 = self.half_screen_width - math.tan(math.radians(max(in_fov))) * self.screen_distance
+		x2 = self.half_screen_width - math.tan(math.radians(min(in_fov))) * self.screen_distance
+		return not self.solid_columns.covered(math.floor(x1), math.ceil(x2))
 
 
 	def _is_point_on_left_side(self, x, y, node):
 		# Checks if the given point is on the left partition of the
 		#  given node id
-		dx = x - node.x_partition
-		dy = y - node.y_partition
-		return ((dx * node.dy_partition) - (dy * node.dx_partition)) <= 0
-
-
-	def _render_subsector(self, screen, subsector):
-		for seg in subsector.segs:
-			v1 = seg.start_vertex
-			v2 = seg.end_vertex
-
-			# Check if the wall is visible, and if so, what it's
-			#  clipped at within the players FOV
-			visible, v1, v2, v1_angle, v2_angle = self._clipped_wall(v1, v2)
-
-			if visible:
-				self.add_wall_in_fov(screen, seg, v1, v2, v1_angle, v2_angle)
+		nodes = self.map.nodes
+		dx = x - nodes.x_partition[node]
+		dy = y - nodes.y_partition[node]
+		return ((dx * nodes.dy_partition[node]) - (dy * nodes.dx_partition[node])) <= 0
+
+
+	def _render_subsectors(self, screen, subsectors):
+		# The segs of every subsector, in the order of the subsectors
+		first_seg = self.map.subsectors.first_seg_id[subsectors]
+		seg_count = self.map.subsectors.seg_count[subsectors]
+		starts = np.cumsum(seg_count) - seg_count
+		segs = np.repeat(first_seg - starts, seg_count) + np.arange(seg_count.sum())
+
+		# Which walls are visible, and what they're clipped at within the
+		#  players FOV
+		segs, v1, v2, v1_angle, v2_angle = self._clipped_walls(segs)
+		if segs.size:
+			self.add_walls_in_fov(screen, segs, v1, v2, v1_angle, v2_angle)
+
+
+	def _clipped_walls(self, segs):
+		# Takes an array of seg ids, and returns the ones that are
+		#  visible, with Vectors of arrays of their clipped end points and
+		#  arrays of their angles
+		vertexes = self.map.vertexes
+		start = self.map.segs.start_vertex[segs]
+		end = self.map.segs.end_vertex[segs]
+		v1 = Vector(vertexes.x[start], vertexes.y[start])
+		v2 = Vector(vertexes.x[end], vertexes.y[end])
 
-
-	def _clipped_wall(self, v1, v2):
 		# These angles are relative to the player
 		v1_angle = self.player.angle_to_vertex(v1)
 		v2_angle = self.player.angle_to_vertex(v2)
@@ -157,34 +444,41 @@ class Renderer:
 		#  behind the player to the left and V2 is behind the player and
 		#  to the right.
 		v1_to_v2_span = v1_angle - v2_angle
-		if v1_to_v2_span <= 0:
-			return False, None, None, None, None
-		if v1_angle > 90 and v2_angle < -90:
-			return False, None, None, None, None
-
-		# Check if both V1 and V2 are outside the FOV
-		if v1_angle > self.half_fov and v2_angle > self.half_fov:
-			return False, None, None, None, None
-		elif v1_angle < -self.half_fov and v2_angle < -self.half_fov:
-			return False, None, None, None, None
-
-		# If V1 is too far left, must clip it
-		if v1_angle > self.half_fov:
-			left_fov_angle = self.player.angle + self.half_fov
-			v1 = self.calculate_fov_intersection(v1, v2, left_fov_angle)
-			v1_angle = self.half_fov
+		visible = (v1_to_v2_span > 0) & ~((v1_angle > 90) & (v2_angle < -90))
+
+		# Or if both V1 and V2 are outside the FOV
+		visible &= ~((v1_angle > self.half_fov) & (v2_angle > self.half_fov))
+		visible &= ~((v1_angle < -self.half_fov) & (v2_angle < -self.half_fov))
+
+		segs = segs[visible]
+		v1 = Vector(v1.x[visible].astype(float), v1.y[visible].astype(float))
+		v2 = Vector(v2.x[visible].astype(float), v2.y[visible].astype(float))
+		v1_angle = v1_angle[visible]
+		v2_angle = v2_angle[visible]
 
-		# If V2 is too far left, must clip it
-		if v2_angle < -self.half_fov:
+		# Where V1 is too far left, must clip it
+		clip = v1_angle > self.half_fov
+		if clip.any():
+			left_fov_angle = self.player.angle + self.half_fov
+			v = self.calculate_fov_intersection(v1[clip], v2[clip], left_fov_angle)
+			v1.x[clip] = v.x
+			v1.y[clip] = v.y
+			v1_angle[clip] = self.half_fov
+
+		# Where V2 is too far right, must clip it
+		clip = v2_angle < -self.half_fov
+		if clip.any():
 			right_fov_angle = self.player.angle - self.half_fov
-			v2 = self.calculate_fov_intersection(v1, v2, right_fov_angle)
-			v2_angle = -self.half_fov
+			v = self.calculate_fov_intersection(v1[clip], v2[clip], right_fov_angle)
+			v2.x[clip] = v.x
+			v2.y[clip] = v.y
+			v2_angle[clip] = -self.half_fov
 
-		return True, v1, v2, v1_angle, v2_angle
+		return segs, v1, v2, v1_angle, v2_angle
 
 
 	def calculate_fov_intersection(self, v1, v2, fov_angle):
-		# Uses Cramer's Rule
+		# Uses Cramer's Rule. Works on Vectors of numbers or of arrays.
 		fov_vector = Vector(
 			np.cos(np.deg2rad(fov_angle)),
 			np.sin(np.deg2rad(fov_angle)))
@@ -200,89 +494,267 @@ class Renderer:
 		return player_pos + fov_vector*u
 
 
-	def add_wall_in_fov(self, screen, seg, v1, v2, v1_angle, v2_angle):
-		# Solid walls don't have a left side
-		if seg.left_sector is None:
-			self.add_solid_wall(screen, seg, v1, v2, v1_angle, v2_angle)
-
-
-	def get_wall_colour(self, v1, v2):
-		# Basic method that gets a shade of grey for the segment,
-		#  brighter if close and darker if far. Uses the midpoint for
-		#  distance,
-		mid_x = (v1.x + v2.x)/2
-		mid_y = (v1.y + v2.y)/2
-		dist = ((mid_x - self.player.x)**2 + (mid_y - self.player.y)**2) ** 0.5
-
-		FOG_DIST = 1500 # Past this distance is black
-		colour_percentage = 1 - np.clip(dist, 0, FOG_DIST)/FOG_DIST
-
-		# Make brightness scale non linear
-		colour_percentage = colour_percentage ** 4
-
-		# Calculate brightness of RGB
-		brightness = int(colour_percentage * 0xff) * 0x10101
-		return brightness
-
-
-	def add_solid_wall(self, screen, seg, v1, v2, v1_angle, v2_angle):
-		v1_angle = normalise_angle(v1_angle)
-		v2_angle = normalise_angle(v2_angle)
-
-		# Calculate the widths on screen of each edge of the wall
-		v1_x = self._angle_to_screen_width(v1_angle)
-		v2_x = self._angle_to_screen_width(v2_angle)
-
-		# Fetch the relative wall heights to the player
-		ceiling_height = seg.right_sector.ceiling_height - self.player.z
-		floor_height   = seg.right_sector.floor_height   - self.player.z
-
-		# Calculate the heights on screen of each corner of the wall
-		v1_ceiling_y, v1_floor_y = self.calculate_wall_screen_heights(
-			ceiling_height, floor_height, v1, v1_angle)
-		v2_ceiling_y, v2_floor_y = self.calculate_wall_screen_heights(
-			ceiling_height, floor_height, v2, v2_angle)
-
-		# Get the colour of the wall
-		colour = self.get_wall_colour(v1, v2)
-
-		# Draw wall wireframe
-		screen.draw_line(v1_x, v1_x, v1_ceiling_y, v1_floor_y, colour=colour, under=True)
-		screen.draw_line(v2_x, v2_x, v2_ceiling_y, v2_floor_y, colour=colour, under=True)
-		screen.draw_line(v1_x, v2_x, v1_ceiling_y, v2_ceiling_y, colour=colour, under=True)
-		screen.draw_line(v1_x, v2_x, v1_floor_y, v2_floor_y, colour=colour, under=True)
-
-		# screen.draw()
-		# time.sleep(1)
-
-
-	def calculate_wall_screen_heights(self, ceiling_height, floor_height, v, v_angle):
-		# Calculate the distance to the vertex
-		v_dist = self.player.distance_to_vertex(v)
-
-		# Calculate the distance the point is from the screen
-		v_screen_dist = self.screen_distance / np.cos(np.deg2rad(v_angle))
-
-		# Calculate ceiling heights and floor heights
-		v_ceiling_y = abs(ceiling_height) * v_screen_dist / v_dist
-		v_floor_y   = abs(floor_height)   * v_screen_dist / v_dist
-
-		# Readjust the ceiling to fit on screen
-		if ceiling_height > 0:
-			v_ceiling_y = self.half_screen_height - v_ceiling_y
-		else:
-			v_ceiling_y += self.half_screen_height
-
-		# Similarly for the floor
-		if floor_height > 0:
-			v_floor_y = self.half_screen_height - v_floor_y
-		else:
-			v_floor_y += self.half_screen_height
-
-		# Return the screen heights as integers
-		return int(round(v_ceiling_y)), int(round(v_floor_y))
-
-
-	def _angle_to_screen_width(self, angle):
-		ix = self.half_screen_width - np.tan(np.deg2rad(angle)) * self.screen_distance
-		return int(round(ix))
+	def add_walls_in_fov(self, screen, segs, v1, v2, v1_angle, v2_angle):
+		# Each wall covers the columns from v1 up to v2. Clip them to the
+		#  columns that no solid wall nearer has been drawn in. Solid
+		#  walls don't have a left side.
+		v1_x = self._vertex_to_screen_x(v1)
+		v2_x = self._vertex_to_screen_x(v2)
+		solid = self.map.segs.left_sector[segs] == -1
+		walls, columns = self.solid_columns.clip(v1_x, v2_x, solid)
+		if walls.size:
+			self.draw_wall_columns(screen, segs[walls], columns)
+
+
+	def draw_wall_columns(self, screen, segs, columns):
+		# Draws the textured wall seen in each screen column, and adds the
+		#  floor and ceiling in front of it to the visplanes. Takes arrays
+		#  of the seg and the column of each, sorted by column and nearest
+		#  first within a column. Of two sided walls, only the upper and
+		#  lower parts, where the ceiling and floor behind step down and
+		#  up, are drawn. What's seen through the gap between them is
+		#  drawn by walls further back.
+		m = self.map
+		start = m.segs.start_vertex[segs]
+		end = m.segs.end_vertex[segs]
+		wall_x = m.vertexes.x[end] - m.vertexes.x[start]
+		wall_y = m.vertexes.y[end] - m.vertexes.y[start]
+		to_x = m.vertexes.x[start] - self.player.x
+		to_y = m.vertexes.y[start] - self.player.y
+
+		# The ray through each column, scaled so that going along it by
+		#  one is going one unit forward. Where it hits the wall, how far
+		#  forward that is, and how far along the wall from its start.
+		tans = self.column_tans[columns]
+		ray_x = self.forward.x + tans * self.left.x
+		ray_y = self.forward.y + tans * self.left.y
+		with np.errstate(divide="ignore", invalid="ignore"):
+			cross = ray_x * wall_y - ray_y * wall_x
+			depth = (to_x * wall_y - to_y * wall_x) / cross
+			along = (to_x * ray_y - to_y * ray_x) / cross
+		depth = np.nan_to_num(depth, nan=self.MIN_DEPTH)
+		depth = np.maximum(depth, self.MIN_DEPTH)
+		scale = self.screen_distance / depth
+
+		# Heights relative to the player of the sectors in front and
+		#  behind. Solid walls have nothing behind, so their opening is
+		#  closed at the floor and the upper part is the whole wall.
+		front = m.segs.right_sector[segs]
+		back = m.segs.left_sector[segs]
+		solid = back == -1
+		back = np.where(solid, front, back)
+		front_ceiling = m.sectors.ceiling_height[front] - self.player.z
+		front_floor   = m.sectors.floor_height[front]   - self.player.z
+		back_ceiling  = m.sectors.ceiling_height[back]  - self.player.z
+		back_floor    = m.sectors.floor_height[back]    - self.player.z
+
+		# Where those are on screen. The opening between the back ceiling
+		#  and floor is kept within the front ones.
+		front_top = self._screen_y(front_ceiling, scale)
+		front_bottom = self._screen_y(front_floor, scale)
+		back_top = np.clip(self._screen_y(back_ceiling, scale), front_top, front_bottom)
+		back_top[solid] = front_bottom[solid]
+		back_bottom = np.clip(self._screen_y(back_floor, scale), back_top, front_bottom)
+
+		# What's still open of each column in front of each wall, after
+		#  the openings of the walls nearer in the batch and before it
+		height = screen.height
+		ceiling_clip = np.maximum(
+			self.ceiling_clip[columns], running_max_before(columns, back_top, height))
+		floor_clip = np.minimum(
+			self.floor_clip[columns], height - running_max_before(columns, height - back_bottom, height))
+		np.maximum.at(self.ceiling_clip, columns, back_top)
+		np.minimum.at(self.floor_clip, columns, back_bottom)
+		closed = self.ceiling_clip[columns] >= self.floor_clip[columns]
+		self.solid_columns.solid[columns[closed]] = True
+
+		# The wall each column closes at is the first whose opening
+		#  leaves nothing open
+		closes = (ceiling_clip < floor_clip) & (
+			np.maximum(ceiling_clip, back_top) >= np.minimum(floor_clip, back_bottom))
+		self.wall_depth[columns[closes]] = depth[closes]
+
+		def cut(y):
+			return np.clip(y, ceiling_clip, floor_clip)
+
+		# The ceiling above the wall and the floor below it, if they face
+		#  the player
+		self.visplanes.add(
+			columns, ceiling_clip, np.where(front_ceiling > 0, cut(front_top), ceiling_clip), front, False)
+		self.visplanes.add(
+			columns, np.where(front_floor < 0, cut(front_bottom), floor_clip), floor_clip, front, True)
+
+		# The parts of the wall to draw: every wall's upper part, and the
+		#  lower parts of two sided ones. As the index of their wall,
+		#  rows, texture, and height of the top of their texture.
+		sidedef = m.segs.right_sidedef[segs]
+		flags = m.linedefs.flags[m.segs.linedef_id[segs]]
+		y_offset = m.sidedefs.y_offset[sidedef]
+		textures = m.textures
+		heights = textures.heights if textures is not None else np.zeros(1, dtype=np.int64)
+
+		# Solid walls are pegged to the ceiling, or the floor if lower
+		#  unpegged. Upper parts are pegged to the ceiling behind, or the
+		#  ceiling in front if upper unpegged.
+		upper_texture = np.where(solid, m.sidedefs.middle_texture_id[sidedef], m.sidedefs.upper_texture_id[sidedef])
+		upper_height = heights[np.maximum(upper_texture, 0)]
+		upper_v = np.where(
+			solid,
+			np.where(flags & LOWER_UNPEGGED, front_floor + upper_height, front_ceiling),
+			np.where(flags & UPPER_UNPEGGED, front_ceiling, back_ceiling + upper_height))
+
+		# Lower parts are pegged to the floor behind, or the ceiling in
+		#  front if lower unpegged
+		lower = np.flatnonzero(~solid)
+		lower_texture = m.sidedefs.lower_texture_id[sidedef[lower]]
+		lower_v = np.where(flags[lower] & LOWER_UNPEGGED, front_ceiling[lower], back_floor[lower])
+
+		wall = np.concatenate((np.arange(segs.size), lower))
+		y1 = np.clip(np.concatenate((front_top, back_bottom[lower])), ceiling_clip[wall], floor_clip[wall])
+		y2 = np.clip(np.concatenate((back_top, front_bottom[lower])), ceiling_clip[wall], floor_clip[wall])
+		texture = np.concatenate((upper_texture, lower_texture))
+		v_top = np.concatenate((upper_v, lower_v)) + y_offset[wall]
+
+		counts = np.maximum(y2 - y1, 0)
+		pixel_part = np.repeat(np.arange(wall.size), counts)
+		ys = np.repeat(y1 - (np.cumsum(counts) - counts), counts) + np.arange(pixel_part.size)
+		pixel_wall = wall[pixel_part]
+
+		levels = self._light_levels(m.sectors.light_level[front], depth)
+
+		# Texture coordinates. Across: how far along the wall, plus the
+		#  offsets. Down: how far below the top of the texture.
+		textured = texture >= 0
+		colours = np.empty(pixel_part.size, dtype=np.int64)
+		if textured.any():
+			u = along * np.hypot(wall_x, wall_y) + m.segs.offset[segs] + m.sidedefs.x_offset[sidedef]
+			v = v_top[pixel_part] + (ys + 0.5 - self.half_screen_height) / scale[pixel_wall]
+
+			# Which of the textured parts each textured pixel is in
+			pixels = textured[pixel_part]
+			parts_index = np.cumsum(textured) - 1
+			textured_wall = wall[textured]
+			colours[pixels] = textures.sample(
+				texture[textured], np.floor(u[textured_wall]).astype(np.int64), levels[textured_wall],
+				np.floor(v[pixels]).astype(np.int64), parts_index[pixel_part[pixels]])
+
+		untextured = ~textured[pixel_part]
+		colours[untextured] = shade_colours(self.UNTEXTURED_COLOUR, levels[pixel_wall[untextured]])
+
+		screen.draw_columns(columns[wall], y1, y2, colours)
+
+
+	def draw_planes(self, screen):
+		# Draws every floor and ceiling seen this frame. Along a row of
+		#  the screen a plane is all the same distance away, so each
+		#  pixel's distance is its plane's height times its row's.
+		spans = self.visplanes.collect()
+		if spans is None:
+			return
+		columns, y1, y2, sectors, floor = spans
+		counts = y2 - y1
+		pixel_span = np.repeat(np.arange(columns.size), counts)
+		ys = np.repeat(y1 - (np.cumsum(counts) - counts), counts) + np.arange(pixel_span.size)
+		xs = columns[pixel_span]
+
+		m = self.map
+		height = np.where(floor, m.sectors.floor_height[sectors], m.sectors.ceiling_height[sectors]) - self.player.z
+		flat = np.where(floor, m.sectors.floor_texture_id[sectors], m.sectors.ceiling_texture_id[sectors])
+		depth = np.maximum(height[pixel_span] * self.row_distances[ys], self.MIN_DEPTH)
+		levels = self._light_levels(m.sectors.light_level[sectors][pixel_span], depth)
+
+		flat = flat[pixel_span]
+		textured = flat >= 0
+		colours = np.empty(pixel_span.size, dtype=np.int64)
+		if textured.any():
+			# Where in the world each pixel is
+			depth = depth[textured]
+			tans = self.column_tans[xs[textured]]
+			world_x = self.player.x + depth * (self.forward.x + tans * self.left.x)
+			world_y = self.player.y + depth * (self.forward.y + tans * self.left.y)
+			colours[textured] = m.textures.sample_flats(
+				flat[textured], np.floor(world_x).astype(np.int64), np.floor(world_y).astype(np.int64),
+				levels[textured])
+
+		untextured = ~textured
+		if untextured.any():
+			plane_colours = np.where(floor[pixel_span[untextured]], self.FLOOR_COLOUR, self.CEILING_COLOUR)
+			colours[untextured] = shade_colours(plane_colours, levels[untextured])
+
+		screen.draw_columns(columns, y1, y2, colours)
+
+
+	def draw_players(self, screen):
+		# Draws the other players standing on the floor of their sector,
+		#  furthest first so nearer ones are drawn over them, and leaving
+		#  out the columns behind the wall that closed them. Players are
+		#  drawn with the WAD's sprites, seen from the side the player is
+		#  looking at them from, or as boxes the size they collide as if
+		#  it doesn't have them.
+		if not len(self.others):
+			return
+		x, y, angle, ids = self.others.T
+		to_x = x - self.player.x
+		to_y = y - self.player.y
+		forward = to_x * self.forward.x + to_y * self.forward.y
+		left = to_x * self.left.x + to_y * self.left.y
+		m = self.map
+		sectors = np.atleast_1d(m.geometry.sectors_at(x, y))
+
+		# Rotation 1 is seen from the front, going round anticlockwise
+		rotations = ((np.rad2deg(np.arctan2(to_y, to_x)) - angle + 202.5) % 360 // 45).astype(np.int64) + 1
+
+		for i in np.argsort(-forward).tolist():
+			if forward[i] < self.MIN_DEPTH:
+				continue
+			scale = self.screen_distance / forward[i]
+			middle = self.half_screen_width - left[i] * scale
+			floor = m.sectors.floor_height[sectors[i]] - self.player.z
+			level = self._light_levels(m.sectors.light_level[sectors[i]], forward[i])
+			visible = self.wall_depth > forward[i]
+
+			sprite, flip = (None, False) if m.sprites is None else m.sprites.rotation(self.PLAYER_SPRITE, rotations[i])
+			if sprite is not None:
+				left_offset = sprite.width - sprite.left_offset if flip else sprite.left_offset
+				screen.draw_sprite(
+					middle - left_offset * scale, self.half_screen_height - (floor + sprite.top_offset) * scale,
+					sprite, scale, flip, visible, int(level))
+				continue
+
+			x1 = max(int(np.ceil(middle - RADIUS * scale)), 0)
+			x2 = min(int(np.ceil(middle + RADIUS * scale)), self.screen.width)
+			columns = np.arange(x1, x2)
+			columns = columns[visible[columns]]
+			if not columns.size:
+				continue
+			y1 = int(self._screen_y(floor + HEIGHT, scale))
+			y2 = int(self._screen_y(floor, scale))
+			colour = shade_colours(self.PLAYER_COLOURS[(int(ids[i]) - 1) % len(self.PLAYER_COLOURS)], level)
+			screen.draw_columns(columns, np.full(columns.size, y1), np.full(columns.size, y2), int(colour))
+
+
+	def _screen_y(self, height, scale):
+		# The first row at or below something height above the player,
+		#  cut to the screen
+		y = np.ceil(self.half_screen_height - height * scale)
+		return np.clip(y, 0, self.screen.height).astype(np.int64)
+
+
+	def _light_levels(self, light, depth):
+		# The shade of a wall, darker in dim sectors and further away
+		brightness = light / 255 * (1 - np.clip(depth, 0, self.FOG_DISTANCE) / self.FOG_DISTANCE)
+		levels = np.round((1 - brightness) * (LIGHT_LEVELS - 1))
+		return np.clip(levels, 0, LIGHT_LEVELS - 1).astype(np.int64)
+
+
+	def _vertex_to_screen_x(self, v):
+		# The screen x of points in the players FOV, from how far left of
+		#  the player they are for how far forward
+		to_x = v.x - self.player.x
+		to_y = v.y - self.player.y
+		forward = to_x * self.forward.x + to_y * self.forward.y
+		left = to_x * self.left.x + to_y * self.left.y
+		with np.errstate(divide="ignore", invalid="ignore"):
+			ix = self.half_screen_width - left / forward * self.screen_distance
+		ix = np.nan_to_num(ix, nan=self.half_screen_width, posinf=self.screen.width, neginf=0)
+		return np.round(np.clip(ix, 0, self.screen.width)).astype(np.int64)
@@ -1,8 +1,18 @@
 
-import cv2
 import numpy as np
 import threading
 
+from apps.doom.cells import HalfBlockCells
+from apps.doom.encoder import FrameEncoder, SHARED_ENCODE_CACHE
+from apps.doom.palette import TrueColourPalette
+from apps.doom.sprites import SPRITE_CACHE, blend_colours
+from apps.doom.textures import shade_colours
+
+
+# Pixels are 0xRRGGBB colours, or NO_CHANGE (-1) in pending buffers, so
+#  32 bits is plenty
+PIXEL_DTYPE = np.int32
+
 
 # ANSI primitives
 def ansi_command(cmd):
@@ -44,6 +54,123 @@ def ansi_move_cursor(x, y):
 
 
 
+class Damage:
+	"""
+	Keeps track of which part of a (height, width) buffer has been drawn
+	to, as a span of columns [start, end) for every row. Rows that
+	haven't been drawn to have start == width and end == 0.
+	"""
+	def __init__(self, height, width):
+		self.height = height
+		self.width = width
+		self.start = np.full(height, width, dtype=np.int32)
+		self.end = np.zeros(height, dtype=np.int32)
+
+
+	def add(self, x1, x2, y1, y2):
+		# Adds the region [x1, x2) x [y1, y2). Must already be clipped
+		#  to the buffer.
+		if x1 >= x2 or y1 >= y2:
+			return
+		np.minimum(self.start[y1:y2], x1, out=self.start[y1:y2])
+		np.maximum(self.end[y1:y2], x2, out=self.end[y1:y2])
+
+
+	def add_pixel(self, x, y):
+		if x < self.start[y]:
+			self.start[y] = x
+		if x >= self.end[y]:
+			self.end[y] = x + 1
+
+
+	def add_pixels(self, xs, ys):
+		# Arrays of pixels, which must already be within the buffer.
+		#  Sorting them by row then column puts the leftmost and
+		#  rightmost pixel of each row at the edges of its run.
+		if xs.size == 0:
+			return
+		pixels = np.sort(ys * self.width + xs)
+		rows = pixels // self.width
+		first = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+		last = np.concatenate((first[1:], [pixels.size])) - 1
+		rows = rows[first]
+		self.start[rows] = np.minimum(self.start[rows], pixels[first] - rows*self.width)
+		self.end[rows] = np.maximum(self.end[rows], pixels[last] - rows*self.width + 1)
+
+
+	def update(self, other):
+		# Adds everything damaged in another Damage of the same size
+		np.minimum(self.start, other.start, out=self.start)
+		np.maximum(self.end, other.end, out=self.end)
+
+
+	def rows(self):
+		# Whether each row has been drawn to
+		return self.end > self.start
+
+
+	def bounds(self):
+		# (x1, x2, y1, y2) of a box around everything damaged, or None
+		rows = np.flatnonzero(self.rows())
+		if rows.size == 0:
+			return None
+		return (int(self.start[rows].min()), int(self.end[rows].max()),
+			int(rows[0]), int(rows[-1]) + 1)
+
+
+	def reset(self):
+		self.start[:] = self.width
+		self.end[:] = 0
+
+
+
+class ScratchPool:
+	"""
+	Pending buffers for Batches, so a Batch doesn't have to allocate and
+	fill a whole screen sized array when it's made. Buffers come back
+	once a Batch has been drawn, with only their damaged part reset.
+
+	count buffers are made up front: two lets one frame be drawn while
+	the last one is being copied to the screen. More are only made if
+	more Batches are in use at once.
+	"""
+	def __init__(self, height, width, fill, count=2):
+		self.height = height
+		self.width = width
+		self.fill = fill
+		self.lock = threading.Lock()
+		self.free = [self._new_buffer() for _ in range(count)]
+
+
+	def _new_buffer(self):
+		pending = np.full((self.height, self.width), self.fill, dtype=PIXEL_DTYPE)
+		return pending, Damage(self.height, self.width)
+
+
+	def acquire(self):
+		# Returns (pending, damage)
+		with self.lock:
+			if self.free:
+				return self.free.pop()
+		return self._new_buffer()
+
+
+	def release(self, pending, damage):
+		self.reset(pending, damage)
+		with self.lock:
+			self.free.append((pending, damage))
+
+
+	def reset(self, pending, damage):
+		# Empties a buffer, only writing to the part that was drawn to
+		bounds = damage.bounds()
+		if bounds is not None:
+			x1, x2, y1, y2 = bounds
+			pending[y1:y2, x1:x2] = self.fill
+			damage.reset()
+
+
+
 class Batch:
 	"""
 	An object returned by the Screen class. This object can be used to
@@ -53,28 +180,48 @@ class Batch:
 	"""
 	def __init__(self, screen):
 		self.screen = screen
-		self.sent = False # If it has been sent to the screen already.
 
 		# Used to signify no update in pending
 		self.NO_CHANGE = -1
-		# Pending array
-		self.pending = np.empty((screen.height, screen.width), dtype=int)
-		self.pending[:] = self.NO_CHANGE
+
+		# Pending array, and which part of it has been drawn to. Anything
+		#  that writes to pending directly must add what it wrote to
+		#  damage. Taken from the screen's pool when first drawn to.
+		self._pending = None
+		self._damage = None
 
 		self.width = self.screen.width
 		self.height = self.screen.height
 
 
+	@property
+	def pending(self):
+		if self._pending is None:
+			self._pending, self._damage = self.screen.scratch.acquire()
+		return self._pending
+
+	@property
+	def damage(self):
+		if self._damage is None:
+			self._pending, self._damage = self.screen.scratch.acquire()
+		return self._damage
+
+
 	def draw(self):
-		# TODO: Is there a reason why a batch can't be sent to a screen
-		#  more than once?
-		# if self.sent:
-		# 	print("Batch already sent to screen")
-		# 	return
-		# self.sent = True
-
-		# Sends all the updates to the screen
+		# Sends all the updates to the screen. The batch is empty
+		#  afterwards, and can be drawn to again.
+		if self._pending is None:
+			return
 		self.screen.draw_batch(self)
+		self.screen.scratch.release(self._pending, self._damage)
+		self._pending = None
+		self._damage = None
+
+
+	def clear(self):
+		# Throws away everything drawn to the batch, keeping its buffer
+		if self._pending is not None:
+			self.screen.scratch.reset(self._pending, self._damage)
 
 
 	# TODO: Move these draw methods somewhere else that can be inherited
@@ -92,41 +239,111 @@ class Batch:
 
 		# Sets one pixel in the pending view
 		self.pending[y,x] = colour
+		self.damage.add_pixel(x, y)
 
 
 	def draw_line(self, x1, x2, y1, y2, colour, under=False):
-		"""Bresenham's line algorithm from rosetta code"""
-		dx = abs(x2 - x1)
-		dy = abs(y2 - y1)
-
-		# TODO: If there is no gradient, just draw boxes, much quicker
-		if dx == 0 or dy == 0:
-			self.draw_box(x1, x2, y1, y2, colour, fill=True, under=under)
-			# self.draw_pixel(x2, y2, colour)
+		self.draw_lines([x1], [x2], [y1], [y2], colour, under=under)
+
+
+	def draw_lines(self, x1, x2, y1, y2, colour, under=False):
+		"""
+		Draws many lines at once, from arrays of their end points. colour
+		is one colour for every line, or an array with one per line. The
+		pixels are the same as Bresenham's algorithm would draw for each
+		line in turn, worked out for all lines together.
+		"""
+		x1, x2, y1, y2 = (np.asarray(a, dtype=np.int64).ravel() for a in (x1, x2, y1, y2))
+		if x1.size == 0:
+			return
+		dx = x2 - x1
+		dy = y2 - y1
+
+		# One pixel per step along the longer axis, including both ends
+		steps = np.maximum(np.abs(dx), np.abs(dy))
+		counts = steps + 1
+		line = np.repeat(np.arange(x1.size), counts)
+		k = np.arange(line.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+		# How far along each axis the k-th pixel is. Bresenham starts with
+		#  an error of half a step, so this is k * d / steps rounded, with
+		#  halves rounded down. Along the longer axis it's just k.
+		steps = np.maximum(steps, 1)[line]
+		xs = x1[line] + np.sign(dx)[line] * -((steps - 2*k*np.abs(dx)[line]) // (2*steps))
+		ys = y1[line] + np.sign(dy)[line] * -((steps - 2*k*np.abs(dy)[line]) // (2*steps))
+
+		if np.ndim(colour) > 0:
+			colour = np.asarray(colour)[line]
+		self.draw_pixels(xs, ys, colour, under=under)
+
+
+	def draw_pixels(self, xs, ys, colour, under=False):
+		"""
+		Draws many pixels at once, from arrays of their coordinates.
+		colour is one colour for every pixel, or an array with one per
+		pixel. Where the same pixel is given more than once, the last one
+		is drawn, or the first one if drawing under.
+		"""
+		xs = np.asarray(xs, dtype=np.int64).ravel()
+		ys = np.asarray(ys, dtype=np.int64).ravel()
+
+		# Clip to the screen
+		inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+		xs = xs[inside]
+		ys = ys[inside]
+		if xs.size == 0:
 			return
+		index = ys * self.width + xs
 
-		x, y = x1, y1
-		sx = -1 if x1 > x2 else 1
-		sy = -1 if y1 > y2 else 1
-		if dx > dy:
-			err = dx / 2.0
-			while x != x2:
-				self.draw_pixel(x, y, colour, under=under)
-				err -= dy
-				if err < 0:
-					y += sy
-					err += dx
-				x += sx
+		if np.ndim(colour) > 0:
+			colours = np.asarray(colour).ravel()[inside]
 		else:
-			err = dy / 2.0
-			while y != y2:
-				self.draw_pixel(x, y, colour, under=under)
-				err -= dx
-				if err < 0:
-					x += sx
-					err += dy
-				y += sy
-		self.draw_pixel(x, y, colour, under=under)
+			colours = colour
+
+		pending = self.pending.reshape(-1)
+		if under:
+			# Only the first to reach a pixel draws it, and only if nothing
+			#  was there already
+			index, first = np.unique(index, return_index=True)
+			if np.ndim(colours) > 0:
+				colours = colours[first]
+			unset = pending[index] == self.NO_CHANGE
+			index = index[unset]
+			if np.ndim(colours) > 0:
+				colours = colours[unset]
+		elif np.ndim(colours) > 0:
+			# The last to reach a pixel draws it
+			_, last = np.unique(index[::-1], return_index=True)
+			last = index.size - 1 - last
+			index = index[last]
+			colours = colours[last]
+
+		pending[index] = colours
+		self.damage.add_pixels(xs, ys)
+
+
+	def draw_columns(self, x, y1, y2, colour):
+		"""
+		Fills the rows from y1 up to y2 of each of an array of columns x,
+		which must already be cut to the screen. A column can be given
+		more than once if its rows don't overlap. colour is one colour
+		for every pixel, or an array with one per pixel, going down each
+		column in turn.
+		"""
+		x = np.asarray(x, dtype=np.int64)
+		y1 = np.asarray(y1, dtype=np.int64)
+		y2 = np.asarray(y2, dtype=np.int64)
+		counts = np.maximum(y2 - y1, 0)
+		if counts.sum() == 0:
+			return
+		xs = np.repeat(x, counts)
+		ys = np.repeat(y1 - (np.cumsum(counts) - counts), counts) + np.arange(xs.size)
+		self.pending[ys, xs] = colour
+
+		drawn = counts > 0
+		self.damage.add(
+			int(x[drawn].min()), int(x[drawn].max()) + 1,
+			int(y1[drawn].min()), int(y2[drawn].max()))
 
 
 	def draw_box(self, x1, x2, y1, y2, colour, fill=False, under=False):
@@ -154,95 +371,170 @@ class Batch:
 				draw_region[:] = colour
 
 		else:
-			# Draw the box, then refill it with what was in the center
-			draw_region = self._get_draw_region(x1,x2,y1,y2)
-			center_space = draw_region[1:-1, 1:-1].copy()
-
-			if under:
-				draw_region[draw_region == self.NO_CHANGE] = colour
-			else:
-				draw_region[:] = colour
-
-			# Restore the center space
-			draw_region[1:-1, 1:-1] = center_space
+			# Draw the top, bottom, left and right edges
+			for edge in (
+					(x1, x2, y1, y1+1), (x1, x2, y2-1, y2),
+					(x1, x1+1, y1, y2), (x2-1, x2, y1, y2)):
+				draw_region = self._get_draw_region(*edge)
+				if under:
+					draw_region[draw_region == self.NO_CHANGE] = colour
+				else:
+					draw_region[:] = colour
 
 
 	def _get_draw_region(self, x1, x2, y1, y2):
-		x1 = np.clip(x1, 0, self.width)
-		x2 = np.clip(x2, 0, self.width)
-		y1 = np.clip(y1, 0, self.height)
-		y2 = np.clip(y2, 0, self.height)
+		# Returns the region of pending to draw to, which is marked as
+		#  damaged
+		x1 = int(np.clip(x1, 0, self.width))
+		x2 = int(np.clip(x2, 0, self.width))
+		y1 = int(np.clip(y1, 0, self.height))
+		y2 = int(np.clip(y2, 0, self.height))
+		self.damage.add(x1, x2, y1, y2)
 		return self.pending[y1:y2,x1:x2]
 
 
 	def draw_image(self, x, y, filename):
-		# Loads an image and draws it to canvas with top left corner at
-		#  the given coordinate
-		img = cv2.imread(filename, cv2.IMREAD_UNCHANGED) # unchanged for alpha channel
-		height, width, _ = img.shape
-
-		# Combine the RGB channels into one hex number
-		pixels = img[:,:,2]*0x10000 + img[:,:,1]*0x100 + img[:,:,0]
-
-		# Extract only non transparent pixels
-		visible = img[:,:,3] > 0
-
-		# Calculate overlap of the image with the screen borders
-		l_overlap = -min(0, x)
-		r_overlap = max(0, x + width - self.width)
-		t_overlap = -min(0, y)
-		b_overlap = max(0, y + height - self.height)
-
-		# Calculate the region of screen space that is going to be drawn
-		#  to, and the region of the image that is to be drawn
-		img_x1 = l_overlap # Start from what doesn't left overlap
-		img_x2 = width - r_overlap # Cut off right overlap
-		img_y1 = t_overlap # Start from what doesn't top overlap
-		img_y2 = height - b_overlap # Cut off bottom overlap
-		scr_x1 = x + l_overlap # Cut off printing space by overlap
-		scr_x2 = x + width - r_overlap # Cut off printing space by overlap
-		scr_y1 = y + t_overlap # Cut off printing space by overlap
-		scr_y2 = y + height - b_overlap # Cut off printing space by overlap
-
-		# Extract the visible pixels from what's actually going to be displayed
-		visible = img[img_y1:img_y2,img_x1:img_x2,3] > 0
-
-		# Draw the visible pixels to canvas
-		# self.pending[scr_y1:scr_y2,scr_x1:scr_x2] = pixels[img_y1:img_y2,img_x1:img_x2]
-		self.pending[scr_y1:scr_y2,scr_x1:scr_x2][visible] = pixels[img_y1:img_y2,img_x1:img_x2][visible]
+		# Draws an image with its top left corner at the given coordinate.
+		#  The image is only read and decoded the first time it's drawn.
+		sprite = SPRITE_CACHE.image(filename)
+		if sprite is not None:
+			self.draw_sprite(x, y, sprite)
+
+
+	def draw_sprite(self, x, y, sprite, scale=1, flip=False, columns=None, light_level=0):
+		"""
+		Draws a Sprite with its top left corner at (x, y), scaled by
+		scale and flipped left to right if flip, from the nearest of its
+		mip levels. columns is an optional array of which screen columns
+		it can be drawn in, and light_level darkens it like walls.
+
+		At full size and bigger, partly transparent pixels are blended
+		with what has been drawn to the batch. Where nothing has, there's
+		nothing known to blend with, so they're drawn if they're at least
+		half opaque, as they always are when drawn smaller.
+		"""
+		# Smaller than full size, the image is already sampled to the size
+		#  drawn, without partly transparent pixels
+		if scale < 1:
+			pixels, alpha = sprite.scaled(scale)
+			partial = False
+			height, width = pixels.shape
+		else:
+			(pixels, alpha), partial = sprite.levels[0], sprite.partial[0]
+			width, height = int(np.ceil(sprite.width * scale)), int(np.ceil(sprite.height * scale))
+
+		# The screen pixels covered, cut to the screen
+		x1, y1 = int(np.floor(x)), int(np.floor(y))
+		x_start, x_end = max(x1, 0), min(x1 + width, self.width)
+		y_start, y_end = max(y1, 0), min(y1 + height, self.height)
+		if x_start >= x_end or y_start >= y_end:
+			return
 
+		# The pixel of the image for each. Up to full size, the image is
+		#  the size drawn, so with every column those are a block of it,
+		#  which can be sliced out rather than gathered a pixel at a
+		#  time. Bigger, it's the nearest pixel to the middle of each.
+		if scale <= 1 and columns is None:
+			rows = slice(y_start - y1, y_end - y1)
+			if flip:
+				stop = x1 + width - 1 - x_end
+				cols = slice(x1 + width - 1 - x_start, stop if stop >= 0 else None, -1)
+			else:
+				cols = slice(x_start - x1, x_end - x1)
+			region = (slice(y_start, y_end), slice(x_start, x_end))
+		else:
+			xs = np.arange(x_start, x_end)
+			ys = np.arange(y_start, y_end)
+			if columns is not None:
+				xs = xs[columns[xs]]
+			if xs.size == 0:
+				return
+			x_start, x_end = int(xs[0]), int(xs[-1]) + 1
+			if scale <= 1:
+				u = xs - x1
+				v = ys - y1
+			else:
+				u = np.minimum(((xs - x + 0.5) / scale).astype(np.int64), pixels.shape[1] - 1)
+				v = np.minimum(((ys - y + 0.5) / scale).astype(np.int64), pixels.shape[0] - 1)
+			if flip:
+				u = pixels.shape[1] - 1 - u
+			rows, cols = v[:, None], u
+			region = (ys[:, None], xs)
+		colours = pixels[rows, cols]
+		alphas = alpha[rows, cols]
+		if light_level:
+			colours = shade_colours(colours, light_level)
+
+		under = self.pending[region]
+		if partial:
+			drawn = under != self.NO_CHANGE
+			opaque = (alphas == 255) | (~drawn & (alphas >= 128))
+			blend = drawn & (alphas > 0) & (alphas < 255)
+			result = np.where(opaque, colours, under)
+			result[blend] = blend_colours(under[blend], colours[blend], alphas[blend])
+		else:
+			result = np.where(alphas == 255, colours, under)
+		self.pending[region] = result
+		self.damage.add(x_start, x_end, y_start, y_end)
 
 
 class Screen:
 	# Handles updating pixels only when needed. Uses block elements to
-	#  draw two pixels per character
+	#  draw two pixels per character, or another of the cell modes to
+	#  draw more
 
-	def __init__(self, height, width, sender):
-		# The char will be used for upper half, and bg for lower half
-		self.px = "▀"
+	def __init__(self, height, width, sender, palette=None, cells=None, clear=True):
+		# How pixels are turned into characters. height and width are in
+		#  characters, and self.height and self.width in pixels.
+		self.cells = cells if cells is not None else HalfBlockCells()
 
 		# Used to signify no update in pending
 		self.NO_CHANGE = -1
 
-		self.width  = np.clip(width, 0, 320)
-		self.height = np.clip(height*2, 0, 200)
+		self.width  = min(width, 320 // self.cells.WIDTH) * self.cells.WIDTH
+		self.height = min(height, 200 // self.cells.HEIGHT) * self.cells.HEIGHT
 
-		self.canvas  = np.zeros((self.height, self.width), dtype=int)
-		self.pending = np.empty((self.height, self.width), dtype=int)
+		# canvas is what the client is showing, and pending what has been
+		#  drawn since the last refresh. Both are kept for the life of the
+		#  screen.
+		self.canvas  = np.zeros((self.height, self.width), dtype=PIXEL_DTYPE)
+		self.pending = np.empty((self.height, self.width), dtype=PIXEL_DTYPE)
 
 		self.pending[:] = self.NO_CHANGE
 
+		# What has been drawn to pending since the last refresh, so only
+		#  that part of the screen is diffed and encoded
+		self.damage = Damage(self.height, self.width)
+
+		# Pending buffers for batches
+		self.scratch = ScratchPool(self.height, self.width, self.NO_CHANGE)
+
+		# Where draw_batch marks which pixels a batch drew
+		self._drawn = np.empty((self.height, self.width), dtype=bool)
+
 		# Prevents writing to the pending table if already writing to
 		self.pending_lock = threading.Lock()
+
+		# The batch used by the draw methods on the screen itself
+		self.batch = Batch(self)
 		self.batch_lock = threading.Lock()
 
 		# Data will be sent to the client by calling this sender
 		self.sender = sender
+		# Colours are drawn in 0xRRGGBB, and turned into whatever the
+		#  client's terminal supports. The canvas holds the latter.
+		self.palette = palette if palette is not None else TrueColourPalette()
+		self.encoder = FrameEncoder(self.cells, self.palette)
 
-		# Clear the screen to start off, then fill it with black.
-		self.clear()
-		self.draw_box(0,self.width,0,self.height, 0x333333, fill=True)
-		self.refresh()
+		# Screens of the same size share frames they both need to send
+		self.encode_cache = SHARED_ENCODE_CACHE
+		self.encode_cache.subscribe(self, (self.height, self.width, self.encoder.cache_key))
+
+		# Clear the screen to start off, then fill it with black. Screens
+		#  that aren't shown yet send nothing until they are reset.
+		if clear:
+			self.reset()
+			self.refresh()
 
 
 	def new_batch(self):
@@ -252,124 +544,115 @@ class Screen:
 
 
 	def draw_batch(self, batch):
-		self.pending_lock.acquire()
-		self.pending[batch.pending != batch.NO_CHANGE] = batch.pending[batch.pending != batch.NO_CHANGE]
-		self.pending_lock.release()
+		# Only the part of the batch that was drawn to is copied over
+		bounds = batch.damage.bounds()
+		if bounds is None:
+			return
+		x1, x2, y1, y2 = bounds
+		region = batch.pending[y1:y2, x1:x2]
+
+		with self.pending_lock:
+			drawn = self._drawn[y1:y2, x1:x2]
+			np.not_equal(region, batch.NO_CHANGE, out=drawn)
+			np.copyto(self.pending[y1:y2, x1:x2], region, where=drawn)
+			self.damage.update(batch.damage)
 
 
 	def draw_pixel(self, x, y, colour):
-		batch = self.new_batch()
-		batch.draw_pixel(x, y, colour)
-		batch.draw()
+		with self.batch_lock:
+			self.batch.draw_pixel(x, y, colour)
+			self.batch.draw()
 
 
 	def draw_line(self, x1, x2, y1, y2, colour):
-		batch = self.new_batch()
-		batch.draw_line(x1, x2, y1, y2, colour)
-		batch.draw()
+		with self.batch_lock:
+			self.batch.draw_line(x1, x2, y1, y2, colour)
+			self.batch.draw()
 
 
 	def draw_box(self, x1, x2, y1, y2, colour, fill=False, under=False):
-		batch = self.new_batch()
-		batch.draw_box(x1, x2, y1, y2, colour, fill, under)
-		batch.draw()
+		with self.batch_lock:
+			self.batch.draw_box(x1, x2, y1, y2, colour, fill, under)
+			self.batch.draw()
 
 
 	def draw_image(self, x, y, filename):
-		batch = self.new_batch()
-		batch.draw_image(x, y, filename)
-		batch.draw()
+		with self.batch_lock:
+			self.batch.draw_image(x, y, filename)
+			self.batch.draw()
 
 
 	def clear(self):
 		self.pending_lock.acquire()
 		self.canvas[:] = 0
 		self.pending[:] = self.NO_CHANGE
+		self.damage.reset()
 		self.pending_lock.release()
 		self.sender(ansi_clear())
 
 
+	def reset(self):
+		# Clears the client's screen and fills it in again on the next
+		#  refresh, for when it has been showing something else, like
+		#  another screen's frames
+		self.clear()
+		self.draw_box(0,self.width,0,self.height, 0x333333, fill=True)
+
+
 	def close(self):
+		self.encode_cache.unsubscribe(self)
 		self.sender(ansi_reset_colour() + ansi_clear() + ansi_move_cursor(0,0))
 
 
 	def refresh(self):
-		# Find if there are any changes needing to be made. Also update
-		#  the canvas and pending.
-		self.pending_lock.acquire()
-		diff_top = (self.pending[0::2] != self.NO_CHANGE) * (self.canvas[0::2] - self.pending[0::2])
-		diff_bot = (self.pending[1::2] != self.NO_CHANGE) * (self.canvas[1::2] - self.pending[1::2])
-		self.canvas[0::2][diff_top != 0] = self.pending[0::2][diff_top != 0]
-		self.canvas[1::2][diff_bot != 0] = self.pending[1::2][diff_bot != 0]
-		self.pending[:] = self.NO_CHANGE
-		self.pending_lock.release()
-
-		diff = (diff_top << 24) + diff_bot # Store top pixel colour in upper bytes
-
-		if np.sum(diff) == 0:
-			# No updates required
-			return
-
-		data_blocks = []
-		data = ""
-		last_row = None
-		last_col = None
-		last_colours = None
-
-		max_packet_length = 4096
-
-		# Get only characters that need to be updated, and the locations
-		#  of those changes
-		new_data = ""
-		for row, col in zip(*np.where(diff != 0)):
-			upper_colour = self.pending[2*row, col]
-			if upper_colour == self.NO_CHANGE:
-				upper_colour = self.canvas[2*row, col]
-
-			lower_colour = self.pending[2*row+1, col]
-			if lower_colour == self.NO_CHANGE:
-				lower_colour = self.canvas[2*row+1, col]
-
-			colours = (upper_colour, lower_colour)
-
-			# If we are in the same row, the next column, and same colours
-			if row == last_row and col-1 == last_col and colours == last_colours:
-				# We can just continue on from the last pixel as it's the same
-				new_data = self.px
-
-			# If we are in the same row, the next column, but different colours
-			elif row == last_row and col-1 == last_col:
-				# Need to set the new colours and then print the pixel
-				new_data = ansi_set_full_colour(*colours) + self.px
-
-			# If we have skipped any columns or rows, but kept the colours
-			elif colours == last_colours:
-				# We must move the cursor and draw the pixel
-				new_data = ansi_move_cursor(col, row) + self.px
-
-			# If we have skipped any columns or rows and a new colour
+		# Sends any changes to the client. Returns how many bytes that
+		#  took.
+
+		# Move the pending changes onto the canvas in the palette's
+		#  colours, keeping track of which pixels actually changed. Only
+		#  the character rows that were drawn to are looked at, between
+		#  the leftmost and rightmost columns drawn to.
+		cell_height, cell_width = self.cells.HEIGHT, self.cells.WIDTH
+		with self.pending_lock:
+			damaged = self.damage.rows().reshape(-1, cell_height).any(axis=1)
+			rows = np.flatnonzero(damaged)
+			if rows.size == 0:
+				return 0
+			x1, x2, _, _ = self.damage.bounds()
+			x1 -= x1 % cell_width
+			x2 += -x2 % cell_width
+			if rows[-1] - rows[0] + 1 == rows.size:
+				# One block of rows, which can be worked on in place
+				pixel_rows = slice(rows[0]*cell_height, (rows[-1] + 1)*cell_height)
 			else:
-				# We must move the cursor, update colours, and then draw pixel
-				new_data = ansi_move_cursor(col, row) + ansi_set_full_colour(*colours) + self.px
-
-			# Add the new data, unless it exceeds the max packet length,
-			#  then the existing data is added to the data blocks and
-			#  a new data is started
-			if len(data) + len(new_data) > max_packet_length:
-				data_blocks.append(data)
-				data = new_data
+				pixel_rows = (rows[:, None]*cell_height + np.arange(cell_height)).ravel()
+
+			pending = self.pending[pixel_rows, x1:x2]
+			canvas = self.canvas[pixel_rows, x1:x2]
+			drawn = pending != self.NO_CHANGE
+			colours = self.palette.quantise(pending[drawn])
+			updated = np.zeros_like(drawn)
+			updated[drawn] = colours != canvas[drawn]
+			canvas[drawn] = colours
+
+			if isinstance(pixel_rows, np.ndarray):
+				# canvas and pending are copies
+				self.canvas[pixel_rows, x1:x2] = canvas
+				self.pending[pixel_rows, x1:x2] = self.NO_CHANGE
 			else:
-				data += new_data
+				pending[:] = self.NO_CHANGE
+				canvas = canvas.copy()
+			self.damage.reset()
 
-			# Update the last_ variables
-			last_row = row
-			last_col = col
-			last_colours = colours
-
-		# If there is existing data in new_data, add it to the blocks
-		if data:
-			data_blocks.append(data)
-
-		# Send off the changes to client's screen
-		for d in data_blocks:
-			self.sender(d)
+		# A character needs redrawing if any of its pixels changed
+		changed = updated.reshape(rows.size, cell_height, -1, cell_width).any(axis=(1, 3))
+		if not changed.any():
+			# No updates required
+			return 0
+		fg, bg, glyphs = self.cells.reduce(canvas, changed)
+
+		# Sent as one message; the channel splits it into packets
+		data = self.encode_cache.encode(
+			self, self.encoder, changed, fg, bg, rows, x1 // cell_width, glyphs)
+		self.sender(data)
+		return len(data)
@@ -0,0 +1,251 @@
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from apps.doom.textures import PATCH_HEADER_DTYPE, decode_patch
+
+
+# Sprites are patches between these marker lumps
+SPRITE_MARKERS = (b"S_START", b"S_END")
+
+# Colours are 0xRRGGBB, like the screen's pixels
+PIXEL_DTYPE = np.int32
+
+
+
+def blend_colours(under, over, alpha):
+	# Mixes 0xRRGGBB colours over others, by alphas from 0 to 255
+	under = np.asarray(under, dtype=np.int64)
+	over = np.asarray(over, dtype=np.int64)
+	alpha = np.asarray(alpha, dtype=np.int64)
+	blended = 0
+	for shift in (16, 8, 0):
+		a = (under >> shift) & 0xff
+		b = (over >> shift) & 0xff
+		blended = blended | (((b * alpha + a * (255 - alpha) + 127) // 255) << shift)
+	return blended
+
+
+def halve(pixels, alpha):
+	# An image half the size, each pixel the average of a 2x2 block,
+	#  with colours weighted by how opaque they are. Odd edges are
+	#  averaged with nothing.
+	height, width = pixels.shape
+	pad = ((0, height % 2), (0, width % 2))
+	pixels = np.pad(pixels, pad)
+	alpha = np.pad(alpha, pad).astype(np.int64)
+	shape = (pixels.shape[0] // 2, 2, pixels.shape[1] // 2, 2)
+	weight = alpha.reshape(shape).sum(axis=(1, 3))
+
+	halved = np.zeros(weight.shape, dtype=np.int64)
+	for shift in (16, 8, 0):
+		channel = ((pixels.astype(np.int64) >> shift) & 0xff) * alpha
+		total = channel.reshape(shape).sum(axis=(1, 3))
+		halved |= (total // np.maximum(weight, 1)) << shift
+	return halved.astype(PIXEL_DTYPE), (weight // 4).astype(np.uint8)
+
+
+
+class Sprite:
+	"""
+	An image decoded once into 0xRRGGBB colours and an alpha channel,
+	with copies of it halved in size again and again down to a pixel
+	(mip levels). Drawing it small uses the nearest level, whose pixels
+	are averages of the full size image's, so it doesn't shimmer from
+	frame to frame the way skipping pixels of the full size image does.
+	The level is sampled to each size once, the first time it's drawn
+	that size, with pixels at least half opaque kept and the rest
+	dropped, so drawing it again is only a copy, with no blending.
+	Sprites are read only once made, so sessions share them.
+	"""
+
+	def __init__(self, pixels, alpha, left_offset=0, top_offset=0):
+		# pixels and alpha are (height, width) arrays. The offsets are how
+		#  far left and up of the image the point it's drawn at is, like
+		#  a patch's.
+		self.height, self.width = pixels.shape
+		self.left_offset = left_offset
+		self.top_offset = top_offset
+
+		self.levels = [(pixels.astype(PIXEL_DTYPE), alpha.astype(np.uint8))]
+		while max(self.levels[-1][0].shape) > 1:
+			self.levels.append(halve(*self.levels[-1]))
+		for level in self.levels:
+			for array in level:
+				array.flags.writeable = False
+
+		# If each level has partly transparent pixels, which have to be
+		#  blended rather than just copied
+		self.partial = [bool(((alpha > 0) & (alpha < 255)).any()) for _, alpha in self.levels]
+
+		# (width, height) -> (pixels, alpha) of the sprite drawn smaller
+		#  than full size. Sessions drawing a size at the same time may
+		#  both sample it, which is harmless.
+		self.sizes = {}
+
+
+	@classmethod
+	def from_image(cls, filename):
+		# None if the file can't be read as an image
+		image = cv2.imread(filename, cv2.IMREAD_UNCHANGED) # unchanged for alpha channel
+		if image is None:
+			return None
+		if image.ndim == 2:
+			image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+		image = image.astype(np.int64)
+		pixels = (image[:, :, 2] << 16) | (image[:, :, 1] << 8) | image[:, :, 0]
+		alpha = image[:, :, 3] if image.shape[2] == 4 else np.full(pixels.shape, 255)
+		return cls(pixels, alpha)
+
+
+	@classmethod
+	def from_patch(cls, data, palette):
+		# From a patch lump, in the colours of a palette of 256 0xRRGGBB
+		#  colours
+		header = np.frombuffer(data, PATCH_HEADER_DTYPE, count=1)[0]
+		indexes, opaque = decode_patch(data)
+		pixels = np.asarray(palette, dtype=PIXEL_DTYPE)[indexes]
+		return cls(pixels, opaque * 255, int(header["left_offset"]), int(header["top_offset"]))
+
+
+	def level(self, scale):
+		# The smallest level that is still at least as big as the image
+		#  drawn at scale
+		if scale >= 1:
+			return 0
+		return min(int(np.log2(1 / scale)), len(self.levels) - 1)
+
+
+	def scaled(self, scale):
+		# The sprite drawn at a scale below 1, as (pixels, alpha) at the
+		#  size it covers on screen, sampled from the nearest level. Every
+		#  pixel is either opaque or transparent.
+		width = max(int(np.ceil(self.width * scale)), 1)
+		height = max(int(np.ceil(self.height * scale)), 1)
+		scaled = self.sizes.get((width, height))
+		if scaled is None:
+			level = self.level(scale)
+			pixels, alpha = self.levels[level]
+			level_scale = scale * 2 ** level
+			u = np.minimum(((np.arange(width) + 0.5) / level_scale).astype(np.int64), pixels.shape[1] - 1)
+			v = np.minimum(((np.arange(height) + 0.5) / level_scale).astype(np.int64), pixels.shape[0] - 1)
+			pixels = pixels[v[:, None], u]
+			alpha = np.where(alpha[v[:, None], u] >= 128, 255, 0).astype(np.uint8)
+			pixels.flags.writeable = False
+			alpha.flags.writeable = False
+			scaled = self.sizes[(width, height)] = (pixels, alpha)
+		return scaled
+
+
+
+class WadSprites:
+	"""
+	The sprites of a WAD, looked up by lump name, and decoded into a
+	SpriteCache the first time they're drawn.
+	"""
+
+	def __init__(self, cache, wad, palette):
+		self.cache = cache
+		self.wad = wad
+		self.path = os.path.realpath(wad.filename)
+		self.palette = palette
+
+		lump_names = wad.directories["lump_name"]
+		start = np.flatnonzero(lump_names == SPRITE_MARKERS[0])
+		end = np.flatnonzero(lump_names == SPRITE_MARKERS[1])
+		self.lumps = {}
+		if start.size and end.size:
+			for index in range(start[0] + 1, end[-1]):
+				self.lumps[lump_names[index].decode().upper()] = index
+
+
+	@classmethod
+	def from_wad(cls, cache, wad):
+		# None if the WAD doesn't have any sprites
+		playpal = wad.get_lump_by_name("PLAYPAL")
+		if playpal is None:
+			return None
+		rgb = playpal[:256 * 3].reshape(256, 3).astype(np.int32)
+		sprites = cls(cache, wad, (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2])
+		return sprites if sprites.lumps else None
+
+
+	def get(self, name):
+		# The Sprite of a lump, or None if there isn't one
+		index = self.lumps.get(name)
+		if index is None:
+			return None
+		return self.cache.get(
+			(self.path, name), lambda: Sprite.from_patch(self.wad.get_lump(index), self.palette))
+
+
+	def rotation(self, frame, rotation):
+		# A frame's sprite seen from one of 8 rotations, 1 being from the
+		#  front, and if it's drawn flipped. frame is the sprite's name
+		#  and frame letter, like "PLAYA". Lumps can be one rotation, like
+		#  PLAYA1, every rotation, like PLAYA0, or two where the second is
+		#  the first flipped, like PLAYA2A8. Returns (None, False) if the
+		#  frame has no lump for the rotation.
+		for name in (f"{frame}{rotation}", f"{frame}0"):
+			if name in self.lumps:
+				return self.get(name), False
+		for name in self.lumps:
+			if name.startswith(frame) and name[4:6] == f"{frame[4]}{rotation}":
+				return self.get(name), False
+			if name[:4] == frame[:4] and name[6:8] == f"{frame[4]}{rotation}":
+				return self.get(name), True
+		return None, False
+
+
+
+class SpriteCache:
+	"""
+	Sprites decoded from image files and WADs, kept for as long as the
+	process runs so each is only decoded once however many sessions
+	draw it.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+
+		# Key -> Sprite. Images are keyed by their real path, and WAD
+		#  sprites by the WAD's real path and their lump name.
+		self.sprites = {}
+
+		self.hits = 0
+		self.misses = 0
+
+
+	def get(self, key, load):
+		# The sprite of key, calling load to make it if it isn't cached.
+		#  Loading is done holding the lock, so it's only done once.
+		with self.lock:
+			if key in self.sprites:
+				self.hits += 1
+				return self.sprites[key]
+			self.misses += 1
+			sprite = self.sprites[key] = load()
+			return sprite
+
+
+	def image(self, filename):
+		# The sprite of an image file, or None if it can't be read
+		path = os.path.realpath(filename)
+		return self.get(path, lambda: Sprite.from_image(path))
+
+
+	def wad_sprites(self, wad):
+		return WadSprites.from_wad(self, wad)
+
+
+	def clear(self):
+		with self.lock:
+			self.sprites.clear()
+
+
+
+# Shared by every session in the process
+SPRITE_CACHE = SpriteCache()
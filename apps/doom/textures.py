@@ -0,0 +1,224 @@
+
+import numpy as np
+
+
+# Layouts of the lumps textures are made from. Everything is little
+#  endian, like the rest of the WAD.
+PATCH_HEADER_DTYPE = np.dtype([
+	("width", "<i2"), ("height", "<i2"), ("left_offset", "<i2"), ("top_offset", "<i2")])
+
+MAPTEXTURE_DTYPE = np.dtype([
+	("name", "S8"), ("masked", "<i4"), ("width", "<i2"), ("height", "<i2"),
+	("column_directory", "<i4"), ("patch_count", "<i2")])
+
+MAPPATCH_DTYPE = np.dtype([
+	("origin_x", "<i2"), ("origin_y", "<i2"), ("patch", "<i2"),
+	("step_dir", "<i2"), ("colormap", "<i2")])
+
+# Shades of each colour, from full brightness at 0 to nearly black
+LIGHT_LEVELS = 32
+
+# Flats, the textures of floors and ceilings, are 64x64 palette indexes
+#  between these marker lumps
+FLAT_SIZE = 64
+FLAT_MARKERS = (b"F_START", b"F_END")
+
+
+
+def decode_patch(data):
+	"""
+	Decodes a patch lump, which is stored as columns of runs of opaque
+	pixels ("posts"). Returns its palette indexes as a (height, width)
+	uint8 array, and a bool array of which of those are opaque.
+	"""
+	data = np.frombuffer(data, np.uint8)
+	header = np.frombuffer(data, PATCH_HEADER_DTYPE, count=1)[0]
+	width = int(header["width"])
+	height = int(header["height"])
+	column_offsets = np.frombuffer(data, "<u4", count=width, offset=PATCH_HEADER_DTYPE.itemsize)
+
+	pixels = np.zeros((height, width), dtype=np.uint8)
+	opaque = np.zeros((height, width), dtype=bool)
+	for x, offset in enumerate(column_offsets.tolist()):
+		# Each post is its top row, length, a padding byte, the pixels,
+		#  and another padding byte. 0xff ends the column.
+		while data[offset] != 0xff:
+			top = int(data[offset])
+			length = int(data[offset + 1])
+			rows = slice(top, min(top + length, height))
+			count = rows.stop - rows.start
+			pixels[rows, x] = data[offset + 3:offset + 3 + count]
+			opaque[rows, x] = True
+			offset += length + 4
+	return pixels, opaque
+
+
+def shade_colours(colours, levels):
+	# Darkens 0xRRGGBB colours to the given light levels
+	colours = np.asarray(colours, dtype=np.int64)
+	factor = 1 - np.asarray(levels) / LIGHT_LEVELS
+	channels = [(colours >> shift) & 0xff for shift in (16, 8, 0)]
+	r, g, b = ((c * factor).astype(np.int64) for c in channels)
+	return (r << 16) | (g << 8) | b
+
+
+
+class TextureAtlas:
+	"""
+	Every wall texture of a WAD, composed from its patches once and kept
+	side by side in one array of palette indexes, so the texels of any
+	mix of textures can be looked up in one go. Flats are kept the same
+	way, in one (count, 64, 64) array. Colours come from a table of
+	every palette colour at every light level, taken from the WAD's
+	COLORMAP if it has one.
+	"""
+
+	def __init__(self, names, textures, palette, colormap=None, flat_names=(), flats=()):
+		# names and textures are lists of each texture's name and its
+		#  (height, width) array of palette indexes. palette is 256
+		#  0xRRGGBB colours, and colormap is the palette indexes of each
+		#  colour at each light level. flat_names and flats are the same
+		#  for flats.
+		self.ids = {name: i for i, name in enumerate(names)}
+		self.names = names
+		self.widths = np.array([t.shape[1] for t in textures], dtype=np.int64)
+		self.heights = np.array([t.shape[0] for t in textures], dtype=np.int64)
+		self.offsets = np.cumsum(self.widths) - self.widths
+
+		self.pixels = np.zeros((int(self.heights.max(initial=1)), int(self.widths.sum())), dtype=np.uint8)
+		for texture, offset in zip(textures, self.offsets.tolist()):
+			self.pixels[:texture.shape[0], offset:offset + texture.shape[1]] = texture
+
+		self.flat_name_ids = {name: i for i, name in enumerate(flat_names)}
+		self.flats = np.zeros((len(flats), FLAT_SIZE, FLAT_SIZE), dtype=np.uint8)
+		for i, flat in enumerate(flats):
+			self.flats[i] = flat
+
+		self.palette = np.asarray(palette, dtype=np.int32)
+		if colormap is not None:
+			self.shades = self.palette[np.asarray(colormap)[:LIGHT_LEVELS]]
+		else:
+			levels = np.arange(LIGHT_LEVELS)[:, None]
+			self.shades = shade_colours(self.palette[None, :], levels).astype(np.int32)
+
+
+	@classmethod
+	def from_wad(cls, wad):
+		# None if the WAD doesn't have any textures
+		playpal = wad.get_lump_by_name("PLAYPAL")
+		pnames = wad.get_lump_by_name("PNAMES")
+		if playpal is None or pnames is None:
+			return None
+
+		# The first of PLAYPAL's palettes is the normal one
+		rgb = playpal[:256 * 3].reshape(256, 3).astype(np.int32)
+		palette = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+		colormap = wad.get_lump_by_name("COLORMAP")
+		if colormap is not None:
+			colormap = colormap[:LIGHT_LEVELS * 256].reshape(LIGHT_LEVELS, 256)
+
+		count = int(np.frombuffer(pnames, "<i4", count=1)[0])
+		patch_names = np.frombuffer(pnames, "S8", count=count, offset=4)
+		patches = {}
+		def get_patch(index):
+			if index not in patches:
+				data = wad.get_lump_by_name(patch_names[index].decode().upper())
+				patches[index] = None if data is None else decode_patch(data)
+			return patches[index]
+
+		names = []
+		textures = []
+		for lump_name in ("TEXTURE1", "TEXTURE2"):
+			lump = wad.get_lump_by_name(lump_name)
+			if lump is None:
+				continue
+			count = int(np.frombuffer(lump, "<i4", count=1)[0])
+			for offset in np.frombuffer(lump, "<i4", count=count, offset=4).tolist():
+				texture = np.frombuffer(lump, MAPTEXTURE_DTYPE, count=1, offset=offset)[0]
+				mappatches = np.frombuffer(
+					lump, MAPPATCH_DTYPE, count=int(texture["patch_count"]),
+					offset=offset + MAPTEXTURE_DTYPE.itemsize)
+				names.append(texture["name"].decode().upper())
+				textures.append(cls.compose(
+					int(texture["width"]), int(texture["height"]), mappatches, get_patch))
+
+		flat_names, flats = cls.load_flats(wad)
+		return cls(names, textures, palette, colormap, flat_names, flats)
+
+
+	@staticmethod
+	def load_flats(wad):
+		# Every flat between the markers. Other lumps in there, like the
+		#  F1_START markers of each WAD the flats came from, are skipped.
+		lump_names = wad.directories["lump_name"]
+		start = np.flatnonzero(lump_names == FLAT_MARKERS[0])
+		end = np.flatnonzero(lump_names == FLAT_MARKERS[1])
+		flat_names = []
+		flats = []
+		if start.size == 0 or end.size == 0:
+			return flat_names, flats
+		for index in range(start[0] + 1, end[-1]):
+			if wad.directories["lump_size"][index] != FLAT_SIZE * FLAT_SIZE:
+				continue
+			flat_names.append(lump_names[index].decode().upper())
+			flats.append(wad.get_lump(index).reshape(FLAT_SIZE, FLAT_SIZE))
+		return flat_names, flats
+
+
+	@staticmethod
+	def compose(width, height, mappatches, get_patch):
+		# Draws a texture's patches over each other, later ones on top
+		pixels = np.zeros((height, width), dtype=np.uint8)
+		for mappatch in mappatches:
+			patch = get_patch(int(mappatch["patch"]))
+			if patch is None:
+				continue
+			patch_pixels, opaque = patch
+			x = int(mappatch["origin_x"])
+			y = int(mappatch["origin_y"])
+
+			# Cut the patch to the texture
+			x1, y1 = max(x, 0), max(y, 0)
+			x2 = min(x + patch_pixels.shape[1], width)
+			y2 = min(y + patch_pixels.shape[0], height)
+			if x1 >= x2 or y1 >= y2:
+				continue
+			source = (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+			np.copyto(pixels[y1:y2, x1:x2], patch_pixels[source], where=opaque[source])
+		return pixels
+
+
+	def texture_ids(self, names):
+		# The id of each of an array of texture names, or -1 for names
+		#  that aren't textures, like "-"
+		return self._look_up(self.ids, names)
+
+	def flat_ids(self, names):
+		# The same for flat names
+		return self._look_up(self.flat_name_ids, names)
+
+	@staticmethod
+	def _look_up(ids, names):
+		names = np.asarray(names)
+		unique, inverse = np.unique(names, return_inverse=True)
+		found = np.array(
+			[ids.get(name.decode().upper(), -1) for name in unique.tolist()],
+			dtype=np.int64)
+		return found[inverse].reshape(names.shape)
+
+
+	def sample(self, ids, u, levels, v, columns):
+		# Colours of texels down columns of textures: ids, u (the texel
+		#  column) and light levels have one entry per column, and v
+		#  (the texel row) and columns (which column) one per texel.
+		#  Textures repeat in both directions.
+		x = self.offsets[ids] + u % self.widths[ids]
+		y = v % self.heights[ids][columns]
+		index = self.pixels[y, x[columns]]
+		return self.shades.ravel()[(levels * 256)[columns] + index]
+
+	def sample_flats(self, ids, x, y, levels):
+		# Colours of texels of flats, all arrays with one entry per texel.
+		#  Flats repeat every 64 units.
+		index = self.flats[ids, y & (FLAT_SIZE - 1), x & (FLAT_SIZE - 1)]
+		return self.shades.ravel()[levels * 256 + index]
@@ -0,0 +1,206 @@
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from apps.doom.map import PLAYER_THING_TYPES
+from apps.doom.map_cache import MAP_CACHE
+from apps.doom.player import Player
+from config import Config
+
+
+
+class World:
+	"""
+	One game of a map that every session playing it joins, so players
+	see each other. The world runs on its own thread, a tick at a time
+	at a fixed rate, applying the inputs every session has queued since
+	the last tick. Sessions only render their player's view of it.
+
+	The map's geometry is shared and read only. Player positions are
+	changed by the tick thread holding lock, which renderers take to
+	copy them at the start of each frame, so they never see a player
+	half way through moving.
+	"""
+
+	def __init__(self, map_, tics_per_second=35):
+		# map_ is the Map played, which the world's players are added to
+		self.map = map_
+		self.tic_length = 1 / tics_per_second
+		self.lock = threading.Lock()
+
+		# The actions each player has asked for since the last tick, in
+		#  the order first asked for. Asking again before the tick, like
+		#  the repeats of a held key, doesn't do it again. Kept under its
+		#  own lock, so sessions don't wait for a tick to finish.
+		self.inputs = {}
+		self.inputs_lock = threading.Lock()
+
+		# Called with no arguments after a tick that changed something
+		self.listeners = []
+
+		self.tic = 0
+		self.running = threading.Event()
+		self.thread = None
+
+
+	@property
+	def players(self):
+		return self.map.players
+
+
+	def join(self, listener=None):
+		# Adds a new player at the next start, going round the map's
+		#  player starts when there are more players than starts.
+		#  listener is called after each tick that changed something.
+		with self.lock:
+			number = max([p.id for p in self.players], default=0) + 1
+			player = Player(number)
+			player.map = self.map
+			self.players.append(player)
+			self.place(player)
+			if listener is not None:
+				self.listeners.append(listener)
+		self.notify()
+		return player
+
+
+	def leave(self, player, listener=None):
+		with self.lock:
+			if player in self.players:
+				self.players.remove(player)
+			if listener in self.listeners:
+				self.listeners.remove(listener)
+		self.notify()
+
+
+	def place(self, player):
+		# Has to be called holding the lock
+		starts = self.map.geometry.player_starts
+		types = [t for t in PLAYER_THING_TYPES if t in starts.type]
+		if not types:
+			return
+		start = int(np.flatnonzero(starts.type == types[(player.id - 1) % len(types)])[0])
+		player.update_from_thing(int(starts.x[start]), int(starts.y[start]), int(starts.angle[start]))
+
+
+	def queue_input(self, player, action):
+		# action is the name of a Player method, like "move_forward"
+		with self.inputs_lock:
+			self.inputs.setdefault(player, {})[action] = None
+
+
+	def tick(self):
+		# Applies every input queued so far, and tells the sessions if
+		#  anything changed
+		with self.inputs_lock:
+			inputs, self.inputs = self.inputs, {}
+		changed = False
+		with self.lock:
+			for player, actions in inputs.items():
+				if player not in self.players:
+					continue
+				for action in actions:
+					getattr(player, action)()
+					changed = True
+			self.tic += 1
+		if changed:
+			self.notify()
+
+
+	def notify(self):
+		for listener in list(self.listeners):
+			listener()
+
+
+	def view(self, player, camera):
+		# Copies where player is to camera, a Player to render their view
+		#  from, and returns where everyone else is as (x, y, angle, id)
+		#  rows. Done together so the frame shows one tick.
+		with self.lock:
+			camera.update_from_thing(player._x, player._y, player.angle)
+			others = [(p._x, p._y, p.angle, p.id) for p in self.players if p is not player]
+		return np.array(others, dtype=np.float64).reshape(-1, 4)
+
+
+	def start(self):
+		self.running.set()
+		self.thread = threading.Thread(target=self.tick_loop, daemon=True)
+		self.thread.start()
+
+
+	def stop(self):
+		self.running.clear()
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread = None
+
+
+	def tick_loop(self):
+		# Ticks at a fixed rate. Late ticks don't make the ones after
+		#  them come sooner, so a stall doesn't cause a burst of ticks.
+		next_tic = time.monotonic()
+		while self.running.is_set():
+			now = time.monotonic()
+			if next_tic > now:
+				time.sleep(next_tic - now)
+				now = next_tic
+			next_tic = now + self.tic_length
+			self.tick()
+
+
+
+class Worlds:
+	"""
+	The worlds being played, one for each map, started when the first
+	player joins and stopped when the last one leaves.
+	"""
+
+	def __init__(self, map_cache, tics_per_second=35):
+		self.map_cache = map_cache
+		self.tics_per_second = tics_per_second
+		self.lock = threading.Lock()
+
+		# (filename, map name) -> World
+		self.worlds = {}
+
+
+	def join(self, filename, map_name, listener=None):
+		# Returns the world and the new player, or None, None if the map
+		#  isn't in the WAD
+		key = (os.path.realpath(filename), map_name)
+		with self.lock:
+			world = self.worlds.get(key)
+			if world is not None:
+				return world, world.join(listener)
+
+		# Loading the map can take a while, so it's done without holding
+		#  up players joining and leaving other worlds. Another session
+		#  may have started this world in the meantime, in which case
+		#  its map is used instead.
+		game_map = self.map_cache.load_map(filename, map_name, players=[])
+		if game_map is None:
+			return None, None
+
+		with self.lock:
+			world = self.worlds.get(key)
+			if world is None:
+				world = World(game_map, self.tics_per_second)
+				world.start()
+				self.worlds[key] = world
+			return world, world.join(listener)
+
+
+	def leave(self, world, player, listener=None):
+		with self.lock:
+			world.leave(player, listener)
+			if not world.players:
+				world.stop()
+				self.worlds = {k: w for k, w in self.worlds.items() if w is not world}
+
+
+
+# Shared by every session in the process
+WORLDS = Worlds(MAP_CACHE, Config.DOOM_TICS_PER_SECOND)
@@ -20,9 +20,35 @@ class AppGeneric:
 		# To write for each app
 		pass
 
+	def handle_CHANNEL_EXTENDED_DATA(self, msg):
+		# Clients rarely send this, so apps that don't care can ignore it
+		pass
+
+	def handle_CHANNEL_EOF(self):
+		# By default, the client sending EOF ends the app
+		self.session.send_CHANNEL_EOF()
+		self.session.send_CHANNEL_CLOSE()
+
+	def handle_server_shutdown(self, message):
+		# The server is going to stop soon, and will disconnect the
+		#  client if the app hasn't finished by then. Apps can use this
+		#  to warn the user or start wrapping up.
+		pass
+
+	def handle_outbound_drained(self):
+		# Everything the app sent has gone out to the client. Apps that
+		#  stop producing output while the client is behind can use
+		#  this to start again.
+		pass
+
 	def send_CHANNEL_DATA(self, data):
 		self.session.send_CHANNEL_DATA(data)
 
+	def send_CHANNEL_EXTENDED_DATA(self, data, data_type_code=1):
+		# Shares the channel window and outbound queue with
+		#  send_CHANNEL_DATA. data_type_code 1 is stderr.
+		self.session.send_CHANNEL_EXTENDED_DATA(data, data_type_code)
+
 	def send_CHANNEL_CLOSE(self):
 		self.session.send_CHANNEL_CLOSE()
 
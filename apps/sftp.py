@@ -0,0 +1,575 @@
+"""
+SFTP version 3, as described in draft-ietf-secsh-filexfer-02. This is
+the version OpenSSH's sftp client speaks.
+
+All packets share the same framing
+
+uint32 length
+	Length of the packet, not including the length field itself.
+
+byte type
+	One of the SSH_FXP_* packet types.
+
+uint32 request-id
+	Chosen by the client, and copied into the response. Every packet
+	except SSH_FXP_INIT and SSH_FXP_VERSION has one.
+
+The client may send many requests without waiting for responses, and
+the server may answer them in any order. Reads and writes carry their
+own offset, so they are served with os.pread and os.pwrite straight
+from/to the file, and never need a file to be read into memory.
+"""
+
+import os
+import posixpath
+import stat
+import struct
+import time
+
+from apps.generic import AppGeneric
+from config import Config
+from data_types import DataReader, DataWriter
+
+
+SFTP_VERSION = 3
+
+# Packet types
+SSH_FXP_INIT           = 1
+SSH_FXP_VERSION        = 2
+SSH_FXP_OPEN           = 3
+SSH_FXP_CLOSE          = 4
+SSH_FXP_READ           = 5
+SSH_FXP_WRITE          = 6
+SSH_FXP_LSTAT          = 7
+SSH_FXP_FSTAT          = 8
+SSH_FXP_SETSTAT        = 9
+SSH_FXP_FSETSTAT       = 10
+SSH_FXP_OPENDIR        = 11
+SSH_FXP_READDIR        = 12
+SSH_FXP_REMOVE         = 13
+SSH_FXP_MKDIR          = 14
+SSH_FXP_RMDIR          = 15
+SSH_FXP_REALPATH       = 16
+SSH_FXP_STAT           = 17
+SSH_FXP_RENAME         = 18
+SSH_FXP_READLINK       = 19
+SSH_FXP_SYMLINK        = 20
+SSH_FXP_STATUS         = 101
+SSH_FXP_HANDLE         = 102
+SSH_FXP_DATA           = 103
+SSH_FXP_NAME           = 104
+SSH_FXP_ATTRS          = 105
+SSH_FXP_EXTENDED       = 200
+SSH_FXP_EXTENDED_REPLY = 201
+
+# Status codes
+SSH_FX_OK                = 0
+SSH_FX_EOF               = 1
+SSH_FX_NO_SUCH_FILE      = 2
+SSH_FX_PERMISSION_DENIED = 3
+SSH_FX_FAILURE           = 4
+SSH_FX_BAD_MESSAGE       = 5
+SSH_FX_NO_CONNECTION     = 6
+SSH_FX_CONNECTION_LOST   = 7
+SSH_FX_OP_UNSUPPORTED    = 8
+
+# Open flags
+SSH_FXF_READ   = 0x01
+SSH_FXF_WRITE  = 0x02
+SSH_FXF_APPEND = 0x04
+SSH_FXF_CREAT  = 0x08
+SSH_FXF_TRUNC  = 0x10
+SSH_FXF_EXCL   = 0x20
+
+# Attribute flags
+SSH_FILEXFER_ATTR_SIZE        = 0x00000001
+SSH_FILEXFER_ATTR_UIDGID      = 0x00000002
+SSH_FILEXFER_ATTR_PERMISSIONS = 0x00000004
+SSH_FILEXFER_ATTR_ACMODTIME   = 0x00000008
+SSH_FILEXFER_ATTR_EXTENDED    = 0x80000000
+
+
+
+class SFTPError(Exception):
+	# Raised by request handlers to send a status back to the client
+	def __init__(self, code, message):
+		super().__init__(message)
+		self.code = code
+		self.message = message
+
+
+
+class SFTPAttributes:
+	"""
+	The ATTRS structure. Only the fields whose flag is set are present.
+	"""
+	def __init__(self, size=None, uid=None, gid=None, permissions=None, atime=None, mtime=None):
+		self.size = size
+		self.uid = uid
+		self.gid = gid
+		self.permissions = permissions
+		self.atime = atime
+		self.mtime = mtime
+
+	@classmethod
+	def from_stat(cls, st):
+		return cls(
+			size=st.st_size,
+			uid=st.st_uid,
+			gid=st.st_gid,
+			permissions=st.st_mode,
+			atime=int(st.st_atime),
+			mtime=int(st.st_mtime))
+
+	@classmethod
+	def from_reader(cls, r):
+		attrs = cls()
+		flags = r.read_uint32()
+		if flags & SSH_FILEXFER_ATTR_SIZE:
+			attrs.size = r.read_uint64()
+		if flags & SSH_FILEXFER_ATTR_UIDGID:
+			attrs.uid = r.read_uint32()
+			attrs.gid = r.read_uint32()
+		if flags & SSH_FILEXFER_ATTR_PERMISSIONS:
+			attrs.permissions = r.read_uint32()
+		if flags & SSH_FILEXFER_ATTR_ACMODTIME:
+			attrs.atime = r.read_uint32()
+			attrs.mtime = r.read_uint32()
+		if flags & SSH_FILEXFER_ATTR_EXTENDED:
+			# We don't understand any extensions, so skip them
+			for _ in range(r.read_uint32()):
+				r.read_string(blob=True)
+				r.read_string(blob=True)
+		return attrs
+
+	def write(self, w):
+		flags = 0
+		if self.size is not None: flags |= SSH_FILEXFER_ATTR_SIZE
+		if self.uid is not None and self.gid is not None: flags |= SSH_FILEXFER_ATTR_UIDGID
+		if self.permissions is not None: flags |= SSH_FILEXFER_ATTR_PERMISSIONS
+		if self.atime is not None and self.mtime is not None: flags |= SSH_FILEXFER_ATTR_ACMODTIME
+
+		w.write_uint32(flags)
+		if flags & SSH_FILEXFER_ATTR_SIZE:
+			w.write_uint64(self.size)
+		if flags & SSH_FILEXFER_ATTR_UIDGID:
+			w.write_uint32(self.uid)
+			w.write_uint32(self.gid)
+		if flags & SSH_FILEXFER_ATTR_PERMISSIONS:
+			w.write_uint32(self.permissions)
+		if flags & SSH_FILEXFER_ATTR_ACMODTIME:
+			w.write_uint32(self.atime)
+			w.write_uint32(self.mtime)
+
+	def longname(self, filename):
+		# Something that looks like a line of 'ls -l'
+		mode = stat.filemode(self.permissions or 0)
+		mtime = time.strftime("%b %d %H:%M", time.localtime(self.mtime or 0))
+		return f"{mode} 1 {self.uid or 0:<8} {self.gid or 0:<8} {self.size or 0:>8} {mtime} {filename}"
+
+
+
+class SFTPFileHandle:
+	def __init__(self, fd, path):
+		self.fd = fd
+		self.path = path
+
+	def close(self):
+		os.close(self.fd)
+
+
+class SFTPDirHandle:
+	def __init__(self, path, entries):
+		self.path = path
+		# Names not yet returned by READDIR
+		self.entries = entries
+
+	def close(self):
+		pass
+
+
+
+class SFTPServer(AppGeneric):
+	"""
+	Serves the files under Config.SFTP_ROOT. Clients see that directory
+	as "/", and can't reach anything outside of it.
+
+	Requests are handled as soon as they have fully arrived, on the
+	thread that receives channel data, and every response is queued on
+	the channel straight away. The channel's flow control holds the
+	responses back if the client's window is full.
+	"""
+
+	# Biggest read we will return in one SSH_FXP_DATA. Clients ask for
+	#  32 KB at a time, but may ask for more.
+	MAX_READ_LENGTH = 65536
+
+	# How many names to send back per SSH_FXP_READDIR
+	READDIR_BATCH = 100
+
+	# Largest packet we accept. Anything bigger is a broken client.
+	MAX_PACKET_LENGTH = 256 * 1024
+
+
+	def __init__(self, session):
+		self.session = session
+
+		self.root = os.path.realpath(Config.SFTP_ROOT)
+
+		# Data received that doesn't make a full packet yet
+		self.buffer = bytearray()
+
+		# Open handles. Handle strings are just a counter.
+		self.handles = {}
+		self.next_handle = 0
+
+		self.handlers = {
+			SSH_FXP_OPEN:     self.handle_OPEN,
+			SSH_FXP_CLOSE:    self.handle_CLOSE,
+			SSH_FXP_READ:     self.handle_READ,
+			SSH_FXP_WRITE:    self.handle_WRITE,
+			SSH_FXP_LSTAT:    self.handle_LSTAT,
+			SSH_FXP_FSTAT:    self.handle_FSTAT,
+			SSH_FXP_SETSTAT:  self.handle_SETSTAT,
+			SSH_FXP_FSETSTAT: self.handle_FSETSTAT,
+			SSH_FXP_OPENDIR:  self.handle_OPENDIR,
+			SSH_FXP_READDIR:  self.handle_READDIR,
+			SSH_FXP_REMOVE:   self.handle_REMOVE,
+			SSH_FXP_MKDIR:    self.handle_MKDIR,
+			SSH_FXP_RMDIR:    self.handle_RMDIR,
+			SSH_FXP_REALPATH: self.handle_REALPATH,
+			SSH_FXP_STAT:     self.handle_STAT,
+			SSH_FXP_RENAME:   self.handle_RENAME,
+			SSH_FXP_READLINK: self.handle_READLINK,
+		}
+
+
+	def start(self):
+		os.makedirs(self.root, exist_ok=True)
+
+
+	def stop(self):
+		for handle in self.handles.values():
+			handle.close()
+		self.handles.clear()
+
+
+	def handle_CHANNEL_DATA(self, msg):
+		self.buffer += msg.data
+
+		# Handle every complete packet in the buffer. The client may
+		#  have sent many at once, or half of one.
+		offset = 0
+		while len(self.buffer) - offset >= 4:
+			length = struct.unpack_from(">I", self.buffer, offset)[0]
+			if length > self.MAX_PACKET_LENGTH:
+				print(f" [!] SFTP packet of {length} bytes is too large")
+				self.send_CHANNEL_CLOSE()
+				return
+			if len(self.buffer) - offset - 4 < length:
+				break
+
+			packet = bytes(self.buffer[offset+4:offset+4+length])
+			offset += 4 + length
+			self.handle_packet(packet)
+
+		del self.buffer[:offset]
+
+
+	def handle_packet(self, packet):
+		r = DataReader(packet)
+		packet_type = r.read_uint8()
+
+		# INIT is the only request without a request id
+		if packet_type == SSH_FXP_INIT:
+			self.handle_INIT(r)
+			return
+
+		request_id = r.read_uint32()
+		handler = self.handlers.get(packet_type)
+		if handler is None:
+			self.send_status(request_id, SSH_FX_OP_UNSUPPORTED, "Operation not supported")
+			return
+
+		try:
+			handler(request_id, r)
+		except SFTPError as e:
+			self.send_status(request_id, e.code, e.message)
+		except OSError as e:
+			self.send_os_error(request_id, e)
+		except Exception as e:
+			# Most likely a malformed packet
+			print(f" [!] SFTP request {packet_type} failed: {e!r}")
+			self.send_status(request_id, SSH_FX_BAD_MESSAGE, "Bad message")
+
+
+	###########
+	# Helpers #
+	###########
+	def local_path(self, path, follow_links=True):
+		"""
+		Turns a path from the client into a path on our side. Paths are
+		relative to our root, and can't climb out of it. Requests that
+		act on a symlink itself rather than what it points to pass
+		follow_links=False, so links out of the root can still be
+		looked at, moved and removed.
+		"""
+		virtual = posixpath.normpath(posixpath.join("/", path))
+		local = os.path.join(self.root, virtual.lstrip("/"))
+
+		# Symlinks could still point outside of the root. Without
+		#  following links, only the directories leading up to the last
+		#  part of the path are resolved.
+		if follow_links or virtual == "/":
+			real = os.path.realpath(local)
+		else:
+			real = os.path.realpath(os.path.dirname(local))
+		if real != self.root and not real.startswith(self.root + os.sep):
+			raise SFTPError(SSH_FX_PERMISSION_DENIED, "Permission denied")
+		return local
+
+
+	def virtual_path(self, path):
+		return posixpath.normpath(posixpath.join("/", path))
+
+
+	def add_handle(self, handle):
+		handle_id = str(self.next_handle).encode()
+		self.next_handle += 1
+		self.handles[handle_id] = handle
+		return handle_id
+
+
+	def get_handle(self, r, handle_type):
+		handle = self.handles.get(r.read_string(blob=True))
+		if not isinstance(handle, handle_type):
+			raise SFTPError(SSH_FX_FAILURE, "Invalid handle")
+		return handle
+
+
+	def send_packet(self, packet_type, request_id, body=b""):
+		length = 1 + 4 + len(body)
+		self.send_CHANNEL_DATA(struct.pack(">IBI", length, packet_type, request_id) + body)
+
+
+	def send_status(self, request_id, code, message=""):
+		w = DataWriter()
+		w.write_uint32(code)
+		w.write_string(message, us_ascii=False)
+		w.write_string("") # Language tag
+		self.send_packet(SSH_FXP_STATUS, request_id, w.data)
+
+
+	def send_os_error(self, request_id, e):
+		if isinstance(e, FileNotFoundError):
+			code = SSH_FX_NO_SUCH_FILE
+		elif isinstance(e, PermissionError):
+			code = SSH_FX_PERMISSION_DENIED
+		else:
+			code = SSH_FX_FAILURE
+		self.send_status(request_id, code, e.strerror or str(e))
+
+
+	def send_attrs(self, request_id, attrs):
+		w = DataWriter()
+		attrs.write(w)
+		self.send_packet(SSH_FXP_ATTRS, request_id, w.data)
+
+
+	def send_names(self, request_id, names):
+		# names is a list of (filename, attrs)
+		w = DataWriter()
+		w.write_uint32(len(names))
+		for filename, attrs in names:
+			w.write_string(filename, us_ascii=False)
+			w.write_string(attrs.longname(filename), us_ascii=False)
+			attrs.write(w)
+		self.send_packet(SSH_FXP_NAME, request_id, w.data)
+
+
+	def apply_attrs(self, path_or_fd, attrs):
+		if attrs.size is not None:
+			os.truncate(path_or_fd, attrs.size)
+		if attrs.permissions is not None:
+			os.chmod(path_or_fd, stat.S_IMODE(attrs.permissions))
+		if attrs.atime is not None and attrs.mtime is not None:
+			os.utime(path_or_fd, (attrs.atime, attrs.mtime))
+
+
+	####################
+	# Request handlers #
+	####################
+	def handle_INIT(self, r):
+		# Version 3 has no request id, and the reply has the same
+		#  framing as INIT
+		client_version = r.read_uint32()
+		w = DataWriter()
+		w.write_uint8(SSH_FXP_VERSION)
+		w.write_uint32(min(client_version, SFTP_VERSION))
+		self.send_CHANNEL_DATA(struct.pack(">I", len(w.data)) + w.data)
+
+
+	def handle_OPEN(self, request_id, r):
+		path = self.local_path(r.read_string())
+		pflags = r.read_uint32()
+		attrs = SFTPAttributes.from_reader(r)
+
+		if pflags & SSH_FXF_READ and pflags & SSH_FXF_WRITE:
+			flags = os.O_RDWR
+		elif pflags & SSH_FXF_WRITE:
+			flags = os.O_WRONLY
+		else:
+			flags = os.O_RDONLY
+		if pflags & SSH_FXF_APPEND: flags |= os.O_APPEND
+		if pflags & SSH_FXF_CREAT:  flags |= os.O_CREAT
+		if pflags & SSH_FXF_TRUNC:  flags |= os.O_TRUNC
+		if pflags & SSH_FXF_EXCL:   flags |= os.O_EXCL
+
+		mode = stat.S_IMODE(attrs.permissions) if attrs.permissions is not None else 0o644
+		fd = os.open(path, flags, mode)
+
+		handle_id = self.add_handle(SFTPFileHandle(fd, path))
+		w = DataWriter()
+		w.write_string(handle_id)
+		self.send_packet(SSH_FXP_HANDLE, request_id, w.data)
+
+
+	def handle_CLOSE(self, request_id, r):
+		handle_id = r.read_string(blob=True)
+		handle = self.handles.pop(handle_id, None)
+		if handle is None:
+			raise SFTPError(SSH_FX_FAILURE, "Invalid handle")
+		handle.close()
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_READ(self, request_id, r):
+		handle = self.get_handle(r, SFTPFileHandle)
+		offset = r.read_uint64()
+		length = min(r.read_uint32(), self.MAX_READ_LENGTH)
+
+		data = os.pread(handle.fd, length, offset)
+		if not data:
+			self.send_status(request_id, SSH_FX_EOF, "End of file")
+			return
+
+		# uint32 length || byte type || uint32 id || string data
+		header = struct.pack(">IBII", 1 + 4 + 4 + len(data), SSH_FXP_DATA, request_id, len(data))
+		self.send_CHANNEL_DATA(header + data)
+
+
+	def handle_WRITE(self, request_id, r):
+		handle = self.get_handle(r, SFTPFileHandle)
+		offset = r.read_uint64()
+		data = memoryview(r.read_string(blob=True))
+
+		while data:
+			written = os.pwrite(handle.fd, data, offset)
+			data = data[written:]
+			offset += written
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_LSTAT(self, request_id, r):
+		path = self.local_path(r.read_string(), follow_links=False)
+		self.send_attrs(request_id, SFTPAttributes.from_stat(os.lstat(path)))
+
+
+	def handle_STAT(self, request_id, r):
+		path = self.local_path(r.read_string())
+		self.send_attrs(request_id, SFTPAttributes.from_stat(os.stat(path)))
+
+
+	def handle_FSTAT(self, request_id, r):
+		handle = self.get_handle(r, SFTPFileHandle)
+		self.send_attrs(request_id, SFTPAttributes.from_stat(os.fstat(handle.fd)))
+
+
+	def handle_SETSTAT(self, request_id, r):
+		path = self.local_path(r.read_string())
+		self.apply_attrs(path, SFTPAttributes.from_reader(r))
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_FSETSTAT(self, request_id, r):
+		handle = self.get_handle(r, SFTPFileHandle)
+		self.apply_attrs(handle.fd, SFTPAttributes.from_reader(r))
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_OPENDIR(self, request_id, r):
+		path = self.local_path(r.read_string())
+		entries = [".", ".."] + sorted(os.listdir(path))
+
+		handle_id = self.add_handle(SFTPDirHandle(path, entries))
+		w = DataWriter()
+		w.write_string(handle_id)
+		self.send_packet(SSH_FXP_HANDLE, request_id, w.data)
+
+
+	def handle_READDIR(self, request_id, r):
+		handle = self.get_handle(r, SFTPDirHandle)
+		if not handle.entries:
+			self.send_status(request_id, SSH_FX_EOF, "End of directory")
+			return
+
+		batch = handle.entries[:self.READDIR_BATCH]
+		del handle.entries[:self.READDIR_BATCH]
+
+		names = []
+		for filename in batch:
+			try:
+				st = os.lstat(os.path.join(handle.path, filename))
+			except OSError:
+				# Removed since the directory was opened
+				continue
+			names.append((filename, SFTPAttributes.from_stat(st)))
+		self.send_names(request_id, names)
+
+
+	def handle_REMOVE(self, request_id, r):
+		os.remove(self.local_path(r.read_string(), follow_links=False))
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_MKDIR(self, request_id, r):
+		path = self.local_path(r.read_string())
+		attrs = SFTPAttributes.from_reader(r)
+		mode = stat.S_IMODE(attrs.permissions) if attrs.permissions is not None else 0o755
+		os.mkdir(path, mode)
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_RMDIR(self, request_id, r):
+		path = self.local_path(r.read_string())
+		if os.path.realpath(path) == self.root:
+			raise SFTPError(SSH_FX_PERMISSION_DENIED, "Permission denied")
+		os.rmdir(path)
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_REALPATH(self, request_id, r):
+		# The path doesn't have to exist, clients use this to tidy up
+		#  paths before creating things
+		path = self.virtual_path(r.read_string())
+		try:
+			attrs = SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+		except OSError:
+			attrs = SFTPAttributes()
+		self.send_names(request_id, [(path, attrs)])
+
+
+	def handle_RENAME(self, request_id, r):
+		old_path = self.local_path(r.read_string(), follow_links=False)
+		new_path = self.local_path(r.read_string(), follow_links=False)
+		# SFTP v3 renames fail if the target already exists
+		if os.path.lexists(new_path):
+			raise SFTPError(SSH_FX_FAILURE, "File already exists")
+		os.rename(old_path, new_path)
+		self.send_status(request_id, SSH_FX_OK)
+
+
+	def handle_READLINK(self, request_id, r):
+		path = self.local_path(r.read_string(), follow_links=False)
+		target = os.readlink(path)
+		self.send_names(request_id, [(target, SFTPAttributes())])
@@ -0,0 +1,145 @@
+"""
+Measures drawing the automap's walls: one draw_line call per wall with
+the old per-pixel Bresenham loop, against one draw_lines call for all
+of them. Then compares the cell modes, drawing the same map on the same
+160x50 character terminal at each mode's resolution.
+
+The map is made up, with about as many walls as E1M1 (475 linedefs),
+drawn on a 320x200 screen. Half the walls are horizontal or vertical,
+like most of Doom's.
+
+Run from the repository root with
+	python -m benchmarks.bench_automap [--frames 50] [--walls 475]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from apps.doom.cells import CELLS
+from apps.doom.screen import Batch, Screen
+
+
+WIDTH = 320
+HEIGHT = 100
+
+
+
+class LegacyBatch(Batch):
+	# The old draw_line, kept for comparison
+
+	def draw_line(self, x1, x2, y1, y2, colour, under=False):
+		dx = abs(x2 - x1)
+		dy = abs(y2 - y1)
+
+		if dx == 0 or dy == 0:
+			self.draw_box(x1, x2, y1, y2, colour, fill=True, under=under)
+			return
+
+		x, y = x1, y1
+		sx = -1 if x1 > x2 else 1
+		sy = -1 if y1 > y2 else 1
+		if dx > dy:
+			err = dx / 2.0
+			while x != x2:
+				self.draw_pixel(x, y, colour, under=under)
+				err -= dy
+				if err < 0:
+					y += sy
+					err += dx
+				x += sx
+		else:
+			err = dy / 2.0
+			while y != y2:
+				self.draw_pixel(x, y, colour, under=under)
+				err -= dx
+				if err < 0:
+					x += sx
+					err += dy
+				y += sy
+		self.draw_pixel(x, y, colour, under=under)
+
+
+
+def make_walls(count, rng, width=WIDTH, height=HEIGHT*2):
+	x1 = rng.integers(0, width, size=count)
+	y1 = rng.integers(0, height, size=count)
+	x2 = x1 + rng.integers(-30, 31, size=count) * width // WIDTH
+	y2 = y1 + rng.integers(-30, 31, size=count) * height // (HEIGHT*2)
+
+	# Make half of them straight
+	straight = rng.random(count) < 0.5
+	horizontal = rng.random(count) < 0.5
+	y2[straight & horizontal] = y1[straight & horizontal]
+	x2[straight & ~horizontal] = x1[straight & ~horizontal]
+	return x1, x2, y1, y2
+
+
+def run(draw, frames):
+	screen = Screen(height=HEIGHT, width=WIDTH, sender=lambda data: None)
+	t = time.perf_counter()
+	for _ in range(frames):
+		draw(screen)
+	return frames / (time.perf_counter() - t)
+
+
+def run_cells(cells, walls, frames):
+	# Draws the map over a blank screen each frame, with the player
+	#  moving around. Returns fps, the bytes of the first frame (the
+	#  whole map), and the bytes of the rest per frame.
+	sent = []
+	screen = Screen(height=HEIGHT//2, width=WIDTH//2, sender=sent.append, cells=cells)
+	x1, x2, y1, y2 = walls
+	scale_x = screen.width / WIDTH
+	scale_y = screen.height / (HEIGHT*2)
+	walls = [(a * scale).astype(int) for a, scale in ((x1, scale_x), (x2, scale_x), (y1, scale_y), (y2, scale_y))]
+	sent.clear()
+
+	t = time.perf_counter()
+	for i in range(frames):
+		batch = screen.new_batch()
+		batch.draw_box(0, screen.width, 0, screen.height, 0x000000, fill=True)
+		batch.draw_lines(*walls, 0x0000ff)
+		x, y = (i * 3) % screen.width, screen.height // 2
+		batch.draw_box(x, x + 1, y, y + 1, 0xff0000, fill=True)
+		batch.draw()
+		screen.refresh()
+	elapsed = time.perf_counter() - t
+	return frames / elapsed, len(sent[0]), sum(len(d) for d in sent[1:]) / (frames - 1)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--frames", type=int, default=50)
+	parser.add_argument("--walls", type=int, default=475)
+	args = parser.parse_args()
+
+	walls = make_walls(args.walls, np.random.default_rng(0))
+	wall_list = [tuple(int(v) for v in wall) for wall in zip(*walls)]
+
+	def legacy(screen):
+		batch = LegacyBatch(screen)
+		for x1, x2, y1, y2 in wall_list:
+			batch.draw_line(x1, x2, y1, y2, 0x0000ff)
+		batch.draw()
+
+	def batched(screen):
+		batch = screen.new_batch()
+		batch.draw_lines(*walls, 0x0000ff)
+		batch.draw()
+
+	print(f"{WIDTH}x{HEIGHT*2} pixels, {args.walls} walls, {args.frames} frames")
+	legacy_fps = run(legacy, args.frames)
+	fps = run(batched, args.frames)
+	print(f"  per line: {legacy_fps:8.1f} fps   batched: {fps:8.1f} fps   x{fps/legacy_fps:.1f}")
+
+	print(f"Cell modes, {WIDTH//2}x{HEIGHT//2} characters")
+	for name, cells in CELLS.items():
+		fps, map_bytes, frame_bytes = run_cells(cells(), walls, args.frames)
+		print(f"  {name:9} {cells.WIDTH*WIDTH//2}x{cells.HEIGHT*HEIGHT//2} pixels: {fps:7.1f} fps"
+			+ f"   whole map {map_bytes/1024:6.1f} KB   then {frame_bytes:5.0f} bytes/frame")
+
+
+if __name__ == "__main__":
+	main()
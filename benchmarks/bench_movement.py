@@ -0,0 +1,96 @@
+"""
+Measures moving the player around with collision against walls. The
+old way would have had to check every linedef of the map for each move,
+so moves got slower as maps got bigger. With the blockmap only the
+linedefs in the blocks around the player are checked, so a move takes
+about the same time on any map.
+
+Finding those linedefs has a cost of its own, which on a small map is
+more than checking every linedef, so maps with up to
+FULL_SCAN_LINEDEFS linedefs still check them all. The 4x4 rooms map is
+one of those, and runs at the old speed. Around E1M1's size, 14x14
+rooms, the blockmap is only a little quicker; it pays off on bigger
+maps.
+
+The maps are the grid of rooms from bench_renderer, at a few sizes,
+with a blockmap made for them. The player walks in a circle, bumping
+into walls and sliding along them.
+
+Run from the repository root with
+	python -m benchmarks.bench_movement [--moves 2000]
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from apps.doom.blockmap import BLOCK_SIZE, pack_blockmap
+from apps.doom.map import Map, MapGeometry
+from apps.doom.player import Player
+from benchmarks.bench_renderer import make_grid_map
+
+
+class LegacyMap(Map):
+	# Gives every linedef of the map to check, as there was nothing to
+	#  narrow them down with
+
+	def lines_near(self, x, y, radius):
+		return np.arange(len(self.linedefs))
+
+
+
+def make_blockmap(lumps):
+	# The blocks each linedef's bounding box touches, which for the
+	#  grid's straight walls are the blocks they go through
+	vertexes = lumps["vertexes"]
+	linedefs = lumps["linedefs"]
+	x = vertexes["x"].astype(np.int64)
+	y = vertexes["y"].astype(np.int64)
+	origin_x, origin_y = int(x.min()), int(y.min())
+	columns = (int(x.max()) - origin_x) // BLOCK_SIZE + 1
+	rows = (int(y.max()) - origin_y) // BLOCK_SIZE + 1
+
+	lists = [[] for _ in range(columns * rows)]
+	for i, linedef in enumerate(linedefs):
+		xs = x[[linedef["start_vertex"], linedef["end_vertex"]]] - origin_x
+		ys = y[[linedef["start_vertex"], linedef["end_vertex"]]] - origin_y
+		for row in range(ys.min() // BLOCK_SIZE, ys.max() // BLOCK_SIZE + 1):
+			for column in range(xs.min() // BLOCK_SIZE, xs.max() // BLOCK_SIZE + 1):
+				lists[row * columns + column].append(i)
+	return pack_blockmap(origin_x, origin_y, columns, rows, lists)
+
+
+def run(map_class, geometry, moves):
+	# Makes moves around a circle, and returns the time per move
+	player = Player(1)
+	map_class(geometry, players=[player])
+
+	t = time.perf_counter()
+	for i in range(moves):
+		angle = math.radians(i * 3)
+		player.move(12 * math.cos(angle), 12 * math.sin(angle))
+	return (time.perf_counter() - t) / moves
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--moves", type=int, default=2000)
+	args = parser.parse_args()
+
+	print(f"{args.moves} moves")
+	for size in (4, 14, 40):
+		lumps = make_grid_map(size, np.random.default_rng(0))
+		lumps["blockmap"] = make_blockmap(lumps)
+		geometry = MapGeometry("GRID", lumps)
+		legacy_time = run(LegacyMap, geometry, args.moves)
+		new_time = run(Map, geometry, args.moves)
+		print(
+			f"  {size:2}x{size:<2} rooms, {len(geometry.linedefs):5} linedefs:"
+			+ f"   every linedef: {legacy_time*1e6:6.1f} us/move"
+			+ f"   blockmap: {new_time*1e6:6.1f} us/move   x{legacy_time/new_time:.1f}")
+
+
+if __name__ == "__main__":
+	main()
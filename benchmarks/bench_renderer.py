@@ -0,0 +1,298 @@
+"""
+Measures rendering the 3D view. The old renderer worked out the visible
+walls one seg at a time with scalar numpy calls and Vector objects, and
+drew them as wireframes, leaving the rest of the screen black. The
+current one works them out a batch of segs at a time, and draws the
+whole scene: textured walls, the steps seen through doorways, and the
+floors and ceilings between them, so every pixel is drawn every frame.
+The screen is 320x200, the largest the game uses.
+
+The map is made up: a grid of square rooms, each its own subsector and
+sector, with doorways between most of them and a proper BSP tree over
+them. The default 14x14 grid has 784 segs, about as many as E1M1 (732).
+The walls have a made up 64x128 texture, and the floors and ceilings
+made up flats. The player walks a circle through the middle of it.
+
+The map is also run with a REJECT lump, so the renderer can skip the
+rooms that can't be seen from the player's room. Real maps get that
+from their node builder. For this map it's found by rendering a few
+views from every room, and noting the rooms that show up.
+
+Run from the repository root with
+	python -m benchmarks.bench_renderer [--frames 50] [--grid 14]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from apps.doom.helpers import normalise_angle, Vector
+from apps.doom.map import Map, MapGeometry, NO_SIDEDEF, SUBSECTOR_FLAG
+from apps.doom.player import Player
+from apps.doom.renderer import Renderer
+from apps.doom.screen import Screen
+from apps.doom.textures import TextureAtlas
+from apps.doom.wad import (
+	LINEDEF_DTYPE, NODE_DTYPE, SECTOR_DTYPE, SEG_DTYPE, SIDEDEF_DTYPE,
+	SUBSECTOR_DTYPE, THING_DTYPE, VERTEX_DTYPE)
+
+
+# Size of each room in map units
+ROOM_SIZE = 256
+
+
+
+class LegacyRenderer(Renderer):
+	# The old one seg at a time renderer, kept for comparison
+
+	def _render_bsp_nodes(self, screen, node=None):
+		if node is None:
+			return self._render_bsp_nodes(screen, self.map.root_node)
+		if node & SUBSECTOR_FLAG:
+			self._render_subsector(screen, node & ~SUBSECTOR_FLAG)
+			return
+		nodes = self.map.nodes
+		if self._is_point_on_left_side(self.player.x, self.player.y, node):
+			self._render_bsp_nodes(screen, int(nodes.l_child[node]))
+			self._render_bsp_nodes(screen, int(nodes.r_child[node]))
+		else:
+			self._render_bsp_nodes(screen, int(nodes.r_child[node]))
+			self._render_bsp_nodes(screen, int(nodes.l_child[node]))
+
+	def _render_subsector(self, screen, subsector):
+		segs = self.map.segs
+		vertexes = self.map.vertexes
+		first_seg = self.map.subsectors.first_seg_id[subsector]
+		seg_count = self.map.subsectors.seg_count[subsector]
+		for seg in range(first_seg, first_seg + seg_count):
+			v1 = Vector(int(vertexes.x[segs.start_vertex[seg]]), int(vertexes.y[segs.start_vertex[seg]]))
+			v2 = Vector(int(vertexes.x[segs.end_vertex[seg]]), int(vertexes.y[segs.end_vertex[seg]]))
+			visible, v1, v2, v1_angle, v2_angle = self._clipped_wall(v1, v2)
+			if visible and self.map.segs.left_sector[seg] == -1:
+				self.add_solid_wall(screen, seg, v1, v2, v1_angle, v2_angle)
+
+	def _clipped_wall(self, v1, v2):
+		v1_angle = self.player.angle_to_vertex(v1)
+		v2_angle = self.player.angle_to_vertex(v2)
+		if v1_angle - v2_angle <= 0:
+			return False, None, None, None, None
+		if v1_angle > 90 and v2_angle < -90:
+			return False, None, None, None, None
+		if v1_angle > self.half_fov and v2_angle > self.half_fov:
+			return False, None, None, None, None
+		elif v1_angle < -self.half_fov and v2_angle < -self.half_fov:
+			return False, None, None, None, None
+		if v1_angle > self.half_fov:
+			v1 = self.calculate_fov_intersection(v1, v2, self.player.angle + self.half_fov)
+			v1_angle = self.half_fov
+		if v2_angle < -self.half_fov:
+			v2 = self.calculate_fov_intersection(v1, v2, self.player.angle - self.half_fov)
+			v2_angle = -self.half_fov
+		return True, v1, v2, v1_angle, v2_angle
+
+	def get_wall_colour(self, v1, v2):
+		mid_x = (v1.x + v2.x)/2
+		mid_y = (v1.y + v2.y)/2
+		dist = ((mid_x - self.player.x)**2 + (mid_y - self.player.y)**2) ** 0.5
+		colour_percentage = (1 - np.clip(dist, 0, 1500)/1500) ** 4
+		return int(colour_percentage * 0xff) * 0x10101
+
+	def add_solid_wall(self, screen, seg, v1, v2, v1_angle, v2_angle):
+		v1_angle = normalise_angle(v1_angle)
+		v2_angle = normalise_angle(v2_angle)
+		v1_x = int(round(self.half_screen_width - np.tan(np.deg2rad(v1_angle)) * self.screen_distance))
+		v2_x = int(round(self.half_screen_width - np.tan(np.deg2rad(v2_angle)) * self.screen_distance))
+		sector = self.map.segs.right_sector[seg]
+		ceiling_height = int(self.map.sectors.ceiling_height[sector]) - self.player.z
+		floor_height   = int(self.map.sectors.floor_height[sector])   - self.player.z
+		v1_ceiling_y, v1_floor_y = self.calculate_wall_screen_height(ceiling_height, floor_height, v1, v1_angle)
+		v2_ceiling_y, v2_floor_y = self.calculate_wall_screen_height(ceiling_height, floor_height, v2, v2_angle)
+		colour = self.get_wall_colour(v1, v2)
+		screen.draw_line(v1_x, v1_x, v1_ceiling_y, v1_floor_y, colour=colour, under=True)
+		screen.draw_line(v2_x, v2_x, v2_ceiling_y, v2_floor_y, colour=colour, under=True)
+		screen.draw_line(v1_x, v2_x, v1_ceiling_y, v2_ceiling_y, colour=colour, under=True)
+		screen.draw_line(v1_x, v2_x, v1_floor_y, v2_floor_y, colour=colour, under=True)
+
+	def calculate_wall_screen_height(self, ceiling_height, floor_height, v, v_angle):
+		v_dist = self.player.distance_to_vertex(v)
+		v_screen_dist = self.screen_distance / np.cos(np.deg2rad(v_angle))
+		v_ceiling_y = abs(ceiling_height) * v_screen_dist / v_dist
+		v_floor_y   = abs(floor_height)   * v_screen_dist / v_dist
+		if ceiling_height > 0:
+			v_ceiling_y = self.half_screen_height - v_ceiling_y
+		else:
+			v_ceiling_y += self.half_screen_height
+		if floor_height > 0:
+			v_floor_y = self.half_screen_height - v_floor_y
+		else:
+			v_floor_y += self.half_screen_height
+		return int(round(v_ceiling_y)), int(round(v_floor_y))
+
+
+
+def make_grid_map(size, rng):
+	"""
+	Lumps of a size x size grid of rooms, as wad.MAP_LUMPS names to
+	arrays of records. Rooms have a few floor and ceiling heights, and
+	each room's four walls go clockwise so the room is on their right.
+	Some walls between rooms are doorways: one two sided linedef, with a
+	seg on each side.
+	"""
+	vertexes = [(i * ROOM_SIZE, j * ROOM_SIZE) for j in range(size + 1) for i in range(size + 1)]
+	def vertex(i, j):
+		return j * (size + 1) + i
+
+	linedefs = []
+	sidedefs = []
+	sectors = []
+	segs = []
+	subsectors = []
+
+	# (start vertex, end vertex) of each doorway's linedef -> its id
+	doorways = {}
+	for j in range(size):
+		for i in range(size):
+			room = len(sectors)
+			sectors.append((16 * ((i + j) % 3), 128 + 32 * ((i * 7 + j * 3) % 4), b"FLOOR4_8", b"CEIL3_5", 160, 0, 0))
+			subsectors.append((4, len(segs)))
+			corners = [vertex(i, j), vertex(i, j+1), vertex(i+1, j+1), vertex(i+1, j)]
+
+			# West, north, east then south walls, and if each is a
+			#  doorway to the next room
+			inside = [i > 0, j < size - 1, i < size - 1, j > 0]
+			for k in range(4):
+				start, end = corners[k], corners[(k+1) % 4]
+				sidedefs.append((0, 0, b"-", b"-", b"STARTAN3", room))
+				if (end, start) in doorways:
+					# The room on the other side made the linedef already
+					linedef = doorways.pop((end, start))
+					linedefs[linedef][6] = len(sidedefs) - 1
+					segs.append((start, end, 0, linedef, 1, 0))
+					continue
+
+				segs.append((start, end, 0, len(linedefs), 0, 0))
+				if inside[k] and k in (1, 2) and rng.random() < 0.6:
+					doorways[(start, end)] = len(linedefs)
+					linedefs.append([start, end, 4, 0, 0, len(sidedefs) - 1, NO_SIDEDEF])
+				else:
+					linedefs.append([start, end, 1, 0, 0, len(sidedefs) - 1, NO_SIDEDEF])
+
+	# Splits the rooms in half along the longer side until each half is
+	#  one room. The node's left side is left of or above the split.
+	nodes = []
+	def split(x1, x2, y1, y2):
+		if x2 - x1 == 1 and y2 - y1 == 1:
+			return (y1 * size + x1) | SUBSECTOR_FLAG
+		if x2 - x1 >= y2 - y1:
+			m = (x1 + x2) // 2
+			left, right = split(x1, m, y1, y2), split(m, x2, y1, y2)
+			partition = (m, y1, 0, y2 - y1)
+			right_box, left_box = (y2, y1, m, x2), (y2, y1, x1, m)
+		else:
+			m = (y1 + y2) // 2
+			left, right = split(x1, x2, m, y2), split(x1, x2, y1, m)
+			partition = (x1, m, x2 - x1, 0)
+			right_box, left_box = (m, y1, x1, x2), (y2, m, x1, x2)
+		nodes.append(tuple(v * ROOM_SIZE for v in partition + right_box + left_box) + (right, left))
+		return len(nodes) - 1
+	split(0, size, 0, size)
+
+	middle = size * ROOM_SIZE // 2 + ROOM_SIZE // 2
+	return {
+		"things": np.array([(middle, middle, 0, 1, 7)], THING_DTYPE),
+		"linedefs": np.array([tuple(l) for l in linedefs], LINEDEF_DTYPE),
+		"sidedefs": np.array(sidedefs, SIDEDEF_DTYPE),
+		"vertexes": np.array(vertexes, VERTEX_DTYPE),
+		"segs": np.array(segs, SEG_DTYPE),
+		"subsectors": np.array(subsectors, SUBSECTOR_DTYPE),
+		"nodes": np.array(nodes, NODE_DTYPE),
+		"sectors": np.array(sectors, SECTOR_DTYPE),
+		"reject": np.zeros((size * size) ** 2 // 8 + 1, np.uint8),
+		"blockmap": np.zeros(4, "<i2")}
+
+
+def make_textures(rng):
+	palette = rng.integers(0, 0x1000000, size=256)
+	flats = rng.integers(0, 256, size=(2, 64, 64), dtype=np.uint8)
+	return TextureAtlas(
+		["STARTAN3"], [rng.integers(0, 256, size=(128, 64), dtype=np.uint8)], palette,
+		flat_names=["FLOOR4_8", "CEIL3_5"], flats=flats)
+
+
+class SectorRecorder(Renderer):
+	# Notes the sectors of every wall it draws
+
+	def draw_wall_columns(self, screen, segs, columns):
+		self.seen.update(self.map.segs.right_sector[segs].tolist())
+		super().draw_wall_columns(screen, segs, columns)
+
+
+def make_reject(geometry):
+	# Renders views all around from near the corners of every room, on
+	#  a small screen, and rejects every room that wasn't seen from it
+	count = len(geometry.sectors)
+	rejected = np.ones((count, count), dtype=bool)
+	player = Player(1)
+	game_map = Map(geometry, players=[player])
+	screen = Screen(height=50, width=80, sender=lambda data: None)
+	renderer = SectorRecorder(screen, player, game_map)
+	renderer.CULL_WITH_REJECT = False
+
+	size = int(round(np.sqrt(count)))
+	for room in range(count):
+		renderer.seen = set()
+		middle_x = (room % size) * ROOM_SIZE + ROOM_SIZE // 2
+		middle_y = (room // size) * ROOM_SIZE + ROOM_SIZE // 2
+		for dx, dy in ((1, 1), (-1, 1), (-1, -1), (1, -1)):
+			player.x = middle_x + dx * ROOM_SIZE // 3
+			player.y = middle_y + dy * ROOM_SIZE // 3
+			for angle in (0, 90, 180, -90):
+				player.angle = angle
+				renderer.render_perspective()
+		rejected[room, list(renderer.seen)] = False
+	return np.packbits(rejected, bitorder="little")
+
+
+def run(renderer_class, geometry, frames):
+	# Renders frames as the player walks in a circle, and returns fps
+	player = Player(1)
+	game_map = Map(geometry, players=[player])
+	screen = Screen(height=200, width=320, sender=lambda data: None)
+	renderer = renderer_class(screen, player, game_map)
+	start_x, start_y = player.x, player.y
+
+	t = time.perf_counter()
+	for i in range(frames):
+		player.angle = normalise_angle(i * 7)
+		player.x = start_x + int(ROOM_SIZE / 3 * np.cos(np.deg2rad(i * 7)))
+		player.y = start_y + int(ROOM_SIZE / 3 * np.sin(np.deg2rad(i * 7)))
+		renderer.render_perspective()
+	elapsed = time.perf_counter() - t
+	return frames / elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--frames", type=int, default=50)
+	parser.add_argument("--grid", type=int, default=14)
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(0)
+	lumps = make_grid_map(args.grid, rng)
+	textures = make_textures(rng)
+	geometry = MapGeometry("GRID", lumps, textures)
+	lumps["reject"] = make_reject(geometry)
+	rejecting_geometry = MapGeometry("GRID", lumps, textures)
+
+	print(f"{args.grid}x{args.grid} rooms, {len(geometry.segs)} segs, 320x200 pixels, {args.frames} frames")
+	legacy_fps = run(LegacyRenderer, geometry, args.frames)
+	fps = run(Renderer, geometry, args.frames)
+	reject_fps = run(Renderer, rejecting_geometry, args.frames)
+	print(f"  per seg wireframe:   {legacy_fps:8.1f} fps {1000/legacy_fps:7.2f} ms/frame")
+	print(f"  full scene:          {fps:8.1f} fps {1000/fps:7.2f} ms/frame")
+	print(f"  full scene, REJECT:  {reject_fps:8.1f} fps {1000/reject_fps:7.2f} ms/frame")
+
+
+if __name__ == "__main__":
+	main()
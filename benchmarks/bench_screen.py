@@ -0,0 +1,172 @@
+"""
+Measures how fast Screen.refresh turns a frame into escape sequences,
+against the per-character Python loop it used to use, and how many
+bytes a frame takes in each palette mode.
+
+Four kinds of frame are timed at 160x50 characters:
+	full    every pixel a random colour, the worst case
+	scene   flat ceiling/floor with random wall columns, like Doom
+	sparse  a few small boxes moving around
+	dot     one pixel moving, like the player on the automap
+
+Run from the repository root with
+	python -m benchmarks.bench_screen [--frames 100]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from apps.doom.palette import PALETTES
+from apps.doom.screen import Screen, ansi_move_cursor, ansi_set_full_colour
+
+
+WIDTH = 160
+HEIGHT = 50
+
+
+
+class LegacyScreen(Screen):
+	# The old Screen.refresh, kept for comparison
+	px = "▀"
+
+	def refresh(self):
+		self.pending_lock.acquire()
+		diff_top = (self.pending[0::2] != self.NO_CHANGE) * (self.canvas[0::2] - self.pending[0::2])
+		diff_bot = (self.pending[1::2] != self.NO_CHANGE) * (self.canvas[1::2] - self.pending[1::2])
+		self.canvas[0::2][diff_top != 0] = self.pending[0::2][diff_top != 0]
+		self.canvas[1::2][diff_bot != 0] = self.pending[1::2][diff_bot != 0]
+		self.pending[:] = self.NO_CHANGE
+		self.pending_lock.release()
+
+		diff = (diff_top.astype(np.int64) << 24) + diff_bot
+
+		if np.sum(diff) == 0:
+			return
+
+		data_blocks = []
+		data = ""
+		last_row = None
+		last_col = None
+		last_colours = None
+
+		max_packet_length = 4096
+
+		new_data = ""
+		for row, col in zip(*np.where(diff != 0)):
+			upper_colour = self.pending[2*row, col]
+			if upper_colour == self.NO_CHANGE:
+				upper_colour = self.canvas[2*row, col]
+
+			lower_colour = self.pending[2*row+1, col]
+			if lower_colour == self.NO_CHANGE:
+				lower_colour = self.canvas[2*row+1, col]
+
+			colours = (upper_colour, lower_colour)
+
+			if row == last_row and col-1 == last_col and colours == last_colours:
+				new_data = self.px
+			elif row == last_row and col-1 == last_col:
+				new_data = ansi_set_full_colour(*colours) + self.px
+			elif colours == last_colours:
+				new_data = ansi_move_cursor(col, row) + self.px
+			else:
+				new_data = ansi_move_cursor(col, row) + ansi_set_full_colour(*colours) + self.px
+
+			if len(data) + len(new_data) > max_packet_length:
+				data_blocks.append(data)
+				data = new_data
+			else:
+				data += new_data
+
+			last_row = row
+			last_col = col
+			last_colours = colours
+
+		if data:
+			data_blocks.append(data)
+
+		for d in data_blocks:
+			self.sender(d)
+
+
+
+def make_frames(kind, count, rng):
+	frames = []
+	for i in range(count):
+		frame = np.full((HEIGHT*2, WIDTH), -1, dtype=int) # -1 is no change
+
+		if kind == "full":
+			frame[:] = rng.integers(0, 0x1000000, size=frame.shape)
+
+		elif kind == "scene":
+			frame[:HEIGHT] = 0x444444
+			frame[HEIGHT:] = 0x222222
+			palette = rng.integers(0, 0x1000000, size=8)
+			for x in range(WIDTH):
+				height = rng.integers(10, HEIGHT)
+				frame[HEIGHT-height:HEIGHT+height, x] = palette[x // 20]
+
+		elif kind == "sparse":
+			for _ in range(4):
+				x, y = rng.integers(0, WIDTH-8), rng.integers(0, HEIGHT*2-8)
+				frame[y:y+8, x:x+8] = rng.integers(0, 0x1000000)
+
+		elif kind == "dot":
+			frame[HEIGHT + i % 2, WIDTH//2 + i // 2 % 10] = 0xff0000
+
+		frames.append(frame)
+	return frames
+
+
+def run(screen_class, frames, palette=None):
+	sent = []
+	screen = screen_class(height=HEIGHT, width=WIDTH, sender=sent.append, palette=palette)
+	sent.clear()
+
+	# What each frame draws to, worked out before timing
+	damage = []
+	for frame in frames:
+		ys, xs = np.nonzero(frame != -1)
+		damage.append((xs.min(), xs.max() + 1, ys.min(), ys.max() + 1))
+
+	t = time.perf_counter()
+	for frame, (x1, x2, y1, y2) in zip(frames, damage):
+		batch = screen.new_batch()
+		batch.pending[y1:y2, x1:x2] = frame[y1:y2, x1:x2]
+		batch.damage.add(x1, x2, y1, y2)
+		batch.draw()
+		screen.refresh()
+	elapsed = time.perf_counter() - t
+
+	sent_bytes = sum(len(d.encode("utf-8") if isinstance(d, str) else d) for d in sent)
+	return len(frames) / elapsed, sent_bytes / len(frames)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--frames", type=int, default=100)
+	args = parser.parse_args()
+
+	print(f"{WIDTH}x{HEIGHT} characters, {args.frames} frames")
+	for kind in ("full", "scene", "sparse", "dot"):
+		frames = make_frames(kind, args.frames, np.random.default_rng(0))
+		legacy_fps, legacy_bytes = run(LegacyScreen, frames)
+		fps, frame_bytes = run(Screen, frames)
+		print(f"  {kind:6}  legacy: {legacy_fps:8.1f} fps {legacy_bytes/1024:7.1f} KB/frame"
+			+ f"   vectorised: {fps:8.1f} fps {frame_bytes/1024:7.1f} KB/frame   x{fps/legacy_fps:.1f}")
+
+	print("Palettes")
+	for kind in ("full", "scene", "sparse"):
+		frames = make_frames(kind, args.frames, np.random.default_rng(0))
+		results = []
+		for name, palette in PALETTES.items():
+			palette().quantise(np.zeros(1, dtype=int)) # Build any LUT first
+			fps, frame_bytes = run(Screen, frames, palette())
+			results.append(f"{name:>9}: {fps:7.1f} fps {frame_bytes/1024:6.1f} KB/frame")
+		print(f"  {kind:6}  " + "   ".join(results))
+
+
+if __name__ == "__main__":
+	main()
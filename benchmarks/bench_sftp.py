@@ -0,0 +1,271 @@
+"""
+Measures SFTP throughput through the whole transport stack: packet
+framing, encryption and MACs, channel flow control and the sftp
+subsystem. A real ClientHandler serves one end of a socket pair, and a
+minimal pipelining SFTP client drives the other.
+
+Run from the repository root with
+	python -m benchmarks.bench_sftp [--size-mb 64] [--cipher aes128-ctr]
+"""
+
+import argparse
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import apps.sftp as sftp
+from algorithms import AES128_CTR, HMAC_SHA1
+from authentication import AuthenticationHandler
+from client_handler import ClientHandler
+from config import Config
+from data_types import DataReader, DataWriter
+from message_handler import MessageHandler
+from messages import (
+	SSH_MSG_CHANNEL_OPEN,
+	SSH_MSG_CHANNEL_OPEN_CONFIRMATION,
+	SSH_MSG_CHANNEL_REQUEST,
+	SSH_MSG_CHANNEL_SUCCESS,
+	SSH_MSG_CHANNEL_DATA,
+	SSH_MSG_CHANNEL_WINDOW_ADJUST,
+	SSH_MSG_CHANNEL_CLOSE)
+
+
+# Same values OpenSSH's sftp client uses
+CLIENT_WINDOW_SIZE = 2097152
+CLIENT_MAX_PACKET = 32768
+REQUEST_SIZE = 32768
+MAX_OUTSTANDING = 64
+
+
+def connect(cipher):
+	"""
+	Starts a ClientHandler on one end of a socket pair and returns a
+	MessageHandler for the other end. Key exchange and authentication
+	are skipped; both ends are given the same fixed keys instead.
+	"""
+	server_sock, client_sock = socket.socketpair()
+
+	# The client identification string has to be there before the
+	#  ClientHandler starts
+	client_sock.sendall(b"SSH-2.0-bench\r\n")
+	auth_handler = AuthenticationHandler()
+	auth_handler.is_authenticated = True
+	server = ClientHandler(server_sock, auth_handler)
+
+	# Read the banner and identification string
+	received = b""
+	while b"SSH-" not in received or not received.endswith(b"\r\n"):
+		received += client_sock.recv(1)
+
+	client = MessageHandler(client_sock)
+
+	if cipher == "aes128-ctr":
+		keys = [os.urandom(16) for _ in range(4)]
+		mac_keys = [os.urandom(20) for _ in range(2)]
+		for handler, (send, recv) in ((server.message_handler, (0, 1)), (client, (1, 0))):
+			handler.encryption_algo_s_to_c = AES128_CTR()
+			handler.encryption_algo_s_to_c.initialise(keys[2*send], keys[2*send+1])
+			handler.encryption_algo_c_to_s = AES128_CTR()
+			handler.encryption_algo_c_to_s.initialise(keys[2*recv], keys[2*recv+1])
+			handler.mac_algo_s_to_c = HMAC_SHA1()
+			handler.mac_algo_s_to_c.initialise(mac_keys[send])
+			handler.mac_algo_c_to_s = HMAC_SHA1()
+			handler.mac_algo_c_to_s.initialise(mac_keys[recv])
+
+	t = threading.Thread(target=server.start)
+	t.daemon = True
+	t.start()
+	return client, t
+
+
+
+class BenchSFTPClient:
+
+	def __init__(self, message_handler):
+		self.mh = message_handler
+		self.buffer = b""
+		self.next_request_id = 0
+
+		self.local_consumed = 0
+		self.remote_window = 0
+		self.remote_max_packet = 0
+		self.channel = None
+
+
+	def open(self):
+		self.mh.send(SSH_MSG_CHANNEL_OPEN("session", 0, CLIENT_WINDOW_SIZE, CLIENT_MAX_PACKET))
+		msg = self.mh.recv()
+		assert isinstance(msg, SSH_MSG_CHANNEL_OPEN_CONFIRMATION), msg
+		self.channel = msg.sender_channel
+		self.remote_window = msg.initial_window_size
+		self.remote_max_packet = msg.maximum_packet_size
+
+		self.mh.send(SSH_MSG_CHANNEL_REQUEST(self.channel, "subsystem", True, subsystem_name="sftp"))
+		assert isinstance(self.recv_message(), SSH_MSG_CHANNEL_SUCCESS)
+
+		self.send_packet(struct.pack(">IBI", 5, sftp.SSH_FXP_INIT, sftp.SFTP_VERSION))
+		packet_type, _ = self.recv_packet()
+		assert packet_type == sftp.SSH_FXP_VERSION
+
+
+	def close(self):
+		# Wait for the server to close its side before hanging up
+		self.mh.send(SSH_MSG_CHANNEL_CLOSE(self.channel))
+		while not isinstance(self.recv_message(), SSH_MSG_CHANNEL_CLOSE):
+			pass
+		self.mh.conn.close()
+
+
+	# Channel level
+	def recv_message(self):
+		while True:
+			msg = self.mh.recv()
+			if isinstance(msg, SSH_MSG_CHANNEL_WINDOW_ADJUST):
+				self.remote_window += msg.bytes_to_add
+				continue
+			return msg
+
+
+	def recv_channel_data(self):
+		msg = self.recv_message()
+		self.buffer += msg.data
+
+		# Top the server's window back up, like the server does for us
+		self.local_consumed += len(msg.data)
+		if self.local_consumed >= CLIENT_WINDOW_SIZE // 2:
+			self.mh.send(SSH_MSG_CHANNEL_WINDOW_ADJUST(self.channel, self.local_consumed))
+			self.local_consumed = 0
+
+
+	def send_packet(self, packet):
+		# Split over as many channel messages as it takes, waiting for
+		#  window adjusts when the server's window is used up
+		view = memoryview(packet)
+		while view:
+			while self.remote_window <= 0:
+				self.recv_channel_data()
+			size = min(len(view), self.remote_window, self.remote_max_packet)
+			self.mh.send(SSH_MSG_CHANNEL_DATA(self.channel, bytes(view[:size])))
+			self.remote_window -= size
+			view = view[size:]
+
+
+	# SFTP level
+	def recv_packet(self):
+		while len(self.buffer) < 4 or len(self.buffer) < 4 + struct.unpack(">I", self.buffer[:4])[0]:
+			self.recv_channel_data()
+
+		length = struct.unpack(">I", self.buffer[:4])[0]
+		packet, self.buffer = self.buffer[4:4+length], self.buffer[4+length:]
+		return packet[0], DataReader(packet[1:])
+
+
+	def request(self, packet_type, body):
+		request_id = self.next_request_id
+		self.next_request_id += 1
+		self.send_packet(struct.pack(">IBI", 1 + 4 + len(body), packet_type, request_id) + body)
+		return request_id
+
+
+	def open_file(self, path, pflags):
+		w = DataWriter()
+		w.write_string(path)
+		w.write_uint32(pflags)
+		w.write_uint32(0) # No attributes
+		self.request(sftp.SSH_FXP_OPEN, w.data)
+		packet_type, r = self.recv_packet()
+		assert packet_type == sftp.SSH_FXP_HANDLE, packet_type
+		r.read_uint32()
+		return r.read_string(blob=True)
+
+
+	def close_file(self, handle):
+		w = DataWriter()
+		w.write_string(handle)
+		self.request(sftp.SSH_FXP_CLOSE, w.data)
+		self.recv_packet()
+
+
+	def download(self, path, size):
+		handle = self.open_file(path, sftp.SSH_FXF_READ)
+		offset = 0
+		outstanding = 0
+		received = 0
+		while received < size:
+			# Keep the pipeline full
+			while outstanding < MAX_OUTSTANDING and offset < size:
+				body = struct.pack(">I", len(handle)) + handle + struct.pack(">QI", offset, REQUEST_SIZE)
+				self.request(sftp.SSH_FXP_READ, body)
+				offset += REQUEST_SIZE
+				outstanding += 1
+
+			packet_type, r = self.recv_packet()
+			assert packet_type == sftp.SSH_FXP_DATA, packet_type
+			r.read_uint32()
+			received += len(r.read_string(blob=True))
+			outstanding -= 1
+
+		self.close_file(handle)
+
+
+	def upload(self, path, size):
+		handle = self.open_file(path, sftp.SSH_FXF_WRITE | sftp.SSH_FXF_CREAT | sftp.SSH_FXF_TRUNC)
+		chunk = os.urandom(REQUEST_SIZE)
+		offset = 0
+		outstanding = 0
+		while offset < size or outstanding:
+			while outstanding < MAX_OUTSTANDING and offset < size:
+				body = struct.pack(">I", len(handle)) + handle + struct.pack(">QI", offset, len(chunk)) + chunk
+				self.request(sftp.SSH_FXP_WRITE, body)
+				offset += len(chunk)
+				outstanding += 1
+
+			packet_type, r = self.recv_packet()
+			assert packet_type == sftp.SSH_FXP_STATUS, packet_type
+			outstanding -= 1
+
+		self.close_file(handle)
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--size-mb", type=int, default=64)
+	parser.add_argument("--cipher", choices=["none", "aes128-ctr"], default="aes128-ctr")
+	args = parser.parse_args()
+
+	size = args.size_mb * 1024 * 1024
+
+	with tempfile.TemporaryDirectory() as root:
+		Config.SFTP_ROOT = root
+		with open(os.path.join(root, "source.bin"), "wb") as f:
+			for _ in range(size // (1024 * 1024)):
+				f.write(os.urandom(1024 * 1024))
+
+		client_mh, server_thread = connect(args.cipher)
+		client = BenchSFTPClient(client_mh)
+		client.open()
+
+		t = time.perf_counter()
+		client.download("/source.bin", size)
+		download_time = time.perf_counter() - t
+
+		t = time.perf_counter()
+		client.upload("/upload.bin", size)
+		upload_time = time.perf_counter() - t
+
+		client.close()
+		server_thread.join(timeout=5)
+
+		assert os.path.getsize(os.path.join(root, "upload.bin")) == size
+
+	print(f"cipher={args.cipher}, {args.size_mb} MB, {MAX_OUTSTANDING} x {REQUEST_SIZE // 1024} KB requests in flight")
+	print(f"  download: {args.size_mb / download_time:8.1f} MB/s")
+	print(f"  upload:   {args.size_mb / upload_time:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+	main()
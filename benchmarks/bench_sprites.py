@@ -0,0 +1,101 @@
+"""
+Measures drawing images and sprites. The old Batch.draw_image read the
+PNG from disk and worked out its colours and alpha mask every time it
+was drawn. Images are now decoded once into a SpriteCache, so drawing
+is only the blit.
+
+Also times drawing a sprite scaled down for distance against sampling
+the full size image every draw. The sprite's nearest mip level is
+sampled to each size once and kept, with its edges made opaque or
+transparent, so drawing it is a copy with no blending, and it doesn't
+shimmer as the sprite moves.
+
+Run from the repository root with
+	python -m benchmarks.bench_sprites [--draws 2000]
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from apps.doom.screen import PIXEL_DTYPE, Screen
+from apps.doom.sprites import SpriteCache
+
+
+IMAGE = "apps/doom/Cacodemon_sprite.png"
+
+
+
+def legacy_draw_image(batch, x, y, filename):
+	# The old Batch.draw_image, kept for comparison
+	img = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+	height, width, _ = img.shape
+	img = img.astype(PIXEL_DTYPE)
+	pixels = img[:,:,2]*0x10000 + img[:,:,1]*0x100 + img[:,:,0]
+	l_overlap = -min(0, x)
+	r_overlap = max(0, x + width - batch.width)
+	t_overlap = -min(0, y)
+	b_overlap = max(0, y + height - batch.height)
+	img_x1, img_x2 = l_overlap, width - r_overlap
+	img_y1, img_y2 = t_overlap, height - b_overlap
+	scr_x1, scr_x2 = x + l_overlap, x + width - r_overlap
+	scr_y1, scr_y2 = y + t_overlap, y + height - b_overlap
+	visible = img[img_y1:img_y2,img_x1:img_x2,3] > 0
+	batch.pending[scr_y1:scr_y2,scr_x1:scr_x2][visible] = pixels[img_y1:img_y2,img_x1:img_x2][visible]
+	batch.damage.add(scr_x1, scr_x2, scr_y1, scr_y2)
+
+
+def legacy_draw_scaled(batch, x, y, sprite, scale):
+	# Picks the nearest pixel of the full size image for each screen
+	#  pixel, every draw, as drawing a sprite small would without mip
+	#  levels
+	pixels, alpha = sprite.levels[0]
+	xs = np.arange(max(x, 0), min(x + int(np.ceil(sprite.width * scale)), batch.width))
+	ys = np.arange(max(y, 0), min(y + int(np.ceil(sprite.height * scale)), batch.height))
+	u = np.minimum(((xs - x + 0.5) / scale).astype(np.int64), sprite.width - 1)
+	v = np.minimum(((ys - y + 0.5) / scale).astype(np.int64), sprite.height - 1)
+	colours = pixels[v[:, None], u]
+	under = batch.pending[ys[:, None], xs]
+	batch.pending[ys[:, None], xs] = np.where(alpha[v[:, None], u] >= 128, colours, under)
+	batch.damage.add(int(xs[0]), int(xs[-1]) + 1, int(ys[0]), int(ys[-1]) + 1)
+
+
+def run(draw, batch, draws):
+	# Draws at a few places, and returns the time per draw
+	t = time.perf_counter()
+	for i in range(draws):
+		draw(i * 7 % 200, i * 3 % 80)
+		if i % 50 == 49:
+			batch.clear()
+	return (time.perf_counter() - t) / draws
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--draws", type=int, default=2000)
+	args = parser.parse_args()
+
+	screen = Screen(height=100, width=320, sender=lambda data: None)
+	batch = screen.new_batch()
+	cache = SpriteCache()
+	sprite = cache.image(IMAGE)
+
+	legacy_time = run(lambda x, y: legacy_draw_image(batch, x, y, IMAGE), batch, args.draws)
+	cached_time = run(lambda x, y: batch.draw_image(x, y, IMAGE), batch, args.draws)
+	print(f"{args.draws} draws of a {sprite.width}x{sprite.height} image")
+	print(
+		f"  read every draw: {legacy_time*1e6:7.1f} us/draw"
+		+ f"   cached: {cached_time*1e6:7.1f} us/draw   x{legacy_time/cached_time:.1f}")
+
+	# A sprite a quarter size, as if far away
+	legacy_time = run(lambda x, y: legacy_draw_scaled(batch, x, y, sprite, 0.25), batch, args.draws)
+	mip_time = run(lambda x, y: batch.draw_sprite(x, y, sprite, scale=0.25), batch, args.draws)
+	print(
+		f"  quarter size, sampled every draw: {legacy_time*1e6:7.1f} us/draw"
+		+ f"   from mip level: {mip_time*1e6:7.1f} us/draw   x{legacy_time/mip_time:.1f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,157 @@
+"""
+Measures loading a map: decoding every lump with one np.frombuffer call
+into column arrays, against the old way of unpacking each field of each
+record with struct and wrapping every record in two Python objects.
+Also measures a new session's load once the map is in the shared
+MapCache, which only copies the per-session sectors.
+
+The WAD is made up, with E1M1's record counts and random contents, as
+the real doom.wad isn't in the repository.
+
+Run from the repository root with
+	python -m benchmarks.bench_wad [--loads 20]
+"""
+
+import argparse
+import os
+import struct
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from apps.doom.blockmap import pack_blockmap
+from apps.doom.map import SUBSECTOR_FLAG
+from apps.doom.map_cache import MapCache
+from apps.doom.player import Player
+from apps.doom.wad import MAP_LUMPS, WAD, pack_wad
+
+
+# Records per lump in E1M1
+COUNTS = {
+	"things": 138, "linedefs": 475, "sidedefs": 648, "vertexes": 467,
+	"segs": 732, "subsectors": 237, "nodes": 236, "sectors": 85,
+	"reject": 904, "blockmap": 2000}
+
+STRUCT_CODES = {"<i2": "h", "<u2": "H", "|u1": "B"}
+
+
+
+class LegacyObject:
+	# Stands in for the old WAD_* and Map_* classes
+	def __init__(self, **fields):
+		self.__dict__.update(fields)
+
+
+def legacy_load(wad):
+	# The old loaders: every field sliced out and unpacked on its own,
+	#  into an object per record, which the Map then wrapped again
+	objects = {}
+	lumps = wad.get_map_lumps("E1M1")
+	for name, dtype in MAP_LUMPS:
+		if dtype.names is None:
+			continue
+		data = lumps[name].tobytes()
+		records = []
+		for i in range(0, len(data), dtype.itemsize):
+			fields = {}
+			for field in dtype.names:
+				field_dtype, offset = dtype.fields[field][:2]
+				if field_dtype.kind == "S":
+					fields[field] = data[i+offset:i+offset+field_dtype.itemsize]
+				else:
+					b = data[i+offset:i+offset+field_dtype.itemsize]
+					fields[field] = struct.unpack(STRUCT_CODES[field_dtype.str], b)[0]
+			records.append(LegacyObject(**fields))
+		objects[name] = [LegacyObject(**record.__dict__) for record in records]
+	return objects
+
+
+def random_node_children(rng, nodes, subsectors):
+	# Each child is a random subsector, or half the time a random node
+	#  before its parent
+	children = rng.integers(0, subsectors, size=(2, nodes)) | SUBSECTOR_FLAG
+	for node in range(1, nodes):
+		for side in range(2):
+			if rng.random() < 0.5:
+				children[side, node] = rng.integers(0, node)
+	return children
+
+
+def make_wad(rng):
+	lumps = [("E1M1", b"")]
+	for name, dtype in MAP_LUMPS:
+		count = COUNTS[name]
+		records = np.zeros(count, dtype)
+		for field in (dtype.names or []):
+			if dtype[field].kind in "iu":
+				records[field] = rng.integers(0, 200, size=count)
+		if dtype.names is None:
+			records = rng.integers(0, 200, size=count).astype(dtype)
+		if name == "blockmap":
+			# 20x20 blocks of two random linedefs, about E1M1's size
+			lists = rng.integers(0, COUNTS["linedefs"], size=(400, 2)).tolist()
+			records = pack_blockmap(0, 0, 20, 20, lists)
+		if name == "sidedefs":
+			records["sector_id"] = rng.integers(0, COUNTS["sectors"], size=count)
+		if name == "nodes":
+			# A BSP tree, with every node's children before it
+			records["r_child"], records["l_child"] = random_node_children(rng, count, COUNTS["subsectors"])
+		lumps.append((name.upper(), records))
+	return pack_wad(lumps, "IWAD")
+
+
+def measure(load, loads):
+	tracemalloc.start()
+	result = load()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	t = time.perf_counter()
+	for _ in range(loads):
+		result = load()
+	elapsed = (time.perf_counter() - t) / loads
+	return elapsed, peak
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--loads", type=int, default=20)
+	args = parser.parse_args()
+
+	fd, path = tempfile.mkstemp(suffix=".wad")
+	with os.fdopen(fd, "wb") as f:
+		f.write(make_wad(np.random.default_rng(0)))
+
+	try:
+		def load():
+			wad = WAD(path)
+			wad.load()
+			return wad.load_map("E1M1", players=[Player(1)])
+
+		def load_legacy():
+			wad = WAD(path)
+			wad.load()
+			return legacy_load(wad)
+
+		cache = MapCache()
+		def load_cached():
+			return cache.load_map(path, "E1M1", players=[Player(1)])
+
+		legacy_time, legacy_memory = measure(load_legacy, args.loads)
+		new_time, new_memory = measure(load, args.loads)
+		load_cached()
+		cached_time, cached_memory = measure(load_cached, args.loads)
+		cache.clear()
+	finally:
+		os.remove(path)
+
+	print(f"E1M1 sized map, {args.loads} loads")
+	print(f"  per record: {legacy_time*1000:7.2f} ms {legacy_memory/1024:7.1f} KB peak")
+	print(f"  columns:    {new_time*1000:7.2f} ms {new_memory/1024:7.1f} KB peak   x{legacy_time/new_time:.1f}")
+	print(f"  cached:     {cached_time*1000:7.2f} ms {cached_memory/1024:7.1f} KB peak   x{legacy_time/cached_time:.1f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,26 +1,35 @@
 
+import threading
+from collections import deque
 from itertools import count, filterfalse
 
 from apps.shells import TestShell
 from apps.chat import BasicChatApp
+from apps.commands import COMMANDS, ExecApp
 from apps.doom import DoomGame
+from apps.sftp import SFTPServer
 
 from data_types import DataReader
+from event_loop import EventLoop
 from messages import (
 	SSH_MSG_CHANNEL_OPEN_CONFIRMATION,
 	SSH_MSG_CHANNEL_OPEN_FAILURE,
 	SSH_MSG_CHANNEL_SUCCESS,
 	SSH_MSG_CHANNEL_FAILURE,
+	SSH_MSG_CHANNEL_WINDOW_ADJUST,
 	SSH_MSG_CHANNEL_DATA,
+	SSH_MSG_CHANNEL_EXTENDED_DATA,
 	SSH_MSG_CHANNEL_EOF,
-	SSH_MSG_CHANNEL_CLOSE)
+	SSH_MSG_CHANNEL_CLOSE,
+	SSH_MSG_CHANNEL_REQUEST)
 
 
 
 APPS = {
 	# "shell": TestShell,
 	"shell": DoomGame,
-	"chat": None
+	"chat": None,
+	"sftp": SFTPServer
 }
 
 
@@ -34,7 +43,7 @@ class ChannelHandler:
 
 	# TODO: Find a way to set the server-side values for these
 	INITIAL_WINDOW_SIZE = 1048576
-	MAXIMUM_PACKET_SIZE = 16384
+	MAXIMUM_PACKET_SIZE = 32768
 
 
 	def __init__(self):
@@ -149,6 +158,17 @@ class ChannelHandler:
 		return None
 
 
+	def handle_CHANNEL_WINDOW_ADJUST(self, msg):
+		# Get the channel. If there is no existing channel for the
+		#  given recipient channel, then end here
+		channel = self.channels.get(msg.recipient_channel)
+		if channel is None:
+			return
+
+		# Let the channel send anything it was holding back
+		channel.handle_CHANNEL_WINDOW_ADJUST(msg.bytes_to_add)
+
+
 	def handle_CHANNEL_DATA(self, msg):
 		# Get the channel. If there is no existing channel for the
 		#  given recipient channel, then end here
@@ -160,7 +180,6 @@ class ChannelHandler:
 		channel.handle_CHANNEL_DATA(msg)
 
 
-	# TODO: Implement
 	def handle_CHANNEL_EXTENDED_DATA(self, msg):
 		# Get the channel. If there is no existing channel for the
 		#  given recipient channel, then end here
@@ -168,7 +187,8 @@ class ChannelHandler:
 		if channel is None:
 			return
 
-		print("TODO: Implement handle_CHANNEL_EXTENDED_DATA")
+		# Pass the request on to the channel to pass to it's app
+		channel.handle_CHANNEL_EXTENDED_DATA(msg)
 
 
 	def handle_CHANNEL_CLOSE(self, msg):
@@ -197,6 +217,14 @@ class ChannelHandler:
 
 # SSH-CONNECT 6.1
 class SessionChannel:
+
+	# Queued in place of a data type code for messages, like EOF, that
+	#  have to go out after the data before them but use no window
+	MESSAGE = "message"
+
+	# How soon the event loop tries again to send what a slow client
+	#  had no room for
+	SEND_RETRY_INTERVAL = 0.01
 	
 	def __init__(self,
 		client_handler,
@@ -214,6 +242,29 @@ class SessionChannel:
 		#  data can be sent to the client asynchronously
 		self.message_handler = message_handler
 
+		# SSH-CONNECT 5.2. Flow control. remote_window is how many bytes
+		#  of data the client will still accept from us. Anything sent
+		#  past that waits in the outbound queue until the client sends
+		#  a window adjust. Normal and extended data share the window,
+		#  so both go through the same queue as (data_type_code, data),
+		#  with a code of None for normal data. Messages that have to
+		#  follow the data, like exit-status and CLOSE, are queued too,
+		#  with a code of MESSAGE. local_consumed is how
+		#  much of our own window the client has used since we last
+		#  topped it up.
+		# The queue is only changed holding queue_lock, which is never
+		#  held while sending, so queueing never waits on the client.
+		#  outbound_lock is held while sending, so only one thread sends
+		#  at a time and packets keep their order.
+		self.remote_window = initial_window_size
+		self.outbound = deque()
+		self.outbound_bytes = 0
+		self.queue_lock = threading.Lock()
+		self.outbound_lock = threading.Lock()
+		self.send_retry = None
+		self.local_window_size = client_handler.INITIAL_WINDOW_SIZE
+		self.local_consumed = 0
+
 		# An empty pty config. This contains any special characters
 		#  or input/output config
 		self.config = PseudoTerminalConfig()
@@ -278,7 +329,7 @@ class SessionChannel:
 			app_class = APPS.get("shell")
 			if app_class is None:
 				return SSH_MSG_CHANNEL_FAILURE(self.client_channel_id)
-			return self.start_app(app_class)
+			return self.start_app(app_class, msg.want_reply)
 
 		# SSH-CONNECT 6.5.
 		elif request_type == "exec":
@@ -287,11 +338,11 @@ class SessionChannel:
 			# This message will request that the server start the
 			#  execution of the given command. The 'command' string may
 			#  contain a path. Normal precautions MUST be taken to
-			#  prevent the execution of unauthorized commands.
-			
-			# We don't handle this currently
-			print(f" [!] Client requested exec request. Command={command}")
-			return SSH_MSG_CHANNEL_FAILURE(self.client_channel_id)
+			#  prevent the execution of unauthorized commands. Only
+			#  commands in the registry can be run.
+			if COMMANDS.lookup(command) is None:
+				return SSH_MSG_CHANNEL_FAILURE(self.client_channel_id)
+			return self.start_app(ExecApp, msg.want_reply, command)
 
 		# SSH-CONNECT 6.5.
 		elif request_type == "subsystem":
@@ -311,7 +362,7 @@ class SessionChannel:
 			if app_class is None:
 				print(f" [!] Client requested 'subsystem:' Sybsystem name={subsystem_name}")
 				return SSH_MSG_CHANNEL_FAILURE(self.client_channel_id)
-			return self.start_app(app_class)
+			return self.start_app(app_class, msg.want_reply)
 
 		# SSH-CONNECT 6.7.
 		elif request_type == "window-change":
@@ -362,29 +413,214 @@ class SessionChannel:
 	# 	self.app.start()
 
 
-	def start_app(self, app_class):
+	def start_app(self, app_class, want_reply, *args):
 		if self.app_has_been_started:
 			return SSH_MSG_CHANNEL_FAILURE(self.client_channel_id)
 
+		# The client must see the reply before anything the app sends,
+		#  as an app can send data, or even close the channel, as soon
+		#  as it is created. So the success is sent here, and nothing is
+		#  returned for the client handler to send.
+		if want_reply:
+			self.message_handler.send(SSH_MSG_CHANNEL_SUCCESS(self.client_channel_id))
+
 		self.app_has_been_started = True
-		self.app = app_class(self)
+		self.app = app_class(self, *args)
 		self.app.start()
 
-		return SSH_MSG_CHANNEL_SUCCESS(self.client_channel_id)
+		return None
 
 
 	# Passes CHANNEL_DATA down from client handler to app
 	def handle_CHANNEL_DATA(self, msg):
 		if self.app is not None:
 			self.app.handle_CHANNEL_DATA(msg)
+		self._consume_local_window(len(msg.data))
+
+
+	# Passes CHANNEL_EXTENDED_DATA down from client handler to app
+	def handle_CHANNEL_EXTENDED_DATA(self, msg):
+		if self.app is not None:
+			self.app.handle_CHANNEL_EXTENDED_DATA(msg)
+		self._consume_local_window(len(msg.data))
+
+
+	def _consume_local_window(self, size):
+		# Once the client has used up half of the window we gave it,
+		#  top it back up so it never has to stall waiting for us
+		self.local_consumed += size
+		if self.local_consumed >= self.local_window_size // 2:
+			adjust = SSH_MSG_CHANNEL_WINDOW_ADJUST(self.client_channel_id, self.local_consumed)
+			self.message_handler.send(adjust)
+			self.local_consumed = 0
+
+
+	def handle_CHANNEL_WINDOW_ADJUST(self, bytes_to_add):
+		with self.outbound_lock:
+			self.remote_window += bytes_to_add
+		self._flush()
 
 
 	# Passes CHANNEL_DATA up from app to client handler
 	# TODO: Have this method call something in parent rather than
 	#  directly use the message_handler
 	def send_CHANNEL_DATA(self, data):
-		msg = SSH_MSG_CHANNEL_DATA(self.client_channel_id, data)
-		self.message_handler.send(msg)
+		self._queue_outbound(None, data)
+
+
+	# Passes CHANNEL_EXTENDED_DATA up from app to client handler
+	def send_CHANNEL_EXTENDED_DATA(self, data, data_type_code=SSH_MSG_CHANNEL_EXTENDED_DATA.STDERR):
+		self._queue_outbound(data_type_code, data)
+
+
+	def _queue_outbound(self, data_type_code, data):
+		# Window sizes are counted in bytes
+		if isinstance(data, str):
+			data = data.encode("utf-8")
+		if not data:
+			return
+
+		with self.queue_lock:
+			self.outbound.append((data_type_code, data))
+			self.outbound_bytes += len(data)
+		self._flush()
+
+
+	def _queue_message(self, msg):
+		# Sends msg once the data queued before it has been sent
+		with self.queue_lock:
+			self.outbound.append((self.MESSAGE, msg))
+		self._flush()
+
+
+	def _flush(self):
+		# Sends what can be sent of the queue. The event loop is shared
+		#  by every session, so on its thread this never waits for a
+		#  slow or dead client: what the socket has no room for, or
+		#  can't be sent while another thread is sending, is tried again
+		#  shortly. Other threads are the session's own, and wait.
+		if not EventLoop.in_shared_loop_thread():
+			with self.outbound_lock:
+				self._flush_outbound()
+		else:
+			done = False
+			if self.outbound_lock.acquire(blocking=False):
+				try:
+					done = self._flush_outbound(blocking=False)
+				finally:
+					self.outbound_lock.release()
+			if not done and self.send_retry is None:
+				self.send_retry = EventLoop.shared().call_later(self.SEND_RETRY_INTERVAL, self._retry_flush)
+
+		app = self.app
+		if app is not None and self.outbound_bytes == 0:
+			app.handle_outbound_drained()
+
+
+	def _retry_flush(self):
+		self.send_retry = None
+		self._flush()
+
+
+	def outbound_backlog(self):
+		"""
+		How far behind the client is in taking our data, as (bytes queued
+		waiting for window space, bytes of window left, bytes sent but
+		still in the socket's buffers). Read without taking outbound_lock,
+		as that is held while a send is blocked on a slow client.
+		"""
+		return self.outbound_bytes, self.remote_window, self.message_handler.unsent_bytes()
+
+
+	# Sends as much queued data as the client's window allows. Small
+	#  writes that had to wait are batched together into as few packets
+	#  as possible, as long as they are the same type of data, so that
+	#  stdout and stderr still arrive in the order they were written.
+	#  Queued messages are sent when they reach the front, window or
+	#  not. Must be called with outbound_lock held. Without blocking,
+	#  it stops when the socket has no room, and returns False if
+	#  there's more that could have been sent.
+	def _flush_outbound(self, blocking=True):
+		while True:
+			if not blocking and not self.message_handler.writable():
+				return self.message_handler.closed or not self._sendable()
+			with self.queue_lock:
+				taken = self._take_outbound()
+			if taken is None:
+				return True
+			msg, entry, size = taken
+
+			sent = self.message_handler.send(msg, blocking=blocking)
+			if sent is None and not blocking and not self.message_handler.closed:
+				# Another thread is sending. Put it back for next time.
+				with self.queue_lock:
+					self.outbound.appendleft(entry)
+				return False
+			self.remote_window -= size
+			with self.queue_lock:
+				self.outbound_bytes -= size
+
+
+	def _sendable(self):
+		# If anything queued could be sent now
+		return bool(self.outbound) and (self.outbound[0][0] == self.MESSAGE or self.remote_window > 0)
+
+
+	def _take_outbound(self):
+		# Takes the next message to send off the front of the queue, as
+		#  (msg, what to put back if it can't be sent, window used), or
+		#  None if nothing can be sent. Must be called with queue_lock
+		#  held.
+		if not self._sendable():
+			return None
+		data_type_code = self.outbound[0][0]
+		if data_type_code == self.MESSAGE:
+			entry = self.outbound.popleft()
+			return entry[1], entry, 0
+		limit = min(self.remote_window, self.maximum_packet_size)
+
+		# Take whole chunks while they fit, then split the one that
+		#  doesn't
+		chunks = []
+		size = 0
+		while self.outbound and size < limit and self.outbound[0][0] == data_type_code:
+			_, chunk = self.outbound.popleft()
+			if size + len(chunk) > limit:
+				split = limit - size
+				self.outbound.appendleft((data_type_code, chunk[split:]))
+				chunk = chunk[:split]
+			chunks.append(chunk)
+			size += len(chunk)
+
+		data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+		if data_type_code is None:
+			msg = SSH_MSG_CHANNEL_DATA(self.client_channel_id, data)
+		else:
+			msg = SSH_MSG_CHANNEL_EXTENDED_DATA(self.client_channel_id, data_type_code, data)
+		return msg, (data_type_code, data), size
+
+
+	# SSH-CONNECT 6.10.
+	def send_exit_status(self, exit_status):
+		msg = SSH_MSG_CHANNEL_REQUEST(
+			recipient_channel=self.client_channel_id,
+			request_type="exit-status",
+			want_reply=False,
+			exit_status=exit_status)
+		self._queue_message(msg)
+
+
+	# SSH-CONNECT 6.10.
+	def send_exit_signal(self, signal_name, core_dumped=False, error_message=""):
+		msg = SSH_MSG_CHANNEL_REQUEST(
+			recipient_channel=self.client_channel_id,
+			request_type="exit-signal",
+			want_reply=False,
+			signal_name=signal_name,
+			core_dumped=core_dumped,
+			error_message=error_message,
+			language_tag="")
+		self._queue_message(msg)
 
 
 	# Receives client's close channel
@@ -394,6 +630,14 @@ class SessionChannel:
 			self.app.stop()
 			self.app = None
 
+		# The client won't take any more data, or give us the window to
+		#  send it, so what is still queued is dropped, to not hold up
+		#  the messages queued after it
+		with self.queue_lock:
+			self.outbound = deque(entry for entry in self.outbound if entry[0] == self.MESSAGE)
+			self.outbound_bytes = 0
+		self._flush()
+
 		# If we have not sent our own CHANNEL_CLOSE, then we must
 		#  respond with our own. Otherwise we have received a response
 		#  to our own CHANNEL_CLOSE and can do nothing.
@@ -411,9 +655,10 @@ class SessionChannel:
 		#  accord. Also, this will likely be called from a thread which
 		#  could cause issues when a thread is requested to join from
 		#  within itself.
+		# Queued behind any data still waiting for window space
 		msg = SSH_MSG_CHANNEL_CLOSE(self.client_channel_id)
-		self.message_handler.send(msg)
 		self.sent_channel_close = True
+		self._queue_message(msg)
 
 
 	def handle_CHANNEL_EOF(self):
@@ -422,13 +667,20 @@ class SessionChannel:
 		#  this message, and more data may still be sent in the other
 		#  direction. This message does not consume window space and
 		#  can be sent even if no window space is available.
+		# The app decides what to do, as a command may still have
+		#  output to send after its input has ended.
+		if self.app is not None:
+			self.app.handle_CHANNEL_EOF()
+			return
+
 		self.send_CHANNEL_EOF()
 		self.send_CHANNEL_CLOSE()
 
 
 	def send_CHANNEL_EOF(self):
+		# Queued behind any data still waiting for window space
 		msg = SSH_MSG_CHANNEL_EOF(self.client_channel_id)
-		self.message_handler.send(msg)
+		self._queue_message(msg)
 
 
 
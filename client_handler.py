@@ -6,6 +6,7 @@ from algorithms import AlgorithmHandler, NoMatchingAlgorithm
 from channels import ChannelHandler
 from config import Config
 from data_types import DataWriter
+from keepalive import KeepaliveMonitor
 from message_handler import MessageHandler
 
 
@@ -22,6 +23,10 @@ def print_terminal_environment(ch):
 
 class ClientHandler:
 
+	# How long disconnect() waits for another thread to finish sending
+	DISCONNECT_SEND_TIMEOUT = 1 # Seconds
+
+
 	def __init__(self, conn, auth_handler):
 		self.auth_handler = auth_handler
 
@@ -35,6 +40,10 @@ class ClientHandler:
 		# Handles channels
 		self.channel_handler = ChannelHandler()
 
+		# Set once the server has asked this client to finish up. No new
+		#  channels can be opened after that.
+		self.shutting_down = False
+
 		# Exchange our protocol versions
 		self.initialise_connection(conn)
 		
@@ -53,9 +62,13 @@ class ClientHandler:
 		# Start our message handler to send/receive messages
 		self.message_handler = MessageHandler(conn)
 
+		# Checks the client is still there when it goes quiet
+		self.keepalive = KeepaliveMonitor(self)
+
 
 	def start(self):
 		self.running = True
+		self.keepalive.start()
 		while self.running:
 			msg = self.message_handler.recv()
 
@@ -65,17 +78,51 @@ class ClientHandler:
 				self.stop()
 				return
 
+			self.keepalive.activity()
 			self.handle_message(msg)
 
 
 	def stop(self):
 		# End the running loop
 		self.running = False
+		self.keepalive.stop()
 
 		# Also close any currently running channels
 		self.channel_handler.close_all_channels()
 
 
+	def notify_shutdown(self, message):
+		# The server is stopping. Clients with nothing running are
+		#  disconnected straight away. Otherwise, each app is told so it
+		#  can let the user know, and the client gets some time to
+		#  finish up before it is disconnected.
+		self.shutting_down = True
+
+		apps = [channel.app for channel in list(self.channel_handler.channels.values()) if channel.app is not None]
+		if not apps:
+			self.disconnect(message)
+			return
+
+		for app in apps:
+			app.handle_server_shutdown(message)
+
+
+	def disconnect(self, description, reason=messages.SSH_MSG_DISCONNECT.BY_APPLICATION):
+		# Can be called from any thread. Tells the client why it's being
+		#  disconnected if that can be done without waiting on it, then
+		#  drops the connection.
+		if self.message_handler.writable():
+			self.message_handler.send(reason(description), timeout=self.DISCONNECT_SEND_TIMEOUT)
+		self.connection_lost()
+
+
+	def connection_lost(self):
+		# Called from other threads when the client is found to be gone.
+		#  Shutting the socket down makes the recv in start() return, so
+		#  stop() runs on this handler's own thread as usual.
+		self.message_handler.shutdown()
+
+
 	def handle_message(self, msg):
 		# SSH-TRANS
 		if   isinstance(msg, messages.SSH_MSG_DISCONNECT):      self.handle_SSH_MSG_DISCONNECT(msg)
@@ -134,6 +181,11 @@ class ClientHandler:
 
 
 	def handle_SSH_MSG_UNIMPLEMENTED(self, msg): # SSH-TRANS 11.4.
+		# Clients that don't know keepalive@openssh.com reply to it with
+		#  this, which is still a reply.
+		if self.keepalive.is_probe_reply(msg.packet_sequence_number):
+			return
+
 		# If we ever get this as a response to a message, we disconnect
 		#  as otherwise it's hard to try pick up where we were.
 		print(f" [!] SSH_MSG_UNIMPLEMENTED received for seq:{msg.packet_sequence_number}")
@@ -241,20 +293,32 @@ class ClientHandler:
 		return
 
 
-	# TODO: Implement
 	def handle_SSH_MSG_GLOBAL_REQUEST(self, msg): # SSH-CONNECT 4.
-		print("TODO: Handle SSH_MSG_GLOBAL_REQUEST")
+		# OpenSSH clients send keepalive@openssh.com when
+		#  ServerAliveInterval is set. It only needs a reply of some
+		#  kind, so it's treated like any other request we know of.
+		if msg.request_name == KeepaliveMonitor.PROBE_REQUEST_NAME:
+			resp = messages.SSH_MSG_REQUEST_SUCCESS()
+		else:
+			# No port forwarding etc. "If the recipient does not
+			#  recognize or support the request, it simply responds
+			#  with SSH_MSG_REQUEST_FAILURE."
+			print(f" [*] Unsupported global request '{msg.request_name}'")
+			resp = messages.SSH_MSG_REQUEST_FAILURE()
+
+		if msg.want_reply:
+			self.message_handler.send(resp)
 
 
 	def handle_SSH_MSG_REQUEST_SUCCESS(self, msg): # SSH-CONNECT 4.
-		# We should never receive this as a server, so ignore
-		print(" [?} Received a SSH_MSG_REQUEST_SUCCESS?")
+		# Only sent in reply to our keepalive probes, and any message
+		#  resets the keepalive already
 		return
 
 
 	def handle_SSH_MSG_REQUEST_FAILURE(self, msg): # SSH-CONNECT 4.
-		# We should never receive this as a server, so ignore
-		print(" [?} Received a SSH_MSG_REQUEST_FAILURE?")
+		# Only sent in reply to our keepalive probes. Clients refuse
+		#  requests they don't know, but it still shows they're alive.
 		return
 
 
@@ -263,7 +327,13 @@ class ClientHandler:
 		if not self.auth_handler.is_authenticated:
 			error_msg = "Cannot open a channel if not logged in"
 			print(" [*] Client tried to open a channel when not logged in")
-			resp = messages.SSH_MSG_CHANNEL_OPEN_FAILURE.ADMINISTRATIVELY_PROHIBITED(client_channel, error_msg)
+			resp = messages.SSH_MSG_CHANNEL_OPEN_FAILURE.ADMINISTRATIVELY_PROHIBITED(msg.sender_channel, error_msg)
+			self.message_handler.send(resp)
+
+		# Nothing new can be started while the server is shutting down
+		elif self.shutting_down:
+			error_msg = "Server is shutting down"
+			resp = messages.SSH_MSG_CHANNEL_OPEN_FAILURE.ADMINISTRATIVELY_PROHIBITED(msg.sender_channel, error_msg)
 			self.message_handler.send(resp)
 
 		else:
@@ -286,9 +356,9 @@ class ClientHandler:
 		return
 
 
-	# TODO: Implement
 	def handle_SSH_MSG_CHANNEL_WINDOW_ADJUST(self, msg): # SSH-CONNECT 5.2.
-		print("TODO: Handle SSH_MSG_CHANNEL_WINDOW_ADJUST")
+		# Pass on to channel
+		self.channel_handler.handle_CHANNEL_WINDOW_ADJUST(msg)
 
 
 	def handle_SSH_MSG_CHANNEL_DATA(self, msg): # SSH-CONNECT 5.2.
@@ -19,3 +19,55 @@ class Config:
 	#  game to guess the password.
 	USERAUTH_BANNER = f"Bro the password its '{PASSWORD}'\n"
 
+	# Commands that can be run with 'ssh host command' besides the
+	#  built-in ones in apps/commands.py. Maps the command name to the
+	#  argv that is run (no shell is involved), with any arguments from
+	#  the client added to the end. Off unless explicitly allowed.
+	EXEC_ALLOW_SUBPROCESSES = False
+	EXEC_SUBPROCESS_COMMANDS = {
+		# "uptime": ["uptime"],
+	}
+
+	# Directory served by the sftp subsystem. Clients see it as "/".
+	SFTP_ROOT = "sftp_root"
+
+	# Sends a keepalive@openssh.com request when nothing has been heard
+	#  from a client for KEEPALIVE_INTERVAL seconds, and disconnects it
+	#  after KEEPALIVE_COUNT_MAX of them go unanswered. 0 turns it off.
+	KEEPALIVE_INTERVAL = 15
+	KEEPALIVE_COUNT_MAX = 3
+
+	# TCP keepalive, for connections that die before logging in or
+	#  without any SSH traffic. Seconds idle before the first probe, the
+	#  seconds between probes, and how many can fail.
+	TCP_KEEPALIVE_IDLE = 60
+	TCP_KEEPALIVE_INTERVAL = 10
+	TCP_KEEPALIVE_COUNT = 3
+
+	# When the server is told to stop (SIGTERM or SIGINT), clients get
+	#  this message and SHUTDOWN_DEADLINE seconds to finish what they're
+	#  doing before they are disconnected. A second signal disconnects
+	#  everyone straight away.
+	SHUTDOWN_MESSAGE = "Server is shutting down"
+	SHUTDOWN_DEADLINE = 30
+
+	# Colours used by the Doom screen: "truecolor", "256" or "16". None
+	#  picks based on the TERM/COLORTERM the client sends.
+	DOOM_PALETTE = None
+
+	# How the Doom screen draws pixels: "half" (1x2 pixels per
+	#  character), "quadrant" (2x2) or "braille" (2x4, best for thin
+	#  lines). DOOM_CELLS is for the textured view, and
+	#  DOOM_AUTOMAP_CELLS for the automap, which has its own screen
+	#  when they differ.
+	DOOM_CELLS = "half"
+	DOOM_AUTOMAP_CELLS = "braille"
+
+	# The WAD the Doom game is loaded from, and how many of its maps are
+	#  kept loaded to be shared by new sessions
+	DOOM_WAD = "apps/doom/doom.wad"
+	DOOM_MAP_CACHE_SIZE = 4
+
+	# Sessions playing the same map share one world, which is moved on
+	#  this many times a second, applying everyone's inputs
+	DOOM_TICS_PER_SECOND = 35
@@ -0,0 +1,229 @@
+
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+
+class Timer:
+	"""
+	Handle returned by EventLoop.call_later. Cancelling a timer stops its
+	callback from being run, but it stays in the timer heap until it is
+	due and then gets thrown away.
+	"""
+	def __init__(self, when, callback, args):
+		self.when = when
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+
+class EventLoop:
+	"""
+	A single background thread that waits on file descriptors and timers
+	for every client, so that things like subprocess pipes and periodic
+	jobs don't need a thread each.
+
+	Callbacks are always run on the loop thread. Registering readers and
+	writers from any other thread is safe, as the actual selector changes
+	are handed over to the loop thread with call_soon.
+	"""
+
+	# The loop shared by every client handler in this process
+	_shared = None
+	_shared_lock = threading.Lock()
+
+
+	@classmethod
+	def shared(cls):
+		with cls._shared_lock:
+			if cls._shared is None:
+				cls._shared = cls()
+				cls._shared.start()
+			return cls._shared
+
+
+	@classmethod
+	def in_shared_loop_thread(cls):
+		# If this is the shared loop's thread, without starting it
+		loop = cls._shared
+		return loop is not None and loop.in_loop_thread()
+
+
+	def __init__(self):
+		self.selector = selectors.DefaultSelector()
+
+		# Heap of (when, sequence, timer). The sequence number stops two
+		#  timers due at the same time from having to be compared.
+		self._timers = []
+		self._timer_sequence = itertools.count()
+
+		# Callbacks to run on the next pass of the loop
+		self._ready = deque()
+		self._lock = threading.Lock()
+
+		# Writing to this socket pair wakes the loop up from select when
+		#  another thread gives it something new to do
+		self._wakeup_r, self._wakeup_w = socket.socketpair()
+		self._wakeup_r.setblocking(False)
+		self._wakeup_w.setblocking(False)
+		self.selector.register(self._wakeup_r, selectors.EVENT_READ, (self._drain_wakeup, None))
+
+		self.running = threading.Event()
+		self.thread = None
+
+
+	def start(self):
+		self.running.set()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	def stop(self):
+		self.running.clear()
+		self._wakeup()
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+
+
+	def in_loop_thread(self):
+		return threading.current_thread() is self.thread
+
+
+	#############
+	# Callbacks #
+	#############
+	def call_soon(self, callback, *args):
+		with self._lock:
+			self._ready.append((callback, args))
+		self._wakeup()
+
+
+	def call_later(self, delay, callback, *args):
+		timer = Timer(time.monotonic() + delay, callback, args)
+		with self._lock:
+			heapq.heappush(self._timers, (timer.when, next(self._timer_sequence), timer))
+		self._wakeup()
+		return timer
+
+
+	###########################
+	# File descriptor watches #
+	###########################
+	def add_reader(self, fileobj, callback):
+		self._modify(fileobj, selectors.EVENT_READ, callback)
+
+	def remove_reader(self, fileobj):
+		self._modify(fileobj, selectors.EVENT_READ, None)
+
+	def add_writer(self, fileobj, callback):
+		self._modify(fileobj, selectors.EVENT_WRITE, callback)
+
+	def remove_writer(self, fileobj):
+		self._modify(fileobj, selectors.EVENT_WRITE, None)
+
+
+	def _modify(self, fileobj, event, callback):
+		# The selector is not thread safe, so only ever touch it from
+		#  the loop thread
+		if not self.in_loop_thread():
+			self.call_soon(self._modify, fileobj, event, callback)
+			return
+
+		# Each registered file keeps a (reader, writer) callback pair
+		try:
+			key = self.selector.get_key(fileobj)
+		except (KeyError, ValueError):
+			key = None
+
+		reader, writer = key.data if key is not None else (None, None)
+		if event == selectors.EVENT_READ:
+			reader = callback
+		else:
+			writer = callback
+
+		events = 0
+		if reader is not None: events |= selectors.EVENT_READ
+		if writer is not None: events |= selectors.EVENT_WRITE
+
+		try:
+			if key is None and events:
+				self.selector.register(fileobj, events, (reader, writer))
+			elif key is not None and events:
+				self.selector.modify(fileobj, events, (reader, writer))
+			elif key is not None:
+				self.selector.unregister(fileobj)
+		except (OSError, ValueError):
+			# The file has already been closed underneath us
+			pass
+
+
+	############
+	# The loop #
+	############
+	def _wakeup(self):
+		try:
+			self._wakeup_w.send(b"\x00")
+		except (BlockingIOError, OSError):
+			# Already a wakeup pending, or we're shutting down
+			pass
+
+
+	def _drain_wakeup(self):
+		try:
+			while self._wakeup_r.recv(4096):
+				pass
+		except BlockingIOError:
+			pass
+
+
+	def _next_timeout(self):
+		with self._lock:
+			if self._ready:
+				return 0
+			if not self._timers:
+				return None
+			return max(0, self._timers[0][0] - time.monotonic())
+
+
+	def run(self):
+		while self.running.is_set():
+			events = self.selector.select(self._next_timeout())
+
+			for key, mask in events:
+				reader, writer = key.data
+				if mask & selectors.EVENT_READ and reader is not None:
+					self._run_callback(reader)
+				if mask & selectors.EVENT_WRITE and writer is not None:
+					self._run_callback(writer)
+
+			# Move any due timers onto the ready queue
+			now = time.monotonic()
+			with self._lock:
+				while self._timers and self._timers[0][0] <= now:
+					_, _, timer = heapq.heappop(self._timers)
+					if not timer.cancelled:
+						self._ready.append((timer.callback, timer.args))
+
+				ready = self._ready
+				self._ready = deque()
+
+			for callback, args in ready:
+				self._run_callback(callback, *args)
+
+
+	def _run_callback(self, callback, *args):
+		# One misbehaving callback must not take the loop down for every
+		#  other client
+		try:
+			callback(*args)
+		except Exception as e:
+			print(f" [!] Event loop callback {callback} raised {e!r}")
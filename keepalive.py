@@ -0,0 +1,111 @@
+
+import time
+
+from config import Config
+from event_loop import EventLoop
+from messages import SSH_MSG_GLOBAL_REQUEST
+
+
+class KeepaliveMonitor:
+	"""
+	Detects clients that have silently gone away, like OpenSSH's
+	ClientAliveInterval. If nothing has been received from the client
+	for Config.KEEPALIVE_INTERVAL seconds, a keepalive@openssh.com
+	global request is sent, which the client must reply to. After
+	Config.KEEPALIVE_COUNT_MAX probes in a row go unanswered, the
+	connection is dropped.
+
+	Every client's checks are timers on the shared event loop rather
+	than a sleeping thread per client, so a check must never block.
+	"""
+
+	PROBE_REQUEST_NAME = "keepalive@openssh.com"
+
+
+	def __init__(self, client_handler, interval=None, count_max=None):
+		self.client_handler = client_handler
+		self.interval = Config.KEEPALIVE_INTERVAL if interval is None else interval
+		self.count_max = Config.KEEPALIVE_COUNT_MAX if count_max is None else count_max
+
+		self.loop = EventLoop.shared()
+		self.timer = None
+		self.running = False
+
+		# When we last heard from the client, and how many probes have
+		#  gone unanswered since then
+		self.last_activity = time.monotonic()
+		self.missed = 0
+
+		# Sequence numbers of probes we've sent. Clients that don't know
+		#  about global requests answer with SSH_MSG_UNIMPLEMENTED
+		#  instead, which still proves they are alive.
+		self.probe_sequence_numbers = set()
+
+
+	@property
+	def enabled(self):
+		return self.interval > 0 and self.count_max > 0
+
+
+	def start(self):
+		if not self.enabled:
+			return
+		self.running = True
+		self.timer = self.loop.call_later(self.interval, self.check)
+
+
+	def stop(self):
+		self.running = False
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+
+	def activity(self):
+		# Any message at all from the client means it's still there
+		self.last_activity = time.monotonic()
+		self.missed = 0
+		self.probe_sequence_numbers.clear()
+
+
+	def is_probe_reply(self, sequence_number):
+		return sequence_number in self.probe_sequence_numbers
+
+
+	def check(self): # Runs on the event loop thread
+		if not self.running:
+			return
+
+		idle = time.monotonic() - self.last_activity
+		if idle < self.interval:
+			# Heard from the client since the last check
+			self.timer = self.loop.call_later(self.interval - idle, self.check)
+			return
+
+		if self.missed >= self.count_max:
+			print(f" [*] Client missed {self.missed} keepalives, disconnecting")
+			self.running = False
+			self.client_handler.connection_lost()
+			return
+
+		# Global requests are part of the connection protocol, so they
+		#  can't be sent until the client has logged in
+		if self.client_handler.auth_handler.is_authenticated:
+			self.send_probe()
+		self.timer = self.loop.call_later(self.interval, self.check)
+
+
+	def send_probe(self):
+		# A probe that can't be sent right now counts as missed. Either
+		#  another thread is stuck sending, or the socket buffer is
+		#  full; both mean the client isn't reading.
+		self.missed += 1
+
+		message_handler = self.client_handler.message_handler
+		if not message_handler.writable():
+			return
+
+		msg = SSH_MSG_GLOBAL_REQUEST(self.PROBE_REQUEST_NAME, True)
+		sequence_number = message_handler.send(msg, blocking=False)
+		if sequence_number is not None:
+			self.probe_sequence_numbers.add(sequence_number)
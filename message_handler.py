@@ -1,9 +1,18 @@
 
 import select
+import socket
 import struct
 import threading
 from os import urandom
 
+# Only used to see how much data is waiting in the socket, which isn't
+#  possible everywhere
+try:
+	import fcntl
+	import termios
+except ImportError:
+	fcntl = termios = None
+
 from messages import SSH_MSG
 
 
@@ -59,6 +68,11 @@ class MessageHandler:
 		#  duplicated sequence number giving an invalid MAC.
 		self._server_sequence_number_lock = threading.Lock()
 
+		# Set once the connection is known to be dead. Sending after
+		#  this does nothing, so apps still running on other threads
+		#  can wind down without errors.
+		self.closed = False
+
 		# Algorithms being used. If None, they are ignored
 		self.encryption_algo_c_to_s = None
 		self.encryption_algo_s_to_c = None
@@ -102,7 +116,7 @@ class MessageHandler:
 	def verify_mac(self, data):
 		if self.mac_algo_c_to_s is None:
 			return True
-		mac = self.conn.recv(self.mac_algo_c_to_s.hash_length)
+		mac = self.recv_exactly(self.mac_algo_c_to_s.hash_length)
 		return self.mac_algo_c_to_s.verify(data, self._client_sequence_number, mac)
 	def generate_mac(self, data):
 		if self.mac_algo_s_to_c is None:
@@ -131,12 +145,31 @@ class MessageHandler:
 	# 	#  reading and writing.
 
 
+	def recv_exactly(self, n):
+		# A single recv can return less than asked for, which happens a
+		#  lot with packets bigger than a few KB. Returns b"" if the
+		#  connection closes part way through.
+		data = self.conn.recv(n)
+		if len(data) == n or data == b"":
+			return data
+
+		chunks = [data]
+		remaining = n - len(data)
+		while remaining > 0:
+			chunk = self.conn.recv(remaining)
+			if chunk == b"":
+				return b""
+			chunks.append(chunk)
+			remaining -= len(chunk)
+		return b"".join(chunks)
+
+
 	def recv(self):
 		# # Poll connection before receiving
 		# self.poll()
 
 		# Read the first block that should contain the packet length.
-		first_block = self.conn.recv(max(8, self.client_block_size))
+		first_block = self.recv_exactly(max(8, self.client_block_size))
 		if first_block == b"":
 			return None # Empty packet
 		first_block = self.decrypt(first_block)
@@ -149,7 +182,9 @@ class MessageHandler:
 		#  accomodate for that by reading 4 less bytes. We have also
 		#  already read 4 one block, so accomodate for that too.
 		remaining_payload_length = packet_len - self.client_block_size + 4
-		remaining_blocks = self.conn.recv(remaining_payload_length) # TODO: Poll?
+		remaining_blocks = self.recv_exactly(remaining_payload_length) # TODO: Poll?
+		if remaining_payload_length > 0 and remaining_blocks == b"":
+			return None # Connection closed mid packet
 		remaining_blocks = self.decrypt(remaining_blocks)
 		full_packet = first_block + remaining_blocks
 
@@ -179,10 +214,15 @@ class MessageHandler:
 		return msg
 
 
-	def send(self, msg):
+	def send(self, msg, blocking=True, timeout=-1):
+		# Returns the sequence number the message was sent with, or None
+		#  if it wasn't sent. With blocking=False, the message is only
+		#  sent if no other thread is part way through sending. A timeout
+		#  gives up after waiting that many seconds for the other thread.
+
 		# If no message, end here
-		if msg is None:
-			return
+		if msg is None or self.closed:
+			return None
 
 		# Handle compression
 		compressed_payload = self.compress(msg.payload())
@@ -203,24 +243,69 @@ class MessageHandler:
 			+ data)
 
 		# Generate mac, encrypt data, and generate full packet. We need to
-		#  atomically acquire the sequence number for this
-		self._server_sequence_number_lock.acquire()
-		mac = self.generate_mac(data)
-		data = self.encrypt(data)
-		full_packet = data + mac
-
-		# Increment the server-side sequence number and send
-		if PRINT_SENT_MESSAGES: print(f" -> Sending SEQ:{self._server_sequence_number}, {msg.__class__.__name__}")
-		self.increment_server_sequence_number()
-		
-		# We can release the sequence number now as we don't access or
-		#  increment it anymore
-		self._server_sequence_number_lock.release()
-
-		# # Poll connection before sending
-		# self.poll()
-
-		self.conn.send(full_packet)
+		#  atomically acquire the sequence number for this. The packet
+		#  is also written while holding the lock, as packets from
+		#  different threads must reach the socket in sequence number
+		#  order (and CBC/CTR ciphers chain between packets too).
+		if not self._server_sequence_number_lock.acquire(blocking, timeout):
+			return None
+		try:
+			mac = self.generate_mac(data)
+			data = self.encrypt(data)
+			full_packet = data + mac
+
+			# Increment the server-side sequence number and send
+			if PRINT_SENT_MESSAGES: print(f" -> Sending SEQ:{self._server_sequence_number}, {msg.__class__.__name__}")
+			sequence_number = self._server_sequence_number
+			self.increment_server_sequence_number()
+
+			# # Poll connection before sending
+			# self.poll()
+
+			# A dead client shows up here as a broken pipe or reset
+			#  connection. Stop reading too, so the client handler's loop
+			#  ends and everything gets cleaned up.
+			try:
+				self.conn.sendall(full_packet)
+			except OSError:
+				self.shutdown()
+				return None
+			return sequence_number
+		finally:
+			self._server_sequence_number_lock.release()
+
+
+	def writable(self):
+		# If there's room in the socket's send buffer for a small
+		#  message. If there isn't, the client has stopped reading.
+		try:
+			_, writable, _ = select.select([], [self.conn], [], 0)
+		except (OSError, ValueError):
+			return False
+		return bool(writable)
+
+
+	def unsent_bytes(self):
+		# How much sent data is still in the socket's send queue, i.e.
+		#  not yet acknowledged by the client. Linux only; elsewhere
+		#  this is always 0.
+		if fcntl is None:
+			return 0
+		try:
+			queued = fcntl.ioctl(self.conn.fileno(), termios.TIOCOUTQ, b"\x00\x00\x00\x00")
+		except (OSError, ValueError, AttributeError):
+			return 0
+		return struct.unpack("I", queued)[0]
+
+
+	def shutdown(self):
+		# Marks the connection as dead. Any thread blocked reading or
+		#  writing the socket is woken up, and gets an error or EOF.
+		self.closed = True
+		try:
+			self.conn.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass # Already gone
 
 
 	def _calculate_padding_length(self, data):
@@ -588,9 +588,12 @@ class SSH_MSG_USERAUTH_BANNER(SSH_MSG):
 class SSH_MSG_GLOBAL_REQUEST(SSH_MSG):
 	message_number = 80
 
-	def __init__(self, request_name, want_reply, **data):
+	def __init__(self, request_name, want_reply, request_data=b"", **data):
 		self.request_name = request_name
 		self.want_reply = want_reply
+		# Request specific data. We don't handle any requests that have
+		#  some, so it is kept as it came.
+		self.request_data = request_data
 		for field_name in data.keys():
 			self.__setattr__(field_name, data[field_name])
 
@@ -598,33 +601,36 @@ class SSH_MSG_GLOBAL_REQUEST(SSH_MSG):
 	def from_reader(cls, r):
 		request_name = r.read_string()
 		want_reply = r.read_bool()
-		print(f"!!!Remaining data in SSH_MSG_GLOBAL_REQUEST is {r.data[r.head:]}")
-		return cls(request_name, want_reply)
+		request_data = r.read_bytes(len(r.data) - r.head)
+		return cls(request_name, want_reply, request_data)
 
 	def payload(self):
 		w = DataWriter()
 		w.write_uint8(self.message_number)
 		w.write_string(self.request_name)
 		w.write_bool(self.want_reply)
-		print("POSSIBLE THERE IS MORE CHANNEL SPECIFIC DATA IN SSH_MSG_GLOBAL_REQUEST")
+		w.write_bytes(self.request_data)
 		return w.data
 
 class SSH_MSG_REQUEST_SUCCESS(SSH_MSG):
 	message_number = 81
 
-	def __init__(self, **data):
+	def __init__(self, response_data=b"", **data):
+		# Response specific data, e.g. the bound port for a
+		#  "tcpip-forward" request
+		self.response_data = response_data
 		for field_name in data.keys():
 			self.__setattr__(field_name, data[field_name])
 
 	@classmethod
 	def from_reader(cls, r):
-		print(f"!!!Remaining data in SSH_MSG_REQUEST_SUCCESS is {r.data[r.head:]}")
-		return cls()
+		response_data = r.read_bytes(len(r.data) - r.head)
+		return cls(response_data)
 
 	def payload(self):
 		w = DataWriter()
 		w.write_uint8(self.message_number)
-		print("POSSIBLE THERE IS MORE CHANNEL SPECIFIC DATA IN SSH_MSG_REQUEST_SUCCESS")
+		w.write_bytes(self.response_data)
 		return w.data
 
 class SSH_MSG_REQUEST_FAILURE(SSH_MSG):
@@ -634,7 +640,7 @@ class SSH_MSG_REQUEST_FAILURE(SSH_MSG):
 		pass
 
 	@classmethod
-	def from_reader(cls):
+	def from_reader(cls, r):
 		return cls()
 
 	def payload(self):
@@ -721,6 +727,7 @@ class SSH_MSG_CHANNEL_OPEN(SSH_MSG):
 	def payload(self):
 		w = DataWriter()
 		w.write_uint8(self.message_number)
+		w.write_string(self.channel_type)
 		w.write_uint32(self.sender_channel)
 		w.write_uint32(self.initial_window_size)
 		w.write_uint32(self.maximum_packet_size)
@@ -867,6 +874,9 @@ class SSH_MSG_CHANNEL_DATA(SSH_MSG):
 class SSH_MSG_CHANNEL_EXTENDED_DATA(SSH_MSG):
 	message_number = 95
 
+	# Data type codes. SSH-CONNECT 5.2.
+	STDERR = 1
+
 	def __init__(self, recipient_channel, data_type_code, data):
 		self.recipient_channel = recipient_channel
 		self.data_type_code = data_type_code
@@ -877,7 +887,7 @@ class SSH_MSG_CHANNEL_EXTENDED_DATA(SSH_MSG):
 		recipient_channel = r.read_uint32()
 		data_type_code = r.read_uint32()
 		data = r.read_string(blob=True)
-		return cls(recipient_channel, data)
+		return cls(recipient_channel, data_type_code, data)
 
 	def payload(self):
 		w = DataWriter()
@@ -1075,6 +1085,25 @@ class SSH_MSG_CHANNEL_REQUEST(SSH_MSG):
 		w.write_uint32(self.recipient_channel)
 		w.write_string(self.request_type)
 		w.write_bool(self.want_reply)
+
+		# SSH-CONNECT 6.5.
+		if self.request_type == "subsystem":
+			w.write_string(self.subsystem_name)
+			return w.data
+
+		# SSH-CONNECT 6.10.
+		elif self.request_type == "exit-status":
+			w.write_uint32(self.exit_status)
+			return w.data
+
+		# SSH-CONNECT 6.10.
+		elif self.request_type == "exit-signal":
+			w.write_string(self.signal_name)
+			w.write_bool(self.core_dumped)
+			w.write_string(self.error_message, us_ascii=False)
+			w.write_string(self.language_tag)
+			return w.data
+
 		# TODO: Handle request-type specific data
 		print("POSSIBLE THERE IS MORE TYPE SPECIFIC DATA")
 		return w.data
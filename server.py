@@ -1,41 +1,196 @@
-
+import signal
 import socket
 import threading
+import time
 from client_handler import ClientHandler
 from authentication import AuthenticationHandler
+from config import Config
+
+
+def set_keepalive(conn):
+	# Have the kernel probe idle connections, so ones whose client has
+	#  vanished error out instead of hanging around forever
+	conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+	# Not every platform lets these be changed
+	if hasattr(socket, "TCP_KEEPIDLE"):
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, Config.TCP_KEEPALIVE_IDLE)
+	if hasattr(socket, "TCP_KEEPINTVL"):
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, Config.TCP_KEEPALIVE_INTERVAL)
+	if hasattr(socket, "TCP_KEEPCNT"):
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, Config.TCP_KEEPALIVE_COUNT)
+
+	# Keepalive probes aren't sent while there is unacknowledged data,
+	#  which is always the case for a game streaming to a dead client.
+	#  Give up on sent data after the same amount of time instead.
+	if hasattr(socket, "TCP_USER_TIMEOUT"):
+		timeout = Config.TCP_KEEPALIVE_IDLE + Config.TCP_KEEPALIVE_INTERVAL * Config.TCP_KEEPALIVE_COUNT
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, timeout * 1000)
+
+
+
+class Server:
+	"""
+	Accepts connections and runs a ClientHandler thread for each.
+
+	On SIGTERM or SIGINT it stops accepting, and drains the sessions
+	that are still running. Each client is sent Config.SHUTDOWN_MESSAGE
+	and has Config.SHUTDOWN_DEADLINE seconds to finish, after which it
+	is disconnected. A second signal skips the wait.
+	"""
+
+	# How often the accept loop checks if it should stop
+	ACCEPT_TIMEOUT = 0.5 # Seconds
+
+	# How long to wait for sessions to end after disconnecting them
+	KILL_TIMEOUT = 2 # Seconds
+
+
+	def __init__(self, host="", port=2222):
+		self.address = (host, port)
+		self.auth_handler = AuthenticationHandler()
+
+		# Active sessions, from their socket to their ClientHandler. The
+		#  handler is None until the identification strings have been
+		#  exchanged.
+		self.sessions = {}
+		self.sessions_changed = threading.Condition()
+
+		self.stopping = threading.Event()
+		self.force = threading.Event()
+
+
+	def handle_signal(self, signum, frame):
+		if self.stopping.is_set():
+			print(" [*] Disconnecting all clients now")
+			self.force.set()
+		else:
+			print(f" [*] Received {signal.Signals(signum).name}, shutting down")
+			self.stopping.set()
+
+
+	def serve_forever(self):
+		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		s.bind(self.address)
+		s.listen(10)
+		s.settimeout(self.ACCEPT_TIMEOUT)
+
+		# Wait for a connection
+		print("Running...")
+		while not self.stopping.is_set():
+			# Accept a connection
+			try:
+				conn, addr = s.accept()
+			except socket.timeout:
+				continue
+			conn.settimeout(None)
 
+			with self.sessions_changed:
+				self.sessions[conn] = None
 
-def client_handler(auth_handler, conn, addr):
-	print(f" [*] Client {addr[0]}:{addr[1]} connected")
-	c = ClientHandler(conn, auth_handler)
-	c.start()
+			# Start a client handler thread
+			t = threading.Thread(target=self.handle_client, args=(conn, addr))
+			t.daemon = True
+			t.start()
 
-	# When c.start returns, we can shut down the connection
-	conn.shutdown(2) # 0=done recv, 1=done send, 2=both
-	conn.close()
-	print(f" [*] Client {addr[0]}:{addr[1]} disconnected")
+		# No new connections from here on
+		s.close()
+		return self.drain()
 
 
+	def handle_client(self, conn, addr):
+		print(f" [*] Client {addr[0]}:{addr[1]} connected")
+		try:
+			set_keepalive(conn)
+			c = ClientHandler(conn, self.auth_handler)
+
+			with self.sessions_changed:
+				self.sessions[conn] = c
+
+			# Connected just as the server started shutting down
+			if self.stopping.is_set():
+				c.notify_shutdown(Config.SHUTDOWN_MESSAGE)
+
+			c.start()
+
+		except OSError:
+			pass # Dropped while exchanging identification strings
+
+		finally:
+			# When c.start returns, we can shut down the connection. It
+			#  may have been shut down already if the client went away.
+			try:
+				conn.shutdown(2) # 0=done recv, 1=done send, 2=both
+			except OSError:
+				pass
+			conn.close()
+			print(f" [*] Client {addr[0]}:{addr[1]} disconnected")
+
+			with self.sessions_changed:
+				del self.sessions[conn]
+				self.sessions_changed.notify_all()
+
+
+	def drain(self):
+		# Lets running sessions finish within the deadline, then
+		#  disconnects the rest. Returns (drained, killed) counts.
+		with self.sessions_changed:
+			sessions = dict(self.sessions)
+		total = len(sessions)
+		print(f" [*] Waiting up to {Config.SHUTDOWN_DEADLINE}s for {total} session(s) to finish")
+
+		for conn, client_handler in sessions.items():
+			if client_handler is None:
+				self._shutdown_socket(conn)
+			else:
+				client_handler.notify_shutdown(Config.SHUTDOWN_MESSAGE)
+
+		deadline = time.monotonic() + Config.SHUTDOWN_DEADLINE
+		self._wait_for_sessions(deadline)
+
+		# Out of time
+		with self.sessions_changed:
+			remaining = dict(self.sessions)
+		for conn, client_handler in remaining.items():
+			if client_handler is None:
+				self._shutdown_socket(conn)
+			else:
+				client_handler.disconnect(Config.SHUTDOWN_MESSAGE)
+
+		self.force.clear()
+		self._wait_for_sessions(time.monotonic() + self.KILL_TIMEOUT)
+
+		killed = len(remaining)
+		drained = total - killed
+		print(f" [*] Shutdown complete: {drained} session(s) drained, {killed} killed")
+		return drained, killed
+
+
+	def _wait_for_sessions(self, deadline):
+		with self.sessions_changed:
+			while self.sessions and not self.force.is_set():
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return
+				# Wake up now and again to check for a second signal
+				self.sessions_changed.wait(min(remaining, self.ACCEPT_TIMEOUT))
+
+
+	def _shutdown_socket(self, conn):
+		try:
+			conn.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
 
 
 def main():
-	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-	s.bind(("", 2222))
-	s.listen(10)
-
-	# Set up a handler for authentication
-	auth_handler = AuthenticationHandler()
-
-	# Wait for a connection
-	print("Running...")
-	while True:
-		# Accept a connection
-		conn, addr = s.accept()
-
-		# Start a client handler thread
-		t = threading.Thread(target=client_handler, args=(auth_handler, conn, addr))
-		t.daemon = True
-		t.start()
-
-main()
+	server = Server()
+	signal.signal(signal.SIGTERM, server.handle_signal)
+	signal.signal(signal.SIGINT, server.handle_signal)
+	server.serve_forever()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,182 @@
+import os
+import tempfile
+
+import numpy as np
+
+from apps.doom.blockmap import pack_blockmap
+from apps.doom.textures import MAPPATCH_DTYPE, MAPTEXTURE_DTYPE, PATCH_HEADER_DTYPE
+from apps.doom.wad import (
+	NODE_DTYPE, LINEDEF_DTYPE, SECTOR_DTYPE, SEG_DTYPE, SIDEDEF_DTYPE,
+	SUBSECTOR_DTYPE, THING_DTYPE, VERTEX_DTYPE, pack_wad)
+
+
+# A 256x256 square room, split down the middle at x=128 into two
+#  subsectors by one node. The player starts in the left half facing
+#  east, and there's one other thing in the right half.
+VERTEXES = [(0, 0), (256, 0), (256, 256), (0, 256), (128, 0), (128, 256)]
+
+# Clockwise, so the room is on the right of every linedef
+LINEDEFS = [
+	(0, 3, 1, 0, 0, 0, 0xffff),
+	(3, 2, 1, 0, 0, 1, 0xffff),
+	(2, 1, 1, 0, 0, 2, 0xffff),
+	(1, 0, 1, 0, 0, 3, 0xffff)]
+
+SIDEDEFS = [(0, 0, b"-", b"-", b"STARTAN3", 0)] * 4
+
+SECTORS = [(0, 128, b"FLOOR4_8", b"CEIL3_5", 160, 0, 0)]
+
+# Right half, then left half
+SEGS = [
+	(5, 2, 0, 1, 0, 128), (2, 1, 0, 2, 0, 0), (1, 4, 0, 3, 0, 0),
+	(4, 0, 0, 3, 0, 128), (0, 3, 0, 0, 0, 0), (3, 5, 0, 1, 0, 0)]
+
+SUBSECTORS = [(3, 0), (3, 3)]
+
+NODES = [(128, 0, 0, 256, 256, 0, 128, 256, 256, 0, 0, 128, 0x8000, 0x8001)]
+
+THINGS = [(64, 128, 0, 1, 7), (200, 200, 90, 3004, 7), (64, 64, 90, 2, 7)]
+
+# 2x2 blocks covering the room, with the linedefs in each, from the
+#  bottom left along each row
+BLOCKMAP = pack_blockmap(0, 0, 2, 2, [[0, 3], [2, 3], [0, 1], [1, 2]])
+
+# The same room with the right half its own sector, with a higher floor
+#  and lower ceiling. A two sided linedef along the split joins them,
+#  and the north and south walls are split there too.
+STEP_LINEDEFS = [
+	(0, 3, 1, 0, 0, 0, 0xffff),
+	(3, 5, 1, 0, 0, 1, 0xffff),
+	(5, 2, 1, 0, 0, 2, 0xffff),
+	(2, 1, 1, 0, 0, 3, 0xffff),
+	(1, 4, 1, 0, 0, 4, 0xffff),
+	(4, 0, 1, 0, 0, 5, 0xffff),
+	(4, 5, 4, 0, 0, 6, 7)]
+
+STEP_SIDEDEFS = (
+	[(0, 0, b"-", b"-", b"STARTAN3", 0)] * 2
+	+ [(0, 0, b"-", b"-", b"STARTAN3", 1)] * 3
+	+ [(0, 0, b"-", b"-", b"STARTAN3", 0)]
+	+ [(0, 0, b"-", b"-", b"-", 1), (0, 0, b"STARTAN3", b"STARTAN3", b"-", 0)])
+
+STEP_SECTORS = SECTORS + [(32, 96, b"FLOOR4_8", b"CEIL3_5", 160, 0, 0)]
+
+STEP_SEGS = [
+	(5, 2, 0, 2, 0, 0), (2, 1, 0, 3, 0, 0), (1, 4, 0, 4, 0, 0), (4, 5, 0, 6, 0, 0),
+	(4, 0, 0, 5, 0, 0), (0, 3, 0, 0, 0, 0), (3, 5, 0, 1, 0, 0), (5, 4, 0, 6, 1, 0)]
+
+STEP_SUBSECTORS = [(4, 0), (4, 4)]
+
+STEP_BLOCKMAP = pack_blockmap(0, 0, 2, 2, [[0, 5, 6], [3, 4, 6], [0, 1, 6], [2, 3, 6]])
+
+
+# Palette index i is (i, 0, 255 - i)
+PALETTE = [(i << 16) | (255 - i) for i in range(256)]
+
+# A 4x8 patch of palette indexes 1 + row*4 + column, with a hole in the
+#  last column
+PATCH = np.arange(32, dtype=np.uint8).reshape(8, 4) + 1
+PATCH_OPAQUE = np.ones((8, 4), dtype=bool)
+PATCH_OPAQUE[3:5, 3] = False
+
+# STARTAN3 is the patch twice, side by side
+TEXTURE_SIZE = (8, 8)
+
+# FLOOR4_8 is palette indexes going up along each row, from 1 to 64
+FLAT = np.tile(np.arange(1, 65, dtype=np.uint8), (64, 1))
+
+
+# Player sprites, 32x56 tiles of the patch standing on the point
+#  they're drawn at. PLAYA1 is seen from the front, and PLAYA2A8 from
+#  the front left, and flipped from the front right.
+SPRITE = np.tile(PATCH, (7, 8))
+SPRITE_OPAQUE = np.tile(PATCH_OPAQUE, (7, 8))
+SPRITE_OFFSETS = (16, 56)
+
+
+def pack_patch(pixels, opaque, left_offset=0, top_offset=0):
+	# A patch lump, with a post for each run of opaque pixels
+	height, width = pixels.shape
+	columns = []
+	for x in range(width):
+		column = b""
+		y = 0
+		while y < height:
+			if not opaque[y, x]:
+				y += 1
+				continue
+			end = y
+			while end < height and opaque[end, x]:
+				end += 1
+			column += bytes([y, end - y, 0]) + pixels[y:end, x].tobytes() + b"\x00"
+			y = end
+		columns.append(column + b"\xff")
+
+	header = np.array([(width, height, left_offset, top_offset)], PATCH_HEADER_DTYPE).tobytes()
+	offset = len(header) + 4 * width
+	offsets = []
+	for column in columns:
+		offsets.append(offset)
+		offset += len(column)
+	return header + np.array(offsets, "<u4").tobytes() + b"".join(columns)
+
+
+def texture_lumps():
+	playpal = np.array([[(c >> 16) & 0xff, (c >> 8) & 0xff, c & 0xff] for c in PALETTE], np.uint8)
+	pnames = np.array([1], "<i4").tobytes() + b"WALL1\x00\x00\x00"
+	texture = np.array([(b"STARTAN3", 0, TEXTURE_SIZE[1], TEXTURE_SIZE[0], 0, 2)], MAPTEXTURE_DTYPE)
+	patches = np.array([(0, 0, 0, 1, 0), (4, 0, 0, 1, 0)], MAPPATCH_DTYPE)
+	texture1 = np.array([1, 8], "<i4").tobytes() + texture.tobytes() + patches.tobytes()
+	return [
+		("PLAYPAL", playpal),
+		("PNAMES", pnames),
+		("TEXTURE1", texture1),
+		("WALL1", pack_patch(PATCH, PATCH_OPAQUE)),
+		("F_START", b""),
+		("FLOOR4_8", FLAT),
+		("F_END", b"")]
+
+
+def sprite_lumps():
+	return [
+		("S_START", b""),
+		("PLAYA1", pack_patch(SPRITE, SPRITE_OPAQUE, *SPRITE_OFFSETS)),
+		("PLAYA2A8", pack_patch(SPRITE[:, ::-1], SPRITE_OPAQUE[:, ::-1], *SPRITE_OFFSETS)),
+		("S_END", b"")]
+
+
+def build_wad(map_names=("E1M1",), textures=True, step=False, reject=b"\x00", sprites=False, nodes=NODES):
+	# The same room under each of the map names, split into two sectors
+	#  with a step between them if step. nodes replaces the BSP tree.
+	linedefs, sidedefs, segs, subsectors, sectors, blockmap = (
+		(STEP_LINEDEFS, STEP_SIDEDEFS, STEP_SEGS, STEP_SUBSECTORS, STEP_SECTORS, STEP_BLOCKMAP) if step
+		else (LINEDEFS, SIDEDEFS, SEGS, SUBSECTORS, SECTORS, BLOCKMAP))
+	lumps = []
+	for map_name in map_names:
+		lumps += [
+			(map_name, b""),
+			("THINGS", np.array(THINGS, THING_DTYPE)),
+			("LINEDEFS", np.array(linedefs, LINEDEF_DTYPE)),
+			("SIDEDEFS", np.array(sidedefs, SIDEDEF_DTYPE)),
+			("VERTEXES", np.array(VERTEXES, VERTEX_DTYPE)),
+			("SEGS", np.array(segs, SEG_DTYPE)),
+			("SSECTORS", np.array(subsectors, SUBSECTOR_DTYPE)),
+			("NODES", np.array(nodes, NODE_DTYPE)),
+			("SECTORS", np.array(sectors, SECTOR_DTYPE)),
+			("REJECT", reject),
+			("BLOCKMAP", blockmap)]
+	if textures:
+		lumps += texture_lumps()
+	if sprites:
+		lumps += sprite_lumps()
+	return pack_wad(lumps)
+
+
+def write_wad(test_case, data=None):
+	# Writes a WAD to a temporary file that's removed after the test,
+	#  and returns its path
+	fd, path = tempfile.mkstemp(suffix=".wad")
+	with os.fdopen(fd, "wb") as f:
+		f.write(build_wad() if data is None else data)
+	test_case.addCleanup(os.remove, path)
+	return path
@@ -0,0 +1,116 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from apps.doom.blockmap import Blockmap, pack_blockmap
+from apps.doom.player import Player, RADIUS
+from apps.doom.wad import WAD
+from test.doom_maps import BLOCKMAP, build_wad, write_wad
+
+
+class TestBlockmap(unittest.TestCase):
+
+	def setUp(self):
+		self.blockmap = Blockmap(BLOCKMAP)
+
+	def test_header(self):
+		val = (self.blockmap.origin_x, self.blockmap.origin_y, self.blockmap.columns, self.blockmap.rows)
+
+		self.assertEqual(val, (0, 0, 2, 2))
+
+	def test_lines_in_box(self):
+		self.assertEqual(self.blockmap.lines_in_box(10, 10, 20, 20).tolist(), [0, 3])
+		self.assertEqual(self.blockmap.lines_in_box(120, 200, 140, 210).tolist(), [0, 1, 2])
+		self.assertEqual(self.blockmap.lines_in_box(-100, -100, 500, 500).tolist(), [0, 1, 2, 3])
+
+	def test_outside(self):
+		val = self.blockmap.lines_in_box(300, 300, 400, 400)
+
+		self.assertEqual(val.tolist(), [])
+
+	def test_unsigned(self):
+		val = Blockmap(pack_blockmap(-64, -64, 1, 1, [[40000]])).lines_in_box(0, 0, 1, 1)
+
+		self.assertEqual(val.tolist(), [40000])
+
+	def test_few_blocks(self):
+		# One block's list is given as it is, and a few blocks' lists are
+		#  merged without repeats
+		self.assertEqual(self.blockmap.lines.in_blocks(slice(1, 2), slice(1, 2)).tolist(), [1, 2])
+		self.assertEqual(self.blockmap.lines.in_blocks(slice(0, 2), slice(0, 2)).tolist(), [0, 1, 2, 3])
+
+	def test_link(self):
+		links = self.blockmap.link(np.array([10, 200, 20, 900]), np.array([10, 10, 200, 900]))
+
+		self.assertEqual(links.in_blocks(slice(0, 1), slice(0, 1)).tolist(), [0])
+		self.assertEqual(links.in_blocks(slice(0, 2), slice(1, 2)).tolist(), [1, 3])
+
+
+class TestMovement(unittest.TestCase):
+
+	def load(self, step=False):
+		wad = WAD(write_wad(self, build_wad(step=step)))
+		wad.load()
+		self.player = Player(1)
+		self.map = wad.load_map("E1M1", players=[self.player])
+
+	def test_open(self):
+		self.load()
+
+		self.player.move(10, 0)
+
+		self.assertEqual((self.player.x, self.player.y), (74, 128))
+
+	def test_stops_at_wall(self):
+		self.load()
+
+		for _ in range(30):
+			self.player.move(10, 0)
+
+		self.assertGreaterEqual(256 - self.player.x, RADIUS)
+		self.assertLess(256 - self.player.x, RADIUS + 10)
+
+	def test_slides_along_wall(self):
+		# Going diagonally into the north wall goes along it instead
+		self.load()
+		self.player.x, self.player.y = 64, 236
+
+		self.player.move(10, 10)
+
+		self.assertEqual((self.player.x, self.player.y), (74, 236))
+
+	def test_step_too_high(self):
+		# The right half's floor is 32 up, too high to step onto, but
+		#  stepping down from it is fine
+		self.load(step=True)
+
+		for _ in range(10):
+			self.player.move(10, 0)
+		self.assertLess(self.player.x, 128 - RADIUS + 1)
+
+		self.player.x = 200
+		for _ in range(10):
+			self.player.move(-10, 0)
+		self.assertLess(self.player.x, 128)
+
+	def test_things_near(self):
+		self.load()
+
+		self.assertEqual(self.map.things_near(180, 180, 40).tolist(), [0])
+		self.assertEqual(self.map.things_near(64, 128, 40).tolist(), [])
+
+
+class TestMovementBlockmap(TestMovement):
+	# The same moves, with the test map's few linedefs found through the
+	#  blockmap rather than all checked
+
+	def setUp(self):
+		patcher = mock.patch("apps.doom.map.FULL_SCAN_LINEDEFS", 0)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_lines_near(self):
+		self.load()
+
+		self.assertEqual(self.map.lines_near(10, 10, 5).tolist(), [0, 3])
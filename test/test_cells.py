@@ -0,0 +1,118 @@
+import re
+import unittest
+
+import numpy as np
+
+from apps.doom.cells import BrailleCells, HalfBlockCells, QuadrantCells
+from apps.doom.encoder import FrameEncoder
+from apps.doom.screen import Screen
+
+
+ESCAPE = re.compile(r"\x1b\[([0-9;]*)([A-Za-z])|(.)")
+
+
+def apply_glyphs(data, glyphs):
+	# Plays back the output of a Screen onto an array of the glyph shown
+	#  in each character
+	row, col = 0, 0
+	for match in ESCAPE.finditer(data.decode("utf-8")):
+		params, command, glyph = match.groups()
+		if glyph:
+			glyphs[row, col] = glyph
+			col += 1
+		elif command == "H":
+			row, col = [int(n) - 1 for n in params.split(";")]
+
+
+class TestReduce(unittest.TestCase):
+
+	def test_half_block(self):
+		pixels = np.array([[1, 2], [3, 4]])
+
+		fg, bg, glyphs = HalfBlockCells().reduce(pixels, np.ones((1, 2), dtype=bool))
+
+		self.assertEqual(fg.tolist(), [[1, 2]])
+		self.assertEqual(bg.tolist(), [[3, 4]])
+		self.assertIsNone(glyphs)
+
+	def test_only_changed(self):
+		pixels = np.array([
+			[5, 9, 7, 7],
+			[5, 5, 7, 3]])
+
+		fg, bg, glyphs = QuadrantCells().reduce(pixels, np.array([[False, True]]))
+
+		self.assertEqual((fg.tolist(), bg.tolist(), glyphs.tolist()), ([[0, 3]], [[0, 7]], [[0, 8]]))
+
+	def test_quadrant(self):
+		pixels = np.array([
+			[5, 9, 7, 7],
+			[5, 5, 7, 7]])
+
+		fg, bg, glyphs = QuadrantCells().reduce(pixels, np.ones((1, 2), dtype=bool))
+
+		self.assertEqual(bg.tolist(), [[5, 7]])
+		self.assertEqual(fg.tolist(), [[9, 7]])
+		self.assertEqual([QuadrantCells.GLYPHS[g] for g in glyphs[0]], ["▝", " "])
+
+	def test_braille(self):
+		pixels = np.zeros((4, 2), dtype=int)
+		pixels[0, 0] = pixels[3, 1] = pixels[1, 1] = 0xff
+
+		fg, bg, glyphs = BrailleCells().reduce(pixels, np.ones((1, 1), dtype=bool))
+
+		self.assertEqual((fg[0, 0], bg[0, 0]), (0xff, 0))
+		# Dots 1, 5 and 8
+		self.assertEqual(BrailleCells.GLYPHS[glyphs[0, 0]], "⢑")
+
+	def test_third_colour_drawn_as_foreground(self):
+		pixels = np.array([[1, 1], [2, 3]])
+
+		fg, bg, glyphs = QuadrantCells().reduce(pixels, np.ones((1, 1), dtype=bool))
+
+		self.assertEqual((fg[0, 0], bg[0, 0]), (2, 1))
+		self.assertEqual(QuadrantCells.GLYPHS[glyphs[0, 0]], "▄")
+
+
+class TestCellScreens(unittest.TestCase):
+
+	def test_encoder_glyphs(self):
+		encoder = FrameEncoder(cells=QuadrantCells())
+		changed = np.array([[True, True]])
+		fg = np.array([[0xff0000, 0xff0000]])
+		bg = np.array([[0, 0]])
+		glyphs = np.array([[15, 3]])
+		expected = "\x1b[1;1H\x1b[38;2;255;0;0;48;2;0;0;0m█▀".encode("utf-8")
+
+		val = encoder.encode(changed, fg, bg, glyphs=glyphs)
+
+		self.assertEqual(val, expected)
+
+	def test_braille_size(self):
+		screen = Screen(height=10, width=20, sender=lambda d: None, cells=BrailleCells())
+
+		self.assertEqual((screen.height, screen.width), (40, 40))
+
+	def test_braille_line(self):
+		sent = []
+		screen = Screen(height=3, width=4, sender=sent.append, cells=BrailleCells())
+		terminal = np.full((3, 4), "", dtype=object)
+		sent.clear()
+
+		screen.draw_line(0, 7, 5, 5, 0xffffff)
+		screen.refresh()
+		apply_glyphs(b"".join(sent), terminal)
+
+		# The second row of dots (dots 2 and 5) of the middle row
+		self.assertEqual(terminal[1].tolist(), ["⠒"] * 4)
+		self.assertEqual(terminal[0].tolist(), [""] * 4)
+
+	def test_partial_refresh(self):
+		sent = []
+		screen = Screen(height=3, width=4, sender=sent.append, cells=QuadrantCells())
+		sent.clear()
+
+		screen.draw_pixel(5, 3, 0xffffff)
+		screen.refresh()
+
+		self.assertEqual(sent, ["\x1b[2;3H\x1b[38;2;255;255;255;48;2;51;51;51m▗".encode("utf-8")])
@@ -0,0 +1,189 @@
+import threading
+import unittest
+
+from channels import ChannelHandler, SessionChannel
+from event_loop import EventLoop
+from messages import (
+	SSH_MSG,
+	SSH_MSG_CHANNEL_CLOSE,
+	SSH_MSG_CHANNEL_DATA,
+	SSH_MSG_CHANNEL_EOF,
+	SSH_MSG_CHANNEL_EXTENDED_DATA,
+	SSH_MSG_CHANNEL_REQUEST,
+	SSH_MSG_CHANNEL_SUCCESS,
+	SSH_MSG_CHANNEL_WINDOW_ADJUST)
+
+
+class FakeMessageHandler:
+	def __init__(self):
+		self.sent = []
+		self.closed = False
+
+	def send(self, msg, blocking=True, timeout=-1):
+		self.sent.append(msg)
+		return len(self.sent)
+
+	def writable(self):
+		return True
+
+
+class FakeMessage:
+	def __init__(self, data):
+		self.data = data
+
+
+class FakeApp:
+	def __init__(self):
+		self.stdin = b""
+		self.extended = b""
+
+	def handle_CHANNEL_DATA(self, msg):
+		self.stdin += msg.data
+
+	def handle_CHANNEL_EXTENDED_DATA(self, msg):
+		self.extended += msg.data
+
+
+class TestFlowControl(unittest.TestCase):
+
+	def make_channel(self, window, max_packet):
+		self.message_handler = FakeMessageHandler()
+		return SessionChannel(
+			client_handler=ChannelHandler(),
+			client_channel_id=3,
+			initial_window_size=window,
+			maximum_packet_size=max_packet,
+			message_handler=self.message_handler)
+
+	def test_split_to_maximum_packet_size(self):
+		channel = self.make_channel(window=100, max_packet=4)
+
+		channel.send_CHANNEL_DATA(b"HelloWorld")
+		val = [m.data for m in self.message_handler.sent]
+
+		self.assertEqual(val, [b"Hell", b"oWor", b"ld"])
+
+	def test_waits_for_window(self):
+		channel = self.make_channel(window=5, max_packet=100)
+
+		channel.send_CHANNEL_DATA(b"Hello")
+		channel.send_CHANNEL_DATA(b"World")
+		channel.send_CHANNEL_DATA("!")
+		before = [m.data for m in self.message_handler.sent]
+		channel.handle_CHANNEL_WINDOW_ADJUST(100)
+		after = [m.data for m in self.message_handler.sent]
+
+		# The writes that were held back are batched into one packet
+		self.assertEqual(before, [b"Hello"])
+		self.assertEqual(after, [b"Hello", b"World!"])
+
+	def test_close_waits_for_data(self):
+		# The command finishes while its output is waiting for window
+		#  space. Its exit-status, EOF and CLOSE go out after the output.
+		channel = self.make_channel(window=2, max_packet=100)
+
+		channel.handle_CHANNEL_REQUEST(SSH_MSG_CHANNEL_REQUEST(0, "exec", True, command="echo hello"))
+		before = [type(m) for m in self.message_handler.sent]
+		channel.handle_CHANNEL_WINDOW_ADJUST(100)
+		sent = self.message_handler.sent
+
+		self.assertEqual(before, [SSH_MSG_CHANNEL_SUCCESS, SSH_MSG_CHANNEL_DATA])
+		self.assertEqual([type(m) for m in sent[2:]], [
+			SSH_MSG_CHANNEL_DATA, SSH_MSG_CHANNEL_REQUEST, SSH_MSG_CHANNEL_EOF, SSH_MSG_CHANNEL_CLOSE])
+		self.assertEqual(sent[1].data + sent[2].data, b"hello\n")
+		self.assertEqual(sent[3].request_type, "exit-status")
+
+	def test_client_close_drops_data(self):
+		# Data the client has no window for is dropped when it closes the
+		#  channel, so our CLOSE isn't held up
+		channel = self.make_channel(window=0, max_packet=100)
+
+		channel.send_CHANNEL_DATA(b"Hello")
+		channel.handle_CHANNEL_CLOSE()
+
+		self.assertEqual([type(m) for m in self.message_handler.sent], [SSH_MSG_CHANNEL_CLOSE])
+		self.assertEqual(channel.outbound_bytes, 0)
+
+	def test_local_window_adjust(self):
+		channel = self.make_channel(window=100, max_packet=100)
+		half = ChannelHandler.INITIAL_WINDOW_SIZE // 2
+
+		channel.handle_CHANNEL_DATA(FakeMessage(b"x" * (half - 1)))
+		before = list(self.message_handler.sent)
+		channel.handle_CHANNEL_DATA(FakeMessage(b"x"))
+		after = self.message_handler.sent
+
+		self.assertEqual(before, [])
+		self.assertIsInstance(after[0], SSH_MSG_CHANNEL_WINDOW_ADJUST)
+		self.assertEqual(after[0].bytes_to_add, half)
+
+	def test_extended_data_shares_window(self):
+		channel = self.make_channel(window=5, max_packet=100)
+
+		channel.send_CHANNEL_EXTENDED_DATA(b"Oops!")
+		channel.send_CHANNEL_DATA(b"Hello")
+		before = len(self.message_handler.sent)
+		channel.handle_CHANNEL_WINDOW_ADJUST(100)
+
+		self.assertEqual(before, 1)
+		self.assertIsInstance(self.message_handler.sent[0], SSH_MSG_CHANNEL_EXTENDED_DATA)
+		self.assertIsInstance(self.message_handler.sent[1], SSH_MSG_CHANNEL_DATA)
+
+	def test_batching_keeps_types_in_order(self):
+		channel = self.make_channel(window=0, max_packet=100)
+
+		channel.send_CHANNEL_DATA(b"a")
+		channel.send_CHANNEL_DATA(b"b")
+		channel.send_CHANNEL_EXTENDED_DATA(b"c")
+		channel.send_CHANNEL_EXTENDED_DATA(b"d")
+		channel.send_CHANNEL_DATA(b"e")
+		channel.handle_CHANNEL_WINDOW_ADJUST(100)
+		val = [(type(m).__name__, m.data) for m in self.message_handler.sent]
+
+		self.assertEqual(val, [
+			("SSH_MSG_CHANNEL_DATA", b"ab"),
+			("SSH_MSG_CHANNEL_EXTENDED_DATA", b"cd"),
+			("SSH_MSG_CHANNEL_DATA", b"e")])
+
+	def test_extended_data_to_app(self):
+		channel = self.make_channel(window=100, max_packet=100)
+		channel.app = FakeApp()
+
+		channel.handle_CHANNEL_EXTENDED_DATA(FakeMessage(b"Hello"))
+
+		self.assertEqual(channel.app.extended, b"Hello")
+		self.assertEqual(channel.local_consumed, 5)
+
+	def test_loop_never_blocks(self):
+		# On the event loop, output for a client whose socket is full
+		#  stays queued and is sent once there's room
+		channel = self.make_channel(window=100, max_packet=100)
+		self.message_handler.writable = lambda: writable
+		writable = False
+		queued = threading.Event()
+
+		def send():
+			channel.send_CHANNEL_DATA(b"Hello")
+			queued.set()
+
+		EventLoop.shared().call_soon(send)
+		self.assertTrue(queued.wait(1))
+		before = list(self.message_handler.sent)
+		writable = True
+		sent = threading.Event()
+		EventLoop.shared().call_later(0.05, sent.set)
+		self.assertTrue(sent.wait(1))
+
+		self.assertEqual(before, [])
+		self.assertEqual([m.data for m in self.message_handler.sent], [b"Hello"])
+		self.assertEqual(channel.outbound_bytes, 0)
+
+
+class TestExtendedDataMessage(unittest.TestCase):
+
+	def test_round_trip(self):
+		msg = SSH_MSG_CHANNEL_EXTENDED_DATA(2, SSH_MSG_CHANNEL_EXTENDED_DATA.STDERR, b"Hello")
+
+		val = SSH_MSG.read_msg(msg.payload())
+
+		self.assertEqual((val.recipient_channel, val.data_type_code, val.data), (2, 1, b"Hello"))
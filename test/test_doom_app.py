@@ -0,0 +1,97 @@
+import types
+import unittest
+from unittest import mock
+
+from apps.doom.cells import BrailleCells
+from apps.doom.doom_app import DoomGame, Game
+from apps.doom.screen import Screen, ansi_clear
+from test.doom_maps import write_wad
+
+
+class TestGameScreens(unittest.TestCase):
+
+	def setUp(self):
+		patcher = mock.patch("apps.doom.doom_engine.Config.DOOM_WAD", write_wad(self))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		self.sent = []
+		self.screen = Screen(height=25, width=80, sender=self.sent.append)
+		self.automap_screen = Screen(height=25, width=80, sender=self.sent.append, cells=BrailleCells(), clear=False)
+
+	def test_automap_screen(self):
+		# The textured view keeps half blocks, and the automap is drawn
+		#  to its own screen, which is redrawn whole when switched to
+		game = Game(self.screen, self.automap_screen)
+		self.addCleanup(game.close)
+
+		game.draw_screen()
+		self.assertIs(game.drawn_screen, self.screen)
+		self.assertIs(game.doom_engine.renderer.screen, self.screen)
+
+		game.toggle_automap()
+		self.sent.clear()
+		game.draw_screen()
+		automap = self.automap_screen.refresh()
+
+		self.assertIs(game.drawn_screen, self.automap_screen)
+		self.assertIs(game.doom_engine.automap_renderer.screen, self.automap_screen)
+		self.assertEqual(self.sent[0], ansi_clear())
+		self.assertGreater(automap, 0)
+		self.assertIn(0x0000ff, self.automap_screen.canvas)
+
+	def test_automap_screen_sends_nothing(self):
+		# Only the screen being shown clears the client's screen at the
+		#  start
+		self.sent.clear()
+		game = Game(self.screen, Screen(height=25, width=80, sender=self.sent.append, cells=BrailleCells(), clear=False))
+		self.addCleanup(game.close)
+
+		game.draw_screen()
+
+		self.assertNotIn(ansi_clear(), self.sent)
+
+	def test_one_screen(self):
+		game = Game(self.screen)
+		self.addCleanup(game.close)
+
+		game.toggle_automap()
+		game.draw_screen()
+
+		self.assertIs(game.drawn_screen, self.screen)
+		self.assertIs(game.doom_engine.automap_renderer, game.doom_engine.renderer)
+
+
+class TestShutdownNotice(unittest.TestCase):
+
+	def setUp(self):
+		patcher = mock.patch("apps.doom.doom_engine.Config.DOOM_WAD", write_wad(self))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		self.sent = []
+		config = types.SimpleNamespace(
+			window_height=25, window_width=80, environ={}, eof=None, icrnl=False, onlcr=False)
+		self.session = mock.Mock(config=config)
+		self.session.send_CHANNEL_DATA = self.sent.append
+		self.session.outbound_backlog.return_value = (0, 0, 0)
+
+	def test_notice_after_frame(self):
+		# The notice is written after the next frame, and again after
+		#  any frame that may have drawn over it
+		app = DoomGame(self.session)
+		self.addCleanup(app.game.close)
+		app.send_frame()
+
+		app.handle_server_shutdown("Server shutting down")
+		self.sent.clear()
+		app.send_frame()
+		app.send_frame()
+		first = list(self.sent)
+		app.game.toggle_automap()
+		app.send_frame()
+
+		self.assertEqual(len(first), 1)
+		self.assertTrue(first[0].endswith("*** Server shutting down ***"))
+		self.assertGreater(len(self.sent), 2)
+		self.assertEqual(self.sent[-1], first[0])
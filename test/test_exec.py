@@ -0,0 +1,248 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from apps.commands import COMMANDS, ExecApp
+from channels import ChannelHandler, SessionChannel
+from config import Config
+from messages import (
+	SSH_MSG,
+	SSH_MSG_CHANNEL_CLOSE,
+	SSH_MSG_CHANNEL_DATA,
+	SSH_MSG_CHANNEL_EOF,
+	SSH_MSG_CHANNEL_FAILURE,
+	SSH_MSG_CHANNEL_REQUEST,
+	SSH_MSG_CHANNEL_SUCCESS)
+
+
+class FakeSession:
+	# Records everything an app sends instead of sending it to a client
+	def __init__(self):
+		self.stdout = b""
+		self.stderr = b""
+		self.exit_status = None
+		self.exit_signal = None
+		self.sent_eof = False
+		self.closed = threading.Event()
+
+	def send_CHANNEL_DATA(self, data):
+		self.stdout += data
+
+	def send_CHANNEL_EXTENDED_DATA(self, data, data_type_code=1):
+		self.stderr += data
+
+	def outbound_backlog(self):
+		# Everything is sent straight away
+		return 0, 0, 0
+
+	def send_exit_status(self, exit_status):
+		self.exit_status = exit_status
+
+	def send_exit_signal(self, signal_name):
+		self.exit_signal = signal_name
+
+	def send_CHANNEL_EOF(self):
+		self.sent_eof = True
+
+	def send_CHANNEL_CLOSE(self):
+		self.closed.set()
+
+
+class FakeMessageHandler:
+	def __init__(self):
+		self.sent = []
+		self.closed = False
+
+	def send(self, msg, blocking=True, timeout=-1):
+		self.sent.append(msg)
+		return len(self.sent)
+
+	def writable(self):
+		return True
+
+	def unsent_bytes(self):
+		return 0
+
+
+class TestCommandRegistry(unittest.TestCase):
+
+	def test_lookup_builtin(self):
+		kind, _, args = COMMANDS.lookup("echo 'Hello World' again")
+
+		self.assertEqual(kind, "builtin")
+		self.assertEqual(args, ["Hello World", "again"])
+
+	def test_lookup_unknown(self):
+		val = COMMANDS.lookup("rm -rf /")
+
+		self.assertIsNone(val)
+
+	def test_lookup_empty(self):
+		val = COMMANDS.lookup("   ")
+
+		self.assertIsNone(val)
+
+	def test_lookup_subprocess_disabled(self):
+		with mock.patch.object(Config, "EXEC_ALLOW_SUBPROCESSES", False), \
+			mock.patch.object(Config, "EXEC_SUBPROCESS_COMMANDS", {"uptime": ["uptime"]}):
+			val = COMMANDS.lookup("uptime")
+
+		self.assertIsNone(val)
+
+	def test_lookup_subprocess_enabled(self):
+		with mock.patch.object(Config, "EXEC_ALLOW_SUBPROCESSES", True), \
+			mock.patch.object(Config, "EXEC_SUBPROCESS_COMMANDS", {"uptime": ["uptime", "-p"]}):
+			val = COMMANDS.lookup("uptime --since")
+
+		self.assertEqual(val, ("subprocess", ["uptime", "-p"], ["--since"]))
+
+
+class TestExecApp(unittest.TestCase):
+
+	def test_builtin(self):
+		session = FakeSession()
+
+		app = ExecApp(session, "echo Hello")
+		app.start()
+
+		self.assertEqual(session.stdout, b"Hello\n")
+		self.assertEqual(session.exit_status, 0)
+		self.assertTrue(session.sent_eof)
+		self.assertTrue(session.closed.is_set())
+
+	def test_builtin_exit_status(self):
+		session = FakeSession()
+
+		app = ExecApp(session, "false")
+		app.start()
+
+		self.assertEqual(session.exit_status, 1)
+
+	def test_subprocess(self):
+		session = FakeSession()
+		script = "read line; echo \"out $line\"; echo err >&2; exit 3"
+
+		with mock.patch.object(Config, "EXEC_ALLOW_SUBPROCESSES", True), \
+			mock.patch.object(Config, "EXEC_SUBPROCESS_COMMANDS", {"script": ["sh", "-c", script]}):
+			app = ExecApp(session, "script")
+			app.start()
+			app.handle_CHANNEL_DATA(mock.Mock(data=b"Hello\n"))
+			app.handle_CHANNEL_EOF()
+
+			self.assertTrue(session.closed.wait(timeout=5))
+
+		self.assertEqual(session.stdout, b"out Hello\n")
+		self.assertEqual(session.stderr, b"err\n")
+		self.assertEqual(session.exit_status, 3)
+
+	def test_subprocess_killed_on_stop(self):
+		session = FakeSession()
+
+		with mock.patch.object(Config, "EXEC_ALLOW_SUBPROCESSES", True), \
+			mock.patch.object(Config, "EXEC_SUBPROCESS_COMMANDS", {"sleep": ["sleep", "30"]}):
+			app = ExecApp(session, "sleep")
+			app.start()
+			app.stop()
+
+		app.process.wait(timeout=5)
+		self.assertFalse(session.closed.is_set())
+
+	def test_subprocess_waits_for_client(self):
+		# The client's window is full, so the output is left in the pipe
+		#  once a few reads are queued, and read again once it's sent
+		message_handler = FakeMessageHandler()
+		channel = SessionChannel(
+			client_handler=ChannelHandler(),
+			client_channel_id=3,
+			initial_window_size=100,
+			maximum_packet_size=32768,
+			message_handler=message_handler)
+		size = 1000000
+
+		with mock.patch.object(Config, "EXEC_ALLOW_SUBPROCESSES", True), \
+			mock.patch.object(Config, "EXEC_SUBPROCESS_COMMANDS", {"zeros": ["head", "-c", str(size), "/dev/zero"]}):
+			channel.handle_CHANNEL_REQUEST(SSH_MSG_CHANNEL_REQUEST(0, "exec", False, command="zeros"))
+			app = channel.app
+			for _ in range(500):
+				if app.reading_paused:
+					break
+				time.sleep(0.01)
+			queued = channel.outbound_bytes
+
+			for _ in range(500):
+				channel.handle_CHANNEL_WINDOW_ADJUST(size)
+				if isinstance(message_handler.sent[-1], SSH_MSG_CHANNEL_CLOSE):
+					break
+				time.sleep(0.01)
+
+		data = b"".join(m.data for m in message_handler.sent if isinstance(m, SSH_MSG_CHANNEL_DATA))
+		self.assertTrue(0 < queued <= ExecApp.MAX_QUEUED + ExecApp.READ_SIZE)
+		self.assertEqual(len(data), size)
+		self.assertIsInstance(message_handler.sent[-1], SSH_MSG_CHANNEL_CLOSE)
+
+
+class TestExecRequest(unittest.TestCase):
+
+	def make_channel(self):
+		self.message_handler = FakeMessageHandler()
+		return SessionChannel(
+			client_handler=ChannelHandler(),
+			client_channel_id=3,
+			initial_window_size=100,
+			maximum_packet_size=100,
+			message_handler=self.message_handler)
+
+	def test_runs_command(self):
+		channel = self.make_channel()
+		msg = SSH_MSG_CHANNEL_REQUEST(0, "exec", True, command="echo hi")
+
+		resp = channel.handle_CHANNEL_REQUEST(msg)
+		sent = self.message_handler.sent
+
+		self.assertIsNone(resp)
+		self.assertEqual([type(m) for m in sent], [
+			SSH_MSG_CHANNEL_SUCCESS, SSH_MSG_CHANNEL_DATA, SSH_MSG_CHANNEL_REQUEST,
+			SSH_MSG_CHANNEL_EOF, SSH_MSG_CHANNEL_CLOSE])
+		self.assertEqual(sent[1].data, b"hi\n")
+		self.assertEqual((sent[2].request_type, sent[2].exit_status), ("exit-status", 0))
+
+	def test_unknown_command(self):
+		channel = self.make_channel()
+		msg = SSH_MSG_CHANNEL_REQUEST(0, "exec", True, command="rm -rf /")
+
+		resp = channel.handle_CHANNEL_REQUEST(msg)
+
+		self.assertIsInstance(resp, SSH_MSG_CHANNEL_FAILURE)
+		self.assertEqual(self.message_handler.sent, [])
+		self.assertIsNone(channel.app)
+
+
+class TestExitStatus(unittest.TestCase):
+
+	def test_payload(self):
+		msg = SSH_MSG_CHANNEL_REQUEST(
+			recipient_channel=7,
+			request_type="exit-status",
+			want_reply=False,
+			exit_status=3)
+		expected = b"b\x00\x00\x00\x07\x00\x00\x00\x0bexit-status\x00\x00\x00\x00\x03"
+
+		val = msg.payload()
+
+		self.assertEqual(val, expected)
+
+	def test_round_trip(self):
+		msg = SSH_MSG_CHANNEL_REQUEST(
+			recipient_channel=7,
+			request_type="exit-signal",
+			want_reply=False,
+			signal_name="KILL",
+			core_dumped=False,
+			error_message="",
+			language_tag="")
+
+		val = SSH_MSG.read_msg(msg.payload())
+
+		self.assertEqual(val.signal_name, "KILL")
+		self.assertFalse(val.core_dumped)
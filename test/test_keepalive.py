@@ -0,0 +1,155 @@
+import socket
+import threading
+import unittest
+
+from authentication import AuthenticationHandler
+from client_handler import ClientHandler
+from data_types import DataReader
+from keepalive import KeepaliveMonitor
+from message_handler import MessageHandler
+from messages import (
+	SSH_MSG,
+	SSH_MSG_GLOBAL_REQUEST,
+	SSH_MSG_REQUEST_FAILURE,
+	SSH_MSG_REQUEST_SUCCESS)
+
+
+class FakeMessageHandler:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, msg, blocking=True, timeout=-1):
+		self.sent.append(msg)
+		return len(self.sent) - 1
+
+	def writable(self):
+		return True
+
+
+class FakeClientHandler:
+	def __init__(self):
+		self.auth_handler = AuthenticationHandler()
+		self.auth_handler.is_authenticated = True
+		self.message_handler = FakeMessageHandler()
+		self.lost = threading.Event()
+
+	def connection_lost(self):
+		self.lost.set()
+
+
+class TestGlobalRequestMessages(unittest.TestCase):
+
+	def test_round_trip_request_data(self):
+		msg = SSH_MSG_GLOBAL_REQUEST("tcpip-forward", True, b"\x00\x00\x00\x00\x00\x00\x00\x16")
+
+		val = SSH_MSG.read_msg(msg.payload())
+
+		self.assertEqual(val.request_name, "tcpip-forward")
+		self.assertTrue(val.want_reply)
+		self.assertEqual(val.request_data, b"\x00\x00\x00\x00\x00\x00\x00\x16")
+
+	def test_request_data_read(self):
+		# The request and response data are read to the end, so nothing
+		#  is left over
+		for msg in (
+			SSH_MSG_GLOBAL_REQUEST("tcpip-forward", True, b"\x00\x00\x00\x00\x00\x00\x00\x16"),
+			SSH_MSG_REQUEST_SUCCESS(b"\x00\x00\x00\x16")):
+			r = DataReader(msg.payload())
+			r.read_uint8()
+
+			type(msg).from_reader(r)
+
+			self.assertEqual(r.head, len(r.data))
+
+	def test_request_failure(self):
+		val = SSH_MSG.read_msg(SSH_MSG_REQUEST_FAILURE().payload())
+
+		self.assertIsInstance(val, SSH_MSG_REQUEST_FAILURE)
+
+
+class TestKeepaliveMonitor(unittest.TestCase):
+
+	def test_unanswered_probes_disconnect(self):
+		client_handler = FakeClientHandler()
+		monitor = KeepaliveMonitor(client_handler, interval=0.02, count_max=2)
+
+		monitor.start()
+		lost = client_handler.lost.wait(timeout=5)
+		monitor.stop()
+
+		self.assertTrue(lost)
+		self.assertEqual(len(client_handler.message_handler.sent), 2)
+		self.assertEqual(client_handler.message_handler.sent[0].request_name, "keepalive@openssh.com")
+
+	def test_activity_resets(self):
+		client_handler = FakeClientHandler()
+		monitor = KeepaliveMonitor(client_handler, interval=10, count_max=2)
+		monitor.send_probe()
+
+		before = monitor.is_probe_reply(0)
+		monitor.activity()
+		after = monitor.is_probe_reply(0)
+
+		self.assertTrue(before)
+		self.assertFalse(after)
+		self.assertEqual(monitor.missed, 0)
+
+	def test_no_probes_before_login(self):
+		client_handler = FakeClientHandler()
+		client_handler.auth_handler.is_authenticated = False
+		monitor = KeepaliveMonitor(client_handler, interval=0.01, count_max=2)
+		monitor.running = True
+		monitor.last_activity -= 1
+
+		monitor.check()
+		monitor.stop()
+
+		self.assertEqual(client_handler.message_handler.sent, [])
+		self.assertFalse(client_handler.lost.is_set())
+
+
+class TestClientHandlerKeepalive(unittest.TestCase):
+
+	def setUp(self):
+		server_sock, client_sock = socket.socketpair()
+		client_sock.sendall(b"SSH-2.0-test\r\n")
+		self.server = ClientHandler(server_sock, AuthenticationHandler())
+
+		# Read the banner and identification string
+		received = b""
+		while b"SSH-" not in received or not received.endswith(b"\r\n"):
+			received += client_sock.recv(1)
+		self.client = MessageHandler(client_sock)
+
+		self.thread = threading.Thread(target=self.server.start)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def tearDown(self):
+		self.client.conn.close()
+		self.thread.join(timeout=5)
+
+	def test_replies_to_keepalive(self):
+		self.client.send(SSH_MSG_GLOBAL_REQUEST("keepalive@openssh.com", True))
+
+		val = self.client.recv()
+
+		self.assertIsInstance(val, SSH_MSG_REQUEST_SUCCESS)
+
+	def test_refuses_unknown_request(self):
+		self.client.send(SSH_MSG_GLOBAL_REQUEST("no-more-sessions@openssh.com", False))
+		self.client.send(SSH_MSG_GLOBAL_REQUEST("tcpip-forward", True, b"\x00\x00\x00\x00\x00\x00\x00\x16"))
+
+		# Nothing is sent for the first, as no reply was wanted
+		val = self.client.recv()
+
+		self.assertIsInstance(val, SSH_MSG_REQUEST_FAILURE)
+
+	def test_dead_client_ends_session(self):
+		self.client.conn.close()
+		self.thread.join(timeout=5)
+
+		val = self.server.message_handler.send(SSH_MSG_REQUEST_SUCCESS())
+
+		self.assertFalse(self.thread.is_alive())
+		self.assertIsNone(val)
@@ -0,0 +1,44 @@
+import unittest
+
+from apps.doom.keys import KeyDecoder
+
+
+class TestKeyDecoder(unittest.TestCase):
+
+	def setUp(self):
+		self.decoder = KeyDecoder()
+
+	def test_bytes(self):
+		val = self.decoder.decode(b"wa\td")
+
+		self.assertEqual(val, [b"w", b"a", b"\t", b"d"])
+
+	def test_arrows(self):
+		val = self.decoder.decode(b"\x1b[A\x1b[Bw\x1bOC\x1bOD")
+
+		self.assertEqual(val, ["up", "down", b"w", "right", "left"])
+
+	def test_unknown_sequence(self):
+		# Like F5, with parameters
+		val = self.decoder.decode(b"\x1b[15~s")
+
+		self.assertEqual(val, [b"\x1b[15~", b"s"])
+
+	def test_split_sequence(self):
+		# A sequence cut off at the end of a packet is finished by the
+		#  next one
+		first = self.decoder.decode(b"w\x1b[")
+		second = self.decoder.decode(b"Aw")
+
+		self.assertEqual(first, [b"w"])
+		self.assertEqual(second, ["up", b"w"])
+
+	def test_escape_key(self):
+		val = self.decoder.decode(b"\x1b\x1b[D")
+
+		self.assertEqual(val, [b"\x1b", "left"])
+
+	def test_held_key(self):
+		val = self.decoder.decode(b"\x1b[A" * 50)
+
+		self.assertEqual(val, ["up"] * 50)
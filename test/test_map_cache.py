@@ -0,0 +1,93 @@
+import mmap
+import threading
+import unittest
+from unittest import mock
+
+from apps.doom.map_cache import MapCache
+from apps.doom.player import Player
+from apps.doom.wad import WAD
+from test.doom_maps import build_wad, write_wad
+
+
+class TestMapCache(unittest.TestCase):
+
+	def setUp(self):
+		self.filename = write_wad(self, build_wad(["E1M1", "E1M2", "E1M3"]))
+		self.cache = MapCache(max_maps=2)
+
+	def test_geometry_shared(self):
+		a = self.cache.load_map(self.filename, "E1M1", players=[Player(1)])
+		b = self.cache.load_map(self.filename, "E1M1", players=[Player(1)])
+
+		self.assertIs(a.geometry, b.geometry)
+		self.assertIs(a.segs, b.segs)
+		self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+	def test_sectors_per_session(self):
+		a = self.cache.load_map(self.filename, "E1M1", players=[Player(1)])
+		b = self.cache.load_map(self.filename, "E1M1", players=[Player(1)])
+
+		a.sectors.ceiling_height[0] = 0
+
+		self.assertNotEqual(b.sectors.ceiling_height[0], 0)
+
+	def test_geometry_read_only(self):
+		geometry = self.cache.get_map(self.filename, "E1M1")
+
+		with self.assertRaises(ValueError):
+			geometry.vertexes.x[0] = 0
+		with self.assertRaises(ValueError):
+			geometry.blockmap.lines.ids[0] = 0
+
+	def test_players_placed_per_session(self):
+		a, b = Player(1), Player(1)
+		self.cache.load_map(self.filename, "E1M1", players=[a])
+		self.cache.load_map(self.filename, "E1M1", players=[b])
+
+		self.assertEqual((b.x, b.y), (a.x, a.y))
+
+	def test_lru_eviction(self):
+		first = self.cache.get_map(self.filename, "E1M1")
+		self.cache.get_map(self.filename, "E1M2")
+		self.cache.get_map(self.filename, "E1M1")
+		self.cache.get_map(self.filename, "E1M3")
+
+		val = [name for _, name in self.cache.maps]
+
+		self.assertEqual(val, ["E1M1", "E1M3"])
+		self.assertIs(self.cache.get_map(self.filename, "E1M1"), first)
+
+	def test_wad_dropped_when_unused(self):
+		other = write_wad(self)
+		self.cache.get_map(other, "E1M1")
+		self.cache.get_map(self.filename, "E1M1")
+		self.cache.get_map(self.filename, "E1M2")
+
+		self.assertEqual(len(self.cache.wads), 1)
+
+	def test_missing_map(self):
+		val = self.cache.load_map(self.filename, "E9M9", players=[])
+
+		self.assertIsNone(val)
+		self.assertEqual(self.cache.wads, {})
+
+	def test_concurrent_loads_once(self):
+		results = []
+		with mock.patch.object(WAD, "load_map_geometry", autospec=True, side_effect=WAD.load_map_geometry) as load:
+			threads = [
+				threading.Thread(target=lambda: results.append(self.cache.get_map(self.filename, "E1M1")))
+				for _ in range(8)]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+
+		self.assertEqual(load.call_count, 1)
+		self.assertEqual(len({id(r) for r in results}), 1)
+
+	def test_wad_memory_mapped(self):
+		self.cache.get_map(self.filename, "E1M1")
+
+		wad = next(iter(self.cache.wads.values()))
+
+		self.assertIsInstance(wad.raw_data, mmap.mmap)
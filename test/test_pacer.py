@@ -0,0 +1,66 @@
+import unittest
+
+from apps.doom.pacer import FramePacer
+
+
+class TestFramePacer(unittest.TestCase):
+
+	def make_pacer(self, queued=0, window=2**21, unsent=0):
+		backlog = {"queued": queued, "window": window, "unsent": unsent}
+		pacer = FramePacer(lambda: (backlog["queued"], backlog["window"], backlog["unsent"]))
+		return pacer, backlog
+
+	def test_clear_connection(self):
+		pacer, _ = self.make_pacer()
+
+		val = pacer.ready()
+
+		self.assertTrue(val)
+		self.assertEqual(pacer.fps, pacer.max_fps)
+
+	def test_queued_skips_and_slows(self):
+		pacer, _ = self.make_pacer(queued=100)
+
+		val = pacer.ready()
+
+		self.assertFalse(val)
+		self.assertEqual(pacer.frames_skipped, 1)
+		self.assertLess(pacer.fps, pacer.max_fps)
+
+	def test_small_window_skips(self):
+		pacer, _ = self.make_pacer(window=FramePacer.INITIAL_FRAME_BYTES - 1)
+
+		self.assertFalse(pacer.ready())
+
+	def test_unsent_socket_bytes_skips(self):
+		pacer, _ = self.make_pacer(unsent=FramePacer.INITIAL_FRAME_BYTES + 1)
+
+		self.assertFalse(pacer.ready())
+
+	def test_fps_floor(self):
+		pacer, _ = self.make_pacer(queued=100)
+
+		for _ in range(50):
+			pacer.ready()
+
+		self.assertEqual(pacer.fps, pacer.min_fps)
+
+	def test_recovers_when_clear(self):
+		pacer, backlog = self.make_pacer(queued=100)
+		for _ in range(50):
+			pacer.ready()
+		backlog["queued"] = 0
+
+		for _ in range(100):
+			if pacer.ready():
+				pacer.sent(1000)
+
+		self.assertEqual(pacer.fps, pacer.max_fps)
+
+	def test_frame_size_tracked(self):
+		pacer, _ = self.make_pacer()
+
+		for _ in range(50):
+			pacer.sent(1000)
+
+		self.assertLess(abs(pacer.frame_bytes - 1000), 10)
@@ -0,0 +1,96 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from apps.doom.encoder import FrameEncoder
+from apps.doom.palette import Ansi16Palette, TrueColourPalette, Xterm256Palette, select_palette
+from apps.doom.screen import Screen
+from config import Config
+
+
+class TestSelectPalette(unittest.TestCase):
+
+	def test_colorterm_truecolor(self):
+		val = select_palette({"TERM": "xterm-256color", "COLORTERM": "truecolor"})
+
+		self.assertIsInstance(val, TrueColourPalette)
+
+	def test_term_256color(self):
+		val = select_palette({"TERM": "screen-256color"})
+
+		self.assertIsInstance(val, Xterm256Palette)
+
+	def test_basic_term(self):
+		val = select_palette({"TERM": "linux"})
+
+		self.assertIsInstance(val, Ansi16Palette)
+
+	def test_no_term(self):
+		val = select_palette({})
+
+		self.assertIsInstance(val, Xterm256Palette)
+
+	def test_config_override(self):
+		with mock.patch.object(Config, "DOOM_PALETTE", "16"):
+			val = select_palette({"COLORTERM": "truecolor"})
+
+		self.assertIsInstance(val, Ansi16Palette)
+
+
+class TestQuantise(unittest.TestCase):
+
+	def test_xterm256(self):
+		data = np.array([0xff0000, 0x000000, 0xffffff, 0x5f87af, 0x767676])
+		expected = [196, 16, 231, 67, 243]
+
+		val = Xterm256Palette().quantise(data)
+
+		self.assertEqual(val.tolist(), expected)
+
+	def test_ansi16(self):
+		data = np.array([0xff0000, 0x000000, 0xffffff, 0x0000e0, 0x808080])
+		expected = [9, 0, 15, 4, 8]
+
+		val = Ansi16Palette().quantise(data)
+
+		self.assertEqual(val.tolist(), expected)
+
+
+class TestIndexedEncoding(unittest.TestCase):
+
+	def test_xterm256_sgr(self):
+		encoder = FrameEncoder(palette=Xterm256Palette())
+		changed = np.array([[True, True]])
+		upper = np.array([[196, 196]])
+		lower = np.array([[16, 16]])
+		expected = "\x1b[1;1H\x1b[38;5;196;48;5;16m▀▀".encode("utf-8")
+
+		val = encoder.encode(changed, upper, lower)
+
+		self.assertEqual(val, expected)
+
+	def test_ansi16_sgr(self):
+		encoder = FrameEncoder(palette=Ansi16Palette())
+		changed = np.array([[True]])
+		upper = np.array([[9]])
+		lower = np.array([[4]])
+		expected = "\x1b[1;1H\x1b[91;44m▀".encode("utf-8")
+
+		val = encoder.encode(changed, upper, lower)
+
+		self.assertEqual(val, expected)
+
+	def test_screen_skips_same_quantised_colour(self):
+		sent = []
+		screen = Screen(height=2, width=2, sender=sent.append, palette=Ansi16Palette())
+		screen.draw_box(0, 1, 0, 3, 0xff0000, fill=True)
+		screen.refresh()
+		sent.clear()
+
+		# Different RGB, but the same palette colour
+		screen.draw_box(0, 1, 0, 3, 0xfe0101, fill=True)
+		screen.refresh()
+
+		self.assertEqual(sent, [])
+		screen.close()
@@ -0,0 +1,102 @@
+import unittest
+
+import numpy as np
+
+from apps.doom.player import Player
+from apps.doom.reject import Reject, sector_bits
+from apps.doom.renderer import Renderer
+from apps.doom.screen import Screen
+from apps.doom.wad import WAD
+from test.doom_maps import NODES, build_wad, write_wad
+
+
+class TestReject(unittest.TestCase):
+
+	def setUp(self):
+		# 3 sectors, where 0 can't see 2, and 1 can't see 0. The bit for
+		#  (i, j) is bit i * 3 + j.
+		self.reject = Reject(np.packbits([0, 0, 1, 1, 0, 0, 0, 0, 0], bitorder="little"), 3)
+
+	def test_can_see(self):
+		self.assertEqual(self.reject.can_see(0, [0, 1, 2]).tolist(), [True, True, False])
+		self.assertEqual(self.reject.can_see(1, [0, 1, 2]).tolist(), [False, True, True])
+		self.assertEqual(self.reject.can_see(2, [0, 1, 2]).tolist(), [True, True, True])
+
+	def test_sees_itself(self):
+		val = Reject(np.array([0xff, 0xff], np.uint8), 3)
+
+		self.assertEqual(val.can_see(1, [0, 1, 2]).tolist(), [False, True, False])
+
+	def test_short_lump(self):
+		val = Reject(np.zeros(0, np.uint8), 3)
+
+		self.assertTrue(val.can_see(0, [0, 1, 2]).all())
+
+	def test_visible_from(self):
+		val = self.reject.visible_from(1)
+
+		self.assertEqual(val.tolist(), sector_bits([1, 2], 3).tolist())
+
+
+class TestVisibility(unittest.TestCase):
+
+	def load(self, reject=b"\x00"):
+		wad = WAD(write_wad(self, build_wad(textures=False, step=True, reject=reject)))
+		wad.load()
+		self.player = Player(1)
+		self.map = wad.load_map("E1M1", players=[self.player])
+		self.screen = Screen(height=50, width=80, sender=lambda data: None)
+		self.renderer = Renderer(self.screen, self.player, self.map)
+
+	def test_sectors_at(self):
+		self.load()
+
+		self.assertEqual(self.map.sector_at(64, 128), 0)
+		self.assertEqual(self.map.sector_at(200, 128), 1)
+		self.assertEqual(self.map.thing_sectors.tolist(), [1])
+
+	def test_node_sectors(self):
+		self.load()
+
+		self.assertEqual(self.map.node_sectors.tolist(), [sector_bits([0, 1], 2).tolist()])
+
+	def test_bad_nodes_refused(self):
+		# A node whose child isn't before it, like one that is its own
+		#  child, could loop forever, as could one off the end. There
+		#  are only two subsectors.
+		for children in ((0, 0x8001), (1, 0x8001), (0x8000, 0x8002)):
+			node = NODES[0][:12] + children
+			wad = WAD(write_wad(self, build_wad(textures=False, nodes=[node])))
+			wad.load()
+
+			with self.assertRaises(ValueError):
+				wad.load_map("E1M1", players=[Player(1)])
+
+	def test_things_visible(self):
+		# Sector 0 can't see sector 1, where the thing is
+		self.load(np.packbits([0, 1, 0, 0], bitorder="little").tobytes())
+
+		self.assertEqual(self.map.things_visible_from(0).tolist(), [])
+		self.assertEqual(self.map.things_visible_from(1).tolist(), [0])
+		self.assertFalse(self.map.can_see(0, 1))
+
+	def test_rejected_sector_skipped(self):
+		# Looking through the gap between the step's upper and lower
+		#  walls, the right half is only drawn if it can be seen
+		self.load()
+		self.renderer.render_perspective()
+		seen = self.screen.pending[35, 40]
+
+		self.load(np.packbits([0, 1, 0, 0], bitorder="little").tobytes())
+		self.renderer.render_perspective()
+
+		self.assertNotEqual(seen, 0)
+		self.assertEqual(self.screen.pending[35, 40], 0)
+		self.assertNotEqual(self.screen.pending[10, 40], 0)
+
+	def test_culling_off(self):
+		self.load(np.packbits([0, 1, 0, 0], bitorder="little").tobytes())
+		self.renderer.CULL_WITH_REJECT = False
+		self.renderer.render_perspective()
+
+		self.assertNotEqual(self.screen.pending[35, 40], 0)
@@ -0,0 +1,351 @@
+import re
+import unittest
+
+import numpy as np
+
+from apps.doom.encoder import FrameEncoder, SharedEncodeCache
+from apps.doom.screen import Damage, Screen
+
+
+ESCAPE = re.compile(rb"\x1b\[([0-9;]*)([A-Za-z])|(\xe2\x96\x80)")
+
+
+def apply_ansi(data, upper, lower):
+	# Plays back the output of a Screen onto arrays of what the client's
+	#  terminal would show
+	row, col, fg, bg = 0, 0, None, None
+	for match in ESCAPE.finditer(data):
+		params, command, px = match.groups()
+		if px:
+			upper[row, col] = fg
+			lower[row, col] = bg
+			col += 1
+		elif command == b"H":
+			row, col = [int(n) - 1 for n in params.split(b";")]
+		elif command == b"m":
+			values = [int(n) for n in params.split(b";")]
+			if values[:2] == [38, 2]:
+				fg = (values[2] << 16) + (values[3] << 8) + values[4]
+				bg = (values[7] << 16) + (values[8] << 8) + values[9]
+
+
+class TestFrameEncoder(unittest.TestCase):
+
+	def test_run_of_same_colour(self):
+		encoder = FrameEncoder()
+		changed = np.array([[False, True, True]])
+		upper = np.array([[0, 0x010203, 0x010203]])
+		lower = np.array([[0, 0x0a0b0c, 0x0a0b0c]])
+		expected = "\x1b[1;2H\x1b[38;2;1;2;3;48;2;10;11;12m▀▀".encode("utf-8")
+
+		val = encoder.encode(changed, upper, lower)
+
+		self.assertEqual(val, expected)
+
+	def test_gap_and_colour_change(self):
+		encoder = FrameEncoder()
+		changed = np.array([[True, False, True], [True, False, False]])
+		upper = np.array([[0xff0000, 0, 0xff0000], [0x00ff00, 0, 0]])
+		lower = np.zeros((2, 3), dtype=int)
+		expected = (
+			"\x1b[1;1H\x1b[38;2;255;0;0;48;2;0;0;0m▀"
+			+ "\x1b[1;3H▀"
+			+ "\x1b[2;1H\x1b[38;2;0;255;0;48;2;0;0;0m▀").encode("utf-8")
+
+		val = encoder.encode(changed, upper, lower)
+
+		self.assertEqual(val, expected)
+
+	def test_nothing_changed(self):
+		encoder = FrameEncoder()
+
+		val = encoder.encode(np.zeros((2, 2), dtype=bool), np.zeros((2, 2)), np.zeros((2, 2)))
+
+		self.assertEqual(val, b"")
+
+
+class TestScreenRefresh(unittest.TestCase):
+
+	def test_random_frames(self):
+		sent = []
+		screen = Screen(height=10, width=20, sender=lambda d: sent.append(d if isinstance(d, bytes) else d.encode("utf-8")))
+		terminal_upper = np.zeros((10, 20), dtype=int)
+		terminal_lower = np.zeros((10, 20), dtype=int)
+		apply_ansi(b"".join(sent), terminal_upper, terminal_lower)
+		rng = np.random.default_rng(1)
+
+		for _ in range(5):
+			sent.clear()
+			batch = screen.new_batch()
+			mask = rng.random((20, 20)) < 0.3
+			batch.pending[mask] = rng.choice([0x000000, 0x333333, 0xff8800], size=mask.sum())
+			batch.draw()
+			screen.refresh()
+			apply_ansi(b"".join(sent), terminal_upper, terminal_lower)
+
+		np.testing.assert_array_equal(terminal_upper, screen.canvas[0::2])
+		np.testing.assert_array_equal(terminal_lower, screen.canvas[1::2])
+
+	def test_no_changes_sends_nothing(self):
+		sent = []
+		screen = Screen(height=4, width=4, sender=sent.append)
+		sent.clear()
+
+		screen.draw_box(0, 3, 0, 7, 0x333333, fill=True)
+		screen.refresh()
+
+		self.assertEqual(sent, [])
+
+
+class TestDamage(unittest.TestCase):
+
+	def test_bounds(self):
+		damage = Damage(10, 20)
+		damage.add(2, 5, 1, 3)
+		damage.add_pixel(15, 7)
+
+		val = damage.bounds()
+
+		self.assertEqual(val, (2, 16, 1, 8))
+		self.assertEqual(np.flatnonzero(damage.rows()).tolist(), [1, 2, 7])
+
+	def test_add_pixels(self):
+		damage = Damage(4, 10)
+
+		damage.add_pixels(np.array([3, 8, 5]), np.array([1, 1, 2]))
+
+		self.assertEqual(damage.start.tolist(), [10, 3, 5, 10])
+		self.assertEqual(damage.end.tolist(), [0, 9, 6, 0])
+
+	def test_nothing_damaged(self):
+		damage = Damage(4, 4)
+		damage.add(2, 2, 0, 4)
+
+		self.assertIsNone(damage.bounds())
+
+
+class TestDamagedRefresh(unittest.TestCase):
+
+	def make_screen(self):
+		sent = []
+		screen = Screen(height=10, width=20, sender=sent.append)
+		terminal_upper = np.zeros((10, 20), dtype=int)
+		terminal_lower = np.zeros((10, 20), dtype=int)
+		apply_ansi(b"".join(d for d in sent if isinstance(d, bytes)), terminal_upper, terminal_lower)
+		sent.clear()
+		return screen, sent, terminal_upper, terminal_lower
+
+	def test_small_change(self):
+		screen, sent, _, _ = self.make_screen()
+
+		screen.draw_pixel(13, 7, 0xff0000)
+		screen.refresh()
+
+		self.assertEqual(sent, ["\x1b[4;14H\x1b[38;2;51;51;51;48;2;255;0;0m▀".encode("utf-8")])
+
+	def test_separate_changes(self):
+		screen, sent, terminal_upper, terminal_lower = self.make_screen()
+		batch = screen.new_batch()
+		batch.draw_box(1, 2, 0, 1, 0x00ff00, fill=True)
+		batch.draw_pixel(18, 17, 0x0000ff)
+		batch.draw_line(5, 5, 9, 12, 0xffffff)
+		batch.draw()
+
+		screen.refresh()
+		apply_ansi(b"".join(sent), terminal_upper, terminal_lower)
+
+		np.testing.assert_array_equal(terminal_upper, screen.canvas[0::2])
+		np.testing.assert_array_equal(terminal_lower, screen.canvas[1::2])
+		self.assertFalse(screen.damage.rows().any())
+		self.assertTrue((screen.pending == screen.NO_CHANGE).all())
+
+	def test_batch_buffer_reused(self):
+		screen, _, _, _ = self.make_screen()
+		batch = screen.new_batch()
+		batch.draw_box(3, 6, 3, 6, 0x00ff00, fill=True)
+		pending = batch.pending
+		batch.draw()
+
+		val = screen.new_batch().pending
+
+		self.assertIs(val, pending)
+		self.assertTrue((val == screen.NO_CHANGE).all())
+
+
+def bresenham(x1, x2, y1, y2):
+	# Pixels of a line as the old per-pixel draw_line drew them
+	if x1 == x2 or y1 == y2:
+		return [(x, y) for x in range(min(x1, x2), max(x1, x2) + 1)
+			for y in range(min(y1, y2), max(y1, y2) + 1)]
+	dx, dy = abs(x2 - x1), abs(y2 - y1)
+	sx = -1 if x1 > x2 else 1
+	sy = -1 if y1 > y2 else 1
+	x, y = x1, y1
+	pixels = []
+	if dx > dy:
+		err = dx / 2.0
+		while x != x2:
+			pixels.append((x, y))
+			err -= dy
+			if err < 0:
+				y += sy
+				err += dx
+			x += sx
+	else:
+		err = dy / 2.0
+		while y != y2:
+			pixels.append((x, y))
+			err -= dx
+			if err < 0:
+				x += sx
+				err += dy
+			y += sy
+	pixels.append((x, y))
+	return pixels
+
+
+class TestDrawLines(unittest.TestCase):
+
+	def setUp(self):
+		self.screen = Screen(height=20, width=50, sender=lambda d: None)
+		self.batch = self.screen.new_batch()
+
+	def test_matches_bresenham(self):
+		rng = np.random.default_rng(2)
+		ends = rng.integers(-10, 60, size=(200, 4))
+
+		for x1, x2, y1, y2 in ends:
+			self.batch.clear()
+			expected = np.full((40, 50), -1)
+			for x, y in bresenham(x1, x2, y1, y2):
+				if 0 <= x < 50 and 0 <= y < 40:
+					expected[y, x] = 7
+
+			self.batch.draw_lines([x1], [x2], [y1], [y2], 7)
+
+			np.testing.assert_array_equal(self.batch.pending, expected, err_msg=str((x1, x2, y1, y2)))
+
+	def test_under(self):
+		self.batch.draw_pixel(2, 0, 1)
+
+		self.batch.draw_lines([0, 0], [4, 4], [0, 0], [0, 0], [2, 3], under=True)
+
+		self.assertEqual(self.batch.pending[0, :6].tolist(), [2, 2, 1, 2, 2, -1])
+
+	def test_later_line_on_top(self):
+		self.batch.draw_lines([0, 0], [4, 2], [0, 0], [0, 0], [2, 3])
+
+		self.assertEqual(self.batch.pending[0, :6].tolist(), [3, 3, 3, 2, 2, -1])
+
+	def test_damage(self):
+		self.batch.draw_lines([3, 10], [5, 10], [1, 30], [1, 35], 1)
+
+		self.assertEqual(self.batch.damage.bounds(), (3, 11, 1, 36))
+
+
+class TestBuffers(unittest.TestCase):
+
+	def test_int32_buffers(self):
+		screen = Screen(height=4, width=4, sender=lambda d: None)
+
+		val = [screen.canvas.dtype, screen.pending.dtype, screen.new_batch().pending.dtype]
+
+		self.assertEqual(val, [np.int32] * 3)
+
+	def test_no_new_buffers(self):
+		screen = Screen(height=4, width=4, sender=lambda d: None)
+		buffers = {id(pending) for pending, _ in screen.scratch.free}
+
+		for i in range(10):
+			screen.draw_pixel(i % 4, 1, 0xff0000)
+			batch = screen.new_batch()
+			batch.draw_box(0, 3, 0, 3, i)
+			batch.draw()
+			screen.refresh()
+
+		self.assertEqual({id(pending) for pending, _ in screen.scratch.free}, buffers)
+
+	def test_batch_clear(self):
+		screen = Screen(height=4, width=4, sender=lambda d: None)
+		batch = screen.new_batch()
+		batch.draw_box(0, 3, 0, 3, 0xff0000, fill=True)
+
+		batch.clear()
+
+		self.assertTrue((batch.pending == batch.NO_CHANGE).all())
+		self.assertIsNone(batch.damage.bounds())
+
+	def test_hollow_box(self):
+		screen = Screen(height=4, width=4, sender=lambda d: None)
+		batch = screen.new_batch()
+		expected = [
+			[-1, -1, -1, -1],
+			[-1,  1,  1,  1],
+			[-1,  1, -1,  1],
+			[-1,  1,  1,  1]]
+
+		batch.draw_box(1, 3, 1, 3, 1)
+
+		self.assertEqual(batch.pending[:4].tolist(), expected)
+
+
+class TestSharedEncodeCache(unittest.TestCase):
+
+	def make_screens(self, cache, count):
+		screens = []
+		for _ in range(count):
+			sent = []
+			screen = Screen(height=5, width=8, sender=sent.append)
+			screen.encode_cache.unsubscribe(screen)
+			screen.encode_cache = cache
+			cache.subscribe(screen, (screen.height, screen.width, screen.encoder.cache_key))
+			sent.clear()
+			screens.append((screen, sent))
+		return screens
+
+	def draw_frame(self, screen, colour):
+		screen.draw_box(0, 7, 0, 9, colour, fill=True)
+		screen.refresh()
+
+	def test_identical_frames_shared(self):
+		cache = SharedEncodeCache()
+		(a, a_sent), (b, b_sent) = self.make_screens(cache, 2)
+
+		self.draw_frame(a, 0x123456)
+		during = len(cache.entries)
+		self.draw_frame(b, 0x123456)
+
+		self.assertEqual(a_sent, b_sent)
+		self.assertEqual(cache.hits, 1)
+		self.assertEqual(during, 1)
+		# Evicted once every subscriber had it
+		self.assertEqual(cache.entries, {})
+
+	def test_entries_dropped_when_behind(self):
+		cache = SharedEncodeCache()
+		(a, _), (b, _) = self.make_screens(cache, 2)
+
+		for i in range(SharedEncodeCache.MAX_HELD + 3):
+			self.draw_frame(a, i + 1)
+
+		self.assertEqual(len(cache.entries), SharedEncodeCache.MAX_HELD)
+		self.assertEqual(cache.hits, 0)
+
+	def test_unsubscribe_releases(self):
+		cache = SharedEncodeCache()
+		(a, _), (b, _) = self.make_screens(cache, 2)
+		self.draw_frame(a, 0x123456)
+
+		cache.unsubscribe(b)
+
+		self.assertEqual(cache.entries, {})
+		self.assertEqual(cache.subscribers[(a.height, a.width, a.encoder.cache_key)], {a})
+
+	def test_single_viewer_not_cached(self):
+		cache = SharedEncodeCache()
+		(a, a_sent), = self.make_screens(cache, 1)
+
+		self.draw_frame(a, 0x123456)
+
+		self.assertEqual(cache.misses, 0)
+		self.assertEqual(len(a_sent), 1)
@@ -0,0 +1,94 @@
+import socket
+import threading
+import unittest
+from unittest import mock
+
+from authentication import AuthenticationHandler
+from client_handler import ClientHandler
+from config import Config
+from message_handler import MessageHandler
+from messages import SSH_MSG_DISCONNECT
+from server import Server
+
+
+class FakeClientHandler:
+	# Finishes by itself when told about the shutdown if finishes=True,
+	#  otherwise only when disconnected
+	def __init__(self, server, conn, finishes):
+		self.server = server
+		self.conn = conn
+		self.finishes = finishes
+		self.notified = None
+		self.disconnected = None
+
+	def end(self):
+		with self.server.sessions_changed:
+			del self.server.sessions[self.conn]
+			self.server.sessions_changed.notify_all()
+
+	def notify_shutdown(self, message):
+		self.notified = message
+		if self.finishes:
+			threading.Timer(0.01, self.end).start()
+
+	def disconnect(self, description):
+		self.disconnected = description
+		self.end()
+
+
+class TestDrain(unittest.TestCase):
+
+	def test_drained_and_killed(self):
+		server = Server()
+		quick = FakeClientHandler(server, "conn1", finishes=True)
+		stuck = FakeClientHandler(server, "conn2", finishes=False)
+		server.sessions = {"conn1": quick, "conn2": stuck}
+
+		with mock.patch.object(Config, "SHUTDOWN_DEADLINE", 0.2):
+			val = server.drain()
+
+		self.assertEqual(val, (1, 1))
+		self.assertEqual(quick.notified, Config.SHUTDOWN_MESSAGE)
+		self.assertIsNone(quick.disconnected)
+		self.assertEqual(stuck.disconnected, Config.SHUTDOWN_MESSAGE)
+
+	def test_second_signal_skips_deadline(self):
+		server = Server()
+		stuck = FakeClientHandler(server, "conn", finishes=False)
+		server.sessions = {"conn": stuck}
+		server.force.set()
+
+		with mock.patch.object(Config, "SHUTDOWN_DEADLINE", 60):
+			val = server.drain()
+
+		self.assertEqual(val, (0, 1))
+
+	def test_no_sessions(self):
+		server = Server()
+
+		val = server.drain()
+
+		self.assertEqual(val, (0, 0))
+
+
+class TestNotifyShutdown(unittest.TestCase):
+
+	def test_idle_client_disconnected(self):
+		server_sock, client_sock = socket.socketpair()
+		client_sock.sendall(b"SSH-2.0-test\r\n")
+		client_handler = ClientHandler(server_sock, AuthenticationHandler())
+		received = b""
+		while b"SSH-" not in received or not received.endswith(b"\r\n"):
+			received += client_sock.recv(1)
+		client = MessageHandler(client_sock)
+
+		client_handler.notify_shutdown("Bye")
+		val = client.recv()
+		after = client.recv()
+
+		self.assertIsInstance(val, SSH_MSG_DISCONNECT)
+		self.assertEqual(val.reason_code, 11) # BY_APPLICATION
+		self.assertEqual(val.description, "Bye")
+		self.assertIsNone(after)
+		server_sock.close()
+		client_sock.close()
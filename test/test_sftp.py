@@ -0,0 +1,164 @@
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import apps.sftp as sftp
+from apps.sftp import SFTPServer
+from config import Config
+from data_types import DataReader
+
+
+class FakeSession:
+	def __init__(self):
+		self.sent = b""
+
+	def send_CHANNEL_DATA(self, data):
+		self.sent += data
+
+	def send_CHANNEL_CLOSE(self):
+		pass
+
+
+def packet(packet_type, request_id, body=b""):
+	return struct.pack(">IBI", 1 + 4 + len(body), packet_type, request_id) + body
+
+def string(data):
+	if isinstance(data, str):
+		data = data.encode()
+	return struct.pack(">I", len(data)) + data
+
+
+class TestSFTPServer(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.TemporaryDirectory()
+		patcher = mock.patch.object(Config, "SFTP_ROOT", self.root.name)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(self.root.cleanup)
+
+		self.session = FakeSession()
+		self.app = SFTPServer(self.session)
+		self.app.start()
+		self.addCleanup(self.app.stop)
+
+	def send(self, data):
+		self.app.handle_CHANNEL_DATA(mock.Mock(data=data))
+
+	def responses(self):
+		# Split everything sent so far into (type, reader) pairs
+		data, self.session.sent = self.session.sent, b""
+		out = []
+		while data:
+			length = struct.unpack(">I", data[:4])[0]
+			r = DataReader(data[4:4+length])
+			out.append((r.read_uint8(), r))
+			data = data[4+length:]
+		return out
+
+	def open_file(self, path, pflags):
+		self.send(packet(sftp.SSH_FXP_OPEN, 1, string(path) + struct.pack(">II", pflags, 0)))
+		[(packet_type, r)] = self.responses()
+		self.assertEqual(packet_type, sftp.SSH_FXP_HANDLE)
+		r.read_uint32()
+		return r.read_string(blob=True)
+
+	def test_init(self):
+		data = struct.pack(">IBI", 5, sftp.SSH_FXP_INIT, 6)
+		expected = struct.pack(">IBI", 5, sftp.SSH_FXP_VERSION, 3)
+
+		self.send(data)
+
+		self.assertEqual(self.session.sent, expected)
+
+	def test_pipelined_writes_and_reads(self):
+		handle = self.open_file("/file.bin", sftp.SSH_FXF_READ | sftp.SSH_FXF_WRITE | sftp.SSH_FXF_CREAT)
+
+		# Writes sent out of order in one go
+		data = b""
+		for request_id, offset, chunk in [(2, 5, b"World"), (3, 0, b"Hello")]:
+			data += packet(sftp.SSH_FXP_WRITE, request_id, string(handle) + struct.pack(">Q", offset) + string(chunk))
+		self.send(data)
+		statuses = [(r.read_uint32(), r.read_uint32()) for _, r in self.responses()]
+		self.assertEqual(statuses, [(2, sftp.SSH_FX_OK), (3, sftp.SSH_FX_OK)])
+
+		# Reads split across channel messages at an awkward point
+		data = b""
+		for request_id, offset in [(4, 5), (5, 0), (6, 10)]:
+			data += packet(sftp.SSH_FXP_READ, request_id, string(handle) + struct.pack(">QI", offset, 5))
+		self.send(data[:7])
+		self.send(data[7:])
+		responses = self.responses()
+
+		self.assertEqual([t for t, _ in responses], [sftp.SSH_FXP_DATA, sftp.SSH_FXP_DATA, sftp.SSH_FXP_STATUS])
+		self.assertEqual([(r.read_uint32(), r.read_string(blob=True)) for _, r in responses[:2]], [(4, b"World"), (5, b"Hello")])
+
+	def test_cannot_escape_root(self):
+		self.send(packet(sftp.SSH_FXP_OPEN, 1, string("/../../etc/passwd") + struct.pack(">II", sftp.SSH_FXF_READ, 0)))
+		[(packet_type, r)] = self.responses()
+
+		# Treated as /etc/passwd inside the root, which doesn't exist
+		self.assertEqual(packet_type, sftp.SSH_FXP_STATUS)
+		self.assertEqual((r.read_uint32(), r.read_uint32()), (1, sftp.SSH_FX_NO_SUCH_FILE))
+
+	def test_symlink_out_of_root(self):
+		os.symlink("/etc", os.path.join(self.root.name, "etc"))
+
+		self.send(packet(sftp.SSH_FXP_STAT, 1, string("/etc/passwd")))
+		[(packet_type, r)] = self.responses()
+
+		self.assertEqual((r.read_uint32(), r.read_uint32()), (1, sftp.SSH_FX_PERMISSION_DENIED))
+
+	def test_symlink_out_of_root_itself(self):
+		# The link is in the root, so it can be looked at and removed,
+		#  but not gone through
+		link = os.path.join(self.root.name, "etc")
+		os.symlink("/etc", link)
+
+		self.send(packet(sftp.SSH_FXP_READLINK, 1, string("/etc")))
+		self.send(packet(sftp.SSH_FXP_LSTAT, 2, string("/etc")))
+		self.send(packet(sftp.SSH_FXP_LSTAT, 3, string("/etc/passwd")))
+		self.send(packet(sftp.SSH_FXP_REMOVE, 4, string("/etc")))
+		responses = self.responses()
+
+		self.assertEqual([t for t, _ in responses], [
+			sftp.SSH_FXP_NAME, sftp.SSH_FXP_ATTRS, sftp.SSH_FXP_STATUS, sftp.SSH_FXP_STATUS])
+		r = responses[0][1]
+		self.assertEqual((r.read_uint32(), r.read_uint32(), r.read_string()), (1, 1, "/etc"))
+		r = responses[2][1]
+		self.assertEqual((r.read_uint32(), r.read_uint32()), (3, sftp.SSH_FX_PERMISSION_DENIED))
+		r = responses[3][1]
+		self.assertEqual((r.read_uint32(), r.read_uint32()), (4, sftp.SSH_FX_OK))
+		self.assertFalse(os.path.lexists(link))
+		self.assertTrue(os.path.exists("/etc"))
+
+	def test_readdir(self):
+		for name in ["a", "b"]:
+			open(os.path.join(self.root.name, name), "w").close()
+
+		self.send(packet(sftp.SSH_FXP_OPENDIR, 1, string("/")))
+		[(_, r)] = self.responses()
+		r.read_uint32()
+		handle = r.read_string(blob=True)
+
+		self.send(packet(sftp.SSH_FXP_READDIR, 2, string(handle)))
+		self.send(packet(sftp.SSH_FXP_READDIR, 3, string(handle)))
+		(name_type, r), (eof_type, _) = self.responses()
+
+		self.assertEqual((name_type, eof_type), (sftp.SSH_FXP_NAME, sftp.SSH_FXP_STATUS))
+		r.read_uint32()
+		count = r.read_uint32()
+		names = []
+		for _ in range(count):
+			names.append(r.read_string())
+			r.read_string()
+			sftp.SFTPAttributes.from_reader(r)
+		self.assertEqual(names, [".", "..", "a", "b"])
+
+	def test_unsupported(self):
+		self.send(packet(sftp.SSH_FXP_SYMLINK, 9, string("a") + string("b")))
+		[(_, r)] = self.responses()
+
+		self.assertEqual((r.read_uint32(), r.read_uint32()), (9, sftp.SSH_FX_OP_UNSUPPORTED))
@@ -0,0 +1,212 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from apps.doom.map_cache import MapCache
+from apps.doom.player import Player
+from apps.doom.renderer import Renderer
+from apps.doom.screen import Screen
+from apps.doom.sprites import Sprite, SpriteCache, blend_colours, halve
+from apps.doom.textures import shade_colours
+from apps.doom.wad import WAD
+from apps.doom.world import World
+from test.doom_maps import (
+	PALETTE, SPRITE, SPRITE_OFFSETS, SPRITE_OPAQUE, build_wad, pack_patch, write_wad)
+
+
+IMAGE = "apps/doom/Cacodemon_sprite.png"
+
+
+def make_screen():
+	return Screen(height=50, width=80, sender=lambda data: None)
+
+
+class TestSprite(unittest.TestCase):
+
+	def test_from_patch(self):
+		sprite = Sprite.from_patch(pack_patch(SPRITE, SPRITE_OPAQUE, *SPRITE_OFFSETS), PALETTE)
+		pixels, alpha = sprite.levels[0]
+
+		self.assertEqual((sprite.width, sprite.height), (32, 56))
+		self.assertEqual((sprite.left_offset, sprite.top_offset), SPRITE_OFFSETS)
+		self.assertEqual(pixels[0, :2].tolist(), [PALETTE[1], PALETTE[2]])
+		self.assertEqual(alpha[3, 3], 0)
+		self.assertEqual([level[0].shape for level in sprite.levels], [
+			(56, 32), (28, 16), (14, 8), (7, 4), (4, 2), (2, 1), (1, 1)])
+
+	def test_halve(self):
+		# Colours are averaged by how opaque they are
+		pixels = np.array([[0x000000, 0xff0000], [0x0000ff, 0x00ff00]])
+		alpha = np.array([[0, 255], [255, 255]])
+
+		val = halve(pixels, alpha)
+
+		self.assertEqual(val[0].tolist(), [[0x555555]])
+		self.assertEqual(val[1].tolist(), [[191]])
+
+	def test_level(self):
+		sprite = Sprite(np.zeros((16, 16)), np.zeros((16, 16)))
+
+		val = [sprite.level(scale) for scale in (2, 1, 0.6, 0.5, 0.25, 0.001)]
+
+		self.assertEqual(val, [0, 0, 0, 1, 2, 4])
+
+	def test_blend(self):
+		val = blend_colours([0x000000, 0xffffff], [0xffffff, 0x000000], [255, 51])
+
+		self.assertEqual(val.tolist(), [0xffffff, 0xcccccc])
+
+
+class TestSpriteCache(unittest.TestCase):
+
+	def test_image_decoded_once(self):
+		cache = SpriteCache()
+
+		a = cache.image(IMAGE)
+		with mock.patch("apps.doom.sprites.cv2.imread") as imread:
+			b = cache.image("apps/doom/../doom/Cacodemon_sprite.png")
+
+		imread.assert_not_called()
+		self.assertIs(a, b)
+		self.assertEqual((a.width, a.height), (61, 66))
+		self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+	def test_missing_image(self):
+		self.assertIsNone(SpriteCache().image("not_an_image.png"))
+
+	def test_wad_rotations(self):
+		wad = WAD(write_wad(self, build_wad(sprites=True)))
+		wad.load()
+		sprites = SpriteCache().wad_sprites(wad)
+
+		front, front_flip = sprites.rotation("PLAYA", 1)
+		left, left_flip = sprites.rotation("PLAYA", 2)
+		right, right_flip = sprites.rotation("PLAYA", 8)
+
+		self.assertEqual((front_flip, left_flip, right_flip), (False, False, True))
+		self.assertIs(left, right)
+		self.assertIs(sprites.get("PLAYA1"), front)
+		self.assertEqual(sprites.rotation("PLAYA", 3), (None, False))
+		self.assertEqual(sprites.rotation("TROOA", 1), (None, False))
+
+	def test_no_sprites(self):
+		wad = WAD(write_wad(self))
+		wad.load()
+
+		self.assertIsNone(wad.get_sprites())
+
+
+class TestDrawSprite(unittest.TestCase):
+
+	def setUp(self):
+		self.screen = make_screen()
+		self.batch = self.screen.new_batch()
+		self.sprite = Sprite.from_patch(pack_patch(SPRITE, SPRITE_OPAQUE), PALETTE)
+
+	def test_clipped(self):
+		# Hanging off the top left corner, with the hole in the patch
+		#  left undrawn
+		self.batch.draw_sprite(-30, -50, self.sprite)
+
+		pending = self.batch.pending
+		expected = np.where(SPRITE_OPAQUE, np.array(PALETTE)[SPRITE], -1)
+		self.assertEqual(pending[:6, :2].tolist(), expected[50:, 30:].tolist())
+		self.assertEqual(pending[6:, :].max(), -1)
+		self.assertEqual(pending[:, 2:].max(), -1)
+
+		self.batch.draw_sprite(0, 0, self.sprite)
+		self.assertEqual(pending[3, 3], -1)
+
+	def test_scaled(self):
+		# Half size is drawn from the first mip level
+		self.batch.draw_sprite(0, 0, self.sprite, scale=0.5)
+
+		pending = self.batch.pending
+		self.assertEqual((pending[:28, :16] != -1).sum(), 28 * 16)
+		self.assertEqual(pending[:, 16:].max(), -1)
+		self.assertEqual(pending[0, 0], self.sprite.levels[1][0][0, 0])
+
+	def test_scaled_once(self):
+		# Each size is sampled once, keeping pixels at least half opaque,
+		#  so it's copied without blending
+		sprite = Sprite(np.full((2, 2), 0xffffff), np.array([[51, 51], [255, 255]]))
+		self.batch.draw_pixel(0, 0, 0x000000)
+
+		self.batch.draw_sprite(0, 0, sprite, scale=0.5)
+
+		self.assertIs(sprite.scaled(0.5), sprite.scaled(0.5))
+		self.assertEqual(sprite.scaled(0.5)[1].tolist(), [[255]])
+		self.assertEqual(self.batch.pending[0, 0], 0xffffff)
+
+	def test_flipped_scaled_and_clipped(self):
+		# Flipped is the mirror image, also when cut by the screen's edge
+		self.batch.draw_sprite(0, 0, self.sprite, scale=0.5)
+		unflipped = self.batch.pending[:28, :16].copy()
+		self.batch.clear()
+		self.batch.draw_sprite(0, 0, self.sprite, scale=0.5, flip=True)
+		flipped = self.batch.pending[:28, :16].copy()
+		self.batch.clear()
+		self.batch.draw_sprite(-5, 0, self.sprite, scale=0.5, flip=True)
+
+		self.assertEqual(flipped.tolist(), unflipped[:, ::-1].tolist())
+		self.assertEqual(self.batch.pending[:28, :11].tolist(), flipped[:, 5:].tolist())
+
+	def test_flipped_and_shaded(self):
+		self.batch.draw_sprite(0, 0, self.sprite, flip=True, light_level=4)
+
+		self.assertEqual(self.batch.pending[0, 31], shade_colours(PALETTE[1], 4))
+
+	def test_columns(self):
+		columns = np.zeros(self.screen.width, dtype=bool)
+		columns[10] = True
+
+		self.batch.draw_sprite(0, 0, self.sprite, columns=columns)
+
+		drawn = np.flatnonzero((self.batch.pending != -1).any(axis=0))
+		self.assertEqual(drawn.tolist(), [10])
+
+	def test_blended(self):
+		# Partly transparent pixels mix with what's under them, or are
+		#  left out if nothing is and they're mostly transparent
+		sprite = Sprite(np.full((1, 2), 0xffffff), np.array([[51, 51]]))
+		self.batch.draw_pixel(0, 0, 0x000000)
+
+		self.batch.draw_sprite(0, 0, sprite)
+
+		self.assertEqual(self.batch.pending[0, :2].tolist(), [0x333333, -1])
+
+	def test_draw_image(self):
+		self.screen.draw_image(10, 5, IMAGE)
+
+		self.assertGreater((self.screen.pending[5:71, 10:71] != -1).sum(), 0)
+
+
+class TestPlayerSprites(unittest.TestCase):
+
+	def render(self, world, player, others):
+		camera = Player(player.id)
+		world.view(player, camera)
+		screen = make_screen()
+		renderer = Renderer(screen, camera, world.map)
+		renderer.others = others
+		renderer.render_perspective()
+		return screen.pending, renderer
+
+	def test_drawn(self):
+		# Player 2 stands 96 in front of player 1, facing them, so is drawn
+		#  from the front in the middle of the screen, 13 columns wide
+		world = World(MapCache().load_map(write_wad(self, build_wad(sprites=True)), "E1M1", players=[]))
+		a = world.join()
+		b = world.join()
+		b.update_from_thing(160, 128, 180)
+
+		empty, _ = self.render(world, a, np.zeros((0, 4)))
+		frame, renderer = self.render(world, a, world.view(a, Player(a.id)))
+
+		drawn = np.flatnonzero((frame != empty).any(axis=0))
+		self.assertEqual((drawn.min(), drawn.max()), (33, 46))
+		sprite = world.map.sprites.get("PLAYA1")
+		pixels = sprite.levels[sprite.level(40 / 96)][0]
+		shades = shade_colours(pixels, renderer._light_levels(160, 96))
+		self.assertIn(frame[60, 40], shades)
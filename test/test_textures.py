@@ -0,0 +1,147 @@
+import unittest
+
+import numpy as np
+
+from apps.doom.player import Player
+from apps.doom.renderer import Renderer
+from apps.doom.screen import Screen
+from apps.doom.textures import LIGHT_LEVELS, TextureAtlas, decode_patch, shade_colours
+from apps.doom.wad import WAD
+from test.doom_maps import FLAT, PALETTE, PATCH, PATCH_OPAQUE, build_wad, pack_patch, write_wad
+
+
+class TestDecodePatch(unittest.TestCase):
+
+	def test_posts(self):
+		pixels, opaque = decode_patch(pack_patch(PATCH, PATCH_OPAQUE))
+
+		self.assertEqual(opaque.tolist(), PATCH_OPAQUE.tolist())
+		self.assertEqual(pixels[opaque].tolist(), PATCH[PATCH_OPAQUE].tolist())
+
+
+class TestTextureAtlas(unittest.TestCase):
+
+	def setUp(self):
+		wad = WAD(write_wad(self))
+		wad.load()
+		self.atlas = wad.get_textures()
+
+	def test_composed(self):
+		# The patch twice, with the hole in its last column left empty
+		expected = np.hstack([PATCH, PATCH])
+		expected[3:5, 3] = 0
+		expected[3:5, 7] = 0
+
+		val = self.atlas.pixels[:8, self.atlas.offsets[0]:][:, :8]
+
+		self.assertEqual(val.tolist(), expected.tolist())
+
+	def test_texture_ids(self):
+		val = self.atlas.texture_ids(np.array([b"STARTAN3", b"-", b"startan3"], "S8"))
+
+		self.assertEqual(val.tolist(), [0, -1, 0])
+
+	def test_sample_repeats(self):
+		val = self.atlas.sample(np.array([0, 0]), np.array([1, 9]), np.array([0, 0]), np.array([2, 10]), np.array([0, 1]))
+
+		self.assertEqual(val.tolist(), [PALETTE[PATCH[2, 1]]] * 2)
+
+	def test_flats(self):
+		ids = self.atlas.flat_ids(np.array([b"FLOOR4_8", b"F_SKY1"], "S8"))
+		val = self.atlas.sample_flats(np.array([0, 0]), np.array([3, 67]), np.array([5, -59]), np.array([0, 0]))
+
+		self.assertEqual(ids.tolist(), [0, -1])
+		self.assertEqual(val.tolist(), [PALETTE[FLAT[5, 3]]] * 2)
+
+	def test_shades_without_colormap(self):
+		val = self.atlas.shades[:, 0]
+
+		self.assertEqual(val[0], 0x0000ff)
+		self.assertLess(val[LIGHT_LEVELS - 1] & 0xff, 0x10)
+
+	def test_colormap(self):
+		colormap = np.zeros((LIGHT_LEVELS, 256), dtype=np.uint8)
+		colormap[1] = 7
+
+		atlas = TextureAtlas(["A"], [np.zeros((2, 2), np.uint8)], PALETTE, colormap)
+
+		self.assertEqual(atlas.shades[1, 100], PALETTE[7])
+
+	def test_no_textures(self):
+		wad = WAD(write_wad(self, build_wad(textures=False)))
+		wad.load()
+
+		self.assertIsNone(wad.get_textures())
+		game_map = wad.load_map("E1M1", players=[])
+		self.assertEqual(game_map.sidedefs.middle_texture_id.tolist(), [-1] * 4)
+
+
+class TestShadeColours(unittest.TestCase):
+
+	def test_levels(self):
+		val = shade_colours(0x808080, np.array([0, LIGHT_LEVELS // 2]))
+
+		self.assertEqual(val.tolist(), [0x808080, 0x404040])
+
+
+class TestWallColumns(unittest.TestCase):
+
+	def render(self, data, step=None):
+		wad = WAD(write_wad(self, data))
+		wad.load()
+		player = Player(1)
+		game_map = wad.load_map("E1M1", players=[player])
+		if step is not None:
+			game_map.sectors.floor_height[1], game_map.sectors.ceiling_height[1] = step
+		screen = Screen(height=50, width=80, sender=lambda data: None)
+		renderer = Renderer(screen, player, game_map)
+		renderer.render_perspective()
+		return screen.pending, renderer
+
+	def shades(self, colour):
+		return set(shade_colours(colour, np.arange(LIGHT_LEVELS)).tolist())
+
+	def test_textured(self):
+		# Every colour of the wall is a shade of one of its texels, and
+		#  of the floor a shade of one of the flat's
+		pending, _ = self.render(build_wad())
+
+		atlas = TextureAtlas(["STARTAN3"], [np.hstack([PATCH, PATCH])], PALETTE)
+		texels = set(atlas.shades[:, [0] + PATCH.ravel().tolist()].ravel().tolist())
+		colours = set(np.unique(pending[35:55]).tolist())
+		self.assertLessEqual(colours, texels)
+		floor = set(atlas.shades[:, FLAT.ravel()].ravel().tolist())
+		colours = set(np.unique(pending[80:]).tolist())
+		self.assertGreater(len(colours), 1)
+		self.assertLessEqual(colours, floor)
+
+	def test_filled(self):
+		# The wall ahead fills the middle of the screen, with the ceiling
+		#  above it and the floor below
+		pending, _ = self.render(build_wad(textures=False))
+
+		self.assertLessEqual(set(pending[35:55].ravel().tolist()), self.shades(Renderer.UNTEXTURED_COLOUR))
+		self.assertLessEqual(set(pending[:20].ravel().tolist()), self.shades(Renderer.CEILING_COLOUR))
+		self.assertLessEqual(set(pending[80:].ravel().tolist()), self.shades(Renderer.FLOOR_COLOUR))
+
+	def test_steps(self):
+		# The split is 64 ahead, where the screen is scaled by 40/64.
+		#  Seen from 41 high, the ceiling behind at 96 and the floor at
+		#  32 are at rows 16 and 56, and the ones in front at 128 and 0
+		#  are at rows -4 and 76.
+		pending, renderer = self.render(build_wad(textures=False, step=True))
+
+		wall = shade_colours(Renderer.UNTEXTURED_COLOUR, renderer._light_levels(160, 64))
+		self.assertEqual(pending[:16, 40].tolist(), [wall] * 16)
+		self.assertEqual(pending[56:76, 40].tolist(), [wall] * 20)
+		self.assertNotEqual(pending[16, 40], wall)
+		self.assertNotEqual(pending[55, 40], wall)
+		self.assertNotEqual(pending[76, 40], wall)
+
+	def test_no_steps(self):
+		# With the same heights on both sides there's nothing to draw of
+		#  the two sided wall
+		pending, renderer = self.render(build_wad(textures=False, step=True), step=(0, 128))
+		level_pending, _ = self.render(build_wad(textures=False))
+
+		self.assertEqual(pending[:, 20:60].tolist(), level_pending[:, 20:60].tolist())
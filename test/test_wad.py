@@ -0,0 +1,174 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from apps.doom.map import SUBSECTOR_FLAG
+from apps.doom.player import Player
+from apps.doom.renderer import Renderer, SolidColumns, running_max_before
+from apps.doom.screen import Screen
+from apps.doom.wad import WAD, SECTOR_DTYPE, pack_wad
+from test.doom_maps import LINEDEFS, SEGS, VERTEXES, write_wad
+
+
+class TestWAD(unittest.TestCase):
+
+	def setUp(self):
+		self.wad = WAD(write_wad(self))
+		self.wad.load()
+
+	def test_header(self):
+		val = (self.wad.wad_type, self.wad.directory_count)
+
+		self.assertEqual(val, ("PWAD", 18))
+
+	def test_directories(self):
+		val = self.wad.directories["lump_name"].tolist()
+
+		self.assertEqual(val[:3], [b"E1M1", b"THINGS", b"LINEDEFS"])
+
+	def test_sector_fields(self):
+		data = np.array([(-8, 72, b"FLAT1", b"CEIL1", 144, 9, 3)], SECTOR_DTYPE).tobytes()
+		wad = WAD(write_wad(self, pack_wad([("SECTORS", data)])))
+		wad.load()
+
+		val = wad.get_lump(0, SECTOR_DTYPE)[0]
+
+		self.assertEqual(val.tolist(), (-8, 72, b"FLAT1", b"CEIL1", 144, 9, 3))
+
+	def test_missing_map(self):
+		val = self.wad.load_map("E9M9", players=[])
+
+		self.assertIsNone(val)
+
+
+class TestMap(unittest.TestCase):
+
+	def setUp(self):
+		wad = WAD(write_wad(self))
+		wad.load()
+		self.player = Player(1)
+		self.map = wad.load_map("E1M1", players=[self.player])
+
+	def test_columns(self):
+		self.assertEqual(self.map.vertexes.x.tolist(), [v[0] for v in VERTEXES])
+		self.assertEqual(self.map.linedefs.end_vertex.tolist(), [l[1] for l in LINEDEFS])
+		self.assertEqual(self.map.segs.start_vertex.tolist(), [s[0] for s in SEGS])
+		self.assertEqual(self.map.nodes.r_child.tolist(), [0 | SUBSECTOR_FLAG])
+		self.assertEqual(self.map.vertexes.x.dtype, np.int64)
+
+	def test_player_placed(self):
+		val = (self.player.x, self.player.y, self.player.angle)
+
+		self.assertEqual(val, (64, 128, 0))
+		self.assertEqual(self.map.things.type.tolist(), [3004])
+
+	def test_seg_sectors(self):
+		self.assertEqual(self.map.segs.right_sector.tolist(), [0] * 6)
+		self.assertEqual(self.map.segs.left_sector.tolist(), [-1] * 6)
+
+	def test_sector_textures(self):
+		val = (self.map.sectors.floor_texture[0], self.map.sectors.ceiling_texture[0])
+
+		self.assertEqual(val, (b"FLOOR4_8", b"CEIL3_5"))
+
+
+class TestRenderer(unittest.TestCase):
+
+	def setUp(self):
+		wad = WAD(write_wad(self))
+		wad.load()
+		self.player = Player(1)
+		self.map = wad.load_map("E1M1", players=[self.player])
+		self.screen = Screen(height=50, width=80, sender=lambda data: None)
+		self.renderer = Renderer(self.screen, self.player, self.map)
+
+	def test_automap(self):
+		self.renderer.render_automap()
+
+		drawn = self.screen.pending != self.screen.NO_CHANGE
+		self.assertEqual(np.unique(self.screen.pending[drawn]).tolist(), [0x0000ff, 0xff0000, 0xff00ff])
+
+	def test_perspective(self):
+		self.renderer.render_perspective()
+
+		# The wall ahead, with the ceiling above and floor below it, fills
+		#  the screen
+		pending = self.screen.pending
+		self.assertFalse((pending == self.screen.NO_CHANGE).any())
+		self.assertFalse((pending == 0x000000).any())
+		self.assertEqual(len({pending[0, 40], pending[50, 40], pending[99, 40]}), 3)
+
+	def test_clipped_walls(self):
+		# From the left half facing east, only the right half's walls are
+		#  in view, with the top and bottom ones cut at the edges of the FOV
+		segs, v1, v2, v1_angle, v2_angle = self.renderer._clipped_walls(np.arange(len(SEGS)))
+
+		self.assertEqual(segs.tolist(), [0, 1, 2])
+		np.testing.assert_allclose(v1_angle, [45, 33.69, -33.69], atol=0.01)
+		np.testing.assert_allclose(v2_angle, [33.69, -33.69, -45], atol=0.01)
+		np.testing.assert_allclose((v1.x[0], v1.y[0]), (192, 256))
+		np.testing.assert_allclose((v2.x[2], v2.y[2]), (192, 0))
+
+	def test_bbox_in_fov(self):
+		# The right half is in front, and the left half is around the player
+		self.assertTrue(self.renderer._is_bbox_visible(0, "rbox"))
+		self.assertTrue(self.renderer._is_bbox_visible(0, "lbox"))
+
+		self.player.angle = 180
+
+		self.assertFalse(self.renderer._is_bbox_visible(0, "rbox"))
+
+	def test_stops_when_screen_full(self):
+		# Facing the east wall from the right half, which fills the screen
+		self.player.x = 200
+		render = mock.Mock(wraps=self.renderer._render_subsectors)
+		with mock.patch.object(Renderer, "SUBSECTORS_PER_BATCH", 1):
+			with mock.patch.object(self.renderer, "_render_subsectors", render):
+				self.renderer.render_perspective()
+
+		self.assertEqual([call.args[1].tolist() for call in render.call_args_list], [[0]])
+		self.assertTrue(self.renderer.solid_columns.full())
+
+
+class TestSolidColumns(unittest.TestCase):
+
+	def setUp(self):
+		self.columns = SolidColumns(10)
+
+	def test_nearest_wall_wins(self):
+		walls, columns = self.columns.clip(np.array([2, 0]), np.array([5, 8]))
+
+		self.assertEqual(columns.tolist(), [0, 1, 2, 3, 4, 5, 6, 7])
+		self.assertEqual(walls.tolist(), [1, 1, 0, 0, 0, 1, 1, 1])
+
+	def test_solid_columns_hidden(self):
+		self.columns.clip(np.array([3]), np.array([6]))
+
+		walls, columns = self.columns.clip(np.array([0]), np.array([10]))
+
+		self.assertEqual(columns.tolist(), [0, 1, 2, 6, 7, 8, 9])
+		self.assertTrue(self.columns.full())
+
+	def test_seen_through_two_sided_walls(self):
+		# Wall 0 is two sided, so wall 1 behind it is seen too, but wall
+		#  2 is behind solid wall 1
+		walls, columns = self.columns.clip(np.array([0, 2, 0]), np.array([4, 6, 10]), np.array([False, True, True]))
+
+		self.assertEqual(columns.tolist(), [0, 0, 1, 1, 2, 2, 3, 3, 4, 5, 6, 7, 8, 9])
+		self.assertEqual(walls.tolist(), [0, 2, 0, 2, 0, 1, 0, 1, 1, 1, 2, 2, 2, 2])
+		self.assertTrue(self.columns.full())
+
+	def test_covered(self):
+		self.columns.clip(np.array([-5]), np.array([4]))
+
+		self.assertTrue(self.columns.covered(0, 4))
+		self.assertFalse(self.columns.covered(3, 5))
+
+
+class TestRunningMaxBefore(unittest.TestCase):
+
+	def test_groups(self):
+		val = running_max_before(np.array([0, 0, 0, 3, 3]), np.array([4, 2, 7, 1, 5]), 10)
+
+		self.assertEqual(val.tolist(), [0, 4, 4, 0, 1])
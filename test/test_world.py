@@ -0,0 +1,142 @@
+import threading
+import unittest
+
+from apps.doom.map_cache import MapCache
+from apps.doom.player import Player
+from apps.doom.renderer import Renderer
+from apps.doom.screen import Screen
+from apps.doom.textures import LIGHT_LEVELS, shade_colours
+from apps.doom.world import World, Worlds
+from test.doom_maps import build_wad, write_wad
+
+
+class TestWorld(unittest.TestCase):
+
+	def setUp(self):
+		self.filename = write_wad(self, build_wad(["E1M1", "E1M2"]))
+		self.worlds = Worlds(MapCache(), tics_per_second=1000)
+
+	def join(self, map_name="E1M1", listener=None):
+		world, player = self.worlds.join(self.filename, map_name, listener)
+		self.addCleanup(self.worlds.leave, world, player, listener)
+		return world, player
+
+	def test_shared(self):
+		a_world, a = self.join()
+		b_world, b = self.join()
+		other_world, _ = self.join("E1M2")
+
+		self.assertIs(a_world, b_world)
+		self.assertIsNot(a_world, other_world)
+		self.assertEqual(a_world.players, [a, b])
+		self.assertIs(b.map, a_world.map)
+
+	def test_starts(self):
+		# Players go to the start of their number, and back to the
+		#  first when there are more players than starts
+		_, a = self.join()
+		_, b = self.join()
+		_, c = self.join()
+
+		self.assertEqual([(p.id, p.x, p.y) for p in (a, b, c)], [(1, 64, 128), (2, 64, 64), (3, 64, 128)])
+
+	def test_tick(self):
+		# Inputs wait for the next tick, which tells every session
+		world = World(MapCache().load_map(self.filename, "E1M1", players=[]))
+		player = world.join()
+		changed = []
+		world.listeners.append(lambda: changed.append(world.tic))
+
+		world.queue_input(player, "move_forward")
+		x = player.x
+		world.tick()
+		world.tick()
+
+		self.assertGreater(player.x, x)
+		self.assertEqual(changed, [1])
+
+	def test_repeats_coalesced(self):
+		# Asking for the same move many times before a tick, like a held
+		#  key, moves once
+		world = World(MapCache().load_map(self.filename, "E1M1", players=[]))
+		player = world.join()
+		for _ in range(5):
+			world.queue_input(player, "move_forward")
+			world.queue_input(player, "turn_left")
+
+		world.tick()
+
+		self.assertEqual((player.x, player.angle), (74, 1))
+
+	def test_view(self):
+		world, a = self.join()
+		self.join()
+		camera = Player(a.id)
+
+		others = world.view(a, camera)
+
+		self.assertEqual((camera.x, camera.y, camera.angle), (a.x, a.y, a.angle))
+		self.assertEqual(others.tolist(), [[64, 64, 90, 2]])
+
+	def test_ticks_on_thread(self):
+		changed = threading.Event()
+		world, player = self.join(listener=changed.set)
+		changed.clear()
+
+		world.queue_input(player, "turn_left")
+
+		self.assertTrue(changed.wait(timeout=5))
+		self.assertEqual(player.angle, 1)
+
+	def test_stopped_when_empty(self):
+		world, a = self.worlds.join(self.filename, "E1M1")
+		_, b = self.worlds.join(self.filename, "E1M1")
+
+		self.worlds.leave(world, a)
+		self.assertTrue(world.running.is_set())
+		self.worlds.leave(world, b)
+
+		self.assertFalse(world.running.is_set())
+		self.assertEqual(self.worlds.worlds, {})
+
+	def test_load_outside_lock(self):
+		# Two sessions load the map at the same time, and both end up
+		#  in the world the first one to finish started
+		both_loading = threading.Barrier(2, timeout=5)
+		load_map = self.worlds.map_cache.load_map
+		def slow_load_map(*args, **kwargs):
+			both_loading.wait()
+			return load_map(*args, **kwargs)
+		self.worlds.map_cache.load_map = slow_load_map
+
+		joined = []
+		threads = [threading.Thread(target=lambda: joined.append(self.join())) for _ in range(2)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(len(joined), 2)
+		self.assertIs(joined[0][0], joined[1][0])
+		self.assertEqual(len(self.worlds.worlds), 1)
+
+
+class TestOtherPlayers(unittest.TestCase):
+
+	def test_drawn(self):
+		# Player 2 stands 96 in front of player 1, in the middle of the
+		#  screen
+		world = World(MapCache().load_map(write_wad(self, build_wad(textures=False)), "E1M1", players=[]))
+		a = world.join()
+		b = world.join()
+		b.update_from_thing(160, 128, 0)
+
+		camera = Player(a.id)
+		screen = Screen(height=50, width=80, sender=lambda data: None)
+		renderer = Renderer(screen, camera, world.map)
+		renderer.others = world.view(a, camera)
+		renderer.render_perspective()
+
+		colours = shade_colours(Renderer.PLAYER_COLOURS[1], range(LIGHT_LEVELS)).tolist()
+		self.assertIn(int(screen.pending[60, 40]), colours)
+		self.assertNotIn(int(screen.pending[60, 20]), colours)